@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# License:
+# This sample code is made available under the MIT-0 license. See the LICENSE file.
+"""
+Benchmarks the inventory hot paths against synthetic AWS Config SELECT results.
+
+Resources are synthesised from the samples in tests/sample_config_query_results, given unique ARNs and split into
+pages the way AWS Config returns them. Each stage is timed separately and, unless --no-isolate is given, runs in its
+own process so the peak RSS reported for it is not inflated by the stages before it:
+
+* decode   - json.loads of every raw result, discarding each resource straight away
+* decode_page - decode_page of every page with the --decoder JSON decoder, as the readers decode them
+* dispatch - MapperRegistry lookup of the mapper for every resource
+* map      - DataMapper.map of every resource
+* reader   - AwsConfigInventoryReader end to end, with stubbed STS and Config clients
+* report   - the --report-format writer's write of the mapped rows, the workbook by default
+
+Results are written as JSON so runs can be compared over time, e.g.
+
+    python benchmarks/benchmark_inventory.py --resources 50000 --mix AWS::EC2::Instance=4,AWS::RDS::DBInstance=1 --output results.json
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+from unittest.mock import Mock, patch
+
+_REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_SAMPLES_DIR = os.path.join(_REPOSITORY_DIR, "tests", "sample_config_query_results")
+sys.path.insert(0, os.path.join(_REPOSITORY_DIR, "src"))
+
+# Loggers read LOG_LEVEL when the inventory modules are imported, and per resource logging would dominate the timings
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from inventory.decoding import get_json_decoder  # noqa: E402
+from inventory.mappers import MapperRegistry, get_default_mappers  # noqa: E402
+from inventory.readers import AwsConfigInventoryReader  # noqa: E402
+from inventory.report_writers import get_report_writers  # noqa: E402
+from inventory.reports import CreateReportCommandHandler  # noqa: E402
+from inventory.sessions import ClientCache  # noqa: E402
+from inventory.throttling import RetryPolicy  # noqa: E402
+
+STAGES = ("decode", "decode_page", "dispatch", "map", "reader", "report")
+RESULTS_VERSION = 1
+
+def load_sample_resources(samples_dir: str = _SAMPLES_DIR, warn: bool = True) -> Dict[str, List[dict]]:
+    """Returns the sample resources by resource type. Samples that are not valid JSON are skipped."""
+    samples: Dict[str, List[dict]] = {}
+
+    for file_name in sorted(glob.glob(os.path.join(samples_dir, "*.json"))):
+        try:
+            with open(file_name) as sample_file:
+                document = json.load(sample_file)
+        except json.JSONDecodeError as ex:
+            if warn:
+                print(f"skipping {os.path.basename(file_name)}: {ex}", file=sys.stderr)
+            continue
+
+        for sample in document if isinstance(document, list) else [document]:
+            samples.setdefault(sample["resourceType"], []).append(sample)
+
+    return samples
+
+def parse_resource_mix(mix: Optional[str], samples: Dict[str, List[dict]]) -> Dict[str, float]:
+    """Parses a comma separated list of resourceType=weight pairs, defaulting to an equal weight for every sampled type."""
+    if not mix:
+        return { resource_type: 1.0 for resource_type in samples }
+
+    weights: Dict[str, float] = {}
+    for entry in mix.split(","):
+        resource_type, _, weight = entry.strip().partition("=")
+        if resource_type not in samples:
+            raise ValueError(f"No sample for resource type {resource_type}, available types are {', '.join(samples)}")
+        weights[resource_type] = float(weight) if weight else 1.0
+
+    return weights
+
+def synthesize_results(resource_count: int, weights: Dict[str, float], samples: Dict[str, List[dict]], seed: int = 0) -> List[Tuple[str, str]]:
+    """Returns resource_count (resource type, raw result) pairs drawn from the samples with a unique ARN each."""
+    randomizer = random.Random(seed)
+    resource_types = list(weights)
+    chosen_types = randomizer.choices(resource_types, weights=[weights[resource_type] for resource_type in resource_types], k=resource_count)
+
+    results: List[Tuple[str, str]] = []
+    for index, resource_type in enumerate(chosen_types):
+        sample = randomizer.choice(samples[resource_type])
+        config_resource = dict(sample, arn=f"{sample.get('arn', resource_type)}-{index:08}")
+        results.append((resource_type, json.dumps(config_resource)))
+
+    return results
+
+def paginate(results: List[str], page_size: int) -> List[List[str]]:
+    return [results[start:start + page_size] for start in range(0, len(results), page_size)]
+
+class StubConfigClient():
+    """Answers select_resource_config with the synthesised results of the resource types named in the query."""
+    def __init__(self, results: List[Tuple[str, str]], page_size: int):
+        self._results = results
+        self._page_size = page_size
+        self._matching: Dict[str, List[str]] = {}
+
+    def select_resource_config(self, Expression: str, NextToken: str = ""):
+        # Matched once per query rather than per page, so the stub does not dominate the reader stage
+        if Expression not in self._matching:
+            self._matching[Expression] = [raw_result for resource_type, raw_result in self._results if f"'{resource_type}'" in Expression]
+        matching = self._matching[Expression]
+        start = int(NextToken or 0)
+        response = { "Results": matching[start:start + self._page_size] }
+
+        if start + self._page_size < len(matching):
+            response["NextToken"] = str(start + self._page_size)
+
+        return response
+
+class _BenchmarkInventoryReader(AwsConfigInventoryReader):
+    def __init__(self, config_clients: Dict[str, StubConfigClient], **kwargs):
+        super().__init__(**kwargs)
+        self._config_clients = config_clients
+
+    def _get_config_client(self, sts_response, region_name=None):
+        return self._config_clients[sts_response["AccountId"]]
+
+def _get_peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / (1024 * 1024) if sys.platform == "darwin" else peak_rss / 1024
+
+def _time_stage(run: Callable[[], int]) -> Tuple[float, int]:
+    start = time.perf_counter()
+    rows = run()
+    return time.perf_counter() - start, rows
+
+def run_stage(stage: str, options: argparse.Namespace) -> dict:
+    samples = load_sample_resources(warn=False)
+    weights = parse_resource_mix(options.mix, samples)
+    results = synthesize_results(options.resources, weights, samples, options.seed)
+    raw_results = [raw_result for _, raw_result in results]
+    registry = MapperRegistry(get_default_mappers())
+    json_decoder = get_json_decoder(options.decoder)
+
+    # Everything a stage consumes is prepared before timing starts and is included in setup_rss_mb
+    if stage in ("dispatch", "map", "report"):
+        resources = [json.loads(raw_result) for raw_result in raw_results]
+    if stage == "map":
+        mapped_resources = [(registry.get_mapper(config_resource["resourceType"]), config_resource) for config_resource in resources]
+    if stage == "report":
+        inventory = [row for config_resource in resources for row in registry.map(config_resource)]
+
+    def decode() -> int:
+        for page in paginate(raw_results, options.page_size):
+            for raw_result in page:
+                json.loads(raw_result)
+        return len(raw_results)
+
+    def decode_page() -> int:
+        return sum(len(json_decoder.decode_page(page)) for page in paginate(raw_results, options.page_size))
+
+    def dispatch() -> int:
+        for config_resource in resources:
+            registry.get_mapper(config_resource["resourceType"])
+        return len(resources)
+
+    def map_resources() -> int:
+        return sum(len(mapper.map(config_resource)) for mapper, config_resource in mapped_resources)
+
+    def read() -> int:
+        account_ids = [f"{100000000000 + index}" for index in range(options.accounts)]
+        config_clients = { account_id: StubConfigClient(results[index::options.accounts], options.page_size)
+                           for index, account_id in enumerate(account_ids) }
+        sts_client = Mock()
+        sts_client.assume_role.side_effect = lambda RoleArn, **kwargs: { "AccountId": RoleArn.split(":")[4] }
+        lambda_context = Mock(invoked_function_arn="arn:aws:lambda:us-east-1:123456789012:function:benchmark")
+
+        with patch.dict(os.environ, { "ACCOUNT_LIST": json.dumps([{ "name": account_id, "id": account_id } for account_id in account_ids]),
+                                      "CROSS_ACCOUNT_ROLE_NAME": "benchmark" }):
+            # A new client cache per run so repeats measure a cold start rather than a warm invocation, and no rate limit
+            # since the stubbed clients are never throttled
+            reader = _BenchmarkInventoryReader(config_clients, lambda_context=lambda_context, sts_client=sts_client, client_cache=ClientCache(),
+                                               retry_policy=RetryPolicy(), json_decoder=json_decoder)
+            return sum(1 for _ in reader.iter_resources_from_all_accounts())
+
+    def report() -> int:
+        report_writer, = get_report_writers(CreateReportCommandHandler(write_mode=options.write_mode), options.report_format)
+        with tempfile.TemporaryDirectory() as output_dir, \
+             open(os.path.join(output_dir, f"benchmark{report_writer.file_extension}"), "wb") as output_file:
+            report_writer.write(inventory, output_file)
+        return len(inventory)
+
+    setup_rss_mb = _get_peak_rss_mb()
+    seconds, rows = min(_time_stage({ "decode": decode, "decode_page": decode_page, "dispatch": dispatch, "map": map_resources, "reader": read, "report": report }[stage])
+                        for _ in range(options.repeat))
+
+    return { "stage": stage,
+             "seconds": round(seconds, 6),
+             "rows": rows,
+             "rows_per_second": round(rows / seconds, 1) if seconds else None,
+             "setup_rss_mb": round(setup_rss_mb, 1),
+             "peak_rss_mb": round(_get_peak_rss_mb(), 1) }
+
+def _run_isolated_stage(stage: str, arguments: List[str]) -> dict:
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__), *arguments, "--stage", stage],
+                               check=True, stdout=subprocess.PIPE, text=True)
+    return json.loads(completed.stdout)
+
+def _get_git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=_REPOSITORY_DIR, check=True, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _parse_arguments(arguments: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmarks inventory collection and report generation against synthetic AWS Config results.")
+    parser.add_argument("--resources", type=int, default=10000, help="number of Config resources to synthesise (default: %(default)s)")
+    parser.add_argument("--mix", help="comma separated resourceType=weight pairs, defaults to an equal weight for every sampled type")
+    parser.add_argument("--page-size", type=int, default=100, help="results per Config SELECT page (default: %(default)s)")
+    parser.add_argument("--accounts", type=int, default=1, help="accounts the reader stage spreads the resources over (default: %(default)s)")
+    parser.add_argument("--write-mode", default="standard", help="REPORT_WRITE_MODE for the report stage (default: %(default)s)")
+    parser.add_argument("--report-format", default="xlsx", choices=("xlsx", "csv", "jsonl", "parquet"), help="report format for the report stage (default: %(default)s)")
+    parser.add_argument("--decoder", default=os.environ.get("JSON_DECODER", "auto"),
+                        help="JSON_DECODER for the decode_page and reader stages, auto, json or orjson (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the resource mix (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per stage, the fastest is reported (default: %(default)s)")
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma separated stages to run (default: %(default)s)")
+    parser.add_argument("--no-isolate", action="store_true", help="run every stage in this process, peak RSS then accumulates")
+    parser.add_argument("--output", help="file to write the JSON results to, defaults to stdout")
+    parser.add_argument("--stage", choices=STAGES, help=argparse.SUPPRESS)
+
+    options = parser.parse_args(arguments)
+
+    if unknown_stages := [stage for stage in options.stages.split(",") if stage not in STAGES]:
+        parser.error(f"unknown stages {', '.join(unknown_stages)}, available stages are {', '.join(STAGES)}")
+    if options.resources < 1 or options.page_size < 1 or options.accounts < 1 or options.repeat < 1:
+        parser.error("--resources, --page-size, --accounts and --repeat must be at least 1")
+
+    return options
+
+def main(arguments: List[str]) -> dict:
+    options = _parse_arguments(arguments)
+
+    if options.stage:
+        stage_result = run_stage(options.stage, options)
+        print(json.dumps(stage_result))
+        return stage_result
+
+    stage_arguments = [argument for argument in arguments if argument != "--no-isolate"]
+    stages = options.stages.split(",")
+
+    results = { "version": RESULTS_VERSION,
+                "started_at": datetime.now(timezone.utc).isoformat(),
+                "git_revision": _get_git_revision(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "parameters": { "resources": options.resources, "mix": parse_resource_mix(options.mix, load_sample_resources()),
+                                "page_size": options.page_size, "accounts": options.accounts, "write_mode": options.write_mode,
+                                "report_format": options.report_format,
+                                "decoder": get_json_decoder(options.decoder).name, "seed": options.seed, "repeat": options.repeat, "isolated": not options.no_isolate },
+                "stages": [ run_stage(stage, options) if options.no_isolate else _run_isolated_stage(stage, stage_arguments) for stage in stages ] }
+
+    document = json.dumps(results, indent=2)
+    if options.output:
+        with open(options.output, "w") as output_file:
+            output_file.write(document)
+    else:
+        print(document)
+
+    for stage_result in results["stages"]:
+        print(f"{stage_result['stage']:>11}: {stage_result['rows']:>8} rows in {stage_result['seconds']:.3f}s, "
+              f"{stage_result['rows_per_second']} rows/s, peak RSS {stage_result['peak_rss_mb']} MB", file=sys.stderr)
+
+    return results
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
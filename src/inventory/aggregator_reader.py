@@ -4,13 +4,16 @@
 import json
 import logging
 import os
-from typing import Iterator, List, Optional
-import boto3
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 from botocore.exceptions import ClientError
-from inventory.mappers import (DataMapper, EC2DataMapper, ElbDataMapper, DynamoDbTableDataMapper, InventoryData, RdsDataMapper,
-                                LambdaDataMapper, S3DataMapper, EfsDataMapper, EksDataMapper, RedshiftDataMapper,
-                                ElastiCacheDataMapper, OpenSearchDataMapper, ApiGatewayDataMapper, CloudFrontDataMapper,
-                                NatGatewayDataMapper, NetworkInterfaceDataMapper)
+from inventory.checkpoints import CollectionPosition, get_next_position, validate_position
+from inventory.concurrency import get_max_workers_from_environment, iter_concurrently_streamed_in_order
+from inventory.decoding import get_json_decoder
+from inventory.mappers import DEFAULT_INVENTORY_BATCH_SIZE, InventoryBatch, InventoryData, MapperRegistry, get_default_mappers, iter_inventory_batches
+from inventory.queries import (DELETED_CONFIGURATION_ITEM_STATUSES, ResourceLocation, build_group_by_query, build_resource_queries,
+                               build_resource_query, is_projection_enabled_from_environment, select_resource_types)
+from inventory.sessions import get_client
+from inventory.throttling import RetryingClient, RetryPolicy, RetryStats, get_retry_policy
 
 _logger = logging.getLogger("inventory.aggregator_reader")
 log_level_name = os.environ.get("LOG_LEVEL", "INFO").upper()
@@ -20,109 +23,282 @@ if log_level_name not in ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'):
 else:
     _logger.setLevel(getattr(logging, log_level_name))
 
+SHARD_DIMENSIONS = ("resourceType", "accountId", "awsRegion")
+DEFAULT_AGGREGATOR_MAX_WORKERS = 4
+# Pages each concurrently queried shard can fetch ahead of the rows being written
+MAX_BUFFERED_PAGES_PER_SHARD = 2
+
+# A shard is the resource types to query plus equality filters, e.g. { "accountId": "123456789012" }
+Shard = Tuple[List[str], Dict[str, str]]
+QueryBuilder = Callable[[List[str], Dict[str, str]], List[str]]
+
+def _get_shard_by_from_environment() -> List[str]:
+    return [dimension.strip() for dimension in os.environ.get("AGGREGATOR_SHARD_BY", "").split(",") if dimension.strip()]
+
+def _get_aggregator_name() -> str:
+    aggregator_name = os.environ.get('CONFIG_AGGREGATOR_NAME')
+    if not aggregator_name:
+        raise ValueError("CONFIG_AGGREGATOR_NAME environment variable is required")
+
+    return aggregator_name
+
 class AwsConfigAggregatorInventoryReader():
     """
     Reads AWS resource inventory using AWS Config Aggregator.
     Simpler and faster than cross-account role assumption approach.
     Requires AWS Organizations and a Config Aggregator.
     """
-    def __init__(self, lambda_context, config_client=None, mappers=None):
+    def __init__(self, lambda_context, config_client=None, mappers=None, include_resource_types=None, exclude_resource_types=None,
+                 projection=None, shard_by=None, max_workers=None, retry_policy: Optional[RetryPolicy] = None, json_decoder=None):
         self._lambda_context = lambda_context
-        self._config_client = config_client if config_client is not None else boto3.client('config', region_name=os.environ.get('AWS_REGION', 'us-east-1'))
-        if mappers is None:
-            mappers = [
-                EC2DataMapper(), ElbDataMapper(), DynamoDbTableDataMapper(), RdsDataMapper(),
-                LambdaDataMapper(), S3DataMapper(), EfsDataMapper(), EksDataMapper(),
-                RedshiftDataMapper(), ElastiCacheDataMapper(), OpenSearchDataMapper(),
-                ApiGatewayDataMapper(), CloudFrontDataMapper(), NatGatewayDataMapper(),
-                NetworkInterfaceDataMapper()
-            ]
-        self._mappers: List[DataMapper] = mappers
-
-    def _get_resources_from_aggregator(self) -> Iterator[List[str]]:
-        aggregator_name = os.environ.get('CONFIG_AGGREGATOR_NAME')
-        if not aggregator_name:
-            raise ValueError("CONFIG_AGGREGATOR_NAME environment variable is required")
+        self._json_decoder = json_decoder if json_decoder is not None else get_json_decoder()
+        self._retry_stats = RetryStats()
+        # Throttling and transient errors are retried with backoff, so only persistent errors fail the collection
+        config_client = config_client if config_client is not None else get_client('config', region_name=os.environ.get('AWS_REGION', 'us-east-1'),
+                                                                                   sdk_retries=False)
+        self._config_client = RetryingClient(config_client, retry_policy if retry_policy is not None else get_retry_policy(), self._retry_stats)
+        self._mapper_registry = MapperRegistry(mappers if mappers is not None else get_default_mappers())
+        self._resource_types: List[str] = select_resource_types(self._mapper_registry, include_resource_types, exclude_resource_types)
+        self._projection: bool = projection if projection is not None else is_projection_enabled_from_environment()
+        self._shard_by: List[str] = shard_by if shard_by is not None else _get_shard_by_from_environment()
+        self._max_workers: int = max_workers if max_workers is not None else get_max_workers_from_environment("AGGREGATOR_MAX_WORKERS",
+                                                                                                            DEFAULT_AGGREGATOR_MAX_WORKERS)
+
+        if unsupported_dimensions := [dimension for dimension in self._shard_by if dimension not in SHARD_DIMENSIONS]:
+            raise ValueError(f"AGGREGATOR_SHARD_BY only supports {', '.join(SHARD_DIMENSIONS)}, not {', '.join(unsupported_dimensions)}")
+
+    @property
+    def failed_account_ids(self) -> List[str]:
+        """Always empty since errors from the aggregator fail the whole collection rather than a single account."""
+        return []
+
+    @property
+    def retry_stats(self) -> RetryStats:
+        """Requests, retries and time spent backing off for the AWS Config calls made by this reader."""
+        return self._retry_stats
+
+    def _build_resource_queries(self, resource_types: List[str], filters: Dict[str, str]) -> List[str]:
+        # Only resource types with a registered mapper are queried, and only the configuration the mappers read is selected
+        return build_resource_queries(["arn", "resourceType", "tags", "accountId"], self._mapper_registry, resource_types, self._projection, filters=filters)
+
+    def _paginate(self, aggregator_name: str, query: str, next_token: str = '') -> Iterator[Tuple[str, List[str]]]:
+        """Yields the next token and results of each page, starting from the page after next_token."""
+        while True:
+            if next_token:
+                resources_result = self._config_client.select_aggregate_resource_config(
+                    Expression=query,
+                    ConfigurationAggregatorName=aggregator_name,
+                    NextToken=next_token
+                )
+            else:
+                resources_result = self._config_client.select_aggregate_resource_config(
+                    Expression=query,
+                    ConfigurationAggregatorName=aggregator_name
+                )
+
+            next_token = resources_result.get('NextToken', '')
+            results: List[str] = resources_result.get('Results', [])
+
+            _logger.debug("page returned %s resources and next token of '%s'", len(results), next_token)
+
+            yield next_token, results
+
+            if not next_token:
+                break
+
+    def _get_shards(self, aggregator_name: str) -> List[Shard]:
+        if not self._shard_by:
+            return [(self._resource_types, {})]
+
+        group_by_fields = [dimension for dimension in SHARD_DIMENSIONS if dimension in self._shard_by and dimension != "resourceType"]
+        if not group_by_fields:
+            return [([resource_type], {}) for resource_type in self._resource_types]
+
+        # Account and region values are discovered from the aggregator, which also means only non-empty shards are queried
+        shard_by_resource_type = "resourceType" in self._shard_by
+        query = build_group_by_query((["resourceType"] if shard_by_resource_type else []) + group_by_fields, self._resource_types)
+        groups = [group for _, page in self._paginate(aggregator_name, query) for group in self._json_decoder.decode_page(page)]
+
+        if any(not group.get(field) for group in groups for field in group_by_fields):
+            _logger.warning("some resources have no %s, querying without sharding by it", " or ".join(group_by_fields))
+            return [([resource_type], {}) for resource_type in self._resource_types] if shard_by_resource_type else [(self._resource_types, {})]
+
+        shards: List[Shard] = [([group["resourceType"]] if shard_by_resource_type else self._resource_types,
+                                {field: group[field] for field in group_by_fields})
+                               for group in groups]
+
+        # Sorted so results are merged in the same order on every run
+        return sorted(shards, key=lambda shard: (self._resource_types.index(shard[0][0]) if shard_by_resource_type else 0,
+                                                 [shard[1][field] for field in group_by_fields]))
+
+    def _iter_shard_pages(self, aggregator_name: str, build_queries: QueryBuilder, shard: Shard) -> Iterator[List[str]]:
+        page_count = 0
+
+        for query in build_queries(*shard):
+            for _, page in self._paginate(aggregator_name, query):
+                page_count += 1
+                yield page
+
+        _logger.debug("shard %s %s returned %s pages", shard[0], shard[1], page_count)
+
+    def _get_resources_from_aggregator(self, build_queries: Optional[QueryBuilder] = None) -> Iterator[List[str]]:
+        aggregator_name = _get_aggregator_name()
+
+        build_queries = build_queries if build_queries is not None else self._build_resource_queries
         
         try:
             _logger.info("querying Config Aggregator: %s", aggregator_name)
 
-            next_token: str = ''
-            # Note: Resource types are hardcoded here for query performance.
-            # This list should be kept in sync with the configured mappers.
-            query = (
-                "SELECT arn, resourceType, configuration, tags, accountId "
-                "WHERE resourceType IN ("
-                "'AWS::EC2::Instance', "
-                "'AWS::ElasticLoadBalancingV2::LoadBalancer', "
-                "'AWS::ElasticLoadBalancing::LoadBalancer', "
-                "'AWS::DynamoDB::Table', "
-                "'AWS::RDS::DBInstance', "
-                "'AWS::RDS::DBCluster', "
-                "'AWS::Lambda::Function', "
-                "'AWS::S3::Bucket', "
-                "'AWS::EFS::FileSystem', "
-                "'AWS::EKS::Cluster', "
-                "'AWS::Redshift::Cluster', "
-                "'AWS::ElastiCache::CacheCluster', "
-                "'AWS::ElastiCache::ReplicationGroup', "
-                "'AWS::Elasticsearch::Domain', "
-                "'AWS::OpenSearchService::Domain', "
-                "'AWS::ApiGateway::RestApi', "
-                "'AWS::ApiGatewayV2::Api', "
-                "'AWS::CloudFront::Distribution', "
-                "'AWS::EC2::NatGateway', "
-                "'AWS::EC2::NetworkInterface')"
-            )
-            
-            while True:
-                if next_token:
-                    resources_result = self._config_client.select_aggregate_resource_config(
-                        Expression=query,
-                        ConfigurationAggregatorName=aggregator_name,
-                        NextToken=next_token
-                    )
-                else:
-                    resources_result = self._config_client.select_aggregate_resource_config(
-                        Expression=query,
-                        ConfigurationAggregatorName=aggregator_name
-                    )
-                
-                next_token = resources_result.get('NextToken', '')
-                results: List[str] = resources_result.get('Results', [])
-
-                _logger.debug("page returned %s resources and next token of '%s'", len(results), next_token)
-
-                yield results
-
-                if not next_token:
-                    break
+            shards = self._get_shards(aggregator_name)
+
+            if self._max_workers > 1 and len(shards) > 1:
+                _logger.info("querying %s shards using %s workers", len(shards), self._max_workers)
+
+                # Pages are handed over as they arrive, so memory is bounded by the pages buffered per shard rather than whole shards
+                yield from iter_concurrently_streamed_in_order(shards, lambda shard: self._iter_shard_pages(aggregator_name, build_queries, shard),
+                                                               self._max_workers, MAX_BUFFERED_PAGES_PER_SHARD,
+                                                               thread_name_prefix="inventory-aggregator")
+            else:
+                for shard in shards:
+                    for query in build_queries(*shard):
+                        for _, page in self._paginate(aggregator_name, query):
+                            yield page
         except ClientError as ex:
             _logger.error("Received error: %s while retrieving resources from aggregator %s", ex, aggregator_name, exc_info=True)
             raise
 
     def get_resources_from_all_accounts(self) -> List[InventoryData]:
+        return list(self.iter_resources_from_all_accounts())
+
+    def iter_resources_from_all_accounts(self) -> Iterator[InventoryData]:
+        """Yields inventory rows as pages are returned from the aggregator so only one page is held at a time."""
         _logger.info("starting retrieval of inventory from AWS Config Aggregator")
 
-        all_inventory: List[InventoryData] = []
+        total_rows = 0
+
+        for _, inventory_items in self._iter_mapped_resources(self._build_resource_queries):
+            total_rows += len(inventory_items)
+            yield from inventory_items
+
+        _logger.info("completed getting inventory, with a total of %s", total_rows)
 
-        for resource_list_page in self._get_resources_from_aggregator():
-            _logger.debug("current page of inventory contained %s items from AWS Config Aggregator", len(resource_list_page))
+    def iter_inventory_batches(self, batch_size: int = DEFAULT_INVENTORY_BATCH_SIZE) -> Iterator[InventoryBatch]:
+        """Yields the same rows as iter_resources_from_all_accounts in columnar batches of up to batch_size rows."""
+        return iter_inventory_batches(self.iter_resources_from_all_accounts(), batch_size)
 
-            for raw_resource in resource_list_page:
-                resource: dict = json.loads(raw_resource)
+    def iter_mapped_resources(self, captured_after: Optional[str] = None,
+                              arns: Optional[Dict[Tuple[str, str], List[str]]] = None) -> Iterator[Tuple[dict, List[InventoryData]]]:
+        """
+        Yields each resource returned from the aggregator together with the rows it was mapped to.
 
-                # One line item returned from AWS Config can result in multiple inventory line items (e.g. multiple IPs)
-                mapper: Optional[DataMapper] = next((mapper for mapper in self._mappers if mapper.can_map(resource["resourceType"])), None)
-                
-                if not mapper:
-                    _logger.warning("skipping mapping, unable to find mapper for resource type of %s", resource['resourceType'])
-                    continue
+        The resources include their configurationItemCaptureTime and configurationItemStatus and, when captured_after
+        is provided, only resources captured at or after that time are returned. When arns is provided, only those
+        resources are returned, queried with a filter on the account id and region they are keyed by rather than once
+        per shard.
+        """
+        select_fields = ["arn", "resourceType", "tags", "accountId", "configurationItemCaptureTime", "configurationItemStatus"]
 
-                inventory_items = mapper.map(resource)
-                if inventory_items:
-                    all_inventory.extend(inventory_items)
+        if arns is not None:
+            return (mapped_resource for resource_list_page in self._get_resources_by_arn(select_fields, captured_after, arns)
+                    for mapped_resource in self._map_resource_page(resource_list_page))
 
-        _logger.info("completed getting inventory, with a total of %s", len(all_inventory))
+        return self._iter_mapped_resources(lambda resource_types, filters: build_resource_queries(select_fields, self._mapper_registry, resource_types,
+                                                                                                 self._projection, captured_after=captured_after,
+                                                                                                 filters=filters))
+
+    def _get_resources_by_arn(self, select_fields: List[str], captured_after: Optional[str],
+                              arns: Dict[Tuple[str, str], List[str]]) -> Iterator[List[str]]:
+        aggregator_name = _get_aggregator_name()
+
+        try:
+            for (account_id, region_name), account_region_arns in arns.items():
+                for query in build_resource_queries(select_fields, self._mapper_registry, self._resource_types, self._projection,
+                                                    captured_after=captured_after, filters={ "accountId": account_id, "awsRegion": region_name },
+                                                    arns=account_region_arns):
+                    for _, page in self._paginate(aggregator_name, query):
+                        yield page
+        except ClientError as ex:
+            _logger.error("Received error: %s while retrieving resources from aggregator %s", ex, aggregator_name, exc_info=True)
+            raise
+
+    def iter_resumable_pages(self, position: Optional[CollectionPosition] = None) -> Iterator[Tuple[CollectionPosition, List[InventoryData]]]:
+        """
+        Yields the inventory rows of each page of results, one shard at a time and in order, together with the position
+        to resume collection from after that page.
+        """
+        aggregator_name = _get_aggregator_name()
+
+        try:
+            shards = self._get_shards(aggregator_name)
+            units = [json.dumps(shard, sort_keys=True) for shard in shards]
+            position = position if position is not None else CollectionPosition()
+            validate_position(position, units)
+
+            for unit_index in range(position.unit_index, len(shards)):
+                queries = self._build_resource_queries(*shards[unit_index])
+                start_query_index, next_token = (position.query_index, position.next_token) if unit_index == position.unit_index else (0, '')
+
+                for query_index in range(start_query_index, len(queries)):
+                    for next_token, resource_list_page in self._paginate(aggregator_name, queries[query_index], next_token):
+                        inventory_items = [inventory_item for _, mapped_items in self._map_resource_page(resource_list_page)
+                                           for inventory_item in mapped_items]
+
+                        yield get_next_position(units, unit_index, query_index, len(queries), next_token), inventory_items
+        except ClientError as ex:
+            _logger.error("Received error: %s while retrieving resources from aggregator %s", ex, aggregator_name, exc_info=True)
+            raise
+
+    def get_work_units(self) -> List[dict]:
+        """Splits collection into one independently collectable unit per shard, see AGGREGATOR_SHARD_BY."""
+        aggregator_name = _get_aggregator_name()
+
+        return [{ "resource_types": resource_types, "filters": filters } for resource_types, filters in self._get_shards(aggregator_name)]
+
+    def iter_work_unit_inventory(self, work_unit: dict) -> Iterator[InventoryData]:
+        """Yields the inventory rows of a unit returned by get_work_units."""
+        aggregator_name = _get_aggregator_name()
+
+        try:
+            for query in self._build_resource_queries(work_unit["resource_types"], work_unit["filters"]):
+                for _, resource_list_page in self._paginate(aggregator_name, query):
+                    for _, inventory_items in self._map_resource_page(resource_list_page):
+                        yield from inventory_items
+        except ClientError as ex:
+            _logger.error("Received error: %s while retrieving resources from aggregator %s", ex, aggregator_name, exc_info=True)
+            raise
+
+    def iter_resource_arns(self) -> Iterator[str]:
+        """
+        Yields the ARN of every resource that can currently be mapped, without retrieving its configuration.
+        Resources AWS Config has recorded as deleted are left out.
+        """
+        return (location.arn for location in self.iter_resource_locations())
+
+    def iter_resource_locations(self) -> Iterator[ResourceLocation]:
+        """Yields the same resources as iter_resource_arns together with the account and region AWS Config recorded each in."""
+        select_fields = ["arn", "accountId", "awsRegion", "configurationItemStatus"]
+
+        for resource_list_page in self._get_resources_from_aggregator(lambda resource_types, filters: [build_resource_query(select_fields, resource_types,
+                                                                                                                           filters=filters)]):
+            for resource in self._json_decoder.decode_page(resource_list_page):
+                if resource.get("configurationItemStatus") not in DELETED_CONFIGURATION_ITEM_STATUSES:
+                    yield ResourceLocation(resource["arn"], resource.get("accountId", ""), resource.get("awsRegion", ""))
+
+    def _iter_mapped_resources(self, build_queries: QueryBuilder) -> Iterator[Tuple[dict, List[InventoryData]]]:
+        for resource_list_page in self._get_resources_from_aggregator(build_queries):
+            yield from self._map_resource_page(resource_list_page)
+
+    def _map_resource_page(self, resource_list_page: List[str]) -> Iterator[Tuple[dict, List[InventoryData]]]:
+        _logger.debug("current page of inventory contained %s items from AWS Config Aggregator", len(resource_list_page))
+
+        # Decoding the whole page in one call is considerably faster than decoding each result on its own
+        for resource in self._json_decoder.decode_page(resource_list_page):
+
+            # One line item returned from AWS Config can result in multiple inventory line items (e.g. multiple IPs)
+            inventory_items: Optional[List[InventoryData]] = self._mapper_registry.map(resource)
+            
+            if inventory_items is None:
+                _logger.warning("skipping mapping, unable to find mapper for resource type of %s", resource['resourceType'])
+                continue
 
-        return all_inventory
+            yield resource, inventory_items
@@ -0,0 +1,309 @@
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# License:
+# This sample code is made available under the MIT-0 license. See the LICENSE file.
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from typing import Generator, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from inventory.mappers import INVENTORY_FIELDS, InventoryBatch, InventoryData
+from inventory.storage import LocalDocumentStore, S3DocumentStore, get_document_location_from_environment, get_document_store
+
+_logger = logging.getLogger("inventory.checkpoints")
+_logger.setLevel(getattr(logging, os.environ.get("LOG_LEVEL", "INFO"), logging.INFO))
+
+CHECKPOINT_VERSION = 2
+DEFAULT_CHECKPOINT_FILE_NAME = "checkpoint.json"
+# Continuation tokens come from the invocation's event and name the checkpoint's file or object
+_CHECKPOINT_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+# Left for saving the checkpoint or, once collection is done, for writing and uploading the report
+DEFAULT_CHECKPOINT_SAFETY_MARGIN_SECONDS = 120
+
+CHECKPOINT_RESUME_MODE_REINVOKE = "reinvoke"
+CHECKPOINT_RESUME_MODE_RETURN = "return"
+
+class CheckpointMismatchError(ValueError):
+    """Raised when a checkpoint was saved for different accounts, regions or shards than are being collected now."""
+
+class CollectionPosition(NamedTuple):
+    """
+    Where collection resumes: the page after next_token of the query at query_index, in the unit (an account and region
+    pair or an aggregator shard) at unit_index. unit names that unit so a changed ACCOUNT_LIST is detected.
+    """
+    unit_index: int = 0
+    unit: Optional[str] = None
+    query_index: int = 0
+    next_token: str = ""
+
+def get_next_position(units: List[str], unit_index: int, query_index: int, query_count: int, next_token: str) -> CollectionPosition:
+    """Returns the position of the page following one that returned next_token."""
+    if next_token:
+        return CollectionPosition(unit_index, units[unit_index], query_index, next_token)
+    if query_index + 1 < query_count:
+        return CollectionPosition(unit_index, units[unit_index], query_index + 1)
+
+    return CollectionPosition(unit_index + 1, units[unit_index + 1] if unit_index + 1 < len(units) else None)
+
+def validate_position(position: CollectionPosition, units: List[str]):
+    # The default position starts at the beginning whatever is being collected
+    if position == CollectionPosition():
+        return
+
+    if position.unit_index > len(units) or (position.unit_index < len(units) and units[position.unit_index] != position.unit):
+        raise CheckpointMismatchError(f"Checkpoint position {position.unit_index} ({position.unit}) does not match the units being collected")
+
+class Checkpoint():
+    """
+    The position collection resumes from and how many parts of rows have been saved so far. inventory holds the rows
+    collected since the last save, which the next save appends as a part of their own.
+    """
+    def __init__(self, checkpoint_id: str, position: CollectionPosition, part_count: int = 0, row_count: int = 0,
+                 failed_account_ids: Optional[List[str]] = None):
+        self.checkpoint_id = checkpoint_id
+        self.position = position
+        self.part_count = part_count
+        self.row_count = row_count
+        self.inventory = InventoryBatch()
+        self.failed_account_ids: List[str] = failed_account_ids if failed_account_ids is not None else []
+
+    def to_json(self) -> str:
+        return json.dumps({ "version": CHECKPOINT_VERSION,
+                            "checkpoint_id": self.checkpoint_id,
+                            "position": self.position._asdict(),
+                            "part_count": self.part_count,
+                            "row_count": self.row_count,
+                            "failed_account_ids": self.failed_account_ids })
+
+    @classmethod
+    def from_json(cls, document: str) -> "Checkpoint":
+        data = json.loads(document)
+        if data.get("version") != CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version: {data.get('version')}")
+
+        return cls(data["checkpoint_id"], CollectionPosition(**data["position"]), data["part_count"], data["row_count"], data.get("failed_account_ids", []))
+
+def get_checkpoint_document_name(name: str, checkpoint_id: str) -> str:
+    """Adds the checkpoint id to a file name or S3 key, e.g. checkpoint.json becomes checkpoint-<id>.json."""
+    root, extension = os.path.splitext(name)
+    return f"{root}-{checkpoint_id}{extension}"
+
+def _get_part_id(checkpoint_id: str, part_index: int) -> str:
+    return f"{checkpoint_id}-part-{part_index:06}"
+
+class _CheckpointDocuments():
+    """
+    Keeps each checkpoint as a small index document and one part document per save holding the rows collected since
+    the previous save, so a save only writes the new rows and the parts can be read back one at a time.
+    """
+    def _get_document_store(self, document_id: str):
+        raise NotImplementedError()
+
+    def load(self, checkpoint_id: str) -> Optional[Checkpoint]:
+        document = self._get_document_store(checkpoint_id).load_document()
+        return Checkpoint.from_json(document) if document is not None else None
+
+    def save(self, checkpoint: Checkpoint):
+        # The part is written before the index that counts it, so an index never refers to a missing part
+        if len(checkpoint.inventory):
+            self._get_document_store(_get_part_id(checkpoint.checkpoint_id, checkpoint.part_count)) \
+                .save_document(json.dumps({ "columns": { field: checkpoint.inventory.column(field) for field in INVENTORY_FIELDS } }))
+            checkpoint.part_count += 1
+            checkpoint.row_count += len(checkpoint.inventory)
+            checkpoint.inventory = InventoryBatch()
+
+        self._get_document_store(checkpoint.checkpoint_id).save_document(checkpoint.to_json())
+
+    def load_part(self, checkpoint_id: str, part_index: int) -> InventoryBatch:
+        document = self._get_document_store(_get_part_id(checkpoint_id, part_index)).load_document()
+        if document is None:
+            raise ValueError(f"Part {part_index} of checkpoint {checkpoint_id} is missing")
+
+        return InventoryBatch(json.loads(document)["columns"])
+
+    def delete(self, checkpoint_id: str):
+        checkpoint = self.load(checkpoint_id)
+        for part_index in range(checkpoint.part_count if checkpoint is not None else 0):
+            self._get_document_store(_get_part_id(checkpoint_id, part_index)).delete_document()
+
+        self._get_document_store(checkpoint_id).delete_document()
+
+class LocalCheckpointStore(_CheckpointDocuments, LocalDocumentStore):
+    """Keeps the checkpoint of each chain of invocations in its own files, named after the store's file and the checkpoint id."""
+    def _get_document_store(self, document_id: str) -> LocalDocumentStore:
+        return LocalDocumentStore(get_checkpoint_document_name(self.location, document_id))
+
+class S3CheckpointStore(_CheckpointDocuments, S3DocumentStore):
+    """Keeps the checkpoint of each chain of invocations in its own objects, named after the store's key and the checkpoint id."""
+    def _get_document_store(self, document_id: str) -> S3DocumentStore:
+        return S3DocumentStore(self._s3_client, self._bucket, get_checkpoint_document_name(self._key, document_id))
+
+class CheckpointInventory():
+    """
+    The rows of a checkpoint followed by the rows collected since it was last saved. The saved parts are read back a
+    batch at a time each time the rows are iterated, rather than all being held in memory.
+    """
+    def __init__(self, checkpoint_store, checkpoint: Checkpoint):
+        self._checkpoint_store = checkpoint_store
+        self._checkpoint_id = checkpoint.checkpoint_id
+        self._part_count = checkpoint.part_count
+        self._row_count = checkpoint.row_count
+        self._inventory = checkpoint.inventory
+
+    def __len__(self) -> int:
+        return self._row_count + len(self._inventory)
+
+    def __iter__(self) -> Iterator[InventoryBatch]:
+        for part_index in range(self._part_count):
+            yield self._checkpoint_store.load_part(self._checkpoint_id, part_index)
+
+        yield self._inventory
+
+def get_checkpoint_store_from_environment(s3_client):
+    """
+    Returns the store named by CHECKPOINT_LOCATION, which is either an s3://bucket/key URL or a local file path.
+    Defaults to a file next to the delivered reports in REPORT_TARGET_BUCKET_NAME/REPORT_TARGET_BUCKET_PATH.
+    """
+    location = get_document_location_from_environment("CHECKPOINT_LOCATION", DEFAULT_CHECKPOINT_FILE_NAME)
+
+    return get_document_store(location, s3_client, "CHECKPOINT_LOCATION", LocalCheckpointStore, S3CheckpointStore)
+
+def get_safety_margin_seconds_from_environment() -> float:
+    try:
+        safety_margin_seconds = float(os.environ.get("CHECKPOINT_SAFETY_MARGIN_SECONDS", DEFAULT_CHECKPOINT_SAFETY_MARGIN_SECONDS))
+    except ValueError:
+        raise ValueError("CHECKPOINT_SAFETY_MARGIN_SECONDS must be a number")
+
+    if safety_margin_seconds < 0:
+        raise ValueError("CHECKPOINT_SAFETY_MARGIN_SECONDS must not be negative")
+
+    return safety_margin_seconds
+
+def get_resume_mode_from_environment() -> str:
+    resume_mode = os.environ.get("CHECKPOINT_RESUME_MODE", CHECKPOINT_RESUME_MODE_REINVOKE).lower()
+    if resume_mode not in (CHECKPOINT_RESUME_MODE_REINVOKE, CHECKPOINT_RESUME_MODE_RETURN):
+        raise ValueError(f"CHECKPOINT_RESUME_MODE must be '{CHECKPOINT_RESUME_MODE_REINVOKE}' or '{CHECKPOINT_RESUME_MODE_RETURN}'")
+
+    return resume_mode
+
+class CollectionResult(NamedTuple):
+    """
+    Either the collected inventory, as batches of rows, or, when the invocation ran out of time, the token to continue collection with.
+    checkpoint_id names the checkpoint a completed collection was resumed from, which is kept until the report is delivered.
+    """
+    inventory: Optional[Iterable[InventoryBatch]] = None
+    continuation_token: Optional[str] = None
+    checkpoint_id: Optional[str] = None
+
+    @property
+    def complete(self) -> bool:
+        return self.continuation_token is None
+
+class DeadlineAwareCollector():
+    """
+    Collects inventory page by page, saving a checkpoint and stopping when the Lambda invocation is about to time out.
+
+    Collection stops once the remaining time is less than the safety margin plus the slowest page seen so far. The
+    checkpoint holds the position of the next page, including its NextToken, so an invocation given the returned
+    continuation token carries on from there. Each save appends the rows collected since the previous one as a part of
+    the checkpoint, and a completed collection reads the parts back a batch at a time when the report is written. A checkpoint is also saved when
+    collection finishes without enough time left to write the report, in which case the next invocation only
+    writes the report. Each chain of invocations has a checkpoint of its own, and the checkpoint of a completed
+    collection is only deleted by delete_checkpoint, once the report has been delivered.
+    """
+    def __init__(self, reader, lambda_context, checkpoint_store, safety_margin_seconds: Optional[float] = None):
+        self._reader = reader
+        self._lambda_context = lambda_context
+        self._checkpoint_store = checkpoint_store
+        self._safety_margin_seconds = safety_margin_seconds if safety_margin_seconds is not None else get_safety_margin_seconds_from_environment()
+
+    def _get_remaining_seconds(self) -> Optional[float]:
+        # Contexts outside of Lambda, e.g. when running the handler locally, have no deadline
+        get_remaining_time_in_millis = getattr(self._lambda_context, "get_remaining_time_in_millis", None)
+        return get_remaining_time_in_millis() / 1000 if callable(get_remaining_time_in_millis) else None
+
+    def _is_out_of_time(self, reserved_seconds: float) -> bool:
+        remaining_seconds = self._get_remaining_seconds()
+        return remaining_seconds is not None and remaining_seconds < self._safety_margin_seconds + reserved_seconds
+
+    def _load_checkpoint(self, continuation_token: Optional[str]) -> Checkpoint:
+        if continuation_token is None:
+            return Checkpoint(uuid.uuid4().hex, CollectionPosition())
+
+        checkpoint = self._checkpoint_store.load(continuation_token) if _CHECKPOINT_ID_RE.match(continuation_token) else None
+        if checkpoint is None or checkpoint.checkpoint_id != continuation_token:
+            raise ValueError(f"No checkpoint found for continuation token {continuation_token}")
+
+        _logger.info("resuming collection from unit %s (%s) with %s rows already collected",
+                     checkpoint.position.unit_index, checkpoint.position.unit, checkpoint.row_count)
+
+        return checkpoint
+
+    def _save_checkpoint(self, checkpoint: Checkpoint) -> CollectionResult:
+        saved_row_count = len(checkpoint.inventory)
+        self._checkpoint_store.save(checkpoint)
+
+        _logger.warning("running out of time, saved %s rows and position %s (%s) to checkpoint %s, which now holds %s rows",
+                        saved_row_count, checkpoint.position.unit_index, checkpoint.position.unit, checkpoint.checkpoint_id, checkpoint.row_count)
+
+        return CollectionResult(continuation_token=checkpoint.checkpoint_id)
+
+    def _iter_pages(self, checkpoint: Checkpoint) -> Generator[Tuple[CollectionPosition, List[InventoryData]], None, None]:
+        try:
+            yield from self._reader.iter_resumable_pages(checkpoint.position)
+        except CheckpointMismatchError as ex:
+            # The rows so far came from accounts that are no longer being collected, so they cannot be kept either
+            _logger.warning("%s, discarding the %s rows of checkpoint %s and starting collection over", ex, checkpoint.row_count, checkpoint.checkpoint_id)
+            self._checkpoint_store.delete(checkpoint.checkpoint_id)
+            checkpoint.position = CollectionPosition()
+            checkpoint.part_count = 0
+            checkpoint.row_count = 0
+            checkpoint.inventory = InventoryBatch()
+            checkpoint.failed_account_ids = []
+            yield from self._reader.iter_resumable_pages(checkpoint.position)
+
+    def collect(self, continuation_token: Optional[str] = None) -> CollectionResult:
+        checkpoint = self._load_checkpoint(continuation_token)
+        slowest_page_seconds = 0.0
+
+        pages = self._iter_pages(checkpoint)
+        while True:
+            started_at = time.perf_counter()
+            next_page = next(pages, None)
+            if next_page is None:
+                break
+
+            checkpoint.position, inventory_items = next_page
+            checkpoint.inventory.extend(inventory_items)
+            checkpoint.failed_account_ids.extend(account_id for account_id in self._reader.failed_account_ids
+                                                 if account_id not in checkpoint.failed_account_ids)
+            slowest_page_seconds = max(slowest_page_seconds, time.perf_counter() - started_at)
+
+            if self._is_out_of_time(slowest_page_seconds):
+                pages.close()
+                return self._save_checkpoint(checkpoint)
+
+        if self._is_out_of_time(0):
+            return self._save_checkpoint(checkpoint)
+
+        if checkpoint.failed_account_ids:
+            _logger.warning("accounts %s could not be read", checkpoint.failed_account_ids)
+
+        inventory = CheckpointInventory(self._checkpoint_store, checkpoint)
+        _logger.info("completed collection with %s rows", len(inventory))
+
+        return CollectionResult(inventory=inventory, checkpoint_id=continuation_token)
+
+    def delete_checkpoint(self, result: CollectionResult):
+        """Deletes the checkpoint a completed collection was resumed from. Called once its report has been delivered."""
+        if result.checkpoint_id is not None:
+            self._checkpoint_store.delete(result.checkpoint_id)
+
+            _logger.info("deleted checkpoint %s", result.checkpoint_id)
+
+def reinvoke_function(lambda_client, function_arn: str, continuation_token: str):
+    """Invokes the function again, asynchronously, so it continues collection from the checkpoint."""
+    _logger.info("invoking %s to continue collection from checkpoint %s", function_arn, continuation_token)
+
+    lambda_client.invoke(FunctionName=function_arn, InvocationType="Event", Payload=json.dumps({ "continuation_token": continuation_token }).encode("utf-8"))
@@ -0,0 +1,114 @@
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# License:
+# This sample code is made available under the MIT-0 license. See the LICENSE file.
+import logging
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Deque, Iterable, Iterator, List, TypeVar
+
+_logger = logging.getLogger("inventory.concurrency")
+_logger.setLevel(getattr(logging, os.environ.get("LOG_LEVEL", "INFO"), logging.INFO))
+
+K = TypeVar("K")
+T = TypeVar("T")
+
+# Marks the end of the items of a key in iter_concurrently_streamed_in_order
+_DONE = object()
+
+def get_max_workers_from_environment(variable_name: str, default: int) -> int:
+    try:
+        max_workers = int(os.environ.get(variable_name, default))
+    except ValueError as ex:
+        _logger.error("Invalid %s value: %s", variable_name, ex)
+        raise ValueError(f"{variable_name} must be a valid integer")
+
+    if max_workers < 1:
+        raise ValueError(f"{variable_name} must be at least 1")
+
+    return max_workers
+
+def iter_concurrently_in_order(keys: Iterable[K], get_items: Callable[[K], List[T]], max_workers: int,
+                               thread_name_prefix: str = "inventory") -> Iterator[T]:
+    """
+    Calls get_items for each key on a pool of max_workers threads and yields the items in the order of keys,
+    regardless of which call finishes first.
+
+    A new key is only submitted once the oldest pending one has been consumed, so at most max_workers results
+    are buffered at a time. Exceptions raised by get_items are re-raised when its results are reached.
+    """
+    remaining_keys = iter(keys)
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix) as executor:
+        pending: Deque[Future] = deque(executor.submit(get_items, key) for key in islice(remaining_keys, max_workers))
+
+        while pending:
+            items = pending.popleft().result()
+
+            for key in islice(remaining_keys, 1):
+                pending.append(executor.submit(get_items, key))
+
+            yield from items
+
+class _Failure():
+    def __init__(self, exception: Exception):
+        self.exception = exception
+
+def iter_concurrently_streamed_in_order(keys: Iterable[K], iter_items: Callable[[K], Iterable[T]], max_workers: int, max_buffered_items: int,
+                                        thread_name_prefix: str = "inventory") -> Iterator[T]:
+    """
+    Like iter_concurrently_in_order, but the items of each key are passed on through a queue as iter_items produces
+    them instead of once all of them have been produced.
+
+    Each queue holds up to max_buffered_items, and a thread whose queue is full waits for the items to be consumed,
+    so at most max_workers * max_buffered_items items are buffered at a time however many items a key has.
+    """
+    remaining_keys = iter(keys)
+    stopped = threading.Event()
+
+    def put(items_queue: queue.Queue, item) -> bool:
+        # Gives up once the consumer has stopped so no thread is left waiting on a queue nobody reads
+        while not stopped.is_set():
+            try:
+                items_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def produce(key: K, items_queue: queue.Queue):
+        try:
+            for item in iter_items(key):
+                if not put(items_queue, item):
+                    return
+
+            put(items_queue, _DONE)
+        except Exception as ex:
+            put(items_queue, _Failure(ex))
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix) as executor:
+        def submit(key: K) -> queue.Queue:
+            items_queue: queue.Queue = queue.Queue(maxsize=max_buffered_items)
+            executor.submit(produce, key, items_queue)
+            return items_queue
+
+        pending: Deque[queue.Queue] = deque(submit(key) for key in islice(remaining_keys, max_workers))
+
+        try:
+            while pending:
+                while (item := pending[0].get()) is not _DONE:
+                    if isinstance(item, _Failure):
+                        raise item.exception
+
+                    yield item
+
+                pending.popleft()
+
+                for key in islice(remaining_keys, 1):
+                    pending.append(submit(key))
+        finally:
+            stopped.set()
@@ -0,0 +1,85 @@
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# License:
+# This sample code is made available under the MIT-0 license. See the LICENSE file.
+import json
+import logging
+import os
+from typing import Any, List, Optional
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None  # type: ignore[assignment]
+
+_logger = logging.getLogger("inventory.decoding")
+_logger.setLevel(getattr(logging, os.environ.get("LOG_LEVEL", "INFO"), logging.INFO))
+
+JSON_DECODER_AUTO = "auto"
+
+class StdlibJsonDecoder():
+    """Decodes with the json module, which is always available."""
+    name = "json"
+
+    def __init__(self):
+        self._decode = json.JSONDecoder().decode
+
+    def decode(self, raw_result: str) -> Any:
+        return self._decode(raw_result)
+
+    def decode_page(self, raw_results: List[str]) -> List[Any]:
+        if not raw_results:
+            return []
+
+        # Every result is a single JSON object, so the page can be decoded as one array instead of one call per result
+        resources = self._decode("[" + ",".join(raw_results) + "]")
+        if len(resources) != len(raw_results):
+            # A result holding more than one value would shift every resource after it, so decode them one by one
+            return [self._decode(raw_result) for raw_result in raw_results]
+
+        return resources
+
+class OrjsonDecoder():
+    """
+    Decodes with orjson. JSON orjson rejects but the json module accepts, e.g. NaN, is decoded with the json module
+    instead. Unlike the json module, orjson decodes integers beyond 64 bits as floats. AWS Config does not return
+    such integers and checking every result for them would cost as much as decoding it.
+    """
+    name = "orjson"
+
+    def __init__(self):
+        if orjson is None:
+            raise ValueError("JSON_DECODER is orjson but the orjson package is not installed")
+
+        self._fallback = StdlibJsonDecoder()
+
+    def decode(self, raw_result: str) -> Any:
+        try:
+            return orjson.loads(raw_result)
+        except orjson.JSONDecodeError:
+            return self._fallback.decode(raw_result)
+
+    def decode_page(self, raw_results: List[str]) -> List[Any]:
+        # orjson's per call overhead is low enough that joining the page into one array, which copies every result,
+        # does not pay off
+        try:
+            return [orjson.loads(raw_result) for raw_result in raw_results]
+        except orjson.JSONDecodeError:
+            return [self.decode(raw_result) for raw_result in raw_results]
+
+_DECODERS = { StdlibJsonDecoder.name: StdlibJsonDecoder, OrjsonDecoder.name: OrjsonDecoder }
+
+def get_json_decoder(name: Optional[str] = None):
+    """
+    Returns the decoder named by name or, if not provided, JSON_DECODER. The default of "auto" picks orjson when it
+    is installed and the json module otherwise.
+    """
+    name = (name or os.environ.get("JSON_DECODER", JSON_DECODER_AUTO)).lower()
+    if name == JSON_DECODER_AUTO:
+        name = OrjsonDecoder.name if orjson is not None else StdlibJsonDecoder.name
+
+    if name not in _DECODERS:
+        raise ValueError(f"JSON_DECODER must be one of {', '.join([JSON_DECODER_AUTO, *_DECODERS])}, not {name}")
+
+    _logger.debug("decoding AWS Config results with %s", name)
+
+    return _DECODERS[name]()
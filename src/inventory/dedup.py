@@ -0,0 +1,128 @@
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# License:
+# This sample code is made available under the MIT-0 license. See the LICENSE file.
+import logging
+import os
+from typing import Dict, Iterable, Iterator, List, Set, Tuple, Union
+from inventory.mappers import INVENTORY_FIELDS, InventoryBatch, InventoryData, iter_inventory_batches
+
+_logger = logging.getLogger("inventory.dedup")
+_logger.setLevel(getattr(logging, os.environ.get("LOG_LEVEL", "INFO"), logging.INFO))
+
+DEDUP_POLICY_FIRST = "first"
+DEDUP_POLICY_MERGE = "merge"
+DEDUP_POLICY_OFF = "off"
+DEDUP_POLICIES = (DEDUP_POLICY_FIRST, DEDUP_POLICY_MERGE, DEDUP_POLICY_OFF)
+
+def get_dedup_policy_from_environment() -> str:
+    policy = os.environ.get("DEDUP_POLICY", DEDUP_POLICY_FIRST).lower()
+    if policy not in DEDUP_POLICIES:
+        raise ValueError(f"DEDUP_POLICY must be one of {', '.join(DEDUP_POLICIES)}, not {policy}")
+
+    return policy
+
+def _merge_rows(kept: InventoryData, duplicate: InventoryData) -> InventoryData:
+    # Copied so rows the readers handed over, which may share values with other rows, are never changed
+    merged = kept._copy()
+    for field in INVENTORY_FIELDS:
+        if field == "extra_tags":
+            if duplicate.extra_tags:
+                merged.extra_tags = { **duplicate.extra_tags, **(kept.extra_tags or {}) }
+        elif not getattr(merged, field) and getattr(duplicate, field):
+            setattr(merged, field, getattr(duplicate, field))
+
+    return merged
+
+class InventoryDeduplicator():
+    """
+    Drops rows with the same unique_id and ip_address as an earlier row, which shared ENIs and overlapping aggregator
+    sources produce. Rows without a unique_id cannot be told apart and are always kept.
+
+    With the "first" policy the first row of each key is kept and rows are passed on as they arrive, remembering only
+    a 64 bit hash of each key rather than the rows. Two different keys with the same hash would drop a row, which for
+    a million rows is a one in tens of millions chance. The "merge" policy fills the empty fields of the first row
+    from its duplicates, so it holds every row until the inventory is complete. "off" passes every row on.
+    """
+    def __init__(self, policy: str = DEDUP_POLICY_FIRST):
+        if policy not in DEDUP_POLICIES:
+            raise ValueError(f"DEDUP_POLICY must be one of {', '.join(DEDUP_POLICIES)}, not {policy}")
+
+        self._policy = policy
+        self._key_hashes: Set[int] = set()
+        self.duplicates_removed = 0
+
+    @property
+    def policy(self) -> str:
+        return self._policy
+
+    def _is_first(self, unique_id, ip_address) -> bool:
+        if unique_id is None:
+            return True
+
+        key_hash = hash((unique_id, ip_address))
+        if key_hash in self._key_hashes:
+            self.duplicates_removed += 1
+            return False
+
+        self._key_hashes.add(key_hash)
+        return True
+
+    def _deduplicate_batch(self, batch: InventoryBatch) -> InventoryBatch:
+        # _is_first inlined, since this runs for every row of the inventory
+        key_hashes = self._key_hashes
+        kept_indexes: List[int] = []
+        for index, key in enumerate(batch.iter_rows(["unique_id", "ip_address"])):
+            if key[0] is None:
+                kept_indexes.append(index)
+                continue
+
+            key_hash = hash(key)
+            if key_hash not in key_hashes:
+                key_hashes.add(key_hash)
+                kept_indexes.append(index)
+
+        if len(kept_indexes) == len(batch):
+            return batch
+
+        self.duplicates_removed += len(batch) - len(kept_indexes)
+
+        return InventoryBatch({ field: [batch.column(field)[index] for index in kept_indexes] for field in INVENTORY_FIELDS })
+
+    def _iter_first(self, inventory: Iterable[Union[InventoryData, InventoryBatch]]) -> Iterator[Union[InventoryData, InventoryBatch]]:
+        for item in inventory:
+            if isinstance(item, InventoryBatch):
+                batch = self._deduplicate_batch(item)
+                if len(batch):
+                    yield batch
+            elif self._is_first(item.unique_id, item.ip_address):
+                yield item
+
+    def _iter_merged(self, inventory: Iterable[Union[InventoryData, InventoryBatch]]) -> Iterator[InventoryBatch]:
+        rows: List[InventoryData] = []
+        row_indexes: Dict[Tuple, int] = {}
+
+        for item in inventory:
+            for inventory_data in (item if isinstance(item, InventoryBatch) else [item]):
+                if inventory_data.unique_id is None:
+                    rows.append(inventory_data)
+                    continue
+
+                key = (inventory_data.unique_id, inventory_data.ip_address)
+                row_index = row_indexes.get(key)
+                if row_index is None:
+                    row_indexes[key] = len(rows)
+                    rows.append(inventory_data)
+                else:
+                    rows[row_index] = _merge_rows(rows[row_index], inventory_data)
+                    self.duplicates_removed += 1
+
+        yield from iter_inventory_batches(rows)
+
+    def deduplicate(self, inventory: Iterable[Union[InventoryData, InventoryBatch]]) -> Iterator[Union[InventoryData, InventoryBatch]]:
+        """Yields the inventory, given as InventoryData rows, InventoryBatch batches of rows or a mix of both, without duplicates."""
+        if self._policy == DEDUP_POLICY_OFF:
+            return iter(inventory)
+        if self._policy == DEDUP_POLICY_MERGE:
+            return self._iter_merged(inventory)
+
+        return self._iter_first(inventory)
@@ -0,0 +1,285 @@
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# License:
+# This sample code is made available under the MIT-0 license. See the LICENSE file.
+"""
+Compares two inventories, e.g. last month's and this month's, and writes the rows added, removed and changed, e.g.
+
+    python -m inventory.diff january.xlsx february.xlsx --output changes.xlsx
+    python -m inventory.diff --snapshots inventory.db 3 latest --output changes.csv
+    python -m inventory.diff january.csv.gz february.csv.gz --partitions 32
+"""
+import argparse
+import csv
+import gzip
+import json
+import logging
+import os
+import pickle
+import sys
+import tempfile
+import zlib
+from typing import IO, BinaryIO, Dict, Iterable, Iterator, List, Optional, Sequence, TextIO, Union
+from openpyxl import Workbook, load_workbook
+from inventory.mappers import DEFAULT_INVENTORY_BATCH_SIZE, InventoryBatch, InventoryData, iter_inventory_rows
+from inventory.report_writers import REPORT_FIELDS
+from inventory.reports import COL_FIRST_EXTRA_TAG, FIELD_MAPPINGS, CreateReportCommandHandler, _workbook_template_file_name
+from inventory.snapshots import CHANGE_ADDED, CHANGE_CHANGED, CHANGE_REMOVED, RowChange, SnapshotStore
+
+_logger = logging.getLogger("inventory.diff")
+_logger.setLevel(getattr(logging, os.environ.get("LOG_LEVEL", "INFO"), logging.INFO))
+
+# The fields every report format holds, so inventories read back from any of them can be compared
+DIFF_FIELDS = REPORT_FIELDS + ["extra_tags"]
+DEFAULT_DIFF_PARTITION_COUNT = 1
+CHANGE_COLUMN_NAMES = ["change", "changed_fields", *DIFF_FIELDS, *(f"old:{field}" for field in DIFF_FIELDS)]
+
+_UNIQUE_ID_INDEX = DIFF_FIELDS.index("unique_id")
+_IP_ADDRESS_INDEX = DIFF_FIELDS.index("ip_address")
+_EXTRA_TAGS_INDEX = DIFF_FIELDS.index("extra_tags")
+_TAG_COLUMN_PREFIX = "tag:"
+
+def _normalize_row(values: Sequence, extra_tags: Optional[dict]) -> tuple:
+    # Empty cells read back from a workbook are None where the mappers had empty strings, so both compare equal, and
+    # tags are held as sorted items so their order does not matter either
+    tags = tuple(sorted((tag_name, value) for tag_name, value in extra_tags.items() if value)) if extra_tags else ()
+    return (*(value if value != "" else None for value in values), tags or None)
+
+def iter_inventory_diff_rows(inventory: Iterable[Union[InventoryData, InventoryBatch]]) -> Iterator[tuple]:
+    """Yields the DIFF_FIELDS of rows from the readers, or any InventoryData rows and batches, in the form InventoryDiffer compares."""
+    return (_normalize_row(values, extra_tags) for *values, extra_tags in iter_inventory_rows(inventory, DIFF_FIELDS))
+
+def iter_workbook_diff_rows(file_name: str) -> Iterator[tuple]:
+    """
+    Yields the DIFF_FIELDS of the rows of a workbook written by CreateReportCommandHandler, reading the worksheet and
+    rows named by REPORT_WORKSHEET_NAME and REPORT_WORKSHEET_FIRST_WRITEABLE_ROW_NUMBER. Extra tags are read from the
+    columns after the template's that have a heading.
+    """
+    report_settings = CreateReportCommandHandler().get_report_settings()
+    first_row_number = report_settings["first_row_number"]
+    field_indexes = [column - 1 for column, _ in FIELD_MAPPINGS]
+
+    def get_field_values(values: tuple) -> tuple:
+        return tuple(values[index] if index < len(values) else None for index in field_indexes)
+
+    def iter_worksheet_rows(workbook_file_name: str) -> Iterator[tuple]:
+        workbook = load_workbook(workbook_file_name, read_only=True, data_only=True)
+        try:
+            if report_settings["worksheet"] not in workbook.sheetnames:
+                raise ValueError(f"Worksheet '{report_settings['worksheet']}' not found in {workbook_file_name}")
+
+            yield from workbook[report_settings["worksheet"]].iter_rows(min_row=max(first_row_number - 1, 1), values_only=True)
+        finally:
+            workbook.close()
+
+    # The report writes its rows over the template's guidance and example rows, clearing the cells a row leaves empty,
+    # so a row still holding every value of the template's row in the same position was not written over
+    template_rows = { row_number: template_values for row_number, template_values
+                      in enumerate((get_field_values(values) for values in iter_worksheet_rows(_workbook_template_file_name)), start=max(first_row_number - 1, 1))
+                      if row_number >= first_row_number and any(template_values) }
+
+    rows = iter_worksheet_rows(file_name)
+    tag_indexes: List[tuple] = []
+    if first_row_number > 1:
+        headings = next(rows, ())
+        tag_indexes = [(index, heading) for index, heading in enumerate(headings) if index >= COL_FIRST_EXTRA_TAG - 1 and heading]
+
+    for row_number, values in enumerate(rows, start=first_row_number):
+        row = get_field_values(values)
+        # The template's formatted rows below the inventory have no values
+        if not any(row) or row == template_rows.get(row_number):
+            continue
+
+        yield _normalize_row(row, { heading: values[index] for index, heading in tag_indexes if index < len(values) })
+
+def _open_text_file(file_name: str) -> TextIO:
+    if file_name.endswith(".gz"):
+        return gzip.open(file_name, "rt", encoding="utf-8", newline="")
+
+    return open(file_name, "r", encoding="utf-8", newline="")
+
+def iter_report_file_diff_rows(file_name: str) -> Iterator[tuple]:
+    """Yields the DIFF_FIELDS of the rows of a csv or jsonl report, optionally gzip compressed."""
+    with _open_text_file(file_name) as report_file:
+        records: Iterable[dict]
+        if file_name.endswith((".jsonl", ".jsonl.gz")):
+            records = (json.loads(line) for line in report_file if line.strip())
+        else:
+            records = csv.DictReader(report_file)
+
+        for record in records:
+            yield _normalize_row(tuple(record.get(field) for field in REPORT_FIELDS),
+                                 { column_name[len(_TAG_COLUMN_PREFIX):]: value for column_name, value in record.items() if column_name.startswith(_TAG_COLUMN_PREFIX) })
+
+def _to_inventory_data(values: tuple) -> InventoryData:
+    fields = dict(zip(DIFF_FIELDS, values))
+    fields["extra_tags"] = dict(fields["extra_tags"]) if fields["extra_tags"] else None
+    return InventoryData(**fields)
+
+class InventoryDiffer():
+    """
+    Finds the rows added, removed and changed between two inventories by joining them on unique_id and ip_address,
+    comparing the DIFF_FIELDS of rows found in both. Rows are expected to be unique by that key, as they are unless
+    DEDUP_POLICY is off, otherwise only the first row of a key in the old inventory is compared.
+
+    The old inventory is loaded into a dictionary by key and the new one streamed past it, so the diff takes time
+    linear in the number of rows but holds the old inventory in memory. With partition_count above 1, both are first
+    split by a hash of the key into that many files in work_directory, and each pair of files is joined in turn, so only
+    one partition of the old inventory is held at a time. Changes are yielded partition by partition, with the added
+    and changed rows of each in the order of the new inventory and then its removed rows in the order of the old one.
+    """
+    def __init__(self, partition_count: int = DEFAULT_DIFF_PARTITION_COUNT, work_directory: Optional[str] = None):
+        if partition_count < 1:
+            raise ValueError("partition_count must be at least 1")
+
+        self._partition_count = partition_count
+        self._work_directory = work_directory
+
+    def _join(self, old_rows: Iterable[tuple], new_rows: Iterable[tuple]) -> Iterator[RowChange]:
+        old_rows_by_key: Dict[tuple, tuple] = {}
+        for row in old_rows:
+            old_rows_by_key.setdefault((row[_UNIQUE_ID_INDEX], row[_IP_ADDRESS_INDEX]), row)
+
+        for row in new_rows:
+            old_row = old_rows_by_key.pop((row[_UNIQUE_ID_INDEX], row[_IP_ADDRESS_INDEX]), None)
+            if old_row is None:
+                yield RowChange(CHANGE_ADDED, None, _to_inventory_data(row))
+            elif old_row != row:
+                yield RowChange(CHANGE_CHANGED, _to_inventory_data(old_row), _to_inventory_data(row))
+
+        for row in old_rows_by_key.values():
+            yield RowChange(CHANGE_REMOVED, _to_inventory_data(row), None)
+
+    def _partition(self, rows: Iterable[tuple], partition_files: Sequence[IO[bytes]]):
+        # crc32 rather than hash, which is salted per process, so the same inventories always produce changes in the same order
+        buffers: List[List[tuple]] = [[] for _ in partition_files]
+        for row in rows:
+            partition_index = zlib.crc32(f"{row[_UNIQUE_ID_INDEX]}\0{row[_IP_ADDRESS_INDEX]}".encode("utf-8")) % len(buffers)
+            buffer = buffers[partition_index]
+            buffer.append(row)
+            # Pickled a batch of rows at a time, a call per row would dominate
+            if len(buffer) >= DEFAULT_INVENTORY_BATCH_SIZE:
+                pickle.dump(buffer, partition_files[partition_index], pickle.HIGHEST_PROTOCOL)
+                buffer.clear()
+
+        for buffer, partition_file in zip(buffers, partition_files):
+            if buffer:
+                pickle.dump(buffer, partition_file, pickle.HIGHEST_PROTOCOL)
+            partition_file.seek(0)
+
+    @staticmethod
+    def _iter_partition(partition_file: IO[bytes]) -> Iterator[tuple]:
+        while True:
+            try:
+                yield from pickle.load(partition_file)
+            except EOFError:
+                return
+
+    def diff(self, old_rows: Iterable[tuple], new_rows: Iterable[tuple]) -> Iterator[RowChange]:
+        """Yields the changes between rows from the iter_*_diff_rows functions, e.g. iter_workbook_diff_rows."""
+        if self._partition_count == 1:
+            yield from self._join(old_rows, new_rows)
+            return
+
+        old_files = [tempfile.TemporaryFile(dir=self._work_directory) for _ in range(self._partition_count)]
+        new_files = [tempfile.TemporaryFile(dir=self._work_directory) for _ in range(self._partition_count)]
+        try:
+            self._partition(old_rows, old_files)
+            self._partition(new_rows, new_files)
+            _logger.info("split the inventories into %s partitions", self._partition_count)
+
+            for old_file, new_file in zip(old_files, new_files):
+                yield from self._join(self._iter_partition(old_file), self._iter_partition(new_file))
+        finally:
+            for partition_file in old_files + new_files:
+                partition_file.close()
+
+def _get_change_values(row_change: RowChange) -> list:
+    row = row_change.old if row_change.change == CHANGE_REMOVED else row_change.new
+    changed_fields = row_change.changed_fields
+    values = [getattr(row, field) for field in DIFF_FIELDS]
+    # Only the previous values of the fields that changed, so they stand out
+    old_values = [getattr(row_change.old, field) if field in changed_fields else None for field in DIFF_FIELDS]
+
+    return [row_change.change, " ".join(changed_fields),
+            *(json.dumps(value, sort_keys=True) if isinstance(value, dict) else value for value in values + old_values)]
+
+def write_changes_csv(changes: Iterable[RowChange], output_file: TextIO) -> Dict[str, int]:
+    """Writes a row per change, with the columns of CHANGE_COLUMN_NAMES, and returns the number of each kind of change."""
+    change_counts = { CHANGE_ADDED: 0, CHANGE_REMOVED: 0, CHANGE_CHANGED: 0 }
+    writer = csv.writer(output_file)
+    writer.writerow(CHANGE_COLUMN_NAMES)
+    for row_change in changes:
+        change_counts[row_change.change] += 1
+        writer.writerow(_get_change_values(row_change))
+
+    return change_counts
+
+def write_changes_workbook(changes: Iterable[RowChange], output_file: Union[str, BinaryIO]) -> Dict[str, int]:
+    """
+    Writes a workbook with a Summary worksheet of the number of each kind of change and a Changes worksheet with the
+    rows of write_changes_csv. The workbook is written in openpyxl's write only mode, so changes are not held in memory.
+    """
+    change_counts = { CHANGE_ADDED: 0, CHANGE_REMOVED: 0, CHANGE_CHANGED: 0 }
+    workbook = Workbook(write_only=True)
+    # Created first so it is the first worksheet, and filled in once the changes have been counted
+    summary_worksheet = workbook.create_sheet("Summary")
+    changes_worksheet = workbook.create_sheet("Changes")
+
+    changes_worksheet.append(CHANGE_COLUMN_NAMES)
+    for row_change in changes:
+        change_counts[row_change.change] += 1
+        changes_worksheet.append(_get_change_values(row_change))
+
+    summary_worksheet.append(["change", "rows"])
+    for change, count in change_counts.items():
+        summary_worksheet.append([change, count])
+
+    workbook.save(output_file)
+
+    return change_counts
+
+def _iter_source_diff_rows(source: str, snapshot_store: Optional[SnapshotStore]) -> Iterator[tuple]:
+    if source.endswith(".xlsx"):
+        return iter_workbook_diff_rows(source)
+    if source.endswith((".csv", ".csv.gz", ".jsonl", ".jsonl.gz")):
+        return iter_report_file_diff_rows(source)
+    if snapshot_store is None:
+        raise ValueError(f"{source} is not an xlsx, csv or jsonl report, and --snapshots is needed to read it as a run")
+
+    return iter_inventory_diff_rows(snapshot_store.query(None if source == "latest" else int(source)))
+
+def main(arguments: List[str], output_file: TextIO = sys.stdout) -> Dict[str, int]:
+    parser = argparse.ArgumentParser(prog="python -m inventory.diff", description="Writes the rows added, removed and changed between two inventories.")
+    parser.add_argument("old", help="the old inventory, an xlsx, csv or jsonl report, or a run id or latest with --snapshots")
+    parser.add_argument("new", help="the new inventory, in the same forms as old")
+    parser.add_argument("--snapshots", help="a SNAPSHOT_LOCATION database, or a local copy of it, to read runs from")
+    parser.add_argument("--output", help="an xlsx or csv file to write the changes to, defaults to csv on stdout")
+    parser.add_argument("--partitions", type=int, default=DEFAULT_DIFF_PARTITION_COUNT,
+                        help="partitions to split the inventories into on disk, for inventories too large to hold in memory (default: %(default)s)")
+    parser.add_argument("--work-directory", help="directory for the partitions, defaults to the system's temporary directory")
+
+    options = parser.parse_args(arguments)
+    if options.partitions < 1:
+        parser.error("--partitions must be at least 1")
+
+    snapshot_store = SnapshotStore(options.snapshots) if options.snapshots else None
+    try:
+        changes = InventoryDiffer(options.partitions, options.work_directory).diff(_iter_source_diff_rows(options.old, snapshot_store),
+                                                                                   _iter_source_diff_rows(options.new, snapshot_store))
+        if options.output and options.output.endswith(".xlsx"):
+            change_counts = write_changes_workbook(changes, options.output)
+        elif options.output:
+            with open(options.output, "w", encoding="utf-8", newline="") as changes_file:
+                change_counts = write_changes_csv(changes, changes_file)
+        else:
+            change_counts = write_changes_csv(changes, output_file)
+    finally:
+        if snapshot_store is not None:
+            snapshot_store.close()
+
+    print(", ".join(f"{count} {change}" for change, count in change_counts.items()), file=sys.stderr)
+
+    return change_counts
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,208 @@
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# License:
+# This sample code is made available under the MIT-0 license. See the LICENSE file.
+import glob
+import json
+import logging
+import os
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Tuple
+from inventory.mappers import INVENTORY_FIELDS, InventoryBatch
+from inventory.storage import get_document_location_from_environment, get_document_store
+
+_logger = logging.getLogger("inventory.distributed")
+_logger.setLevel(getattr(logging, os.environ.get("LOG_LEVEL", "INFO"), logging.INFO))
+
+WORK_FILE_VERSION = 1
+DEFAULT_WORK_DIRECTORY_NAME = "runs"
+
+ROLE_WORKER = "worker"
+ROLE_REDUCE = "reduce"
+
+class WorkStore():
+    """
+    Keeps the files of distributed runs under a common location, which is either an s3://bucket/prefix URL or a local
+    directory: a manifest of the run's work units, one file per unit with either its mapped rows or the error it failed
+    with, and a claim on the reduce step.
+    """
+    def __init__(self, location: str, s3_client=None):
+        self._location = location.rstrip("/")
+        self._s3_client = s3_client
+
+    def _get_location(self, run_id: str, name: str) -> str:
+        return f"{self._location}/{run_id}/{name}"
+
+    def _get_store(self, run_id: str, name: str):
+        location = self._get_location(run_id, name)
+        if not location.startswith("s3://"):
+            os.makedirs(os.path.dirname(location), exist_ok=True)
+
+        return get_document_store(location, self._s3_client, "WORK_LOCATION")
+
+    def save_manifest(self, run_id: str, work_units: List[dict]):
+        self._get_store(run_id, "manifest.json").save_document(json.dumps({ "version": WORK_FILE_VERSION,
+                                                                             "run_id": run_id,
+                                                                             "created_at": datetime.now(timezone.utc).isoformat(),
+                                                                             "work_units": work_units }))
+
+    def load_manifest(self, run_id: str) -> List[dict]:
+        document = self._get_store(run_id, "manifest.json").load_document()
+        if document is None:
+            raise ValueError(f"No manifest found for distributed run {run_id}")
+
+        return json.loads(document)["work_units"]
+
+    def save_unit_result(self, run_id: str, unit_index: int, inventory: InventoryBatch, failed_account_ids: List[str]):
+        # Columnar so each field name is written once per unit rather than once per row
+        self._get_store(run_id, f"unit-{unit_index:06}.json").save_document(json.dumps({ "version": WORK_FILE_VERSION,
+                                                                                         "unit_index": unit_index,
+                                                                                         "failed_account_ids": failed_account_ids,
+                                                                                         "columns": { field: inventory.column(field)
+                                                                                                      for field in INVENTORY_FIELDS } }))
+
+    def save_unit_failure(self, run_id: str, unit_index: int, error: str):
+        # Counted like a result, so the reduce step still runs and reports the unit as failed
+        self._get_store(run_id, f"unit-{unit_index:06}.json").save_document(json.dumps({ "version": WORK_FILE_VERSION,
+                                                                                         "unit_index": unit_index,
+                                                                                         "error": error }))
+
+    def load_unit_result(self, run_id: str, unit_index: int) -> Tuple[InventoryBatch, List[str], Optional[str]]:
+        """Returns the unit's rows, the accounts that could not be read and, for a failed unit, its error and no rows."""
+        document = self._get_store(run_id, f"unit-{unit_index:06}.json").load_document()
+        if document is None:
+            raise ValueError(f"No result found for unit {unit_index} of distributed run {run_id}")
+
+        data = json.loads(document)
+        if data.get("version") != WORK_FILE_VERSION:
+            raise ValueError(f"Unsupported work file version: {data.get('version')}")
+
+        if "error" in data:
+            return InventoryBatch(), [], data["error"]
+
+        return InventoryBatch(data["columns"]), data.get("failed_account_ids", []), None
+
+    def count_unit_results(self, run_id: str) -> int:
+        location = self._get_location(run_id, "unit-")
+        if not location.startswith("s3://"):
+            return len(glob.glob(f"{glob.escape(location)}*.json"))
+
+        bucket, _, key_prefix = location[len("s3://"):].partition("/")
+        paginator = self._s3_client.get_paginator("list_objects_v2")
+
+        return sum(page.get("KeyCount", 0) for page in paginator.paginate(Bucket=bucket, Prefix=key_prefix))
+
+    def claim_reduce(self, run_id: str) -> bool:
+        """Returns True to exactly one caller per run, so the workbook is only written once."""
+        return self._get_store(run_id, "reduce.json").create_document(json.dumps({ "claimed_at": datetime.now(timezone.utc).isoformat() }))
+
+    def delete_run(self, run_id: str):
+        """Deletes the manifest, unit files and reduce claim of the run."""
+        unit_count = len(self.load_manifest(run_id))
+        for name in [ *(f"unit-{unit_index:06}.json" for unit_index in range(unit_count)), "reduce.json", "manifest.json" ]:
+            self._get_store(run_id, name).delete_document()
+
+        run_directory = self._get_location(run_id, "")
+        if not run_directory.startswith("s3://") and os.path.isdir(run_directory):
+            os.rmdir(run_directory)
+
+def get_work_store_from_environment(s3_client) -> WorkStore:
+    """
+    Returns the store for the location in WORK_LOCATION, either an s3://bucket/prefix URL or a local directory.
+    Defaults to a runs directory next to the delivered reports in REPORT_TARGET_BUCKET_NAME/REPORT_TARGET_BUCKET_PATH.
+    """
+    return WorkStore(get_document_location_from_environment("WORK_LOCATION", DEFAULT_WORK_DIRECTORY_NAME), s3_client)
+
+class LambdaDispatcher():
+    """Sends each event to the function with an asynchronous invocation."""
+    def __init__(self, lambda_client, function_arn: str):
+        self._lambda_client = lambda_client
+        self._function_arn = function_arn
+
+    def dispatch(self, event: dict):
+        self._lambda_client.invoke(FunctionName=self._function_arn, InvocationType="Event", Payload=json.dumps(event).encode("utf-8"))
+
+class InProcessDispatcher():
+    """
+    Stand-in for asynchronous invocations that queues events and, once run is called, hands them to handle_event in
+    this process in the order they were dispatched, including events dispatched while handling others.
+    """
+    def __init__(self, handle_event: Callable[[dict, "InProcessDispatcher"], dict]):
+        self._handle_event = handle_event
+        self._pending_events: Deque[dict] = deque()
+
+    def dispatch(self, event: dict):
+        self._pending_events.append(event)
+
+    def run(self) -> List[dict]:
+        responses: List[dict] = []
+        while self._pending_events:
+            responses.append(self._handle_event(self._pending_events.popleft(), self))
+
+        return responses
+
+def start_run(reader, work_store: WorkStore, dispatcher, run_id: Optional[str] = None) -> str:
+    """Splits collection into the reader's work units and dispatches a worker event for each of them."""
+    run_id = run_id or f"{datetime.now(timezone.utc):%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}"
+    work_units = reader.get_work_units()
+    if not work_units:
+        raise ValueError("No work units to collect")
+
+    work_store.save_manifest(run_id, work_units)
+
+    for unit_index in range(len(work_units)):
+        dispatcher.dispatch({ "distributed": { "role": ROLE_WORKER, "run_id": run_id, "unit_index": unit_index } })
+
+    _logger.info("started distributed run %s with %s work units", run_id, len(work_units))
+
+    return run_id
+
+def run_work_unit(reader, work_store: WorkStore, dispatcher, run_id: str, unit_index: int) -> int:
+    """
+    Collects and maps one work unit and saves its rows, or the error it failed with, which is raised again afterwards.
+    The worker that completes the last unit dispatches the reduce event. Running a unit again, e.g. when an invocation
+    is retried, overwrites its rows.
+
+    A worker that times out or runs out of memory saves nothing; Lambda retries the asynchronous invocation, and until
+    one of the retries completes the unit the run is not reduced.
+    """
+    work_units = work_store.load_manifest(run_id)
+    error = None
+    try:
+        inventory = InventoryBatch.from_inventory(reader.iter_work_unit_inventory(work_units[unit_index]))
+        work_store.save_unit_result(run_id, unit_index, inventory, reader.failed_account_ids)
+
+        _logger.info("collected %s rows for unit %s of distributed run %s", len(inventory), unit_index, run_id)
+    except Exception as ex:
+        error = ex
+        work_store.save_unit_failure(run_id, unit_index, f"{type(ex).__name__}: {ex}")
+
+        _logger.error("unit %s of distributed run %s failed: %s", unit_index, run_id, ex)
+
+    if work_store.count_unit_results(run_id) >= len(work_units) and work_store.claim_reduce(run_id):
+        _logger.info("all %s work units of distributed run %s are complete", len(work_units), run_id)
+        dispatcher.dispatch({ "distributed": { "role": ROLE_REDUCE, "run_id": run_id } })
+
+    if error is not None:
+        raise error
+
+    return len(inventory)
+
+def iter_run_inventory(work_store: WorkStore, run_id: str, failed_units: Optional[Dict[int, str]] = None) -> Iterator[InventoryBatch]:
+    """
+    Yields the rows of every work unit of the run, in work unit order, for the report to be written from. Failed units
+    have no rows; their errors are logged and, when failed_units is given, added to it by unit index.
+    """
+    work_units = work_store.load_manifest(run_id)
+
+    for unit_index in range(len(work_units)):
+        inventory, failed_account_ids, error = work_store.load_unit_result(run_id, unit_index)
+        if error is not None:
+            _logger.error("unit %s of distributed run %s failed, its rows are missing from the report: %s", unit_index, run_id, error)
+            if failed_units is not None:
+                failed_units[unit_index] = error
+        if failed_account_ids:
+            _logger.warning("accounts %s could not be read for unit %s of distributed run %s", failed_account_ids, unit_index, run_id)
+
+        yield inventory
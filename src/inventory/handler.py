@@ -6,32 +6,180 @@ import json
 import os
 from inventory.readers import AwsConfigInventoryReader
 from inventory.aggregator_reader import AwsConfigAggregatorInventoryReader
+from inventory.checkpoints import (CHECKPOINT_RESUME_MODE_REINVOKE, DeadlineAwareCollector, get_checkpoint_store_from_environment,
+                                   get_resume_mode_from_environment, reinvoke_function)
+from inventory.dedup import InventoryDeduplicator, get_dedup_policy_from_environment
+from inventory.distributed import (ROLE_REDUCE, ROLE_WORKER, LambdaDispatcher, get_work_store_from_environment, iter_run_inventory,
+                                   run_work_unit, start_run)
+from inventory.incremental import IncrementalInventoryCollector, get_incremental_state_store_from_environment
+from inventory.mappers import get_sanitize_cache_stats
+from inventory.report_cache import ReportDigest, collect_with_digest, get_report_digest_store_from_environment, get_unchanged_report
+from inventory.report_writers import get_report_compression_from_environment, get_report_writers
 from inventory.reports import CreateReportCommandHandler, DeliverReportCommandHandler
+from inventory.sessions import get_client
+from inventory.snapshots import get_snapshot_location_from_environment, save_snapshot
 
 _logger = logging.getLogger("inventory.handler")
 _logger.setLevel(logging.INFO)
 
-def lambda_handler(event, context):
+def lambda_handler(event, context, dispatcher=None):
     try:
         _logger.info("Starting FedRAMP inventory collection")
         
         # Choose reader based on deployment type
         use_aggregator = os.environ.get('USE_AGGREGATOR', 'false').lower() == 'true'
         
-        if use_aggregator:
-            _logger.info("Using Config Aggregator reader")
-            inventory = AwsConfigAggregatorInventoryReader(lambda_context=context).get_resources_from_all_accounts()
+        use_incremental = os.environ.get('INCREMENTAL_MODE', 'false').lower() == 'true'
+        use_checkpoints = os.environ.get('CHECKPOINT_MODE', 'false').lower() == 'true'
+        use_distributed = os.environ.get('DISTRIBUTED_MODE', 'false').lower() == 'true'
+        skip_unchanged_report = os.environ.get('SKIP_UNCHANGED_REPORT', 'false').lower() == 'true'
+        if use_incremental and use_checkpoints:
+            raise ValueError("INCREMENTAL_MODE and CHECKPOINT_MODE cannot be used together")
+        if use_distributed and (use_incremental or use_checkpoints):
+            raise ValueError("DISTRIBUTED_MODE cannot be used together with INCREMENTAL_MODE or CHECKPOINT_MODE")
+
+        deduplicator = InventoryDeduplicator(get_dedup_policy_from_environment())
+        create_report_handler = CreateReportCommandHandler()
+        report_writers = get_report_writers(create_report_handler)
+        report_compression = get_report_compression_from_environment()
+        snapshot_location = get_snapshot_location_from_environment()
+        deliver_report_handler = DeliverReportCommandHandler()
+
+        distributed_event = (event or {}).get('distributed') if use_distributed else None
+        failed_units = {}
+
+        # The reduce step only reads the saved unit results, so it needs no reader or Config and STS clients
+        reader = None
+        if distributed_event is None or distributed_event['role'] != ROLE_REDUCE:
+            if use_aggregator:
+                _logger.info("Using Config Aggregator reader")
+                reader = AwsConfigAggregatorInventoryReader(lambda_context=context)
+            else:
+                _logger.info("Using cross-account reader")
+                reader = AwsConfigInventoryReader(lambda_context=context)
+
+        # Rows are streamed from the reader straight into the report instead of being collected into a list first
+        if use_distributed:
+            work_store = get_work_store_from_environment(deliver_report_handler.s3_client)
+            dispatcher = dispatcher if dispatcher is not None else LambdaDispatcher(get_client('lambda'), context.invoked_function_arn)
+
+            if distributed_event is None:
+                _logger.info("Using distributed collection, starting a run")
+                run_id = start_run(reader, work_store, dispatcher)
+
+                return {'statusCode': 202,
+                        'body': json.dumps({
+                                'run_id': run_id
+                            })
+                        }
+
+            if distributed_event['role'] == ROLE_WORKER:
+                row_count = run_work_unit(reader, work_store, dispatcher, distributed_event['run_id'], distributed_event['unit_index'])
+                _logger.info("AWS API calls: %s", json.dumps(reader.retry_stats.to_dict()))
+                _logger.info("Sanitized value cache: %s", json.dumps(get_sanitize_cache_stats()))
+
+                return {'statusCode': 200,
+                        'body': json.dumps({
+                                'run_id': distributed_event['run_id'],
+                                'unit_index': distributed_event['unit_index'],
+                                'rows': row_count
+                            })
+                        }
+
+            if distributed_event['role'] != ROLE_REDUCE:
+                raise ValueError(f"Unsupported distributed role: {distributed_event['role']}")
+
+            _logger.info("Writing the report for distributed run %s", distributed_event['run_id'])
+            inventory = iter_run_inventory(work_store, distributed_event['run_id'], failed_units)
+        elif use_incremental:
+            _logger.info("Using incremental collection")
+            inventory = IncrementalInventoryCollector(reader, get_incremental_state_store_from_environment(deliver_report_handler.s3_client)).collect()
+        elif use_checkpoints:
+            _logger.info("Using deadline aware collection")
+            resume_mode = get_resume_mode_from_environment()
+            collector = DeadlineAwareCollector(reader, context, get_checkpoint_store_from_environment(deliver_report_handler.s3_client))
+            result = collector.collect((event or {}).get('continuation_token'))
+
+            if not result.complete:
+                if resume_mode == CHECKPOINT_RESUME_MODE_REINVOKE:
+                    reinvoke_function(get_client('lambda'), context.invoked_function_arn, result.continuation_token)
+
+                return {'statusCode': 202,
+                        'body': json.dumps({
+                                'continuation_token': result.continuation_token
+                            })
+                        }
+
+            inventory = result.inventory
         else:
-            _logger.info("Using cross-account reader")
-            inventory = AwsConfigInventoryReader(lambda_context=context).get_resources_from_all_accounts()
-        
-        report_path = CreateReportCommandHandler().execute(inventory)
-        report_url = DeliverReportCommandHandler().execute(report_path)
+            inventory = reader.iter_inventory_batches()
         
+        inventory = deduplicator.deduplicate(inventory)
+
+        if skip_unchanged_report:
+            report_digest_store = get_report_digest_store_from_environment(deliver_report_handler.s3_client)
+            report_settings = { **create_report_handler.get_report_settings(),
+                                'formats': [report_writer.format_name for report_writer in report_writers],
+                                'compression': report_compression }
+            inventory, digest = collect_with_digest(inventory, report_settings)
+
+            if unchanged_report := get_unchanged_report(report_digest_store, digest, deliver_report_handler.report_exists):
+                _logger.info(f"Inventory is unchanged since the last report, skipping report generation. Reports: {unchanged_report.report_urls}")
+                if use_checkpoints:
+                    collector.delete_checkpoint(result)
+                if use_distributed:
+                    work_store.delete_run(distributed_event['run_id'])
+                return {'statusCode': 200,
+                        'body': json.dumps({
+                                'report': { 'url': next(iter(unchanged_report.report_urls.values())), 'urls': unchanged_report.report_urls,
+                                            'unchanged': True }
+                            })
+                        }
+        elif len(report_writers) > 1 or snapshot_location:
+            # Every format, and the snapshot, reads the rows, so they are held rather than streamed from the reader
+            inventory = list(inventory)
+
+        # With REPORT_DELIVERY_MODE stream each report is uploaded while it is written instead of being saved to /tmp first
+        report_urls = { report_writer.format_name: deliver_report_handler.deliver(report_writer, inventory, report_compression)
+                        for report_writer in report_writers }
+        report_url = next(iter(report_urls.values()))
+
+        # Saved before the digest, and a failure only logged, so the delivered report stands and the next run saves it again
+        snapshot_saved = True
+        if snapshot_location:
+            try:
+                save_snapshot(snapshot_location, inventory, deliver_report_handler.s3_client, report_urls=report_urls)
+            except Exception as ex:
+                snapshot_saved = False
+                _logger.warning(f"Saving the snapshot to {snapshot_location} failed, the next run will not skip the report: {ex}", exc_info=True)
+
+        if skip_unchanged_report and snapshot_saved:
+            report_digest_store.save(ReportDigest(digest, report_urls, sum(len(batch) for batch in inventory)))
+
+        # Kept until now so a failed report can be written again from the checkpoint or the run's unit results
+        if use_checkpoints:
+            collector.delete_checkpoint(result)
+        if use_distributed:
+            work_store.delete_run(distributed_event['run_id'])
+
+        _logger.info("Removed %s duplicate rows with dedup policy %s", deduplicator.duplicates_removed, deduplicator.policy)
+        if reader is not None:
+            _logger.info("AWS API calls: %s", json.dumps(reader.retry_stats.to_dict()))
+        _logger.info("Sanitized value cache: %s", json.dumps(get_sanitize_cache_stats()))
+
+        if failed_units:
+            _logger.error(f"Inventory collection completed without the rows of failed work units {sorted(failed_units)}. Report: {report_url}")
+            return {'statusCode': 200,
+                    'body': json.dumps({
+                            'report': { 'url': report_url, 'urls': report_urls },
+                            'failed_units': { str(unit_index): error for unit_index, error in failed_units.items() }
+                        })
+                    }
+
         _logger.info(f"Inventory collection completed successfully. Report: {report_url}")
         return {'statusCode': 200,
                 'body': json.dumps({
-                        'report': { 'url': report_url }
+                        'report': { 'url': report_url, 'urls': report_urls }
                     })
                 }
     except Exception as ex:
@@ -47,6 +195,16 @@ if __name__ == "__main__":
         def __init__(self):
             self.invoked_function_arn = "arn:aws-us-gov:lambda:us-east-1:123456789012:function:testing"
 
-    result = lambda_handler(None, Context())
+    if os.environ.get('DISTRIBUTED_MODE', 'false').lower() == 'true':
+        from inventory.distributed import InProcessDispatcher
+
+        # Workers and the reduce step run in this process instead of in asynchronous invocations
+        dispatcher = InProcessDispatcher(lambda event, dispatcher: lambda_handler(event, Context(), dispatcher))
+        print(lambda_handler(None, Context(), dispatcher))
+
+        for result in dispatcher.run():
+            print(result)
+    else:
+        result = lambda_handler(None, Context())
 
-    print(result)
+        print(result)
@@ -0,0 +1,211 @@
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# License:
+# This sample code is made available under the MIT-0 license. See the LICENSE file.
+import json
+import logging
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional
+from dateutil.parser import isoparse
+from inventory.mappers import InventoryData
+from inventory.queries import DELETED_CONFIGURATION_ITEM_STATUSES, group_arns_by_account_region
+from inventory.storage import LocalDocumentStore, S3DocumentStore, get_document_location_from_environment, get_document_store
+
+_logger = logging.getLogger("inventory.incremental")
+_logger.setLevel(getattr(logging, os.environ.get("LOG_LEVEL", "INFO"), logging.INFO))
+
+INCREMENTAL_STATE_VERSION = 1
+DEFAULT_INCREMENTAL_STATE_FILE_NAME = "incremental-state.json"
+DEFAULT_INCREMENTAL_LOOKBACK_SECONDS = 3600
+# Every run lists the ARNs of all current resources by default
+DEFAULT_INCREMENTAL_ARN_SCAN_INTERVAL_SECONDS = 0
+# Capture times are written into the Config query so anything read back from storage must look like a timestamp
+_CAPTURE_TIME_RE = re.compile(r"^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?(Z|[+-]\d{2}:?\d{2})?$")
+
+class IncrementalState():
+    """
+    Mapped inventory rows from previous runs, keyed by the ARN of the resource they were mapped from, together with
+    the latest configurationItemCaptureTime seen so the next run only needs resources captured since then, and when
+    the ARNs of all current resources were last listed.
+    """
+    def __init__(self, high_water_mark: Optional[str] = None, resources: Optional[Dict[str, List[dict]]] = None,
+                 arn_scanned_at: Optional[str] = None):
+        if high_water_mark is not None and not _CAPTURE_TIME_RE.match(high_water_mark):
+            raise ValueError(f"Invalid high water mark in incremental state: {high_water_mark}")
+
+        self.high_water_mark = high_water_mark
+        self.resources: Dict[str, List[dict]] = resources if resources is not None else {}
+        self.arn_scanned_at = arn_scanned_at
+
+    def to_json(self) -> str:
+        return json.dumps({ "version": INCREMENTAL_STATE_VERSION,
+                            "high_water_mark": self.high_water_mark,
+                            "arn_scanned_at": self.arn_scanned_at,
+                            "resources": self.resources })
+
+    @classmethod
+    def from_json(cls, document: str) -> "IncrementalState":
+        data = json.loads(document)
+        if data.get("version") != INCREMENTAL_STATE_VERSION:
+            raise ValueError(f"Unsupported incremental state version: {data.get('version')}")
+
+        return cls(high_water_mark=data.get("high_water_mark"), resources=data.get("resources", {}), arn_scanned_at=data.get("arn_scanned_at"))
+
+class LocalIncrementalStateStore(LocalDocumentStore):
+    def load(self) -> Optional[IncrementalState]:
+        document = self.load_document()
+        return IncrementalState.from_json(document) if document is not None else None
+
+    def save(self, state: IncrementalState):
+        self.save_document(state.to_json())
+
+class S3IncrementalStateStore(S3DocumentStore):
+    def load(self) -> Optional[IncrementalState]:
+        document = self.load_document()
+        return IncrementalState.from_json(document) if document is not None else None
+
+    def save(self, state: IncrementalState):
+        self.save_document(state.to_json())
+
+def get_incremental_state_store_from_environment(s3_client):
+    """
+    Returns the store named by INCREMENTAL_STATE_LOCATION, which is either an s3://bucket/key URL or a local file path.
+    Defaults to a file next to the delivered reports in REPORT_TARGET_BUCKET_NAME/REPORT_TARGET_BUCKET_PATH.
+    """
+    location = get_document_location_from_environment("INCREMENTAL_STATE_LOCATION", DEFAULT_INCREMENTAL_STATE_FILE_NAME)
+
+    return get_document_store(location, s3_client, "INCREMENTAL_STATE_LOCATION", LocalIncrementalStateStore, S3IncrementalStateStore)
+
+def get_lookback_seconds_from_environment() -> float:
+    try:
+        lookback_seconds = float(os.environ.get("INCREMENTAL_LOOKBACK_SECONDS", DEFAULT_INCREMENTAL_LOOKBACK_SECONDS))
+    except ValueError:
+        raise ValueError("INCREMENTAL_LOOKBACK_SECONDS must be a number")
+
+    if lookback_seconds < 0:
+        raise ValueError("INCREMENTAL_LOOKBACK_SECONDS must not be negative")
+
+    return lookback_seconds
+
+def get_arn_scan_interval_seconds_from_environment() -> float:
+    try:
+        arn_scan_interval_seconds = float(os.environ.get("INCREMENTAL_ARN_SCAN_INTERVAL_SECONDS", DEFAULT_INCREMENTAL_ARN_SCAN_INTERVAL_SECONDS))
+    except ValueError:
+        raise ValueError("INCREMENTAL_ARN_SCAN_INTERVAL_SECONDS must be a number")
+
+    if arn_scan_interval_seconds < 0:
+        raise ValueError("INCREMENTAL_ARN_SCAN_INTERVAL_SECONDS must not be negative")
+
+    return arn_scan_interval_seconds
+
+def get_captured_after(high_water_mark: Optional[str], lookback_seconds: float) -> Optional[str]:
+    """Returns the capture time to query from, lookback_seconds before the high water mark."""
+    if high_water_mark is None or not lookback_seconds:
+        return high_water_mark
+
+    captured_after = isoparse(high_water_mark) - timedelta(seconds=lookback_seconds)
+    if captured_after.tzinfo is not None:
+        captured_after = captured_after.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return captured_after.isoformat(timespec="milliseconds") + "Z"
+
+class IncrementalInventoryCollector():
+    """
+    Collects inventory by merging resources changed since the previous run into the rows stored from that run.
+
+    The first run, or any run without stored state, reads every resource. Later runs only read resources captured
+    since lookback_seconds, INCREMENTAL_LOOKBACK_SECONDS by default, before the stored high water mark, so items AWS
+    Config records late are still read. Deletions AWS Config records within that window drop their rows directly.
+
+    Once arn_scan_interval_seconds, INCREMENTAL_ARN_SCAN_INTERVAL_SECONDS by default, has passed since the last
+    scan, a run also lists the ARNs of all current resources, which costs as many queries as a full collection but
+    without their configuration. Rows of resources no longer listed are dropped, and resources with no rows yet,
+    e.g. ones recorded even later than the lookback allows for, are read only from the account and region pair
+    they were listed in. If any account could not be read, the high water mark is not moved and nothing is
+    dropped, so the missed changes are picked up by the next run instead of being lost.
+    """
+    def __init__(self, reader, state_store, lookback_seconds: Optional[float] = None, arn_scan_interval_seconds: Optional[float] = None):
+        self._reader = reader
+        self._state_store = state_store
+        self._lookback_seconds = lookback_seconds if lookback_seconds is not None else get_lookback_seconds_from_environment()
+        self._arn_scan_interval_seconds = (arn_scan_interval_seconds if arn_scan_interval_seconds is not None
+                                           else get_arn_scan_interval_seconds_from_environment())
+
+    def _is_arn_scan_due(self, state: IncrementalState, now: datetime) -> bool:
+        return (state.arn_scanned_at is None
+                or now - isoparse(state.arn_scanned_at) >= timedelta(seconds=self._arn_scan_interval_seconds))
+
+    def collect(self) -> Iterator[InventoryData]:
+        previous_state = self._state_store.load()
+        state = previous_state if previous_state is not None else IncrementalState()
+
+        captured_after = get_captured_after(state.high_water_mark, self._lookback_seconds)
+
+        if previous_state is None:
+            _logger.info("no incremental state found, collecting all resources")
+        else:
+            _logger.info("collecting resources captured since %s, %s seconds before the high water mark of %s",
+                         captured_after, self._lookback_seconds, previous_state.high_water_mark)
+
+        self._high_water_mark = state.high_water_mark
+        self._changed_resource_count = 0
+        self._deleted_resource_count = 0
+
+        self._merge(state, self._reader.iter_mapped_resources(captured_after=captured_after))
+
+        complete = not self._reader.failed_account_ids
+
+        now = datetime.now(timezone.utc)
+        if previous_state is None:
+            state.arn_scanned_at = now.isoformat()
+        elif complete and self._is_arn_scan_due(state, now):
+            live_locations = { location.arn: location for location in self._reader.iter_resource_locations() }
+            complete = not self._reader.failed_account_ids
+            if complete:
+                for arn in [arn for arn in state.resources if arn not in live_locations]:
+                    del state.resources[arn]
+                    self._deleted_resource_count += 1
+
+                # Resources captured before the lookback window but recorded by AWS Config after the last run
+                if missing_locations := [live_locations[arn] for arn in live_locations.keys() - state.resources.keys()]:
+                    missing_arns = group_arns_by_account_region(missing_locations)
+                    _logger.info("collecting %s resources missing from the incremental state from %s account and region pairs",
+                                 len(missing_locations), len(missing_arns))
+                    self._merge(state, self._reader.iter_mapped_resources(arns=missing_arns))
+                    complete = not self._reader.failed_account_ids
+
+                if complete:
+                    state.arn_scanned_at = now.isoformat()
+        elif complete:
+            _logger.info("skipping the ARN scan, last run at %s", state.arn_scanned_at)
+
+        if complete:
+            state.high_water_mark = self._high_water_mark
+        else:
+            _logger.warning("accounts %s could not be read, keeping high water mark at %s", self._reader.failed_account_ids, state.high_water_mark)
+
+        self._state_store.save(state)
+
+        _logger.info("incremental collection found %s changed and %s deleted resources, high water mark is now %s",
+                     self._changed_resource_count, self._deleted_resource_count, state.high_water_mark)
+
+        return (InventoryData.from_dict(row) for rows in state.resources.values() for row in rows)
+
+    def _merge(self, state: IncrementalState, mapped_resources: Iterator[tuple]):
+        for resource, inventory_items in mapped_resources:
+            arn = resource.get("arn")
+            if not arn:
+                _logger.warning("skipping resource of type %s without an ARN", resource.get("resourceType"))
+                continue
+
+            capture_time = resource.get("configurationItemCaptureTime")
+            if capture_time and (self._high_water_mark is None or capture_time > self._high_water_mark):
+                self._high_water_mark = capture_time
+
+            if resource.get("configurationItemStatus") in DELETED_CONFIGURATION_ITEM_STATUSES:
+                self._deleted_resource_count += 1 if state.resources.pop(arn, None) is not None else 0
+                continue
+
+            state.resources[arn] = [inventory_item.to_dict() for inventory_item in inventory_items]
+            self._changed_resource_count += 1
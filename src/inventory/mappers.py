@@ -1,19 +1,15 @@
 # (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
 # License:
 # This sample code is made available under the MIT-0 license. See the LICENSE file.
-import copy
 import logging
 import os
-from typing import List
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, Iterable, Iterator, List, Optional, Sequence, Tuple
 from abc import ABC, abstractmethod
 
 _logger = logging.getLogger("inventory.mappers")
 _logger.setLevel(getattr(logging, os.environ.get("LOG_LEVEL", "INFO"), logging.INFO))
 
-def _get_tag_value(tags: dict, tag_name: str) -> str:
-    value = next((tag["value"] for tag in tags if tag["key"].casefold() == tag_name.casefold()), '')
-    return _sanitize_for_excel(value) if value else ''
-
 def _sanitize_for_excel(value: str) -> str:
     """Prevent Excel formula injection by prefixing dangerous characters.
     Note: This protects against CSV/Excel injection, not XSS (output is Excel, not HTML).
@@ -26,12 +22,82 @@ def _sanitize_for_excel(value: str) -> str:
         return f"'{value}"
     return value
 
+# Enough for the asset types, instance types, AMI IDs, engine versions and tag values of a large estate
+SANITIZE_CACHE_SIZE = 4096
+
+@lru_cache(maxsize=SANITIZE_CACHE_SIZE)
+def _sanitize_repeated_string(value: str) -> str:
+    return _sanitize_for_excel(value)
+
+def _sanitize_repeated_value(value) -> str:
+    """
+    _sanitize_for_excel for values that repeat across many rows, such as instance types or owner tags. Values are
+    sanitized once and the rows that hold them share one string object rather than a copy per decoded result.
+    Values that are unique per resource, e.g. IDs, would only evict these so are sanitized with _sanitize_for_excel.
+    """
+    # Only strings are cached, other values, which sanitize to '', may not be hashable
+    return _sanitize_repeated_string(value) if isinstance(value, str) else _sanitize_for_excel(value)
+
+def get_sanitize_cache_stats() -> dict:
+    cache_info = _sanitize_repeated_string.cache_info()
+    return { "hits": cache_info.hits, "misses": cache_info.misses, "size": cache_info.currsize, "max_size": cache_info.maxsize }
+
+class TagIndex:
+   """
+   Tags of a resource indexed once by casefolded key, so looking up a tag is a single dict access however many tags
+   the resource has and however many rows it is mapped to.
+   """
+   __slots__ = ("_values",)
+
+   def __init__(self, tags: Optional[List[dict]]):
+        values: Dict[str, str] = {}
+        for tag in tags or []:
+            # The first of several keys that only differ in case wins, as it did when the tags were scanned in order
+            values.setdefault(tag["key"].casefold(), tag["value"])
+        self._values = values
+
+   def get(self, tag_name: str) -> str:
+        value = self._values.get(tag_name.casefold())
+        return _sanitize_for_excel(value) if value else ''
+
+@lru_cache(maxsize=8)
+def _parse_tag_columns(value: str) -> Tuple[str, ...]:
+    tag_names: Dict[str, str] = {}
+    for tag_name in value.split(","):
+        if tag_name.strip():
+            tag_names.setdefault(tag_name.strip().casefold(), tag_name.strip())
+    return tuple(tag_names.values())
+
+def get_extra_tag_columns() -> Tuple[str, ...]:
+    """Tag names from the comma separated EXTRA_TAG_COLUMNS, each reported in a column of its own after the template's columns."""
+    return _parse_tag_columns(os.environ.get("EXTRA_TAG_COLUMNS", ""))
+
+def get_tag_fields(config_resource: dict) -> Dict[str, Any]:
+    """Returns the tag driven fields of every row of a resource, function, owner and any extra tag columns, from one index of its tags."""
+    tags = TagIndex(config_resource.get("tags"))
+    tag_fields: Dict[str, Any] = { "function": tags.get("function"), "owner": tags.get("owner") }
+
+    if extra_tag_columns := get_extra_tag_columns():
+        tag_fields["extra_tags"] = { tag_name: tags.get(tag_name) for tag_name in extra_tag_columns }
+
+    return tag_fields
+
+# Fields of an inventory row, in the order of the InventoryData constructor
+INVENTORY_FIELDS: Tuple[str, ...] = ("asset_type", "unique_id", "ip_address", "location", "is_virtual", "authenticated_scan_planned", "dns_name",
+                                     "mac_address", "baseline_config", "hardware_model", "is_public", "network_id", "function", "owner",
+                                     "software_product_name", "software_vendor", "extra_tags")
+DEFAULT_INVENTORY_BATCH_SIZE = 1000
+
 class InventoryData:
+   # Slots instead of a per-instance __dict__ since estates with many IPs produce hundreds of thousands of rows
+   __slots__ = INVENTORY_FIELDS
+
    def __init__(self, *, asset_type=None, unique_id=None, ip_address=None, location=None, is_virtual=None,
                  authenticated_scan_planned=None, dns_name=None, mac_address=None, baseline_config=None,
                  hardware_model=None,
-                 is_public=None, network_id=None, function=None, owner=None, software_product_name=None, software_vendor=None):
-        self.asset_type = _sanitize_for_excel(asset_type) if asset_type else None
+                 is_public=None, network_id=None, function=None, owner=None, software_product_name=None, software_vendor=None,
+                 extra_tags=None):
+        self.asset_type = _sanitize_repeated_value(asset_type) if asset_type else None
         self.unique_id = _sanitize_for_excel(unique_id) if unique_id else None
         self.ip_address = ip_address
         self.location = location
@@ -39,14 +105,131 @@ class InventoryData:
         self.authenticated_scan_planned = authenticated_scan_planned
         self.dns_name = _sanitize_for_excel(dns_name) if dns_name else None
         self.mac_address = mac_address
-        self.baseline_config = _sanitize_for_excel(baseline_config) if baseline_config else None
-        self.hardware_model = _sanitize_for_excel(hardware_model) if hardware_model else None
+        self.baseline_config = _sanitize_repeated_value(baseline_config) if baseline_config else None
+        self.hardware_model = _sanitize_repeated_value(hardware_model) if hardware_model else None
         self.is_public = is_public
         self.network_id = network_id
-        self.function = _sanitize_for_excel(function) if function else None
-        self.owner = _sanitize_for_excel(owner) if owner else None
-        self.software_product_name = _sanitize_for_excel(software_product_name) if software_product_name else None
-        self.software_vendor = _sanitize_for_excel(software_vendor) if software_vendor else None
+        self.function = _sanitize_repeated_value(function) if function else None
+        self.owner = _sanitize_repeated_value(owner) if owner else None
+        self.software_product_name = _sanitize_repeated_value(software_product_name) if software_product_name else None
+        self.software_vendor = _sanitize_repeated_value(software_vendor) if software_vendor else None
+        # Values of the EXTRA_TAG_COLUMNS tags by tag name
+        self.extra_tags = { tag_name: _sanitize_repeated_value(value) for tag_name, value in extra_tags.items() } if extra_tags else None
+
+   def to_dict(self) -> dict:
+        return { field: getattr(self, field) for field in INVENTORY_FIELDS }
+
+   @classmethod
+   def from_dict(cls, data: dict) -> "InventoryData":
+        # Sanitizing is idempotent so rows read back from storage can go through the constructor again
+        return cls(**data)
+
+   @classmethod
+   def _from_sanitized_values(cls, values: Sequence) -> "InventoryData":
+        # Values taken from another InventoryData have already been sanitized, so the constructor is skipped
+        inventory_data = cls.__new__(cls)
+        for field, value in zip(INVENTORY_FIELDS, values):
+            setattr(inventory_data, field, value)
+        return inventory_data
+
+   def _copy(self) -> "InventoryData":
+        """
+        Returns a copy of this row sharing its already sanitized values. Mappers build the fields common to all IP
+        addresses of a resource once and copy them for each address, setting only ip_address, mac_address and is_public,
+        which are not sanitized. The assignments are written out as a loop over the fields is several times slower.
+        """
+        inventory_data = InventoryData.__new__(InventoryData)
+        inventory_data.asset_type = self.asset_type
+        inventory_data.unique_id = self.unique_id
+        inventory_data.ip_address = self.ip_address
+        inventory_data.location = self.location
+        inventory_data.is_virtual = self.is_virtual
+        inventory_data.authenticated_scan_planned = self.authenticated_scan_planned
+        inventory_data.dns_name = self.dns_name
+        inventory_data.mac_address = self.mac_address
+        inventory_data.baseline_config = self.baseline_config
+        inventory_data.hardware_model = self.hardware_model
+        inventory_data.is_public = self.is_public
+        inventory_data.network_id = self.network_id
+        inventory_data.function = self.function
+        inventory_data.owner = self.owner
+        inventory_data.software_product_name = self.software_product_name
+        inventory_data.software_vendor = self.software_vendor
+        inventory_data.extra_tags = self.extra_tags
+        return inventory_data
+
+class InventoryBatch:
+   """
+   Columnar form of a number of inventory rows, holding one list per field instead of one object per row.
+
+   Readers can hand rows to the report writers in batches, which then read only the columns they write.
+   Iterating a batch yields InventoryData rows for code that works row by row.
+   """
+   __slots__ = ("_columns",)
+
+   def __init__(self, columns: Optional[Dict[str, list]] = None):
+        columns = columns or {}
+
+        if unknown_fields := [field for field in columns if field not in INVENTORY_FIELDS]:
+            raise ValueError(f"Unknown inventory fields: {', '.join(unknown_fields)}")
+
+        row_counts = { len(column) for column in columns.values() }
+        if len(row_counts) > 1:
+            raise ValueError("All columns of an inventory batch must have the same length")
+
+        # Fields without a column are empty for every row
+        row_count = row_counts.pop() if row_counts else 0
+        self._columns: Dict[str, list] = { field: list(columns[field]) if field in columns else [None] * row_count for field in INVENTORY_FIELDS }
+
+   @classmethod
+   def from_inventory(cls, inventory: Iterable[InventoryData]) -> "InventoryBatch":
+        batch = cls()
+        batch.extend(inventory)
+        return batch
+
+   def __len__(self) -> int:
+        return len(self._columns[INVENTORY_FIELDS[0]])
+
+   def __iter__(self) -> Iterator[InventoryData]:
+        for values in zip(*(self._columns[field] for field in INVENTORY_FIELDS)):
+            yield InventoryData._from_sanitized_values(values)
+
+   def append(self, inventory_data: InventoryData):
+        for field in INVENTORY_FIELDS:
+            self._columns[field].append(getattr(inventory_data, field, None))
+
+   def extend(self, inventory: Iterable[InventoryData]):
+        for inventory_data in inventory:
+            self.append(inventory_data)
+
+   def column(self, field: str) -> list:
+        return self._columns[field]
+
+   def iter_rows(self, fields: Sequence[str]) -> Iterator[tuple]:
+        """Yields a tuple per row with the values of fields, in the order given."""
+        return zip(*(self._columns[field] for field in fields))
+
+def iter_inventory_batches(inventory: Iterable[InventoryData], batch_size: int = DEFAULT_INVENTORY_BATCH_SIZE) -> Iterator[InventoryBatch]:
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+
+    batch = InventoryBatch()
+    for inventory_data in inventory:
+        batch.append(inventory_data)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = InventoryBatch()
+
+    if len(batch):
+        yield batch
+
+def iter_inventory_rows(inventory: Iterable, fields: Sequence[str]) -> Iterator[tuple]:
+    """Yields a tuple of the values of fields for every row, whether inventory holds InventoryData rows, batches or both."""
+    for item in inventory:
+        if isinstance(item, InventoryBatch):
+            yield from item.iter_rows(fields)
+        else:
+            yield tuple(getattr(item, field, None) for field in fields)
 
 class DataMapper(ABC):
     @abstractmethod
@@ -57,13 +240,31 @@ class DataMapper(ABC):
     def _get_supported_resource_type(self) -> List[str]:
         pass
 
+    def _get_configuration_paths(self) -> Optional[List[str]]:
+        """
+        Returns the paths under configuration that _do_mapping reads, so readers can select only those properties.
+        None means the whole configuration is needed, which is the default for mappers that have not declared paths.
+        """
+        return None
+
+    def _get_supported_resource_type_set(self) -> FrozenSet[str]:
+        # Cached since can_map is called for every resource returned from AWS Config
+        try:
+            return self._supported_resource_types
+        except AttributeError:
+            self._supported_resource_types: FrozenSet[str] = frozenset(self._get_supported_resource_type())
+            return self._supported_resource_types
+
     def can_map(self, resource_type: str) -> bool:
-        return resource_type in self._get_supported_resource_type()
+        return resource_type in self._get_supported_resource_type_set()
 
     def map(self, config_resource: dict) -> List[InventoryData]:
         if not self.can_map(config_resource["resourceType"]):
             return[]
 
+        return self._map_resource(config_resource)
+
+    def _map_resource(self, config_resource: dict) -> List[InventoryData]:
         mapped_data = []
 
         _logger.debug("mapping %s", config_resource['resourceType'])
@@ -74,45 +275,81 @@ class DataMapper(ABC):
 
         return mapped_data    
 
+class MapperRegistry():
+    """
+    Indexes mappers by the resource types they support so a mapper can be found with a single lookup.
+    Each resource type can only be claimed by one mapper.
+    """
+    def __init__(self, mappers: List[DataMapper]):
+        self._mappers_by_resource_type: Dict[str, DataMapper] = {}
+
+        for mapper in mappers:
+            for resource_type in mapper._get_supported_resource_type():
+                if (registered_mapper := self._mappers_by_resource_type.get(resource_type)) is not None:
+                    raise ValueError(f"Resource type {resource_type} is supported by both {type(registered_mapper).__name__} and {type(mapper).__name__}")
+
+                self._mappers_by_resource_type[resource_type] = mapper
+
+    def get_mapper(self, resource_type: str) -> Optional[DataMapper]:
+        return self._mappers_by_resource_type.get(resource_type)
+
+    def get_supported_resource_types(self) -> List[str]:
+        return list(self._mappers_by_resource_type)
+
+    def get_configuration_paths(self, resource_type: str) -> Optional[List[str]]:
+        return self._mappers_by_resource_type[resource_type]._get_configuration_paths()
+
+    def map(self, config_resource: dict) -> Optional[List[InventoryData]]:
+        """Maps the resource with the mapper registered for its type, returning None if no mapper supports it."""
+        mapper = self._mappers_by_resource_type.get(config_resource["resourceType"])
+        if mapper is None:
+            return None
+
+        # The registry lookup already guarantees the mapper supports the type, so can_map is not checked again
+        return mapper._map_resource(config_resource)
+
 class EC2DataMapper(DataMapper):
     def _get_supported_resource_type(self) -> List[str]:
         return ["AWS::EC2::Instance"]
 
+    def _get_configuration_paths(self) -> Optional[List[str]]:
+        return ["instanceId", "imageId", "instanceType", "vpcId", "publicDnsName", "privateDnsName", "networkInterfaces"]
+
     def _do_mapping(self, config_resource: dict) -> List[InventoryData]:
         ec2_data_list: List[InventoryData] = []
         config = config_resource.get("configuration", {})
-        tags = config_resource.get("tags", [])
+        network_interfaces = config.get("networkInterfaces", [])
+        if not network_interfaces:
+            return ec2_data_list
+
+        public_dns_name = config.get("publicDnsName")
+        # Everything but the addresses is the same for every IP of the instance, so it is built and sanitized once
+        instance_data = InventoryData(asset_type="EC2",
+                                      unique_id=config.get("instanceId", ""),
+                                      is_virtual="Yes",
+                                      authenticated_scan_planned="Yes",
+                                      dns_name=public_dns_name or config.get("privateDnsName", ""),
+                                      is_public="Yes" if public_dns_name else "No",
+                                      baseline_config=config.get("imageId", ""),
+                                      hardware_model=config.get("instanceType", ""),
+                                      network_id=config.get("vpcId", ""),
+                                      **get_tag_fields(config_resource))
+
+        for nic in network_interfaces:
+            instance_data.mac_address = nic.get("macAddress", "")
 
-        for nic in config.get("networkInterfaces", []):
             for ipAddress in nic.get("privateIpAddresses", []):
-                ec2_data = { "asset_type": "EC2",
-                             "unique_id": config.get("instanceId", ""),
-                             "ip_address": ipAddress.get("privateIpAddress", ""),
-                             "is_virtual": "Yes",
-                             "authenticated_scan_planned": "Yes",
-                             "mac_address": nic.get("macAddress", ""),
-                             "baseline_config": config.get("imageId", ""),
-                             "hardware_model": config.get("instanceType", ""),
-                             "network_id": config.get("vpcId", ""),
-                             "function": _get_tag_value(tags, "function"),
-                             "owner": _get_tag_value(tags, "owner") }
-
-                if (public_dns_name := config.get("publicDnsName")):
-                    ec2_data["dns_name"] = public_dns_name
-                    ec2_data["is_public"] = "Yes"
-                else:
-                    ec2_data["dns_name"] = config.get("privateDnsName", "")
-                    ec2_data["is_public"] = "No"
-
-                ec2_data_list.append(InventoryData(**ec2_data))
+                ec2_data = instance_data._copy()
+                ec2_data.ip_address = ipAddress.get("privateIpAddress", "")
+                ec2_data_list.append(ec2_data)
 
                 if "association" in ipAddress:
                     public_ip = ipAddress["association"].get("publicIp", "")
                     if public_ip:
                         # Each IP address needs its own row in report so public IP requires an additional row
-                        ec2_data = copy.copy(ec2_data)
-                        ec2_data["ip_address"] = public_ip
-                        ec2_data_list.append(InventoryData(**ec2_data))
+                        ec2_data = instance_data._copy()
+                        ec2_data.ip_address = public_ip
+                        ec2_data_list.append(ec2_data)
 
         return ec2_data_list
 
@@ -150,17 +387,17 @@ class ElbDataMapper(DataMapper):
                  "authenticated_scan_planned": "Yes",
                  "is_public": "Yes" if config.get("scheme", "unknown") == "internet-facing" else "No",
                  "network_id": network_id,
-                 "function": _get_tag_value(config_resource.get("tags", []), "function"),
-                 "owner": _get_tag_value(config_resource.get("tags", []), "owner") }
+                 **get_tag_fields(config_resource) }
 
+        load_balancer_data = InventoryData(**data)
         ip_addresses = self._get_ip_addresses(config.get("availabilityZones", []))
         if ip_addresses:
             for ip_address in ip_addresses:
-                data = copy.copy(data)
-                data["ip_address"] = ip_address
-                data_list.append(InventoryData(**data))
+                elb_data = load_balancer_data._copy()
+                elb_data.ip_address = ip_address
+                data_list.append(elb_data)
         else:
-            data_list.append(InventoryData(**data))
+            data_list.append(load_balancer_data)
 
         return data_list
 
@@ -185,8 +422,7 @@ class RdsDataMapper(DataMapper):
                  "hardware_model": config.get("dBInstanceClass", ""),
                  "software_product_name": f"{config.get('engine', 'unknown')}-{config.get('engineVersion', 'unknown')}",
                  "network_id": network_id,
-                 "function": _get_tag_value(config_resource.get("tags", []), "function"),
-                 "owner": _get_tag_value(config_resource.get("tags", []), "owner") }
+                 **get_tag_fields(config_resource) }
 
         return [InventoryData(**data)]
 
@@ -194,6 +430,9 @@ class DynamoDbTableDataMapper(DataMapper):
     def _get_supported_resource_type(self) -> List[str]:
         return ["AWS::DynamoDB::Table"]
 
+    def _get_configuration_paths(self) -> Optional[List[str]]:
+        return []
+
     def _do_mapping(self, config_resource: dict) -> List[InventoryData]:
         data = { "asset_type": "DynamoDB",
                  "unique_id": config_resource.get("arn", ""),
@@ -201,8 +440,7 @@ class DynamoDbTableDataMapper(DataMapper):
                  "is_public": "No",
                  "software_vendor": "AWS",
                  "software_product_name": "DynamoDB",
-                 "function": _get_tag_value(config_resource.get("tags", []), "function"),
-                 "owner": _get_tag_value(config_resource.get("tags", []), "owner") }
+                 **get_tag_fields(config_resource) }
 
         return [InventoryData(**data)]
 
@@ -210,10 +448,13 @@ class LambdaDataMapper(DataMapper):
     def _get_supported_resource_type(self) -> List[str]:
         return ["AWS::Lambda::Function"]
 
+    def _get_configuration_paths(self) -> Optional[List[str]]:
+        return ["vpcConfig", "runtime", "memorySize"]
+
     def _do_mapping(self, config_resource: dict) -> List[InventoryData]:
         config = config_resource.get("configuration", {})
         vpc_config = config.get("vpcConfig", {})
-        tags = config_resource.get("tags", [])
+        tag_fields = get_tag_fields(config_resource)
         
         data = {
             "asset_type": "Lambda",
@@ -225,8 +466,7 @@ class LambdaDataMapper(DataMapper):
             "software_vendor": "AWS",
             "software_product_name": f"Lambda-{config.get('runtime', 'unknown')}",
             "hardware_model": f"{config.get('memorySize', 'unknown')}MB",
-            "function": _get_tag_value(tags, "function"),
-            "owner": _get_tag_value(tags, "owner")
+            **tag_fields
         }
         return [InventoryData(**data)]
 
@@ -234,10 +474,13 @@ class S3DataMapper(DataMapper):
     def _get_supported_resource_type(self) -> List[str]:
         return ["AWS::S3::Bucket"]
 
+    def _get_configuration_paths(self) -> Optional[List[str]]:
+        return ["name", "publicAccessBlockConfiguration"]
+
     def _do_mapping(self, config_resource: dict) -> List[InventoryData]:
         config = config_resource.get("configuration", {})
         public_access = config.get("publicAccessBlockConfiguration", {})
-        tags = config_resource.get("tags", [])
+        tag_fields = get_tag_fields(config_resource)
         
         is_public = "No"
         if (not public_access.get("blockPublicAcls", True) or 
@@ -254,8 +497,7 @@ class S3DataMapper(DataMapper):
             "is_public": is_public,
             "software_vendor": "AWS",
             "software_product_name": "S3",
-            "function": _get_tag_value(tags, "function"),
-            "owner": _get_tag_value(tags, "owner")
+            **tag_fields
         }
         return [InventoryData(**data)]
 
@@ -263,8 +505,11 @@ class EfsDataMapper(DataMapper):
     def _get_supported_resource_type(self) -> List[str]:
         return ["AWS::EFS::FileSystem"]
 
+    def _get_configuration_paths(self) -> Optional[List[str]]:
+        return []
+
     def _do_mapping(self, config_resource: dict) -> List[InventoryData]:
-        tags = config_resource.get("tags", [])
+        tag_fields = get_tag_fields(config_resource)
         
         data = {
             "asset_type": "EFS",
@@ -273,8 +518,7 @@ class EfsDataMapper(DataMapper):
             "is_public": "No",
             "software_vendor": "AWS",
             "software_product_name": "EFS",
-            "function": _get_tag_value(tags, "function"),
-            "owner": _get_tag_value(tags, "owner")
+            **tag_fields
         }
         return [InventoryData(**data)]
 
@@ -282,10 +526,13 @@ class EksDataMapper(DataMapper):
     def _get_supported_resource_type(self) -> List[str]:
         return ["AWS::EKS::Cluster"]
 
+    def _get_configuration_paths(self) -> Optional[List[str]]:
+        return ["resourcesVpcConfig", "version"]
+
     def _do_mapping(self, config_resource: dict) -> List[InventoryData]:
         config = config_resource.get("configuration", {})
         resources_vpc = config.get("resourcesVpcConfig", {})
-        tags = config_resource.get("tags", [])
+        tag_fields = get_tag_fields(config_resource)
         
         data = {
             "asset_type": "EKS",
@@ -296,8 +543,7 @@ class EksDataMapper(DataMapper):
             "network_id": resources_vpc.get("vpcId", ""),
             "software_vendor": "AWS",
             "software_product_name": f"EKS-{config.get('version', 'unknown')}",
-            "function": _get_tag_value(tags, "function"),
-            "owner": _get_tag_value(tags, "owner")
+            **tag_fields
         }
         return [InventoryData(**data)]
 
@@ -305,10 +551,13 @@ class RedshiftDataMapper(DataMapper):
     def _get_supported_resource_type(self) -> List[str]:
         return ["AWS::Redshift::Cluster"]
 
+    def _get_configuration_paths(self) -> Optional[List[str]]:
+        return ["endpoint", "publiclyAccessible", "vpcId", "nodeType"]
+
     def _do_mapping(self, config_resource: dict) -> List[InventoryData]:
         config = config_resource.get("configuration", {})
         endpoint = config.get("endpoint", {})
-        tags = config_resource.get("tags", [])
+        tag_fields = get_tag_fields(config_resource)
         
         data = {
             "asset_type": "Redshift",
@@ -321,8 +570,7 @@ class RedshiftDataMapper(DataMapper):
             "software_vendor": "AWS",
             "software_product_name": "Redshift",
             "hardware_model": config.get("nodeType", ""),
-            "function": _get_tag_value(tags, "function"),
-            "owner": _get_tag_value(tags, "owner")
+            **tag_fields
         }
         return [InventoryData(**data)]
 
@@ -332,7 +580,7 @@ class ElastiCacheDataMapper(DataMapper):
 
     def _do_mapping(self, config_resource: dict) -> List[InventoryData]:
         config = config_resource.get("configuration", {})
-        tags = config_resource.get("tags", [])
+        tag_fields = get_tag_fields(config_resource)
         
         engine = config.get('engine', config.get('Engine', 'unknown'))
         node_type = config.get("cacheNodeType", config.get("CacheNodeType", ""))
@@ -346,8 +594,7 @@ class ElastiCacheDataMapper(DataMapper):
             "software_vendor": "AWS",
             "software_product_name": f"ElastiCache-{engine}",
             "hardware_model": node_type,
-            "function": _get_tag_value(tags, "function"),
-            "owner": _get_tag_value(tags, "owner")
+            **tag_fields
         }
         return [InventoryData(**data)]
 
@@ -358,7 +605,7 @@ class OpenSearchDataMapper(DataMapper):
     def _do_mapping(self, config_resource: dict) -> List[InventoryData]:
         config = config_resource.get("configuration", {})
         vpc_options = config.get("vpcOptions", config.get("VPCOptions", {}))
-        tags = config_resource.get("tags", [])
+        tag_fields = get_tag_fields(config_resource)
         
         vpc_id = vpc_options.get("vpcId", vpc_options.get("VPCId", ""))
         endpoint = config.get("endpoint", config.get("Endpoint", ""))
@@ -374,8 +621,7 @@ class OpenSearchDataMapper(DataMapper):
             "network_id": vpc_id,
             "software_vendor": "AWS",
             "software_product_name": f"OpenSearch-{version}",
-            "function": _get_tag_value(tags, "function"),
-            "owner": _get_tag_value(tags, "owner")
+            **tag_fields
         }
         return [InventoryData(**data)]
 
@@ -385,7 +631,7 @@ class ApiGatewayDataMapper(DataMapper):
 
     def _do_mapping(self, config_resource: dict) -> List[InventoryData]:
         config = config_resource.get("configuration", {})
-        tags = config_resource.get("tags", [])
+        tag_fields = get_tag_fields(config_resource)
         
         # V1 (RestApi) uses endpointConfiguration.types, V2 uses different structure
         if config_resource.get("resourceType") == "AWS::ApiGateway::RestApi":
@@ -405,8 +651,7 @@ class ApiGatewayDataMapper(DataMapper):
             "is_public": is_public,
             "software_vendor": "AWS",
             "software_product_name": protocol_type,
-            "function": _get_tag_value(tags, "function"),
-            "owner": _get_tag_value(tags, "owner")
+            **tag_fields
         }
         return [InventoryData(**data)]
 
@@ -414,9 +659,12 @@ class CloudFrontDataMapper(DataMapper):
     def _get_supported_resource_type(self) -> List[str]:
         return ["AWS::CloudFront::Distribution"]
 
+    def _get_configuration_paths(self) -> Optional[List[str]]:
+        return ["domainName"]
+
     def _do_mapping(self, config_resource: dict) -> List[InventoryData]:
         config = config_resource.get("configuration", {})
-        tags = config_resource.get("tags", [])
+        tag_fields = get_tag_fields(config_resource)
         
         data = {
             "asset_type": "CloudFront",
@@ -426,8 +674,7 @@ class CloudFrontDataMapper(DataMapper):
             "is_public": "Yes",
             "software_vendor": "AWS",
             "software_product_name": "CloudFront",
-            "function": _get_tag_value(tags, "function"),
-            "owner": _get_tag_value(tags, "owner")
+            **tag_fields
         }
         return [InventoryData(**data)]
 
@@ -435,9 +682,12 @@ class NatGatewayDataMapper(DataMapper):
     def _get_supported_resource_type(self) -> List[str]:
         return ["AWS::EC2::NatGateway"]
 
+    def _get_configuration_paths(self) -> Optional[List[str]]:
+        return ["natGatewayAddresses", "vpcId"]
+
     def _do_mapping(self, config_resource: dict) -> List[InventoryData]:
         config = config_resource.get("configuration", {})
-        tags = config_resource.get("tags", [])
+        tag_fields = get_tag_fields(config_resource)
         addresses = config.get("natGatewayAddresses", [])
         
         data_list: List[InventoryData] = []
@@ -451,8 +701,7 @@ class NatGatewayDataMapper(DataMapper):
                     "is_virtual": "Yes",
                     "is_public": "Yes",
                     "network_id": config.get("vpcId", ""),
-                    "function": _get_tag_value(tags, "function"),
-                    "owner": _get_tag_value(tags, "owner")
+                    **tag_fields
                 }
                 data_list.append(InventoryData(**data))
         else:
@@ -462,8 +711,7 @@ class NatGatewayDataMapper(DataMapper):
                 "is_virtual": "Yes",
                 "is_public": "Yes",
                 "network_id": config.get("vpcId", ""),
-                "function": _get_tag_value(tags, "function"),
-                "owner": _get_tag_value(tags, "owner")
+                **tag_fields
             }
             data_list.append(InventoryData(**data))
         
@@ -473,36 +721,46 @@ class NetworkInterfaceDataMapper(DataMapper):
     def _get_supported_resource_type(self) -> List[str]:
         return ["AWS::EC2::NetworkInterface"]
 
+    def _get_configuration_paths(self) -> Optional[List[str]]:
+        return ["privateIpAddresses", "macAddress", "vpcId"]
+
     def _do_mapping(self, config_resource: dict) -> List[InventoryData]:
         config = config_resource.get("configuration", {})
-        tags = config_resource.get("tags", [])
         private_ips = config.get("privateIpAddresses", [])
         
         data_list: List[InventoryData] = []
+        if not private_ips:
+            return data_list
+
+        # Built once and shared by the rows of every IP address of the interface
+        interface_data = InventoryData(asset_type="Network Interface",
+                                       unique_id=config_resource.get("arn", ""),
+                                       is_virtual="Yes",
+                                       mac_address=config.get("macAddress", ""),
+                                       network_id=config.get("vpcId", ""),
+                                       **get_tag_fields(config_resource))
         
         for ip_info in private_ips:
-            data = {
-                "asset_type": "Network Interface",
-                "unique_id": config_resource.get("arn", ""),
-                "ip_address": ip_info.get("privateIpAddress", ""),
-                "is_virtual": "Yes",
-                "mac_address": config.get("macAddress", ""),
-                "network_id": config.get("vpcId", ""),
-                "function": _get_tag_value(tags, "function"),
-                "owner": _get_tag_value(tags, "owner")
-            }
-            
-            association = ip_info.get("association", {})
-            if association.get("publicIp"):
-                data["is_public"] = "Yes"
-            else:
-                data["is_public"] = "No"
+            public_ip = ip_info.get("association", {}).get("publicIp")
+            interface_data.is_public = "Yes" if public_ip else "No"
             
-            data_list.append(InventoryData(**data))
+            data = interface_data._copy()
+            data.ip_address = ip_info.get("privateIpAddress", "")
+            data_list.append(data)
             
-            if association.get("publicIp"):
-                public_data = copy.copy(data)
-                public_data["ip_address"] = association["publicIp"]
-                data_list.append(InventoryData(**public_data))
+            if public_ip:
+                public_data = interface_data._copy()
+                public_data.ip_address = public_ip
+                data_list.append(public_data)
         
         return data_list
+
+
+def get_default_mappers() -> List[DataMapper]:
+    return [
+        EC2DataMapper(), ElbDataMapper(), DynamoDbTableDataMapper(), RdsDataMapper(),
+        LambdaDataMapper(), S3DataMapper(), EfsDataMapper(), EksDataMapper(),
+        RedshiftDataMapper(), ElastiCacheDataMapper(), OpenSearchDataMapper(),
+        ApiGatewayDataMapper(), CloudFrontDataMapper(), NatGatewayDataMapper(),
+        NetworkInterfaceDataMapper()
+    ]
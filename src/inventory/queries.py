@@ -0,0 +1,145 @@
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# License:
+# This sample code is made available under the MIT-0 license. See the LICENSE file.
+import logging
+import os
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from inventory.mappers import MapperRegistry
+
+_logger = logging.getLogger("inventory.queries")
+_logger.setLevel(getattr(logging, os.environ.get("LOG_LEVEL", "INFO"), logging.INFO))
+
+DELETED_CONFIGURATION_ITEM_STATUSES = ("ResourceDeleted", "ResourceDeletedNotRecorded")
+# Keeps queries that select resources by ARN well within the length AWS Config accepts for an expression
+MAX_ARNS_PER_QUERY = 20
+
+class ResourceLocation(NamedTuple):
+    """The ARN of a resource and the account and region AWS Config recorded it in, as listed without its configuration."""
+    arn: str
+    account_id: str
+    region_name: str
+
+def group_arns_by_account_region(locations: List[ResourceLocation]) -> Dict[Tuple[str, str], List[str]]:
+    """Returns the ARNs of the resources keyed by their account id and region, in order, so each is only queried where it lives."""
+    arns: Dict[Tuple[str, str], List[str]] = {}
+    for location in sorted(locations):
+        arns.setdefault((location.account_id, location.region_name), []).append(location.arn)
+
+    return arns
+
+def _get_resource_types_from_environment(variable_name: str) -> Optional[List[str]]:
+    value = os.environ.get(variable_name, "")
+    resource_types = [resource_type.strip() for resource_type in value.split(",") if resource_type.strip()]
+
+    return resource_types if resource_types else None
+
+def select_resource_types(mapper_registry: MapperRegistry, include_resource_types: Optional[List[str]] = None,
+                          exclude_resource_types: Optional[List[str]] = None) -> List[str]:
+    """
+    Returns the resource types to query from AWS Config, in the order the mappers were registered.
+
+    Defaults to every type supported by the registered mappers. include_resource_types narrows that down and
+    exclude_resource_types removes types from it. When not provided, they are read from the comma separated
+    RESOURCE_TYPES_INCLUDE and RESOURCE_TYPES_EXCLUDE environment variables.
+    """
+    if include_resource_types is None:
+        include_resource_types = _get_resource_types_from_environment("RESOURCE_TYPES_INCLUDE")
+    if exclude_resource_types is None:
+        exclude_resource_types = _get_resource_types_from_environment("RESOURCE_TYPES_EXCLUDE")
+
+    supported_resource_types = mapper_registry.get_supported_resource_types()
+
+    unsupported_resource_types = [resource_type for resource_type in (include_resource_types or []) + (exclude_resource_types or [])
+                                  if resource_type not in supported_resource_types]
+    if unsupported_resource_types:
+        raise ValueError(f"No mapper supports resource types: {', '.join(unsupported_resource_types)}")
+
+    resource_types = [resource_type for resource_type in supported_resource_types
+                      if (include_resource_types is None or resource_type in include_resource_types)
+                      and (exclude_resource_types is None or resource_type not in exclude_resource_types)]
+
+    if not resource_types:
+        raise ValueError("No resource types left to query after applying RESOURCE_TYPES_INCLUDE and RESOURCE_TYPES_EXCLUDE")
+
+    _logger.debug("querying resource types %s", resource_types)
+
+    return resource_types
+
+def _quote(value: str) -> str:
+    # Values come from mappers or from Config itself, so a quote can only mean something has gone wrong
+    if "'" in value:
+        raise ValueError(f"Invalid value for AWS Config query: {value}")
+
+    return f"'{value}'"
+
+def build_resource_query(select_fields: List[str], resource_types: List[str], captured_after: Optional[str] = None,
+                         filters: Optional[Dict[str, str]] = None, arns: Optional[List[str]] = None) -> str:
+    quoted_resource_types = ", ".join(_quote(resource_type) for resource_type in resource_types)
+    query = f"SELECT {', '.join(select_fields)} WHERE resourceType IN ({quoted_resource_types})"
+
+    if captured_after:
+        query += f" AND configurationItemCaptureTime >= {_quote(captured_after)}"
+
+    for field, value in (filters or {}).items():
+        query += f" AND {field} = {_quote(value)}"
+
+    if arns is not None:
+        query += f" AND arn IN ({', '.join(_quote(arn) for arn in arns)})"
+
+    return query
+
+def build_group_by_query(group_by_fields: List[str], resource_types: List[str]) -> str:
+    quoted_resource_types = ", ".join(_quote(resource_type) for resource_type in resource_types)
+    group_by = ", ".join(group_by_fields)
+
+    return f"SELECT {group_by}, COUNT(*) WHERE resourceType IN ({quoted_resource_types}) GROUP BY {group_by}"
+
+def is_projection_enabled_from_environment() -> bool:
+    return os.environ.get("CONFIG_QUERY_PROJECTION", "true").lower() == "true"
+
+def build_resource_queries(select_fields: List[str], mapper_registry: MapperRegistry, resource_types: List[str],
+                           projection: bool = True, captured_after: Optional[str] = None,
+                           filters: Optional[Dict[str, str]] = None, arns: Optional[List[str]] = None) -> List[str]:
+    """
+    Builds the queries needed to retrieve the resource types, selecting select_fields plus the configuration.
+
+    With projection, resource types whose mappers declare the configuration paths they read are fetched together in
+    one query that selects only the union of those paths. Types whose mappers need the whole configuration are fetched
+    in a second query. Without projection a single query selects the whole configuration for every type.
+    When captured_after is provided, only resources captured at or after that time are queried, and filters adds
+    an equality condition for each field, e.g. { "accountId": "123456789012" }. When arns is provided, only those
+    resources are queried, MAX_ARNS_PER_QUERY at a time.
+    """
+    if arns is not None and not arns:
+        return []
+
+    if arns is not None and len(arns) > MAX_ARNS_PER_QUERY:
+        return [query for start in range(0, len(arns), MAX_ARNS_PER_QUERY)
+                for query in build_resource_queries(select_fields, mapper_registry, resource_types, projection, captured_after, filters,
+                                                    arns[start:start + MAX_ARNS_PER_QUERY])]
+
+    if not projection:
+        return [build_resource_query(select_fields + ["configuration"], resource_types, captured_after, filters, arns)]
+
+    projected_resource_types: List[str] = []
+    full_resource_types: List[str] = []
+    configuration_fields: List[str] = []
+
+    for resource_type in resource_types:
+        configuration_paths = mapper_registry.get_configuration_paths(resource_type)
+        if configuration_paths is None:
+            full_resource_types.append(resource_type)
+            continue
+
+        projected_resource_types.append(resource_type)
+        for configuration_path in configuration_paths:
+            if (configuration_field := f"configuration.{configuration_path}") not in configuration_fields:
+                configuration_fields.append(configuration_field)
+
+    queries: List[str] = []
+    if projected_resource_types:
+        queries.append(build_resource_query(select_fields + configuration_fields, projected_resource_types, captured_after, filters, arns))
+    if full_resource_types:
+        queries.append(build_resource_query(select_fields + ["configuration"], full_resource_types, captured_after, filters, arns))
+
+    return queries
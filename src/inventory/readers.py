@@ -4,13 +4,18 @@
 import json
 import logging
 import os
-from typing import Iterator, List, Optional
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
 import boto3
 from botocore.exceptions import ClientError
-from  inventory.mappers import (DataMapper, EC2DataMapper, ElbDataMapper, DynamoDbTableDataMapper, InventoryData, RdsDataMapper,
-                                 LambdaDataMapper, S3DataMapper, EfsDataMapper, EksDataMapper, RedshiftDataMapper,
-                                 ElastiCacheDataMapper, OpenSearchDataMapper, ApiGatewayDataMapper, CloudFrontDataMapper,
-                                 NatGatewayDataMapper, NetworkInterfaceDataMapper)
+from inventory.checkpoints import CollectionPosition, get_next_position, validate_position
+from inventory.concurrency import get_max_workers_from_environment, iter_concurrently_in_order
+from inventory.decoding import get_json_decoder
+from inventory.mappers import DEFAULT_INVENTORY_BATCH_SIZE, InventoryBatch, InventoryData, MapperRegistry, get_default_mappers, iter_inventory_batches
+from inventory.queries import (DELETED_CONFIGURATION_ITEM_STATUSES, ResourceLocation, build_resource_queries, build_resource_query,
+                               is_projection_enabled_from_environment, select_resource_types)
+from inventory.sessions import ClientCache, get_assumed_role_client, get_client
+from inventory.throttling import NO_SDK_RETRIES_CONFIG, RetryingClient, RetryPolicy, RetryStats, get_retry_policy
 
 _logger = logging.getLogger("inventory.readers")
 log_level_name = os.environ.get("LOG_LEVEL", "INFO").upper()
@@ -20,86 +25,116 @@ if log_level_name not in ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'):
 else:
     _logger.setLevel(getattr(logging, log_level_name))
 
+DEFAULT_ACCOUNT_COLLECTION_MAX_WORKERS = 1
+
+T = TypeVar("T")
+
+def _get_default_region() -> str:
+    return os.environ.get('AWS_REGION', 'us-east-1')
+
+def _parse_regions(value, source: str) -> List[str]:
+    # Regions can be given as a JSON list or, in the REGIONS environment variable, a comma separated string
+    regions = value.split(",") if isinstance(value, str) else value
+    if not isinstance(regions, list) or not all(isinstance(region, str) for region in regions):
+        raise ValueError(f"{source} must be a list of region names")
+
+    regions = [region.strip() for region in regions if region.strip()]
+    if not regions:
+        raise ValueError(f"{source} must contain at least one region")
+
+    return list(dict.fromkeys(regions))
+
 class AwsConfigInventoryReader():
-    def __init__(self, lambda_context, sts_client=None, mappers=None):
+    def __init__(self, lambda_context, sts_client=None, mappers=None, max_workers=None,
+                 include_resource_types=None, exclude_resource_types=None, projection=None, client_cache: Optional[ClientCache] = None,
+                 retry_policy: Optional[RetryPolicy] = None, json_decoder=None):
         self._lambda_context = lambda_context
-        self._sts_client = sts_client if sts_client is not None else boto3.client('sts')
-        if mappers is None:
-            mappers = [
-                EC2DataMapper(), ElbDataMapper(), DynamoDbTableDataMapper(), RdsDataMapper(),
-                LambdaDataMapper(), S3DataMapper(), EfsDataMapper(), EksDataMapper(),
-                RedshiftDataMapper(), ElastiCacheDataMapper(), OpenSearchDataMapper(),
-                ApiGatewayDataMapper(), CloudFrontDataMapper(), NatGatewayDataMapper(),
-                NetworkInterfaceDataMapper()
-            ]
-        self._mappers: List[DataMapper] = mappers
+        self._json_decoder = json_decoder if json_decoder is not None else get_json_decoder()
+        self._client_cache = client_cache
+        self._retry_policy = retry_policy if retry_policy is not None else get_retry_policy()
+        self._retry_stats = RetryStats()
+        self._sts_client = sts_client if sts_client is not None else get_client('sts', client_cache=client_cache, sdk_retries=False)
+        self._mapper_registry = MapperRegistry(mappers if mappers is not None else get_default_mappers())
+        self._resource_types: List[str] = select_resource_types(self._mapper_registry, include_resource_types, exclude_resource_types)
+        self._projection: bool = projection if projection is not None else is_projection_enabled_from_environment()
+        self._queries: List[str] = build_resource_queries(["arn", "resourceType", "tags"], self._mapper_registry, self._resource_types, self._projection)
+        self._failed_account_ids: List[str] = []
+        self._max_workers: int = max_workers if max_workers is not None else get_max_workers_from_environment("ACCOUNT_COLLECTION_MAX_WORKERS",
+                                                                                                            DEFAULT_ACCOUNT_COLLECTION_MAX_WORKERS)
 
     # Moved into it's own method to make it easier to mock boto3 client
-    def _get_config_client(self, sts_response) -> boto3.client:
-        return boto3.client('config', 
+    # A new session is used per client since the default boto3 session is not thread safe
+    def _get_config_client(self, sts_response, region_name: Optional[str] = None) -> boto3.client:
+        return boto3.session.Session().client('config',
                             aws_access_key_id=sts_response['Credentials']['AccessKeyId'],
                             aws_secret_access_key=sts_response['Credentials']['SecretAccessKey'],
                             aws_session_token=sts_response['Credentials']['SessionToken'],
-                            region_name=os.environ.get('AWS_REGION', 'us-east-1'))
+                            region_name=region_name or _get_default_region(),
+                            config=NO_SDK_RETRIES_CONFIG)
+
+    @property
+    def failed_account_ids(self) -> List[str]:
+        """Accounts whose resources could not be retrieved during the most recent collection."""
+        return list(self._failed_account_ids)
 
-    def _get_resources_from_account(self, account_id: str) -> Iterator[List[str]]:
+    @property
+    def retry_stats(self) -> RetryStats:
+        """Requests, retries and time spent backing off for the AWS Config and STS calls made by this reader."""
+        return self._retry_stats
+
+    def _get_resources_from_account(self, account_id: str, queries: Optional[List[str]] = None, region_name: Optional[str] = None) -> Iterator[List[str]]:
+        for _, _, results in self._iter_account_pages(account_id, queries, region_name):
+            yield results
+
+    def _iter_account_pages(self, account_id: str, queries: Optional[List[str]] = None, region_name: Optional[str] = None,
+                            query_index: int = 0, next_token: str = '') -> Iterator[Tuple[int, str, List[str]]]:
+        """
+        Yields the query index, next token and results of each page, starting from the page after next_token of the
+        query at query_index so collection can be resumed part way through an account.
+        """
         cross_account_role = os.environ.get('CROSS_ACCOUNT_ROLE_NAME')
         if not cross_account_role:
             raise ValueError("CROSS_ACCOUNT_ROLE_NAME environment variable is required")
+
+        queries = queries if queries is not None else self._queries
+        region_name = region_name or _get_default_region()
         
         try:
-            _logger.info(f"assuming role on account {account_id}")
-
-            sts_response = self._sts_client.assume_role(RoleArn=f"arn:{self._get_aws_partition()}:iam::{account_id}:role/{cross_account_role}",
-                                                        RoleSessionName=f"{account_id}-Assumed-Role",
-                                                        DurationSeconds=900)
-            config_client = self._get_config_client(sts_response)
-
-            next_token: str = ''
-            # Note: Resource types are hardcoded here for query performance.
-            # This list should be kept in sync with the configured mappers.
-            query = (
-                "SELECT arn, resourceType, configuration, tags "
-                "WHERE resourceType IN ("
-                "'AWS::EC2::Instance', "
-                "'AWS::ElasticLoadBalancingV2::LoadBalancer', "
-                "'AWS::ElasticLoadBalancing::LoadBalancer', "
-                "'AWS::DynamoDB::Table', "
-                "'AWS::RDS::DBInstance', "
-                "'AWS::RDS::DBCluster', "
-                "'AWS::Lambda::Function', "
-                "'AWS::S3::Bucket', "
-                "'AWS::EFS::FileSystem', "
-                "'AWS::EKS::Cluster', "
-                "'AWS::Redshift::Cluster', "
-                "'AWS::ElastiCache::CacheCluster', "
-                "'AWS::ElastiCache::ReplicationGroup', "
-                "'AWS::Elasticsearch::Domain', "
-                "'AWS::OpenSearchService::Domain', "
-                "'AWS::ApiGateway::RestApi', "
-                "'AWS::ApiGatewayV2::Api', "
-                "'AWS::CloudFront::Distribution', "
-                "'AWS::EC2::NatGateway', "
-                "'AWS::EC2::NetworkInterface')"
-            )
-            while True:
-                resources_result = config_client.select_resource_config(
-                    Expression=query,
-                    NextToken=next_token
-                )
-                
-                next_token = resources_result.get('NextToken', '')
-                results: List[str] = resources_result.get('Results', [])
-
-                _logger.debug(f"page returned {len(results)} and next token of '{next_token}'")
-
-                yield results
-
-                if not next_token:
-                    break
+            _logger.info(f"getting Config client for account {account_id} in {region_name}")
+
+            # The role is only assumed again once the cached credentials for the account are about to expire
+            config_client = get_assumed_role_client(RetryingClient(self._sts_client, self._retry_policy, self._retry_stats),
+                                                    role_arn=f"arn:{self._get_aws_partition()}:iam::{account_id}:role/{cross_account_role}",
+                                                    role_session_name=f"{account_id}-Assumed-Role",
+                                                    region_name=region_name,
+                                                    create_client=lambda sts_response: self._get_config_client(sts_response, region_name),
+                                                    client_cache=self._client_cache)
+            # Throttling and transient errors are retried with backoff, so only persistent errors skip the account
+            config_client = RetryingClient(config_client, self._retry_policy, self._retry_stats, account_id, region_name)
+
+            # Only resource types with a registered mapper are queried, and only the configuration the mappers read is selected
+            for query_index in range(query_index, len(queries)):
+                while True:
+                    resources_result = config_client.select_resource_config(
+                        Expression=queries[query_index],
+                        NextToken=next_token
+                    )
+
+                    next_token = resources_result.get('NextToken', '')
+                    results: List[str] = resources_result.get('Results', [])
+
+                    _logger.debug(f"page returned {len(results)} and next token of '{next_token}'")
+
+                    yield query_index, next_token, results
+
+                    if not next_token:
+                        break
         except ClientError as ex:
-            _logger.error("Received error: %s while retrieving resources from account %s, returning empty results.", ex, account_id, exc_info=True)
-            yield []
+            _logger.error("Received error: %s while retrieving resources from account %s in %s, returning empty results.", ex, account_id, region_name,
+                          exc_info=True)
+            if account_id not in self._failed_account_ids:
+                self._failed_account_ids.append(account_id)
+            yield len(queries) - 1, '', []
 
     def _get_aws_partition(self):
         arn_parts = self._lambda_context.invoked_function_arn.split(":")
@@ -108,10 +143,101 @@ class AwsConfigInventoryReader():
         return arn_parts[1]
 
     def get_resources_from_all_accounts(self) -> List[InventoryData]:
+        return list(self.iter_resources_from_all_accounts())
+
+    def iter_resources_from_all_accounts(self) -> Iterator[InventoryData]:
+        """Yields inventory rows as pages are returned from AWS Config rather than building the full list.
+
+        When collecting sequentially only one page of results is held at a time. When collecting concurrently,
+        at most max_workers account and region pairs are buffered so rows can still be yielded in ACCOUNT_LIST order.
+        """
         _logger.info("starting retrieval of inventory from AWS Config")
 
-        all_inventory : List[InventoryData] = []
-        
+        total_rows = 0
+
+        for inventory_item in self._iter_from_all_accounts(self._iter_inventory_from_account):
+            total_rows += 1
+            yield inventory_item
+
+        _logger.info(f"completed getting inventory, with a total of {total_rows}")
+
+    def iter_inventory_batches(self, batch_size: int = DEFAULT_INVENTORY_BATCH_SIZE) -> Iterator[InventoryBatch]:
+        """Yields the same rows as iter_resources_from_all_accounts in columnar batches of up to batch_size rows."""
+        return iter_inventory_batches(self.iter_resources_from_all_accounts(), batch_size)
+
+    def iter_mapped_resources(self, captured_after: Optional[str] = None,
+                              arns: Optional[Dict[Tuple[str, str], List[str]]] = None) -> Iterator[Tuple[dict, List[InventoryData]]]:
+        """
+        Yields each resource returned from AWS Config together with the rows it was mapped to.
+
+        The resources include their configurationItemCaptureTime and configurationItemStatus and, when captured_after
+        is provided, only resources captured at or after that time are returned. When arns is provided, only those
+        resources are returned, each queried only in the account and region pair it is keyed by.
+        """
+        select_fields = ["arn", "resourceType", "tags", "configurationItemCaptureTime", "configurationItemStatus"]
+
+        if arns is not None:
+            return self._iter_from_all_accounts(lambda account_id, region_name: self._iter_mapped_resources_from_account(
+                                                    account_id, build_resource_queries(select_fields, self._mapper_registry, self._resource_types,
+                                                                                       self._projection, captured_after=captured_after,
+                                                                                       arns=arns[(account_id, region_name)]), region_name),
+                                                account_regions=[account_region for account_region in self._get_account_regions() if account_region in arns])
+
+        queries = build_resource_queries(select_fields, self._mapper_registry, self._resource_types, self._projection, captured_after=captured_after)
+
+        return self._iter_from_all_accounts(lambda account_id, region_name: self._iter_mapped_resources_from_account(account_id, queries, region_name))
+
+    def iter_resumable_pages(self, position: Optional[CollectionPosition] = None) -> Iterator[Tuple[CollectionPosition, List[InventoryData]]]:
+        """
+        Yields the inventory rows of each page of results, one account and region pair at a time and in order, together
+        with the position to resume collection from after that page.
+        """
+        account_regions = self._get_account_regions()
+        units = [f"{account_id}/{region_name}" for account_id, region_name in account_regions]
+        position = position if position is not None else CollectionPosition()
+        validate_position(position, units)
+        self._failed_account_ids = []
+
+        for unit_index in range(position.unit_index, len(account_regions)):
+            account_id, region_name = account_regions[unit_index]
+            start_query_index, start_next_token = (position.query_index, position.next_token) if unit_index == position.unit_index else (0, '')
+
+            for query_index, next_token, resource_list_page in self._iter_account_pages(account_id, self._queries, region_name,
+                                                                                         start_query_index, start_next_token):
+                inventory_items = [inventory_item for _, mapped_items in self._map_resource_page(resource_list_page) for inventory_item in mapped_items]
+
+                yield get_next_position(units, unit_index, query_index, len(self._queries), next_token), inventory_items
+
+    def get_work_units(self) -> List[dict]:
+        """Splits collection into one independently collectable unit per account and region pair."""
+        return [{ "account_id": account_id, "region_name": region_name } for account_id, region_name in self._get_account_regions()]
+
+    def iter_work_unit_inventory(self, work_unit: dict) -> Iterator[InventoryData]:
+        """Yields the inventory rows of a unit returned by get_work_units."""
+        self._failed_account_ids = []
+
+        return self._iter_inventory_from_account(work_unit["account_id"], work_unit["region_name"])
+
+    def iter_resource_arns(self) -> Iterator[str]:
+        """
+        Yields the ARN of every resource that can currently be mapped, without retrieving its configuration.
+        Resources AWS Config has recorded as deleted are left out.
+        """
+        return (location.arn for location in self.iter_resource_locations())
+
+    def iter_resource_locations(self) -> Iterator[ResourceLocation]:
+        """Yields the same resources as iter_resource_arns together with the account and region pair each was listed from."""
+        query = build_resource_query(["arn", "configurationItemStatus"], self._resource_types)
+
+        def iter_resource_locations_from_account(account_id: str, region_name: str) -> Iterator[ResourceLocation]:
+            for resource_list_page in self._get_resources_from_account(account_id, [query], region_name):
+                for resource in self._json_decoder.decode_page(resource_list_page):
+                    if resource.get("configurationItemStatus") not in DELETED_CONFIGURATION_ITEM_STATUSES:
+                        yield ResourceLocation(resource["arn"], account_id, region_name)
+
+        return self._iter_from_all_accounts(iter_resource_locations_from_account)
+
+    def _get_accounts(self) -> List[dict]:
         try:
             accounts = json.loads(os.environ["ACCOUNT_LIST"])
         except KeyError:
@@ -121,33 +247,83 @@ class AwsConfigInventoryReader():
             _logger.error("ACCOUNT_LIST environment variable contains invalid JSON: %s", ex)
             raise ValueError(f"ACCOUNT_LIST environment variable contains invalid JSON: {ex}")
 
+        valid_accounts: List[dict] = []
         for account in accounts:
-            account_id = account.get('id')
-            if not account_id:
+            if not account.get('id'):
                 _logger.warning("Skipping account with missing 'id' field")
                 continue
-            
-            _logger.info("retrieving inventory for account %s", account_id)
 
-            for resource_list_page in self._get_resources_from_account(account_id):
-                _logger.debug("current page of inventory contained %s items from AWS Config", len(resource_list_page))
+            valid_accounts.append(account)
+
+        return valid_accounts
+
+    def _get_account_ids(self) -> List[str]:
+        return [account['id'] for account in self._get_accounts()]
 
-                for raw_resource in resource_list_page:
-                    resource : dict = json.loads(raw_resource)
+    def _get_account_regions(self) -> List[Tuple[str, str]]:
+        """
+        Returns every (account id, region) pair to collect, in ACCOUNT_LIST order.
 
-                    # One line item returned from AWS Config can result in multiple inventory line items (e.g. multiple IPs)
-                    # Mappers that do not support the resource type will return False
-                    mapper: Optional[DataMapper] = next((mapper for mapper in self._mappers if mapper.can_map(resource["resourceType"])), None)
-                    
-                    if not mapper:
-                        _logger.warning(f"skipping mapping, unable to find mapper for resource type of {resource['resourceType']}")
+        An account's optional "regions" list takes precedence over the comma separated REGIONS environment variable,
+        which in turn defaults to AWS_REGION.
+        """
+        default_regions = _parse_regions(os.environ["REGIONS"], "REGIONS") if os.environ.get("REGIONS", "").strip() else [_get_default_region()]
 
-                        continue
+        return [(account['id'], region_name)
+                for account in self._get_accounts()
+                for region_name in (_parse_regions(account['regions'], f"regions of account {account['id']}") if 'regions' in account else default_regions)]
 
-                    inventory_items = mapper.map(resource)
-                    if inventory_items:
-                        all_inventory.extend(inventory_items)
+    def _iter_from_account_region(self, iter_account_items: Callable[[str, str], Iterator[T]], account_id: str, region_name: str) -> Iterator[T]:
+        # Timed per pair so slow accounts and regions stand out in the logs
+        started_at = time.perf_counter()
+        item_count = 0
 
-        _logger.info(f"completed getting inventory, with a total of {len(all_inventory)}")
+        for item in iter_account_items(account_id, region_name):
+            item_count += 1
+            yield item
+
+        _logger.info("collected %s items from account %s in %s in %.2f seconds", item_count, account_id, region_name, time.perf_counter() - started_at)
+
+    def _iter_from_all_accounts(self, iter_account_items: Callable[[str, str], Iterator[T]],
+                                account_regions: Optional[List[Tuple[str, str]]] = None) -> Iterator[T]:
+        account_regions = account_regions if account_regions is not None else self._get_account_regions()
+        self._failed_account_ids = []
+
+        if self._max_workers > 1 and len(account_regions) > 1:
+            _logger.info("collecting from %s account and region pairs using %s workers", len(account_regions), self._max_workers)
+
+            # Pairs are yielded in ACCOUNT_LIST order so the report is the same regardless of which pair finishes first
+            yield from iter_concurrently_in_order(account_regions,
+                                                  lambda account_region: list(self._iter_from_account_region(iter_account_items, *account_region)),
+                                                  self._max_workers, thread_name_prefix="inventory-reader")
+        else:
+            for account_id, region_name in account_regions:
+                yield from self._iter_from_account_region(iter_account_items, account_id, region_name)
+
+    def _iter_inventory_from_account(self, account_id: str, region_name: Optional[str] = None) -> Iterator[InventoryData]:
+        _logger.info("retrieving inventory for account %s in %s", account_id, region_name or _get_default_region())
+
+        for _, inventory_items in self._iter_mapped_resources_from_account(account_id, self._queries, region_name):
+            yield from inventory_items
+
+    def _iter_mapped_resources_from_account(self, account_id: str, queries: List[str],
+                                            region_name: Optional[str] = None) -> Iterator[Tuple[dict, List[InventoryData]]]:
+        for resource_list_page in self._get_resources_from_account(account_id, queries, region_name):
+            yield from self._map_resource_page(resource_list_page)
+
+    def _map_resource_page(self, resource_list_page: List[str]) -> Iterator[Tuple[dict, List[InventoryData]]]:
+        _logger.debug("current page of inventory contained %s items from AWS Config", len(resource_list_page))
+
+        # Decoding the whole page in one call is considerably faster than decoding each result on its own
+        for resource in self._json_decoder.decode_page(resource_list_page):
+
+            # One line item returned from AWS Config can result in multiple inventory line items (e.g. multiple IPs)
+            # The registry returns None when no mapper supports the resource type
+            inventory_items: Optional[List[InventoryData]] = self._mapper_registry.map(resource)
+
+            if inventory_items is None:
+                _logger.warning(f"skipping mapping, unable to find mapper for resource type of {resource['resourceType']}")
+
+                continue
 
-        return all_inventory
+            yield resource, inventory_items
@@ -0,0 +1,146 @@
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# License:
+# This sample code is made available under the MIT-0 license. See the LICENSE file.
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from inventory.mappers import DEFAULT_INVENTORY_BATCH_SIZE, INVENTORY_FIELDS, InventoryBatch, InventoryData
+from inventory.storage import LocalDocumentStore, S3DocumentStore, get_document_location_from_environment, get_document_store
+
+_logger = logging.getLogger("inventory.report_cache")
+_logger.setLevel(getattr(logging, os.environ.get("LOG_LEVEL", "INFO"), logging.INFO))
+
+REPORT_DIGEST_VERSION = 1
+DEFAULT_REPORT_DIGEST_FILE_NAME = "report-digest.json"
+_DIGEST_MODULUS = 2 ** 256
+_EXTRA_TAGS_INDEX = INVENTORY_FIELDS.index("extra_tags")
+
+class InventoryDigest():
+    """
+    SHA-256 based digest of inventory rows and of the settings that shape the report written from them.
+
+    Rows are hashed one by one and the hashes summed, so the digest does not depend on the order AWS Config happens
+    to return resources in, while a row that appears twice still counts twice.
+    """
+    def __init__(self, settings: dict):
+        self._settings_digest = hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()
+        self._rows_sum = 0
+        self.row_count = 0
+
+    def update(self, rows: Iterable[tuple]):
+        """Adds rows, each holding the values of INVENTORY_FIELDS in that order."""
+        rows_sum = self._rows_sum
+        sha256 = hashlib.sha256
+        for row in rows:
+            extra_tags = row[_EXTRA_TAGS_INDEX]
+            if extra_tags:
+                # Sorted so the encoding does not depend on the order tags were returned in
+                row = row[:_EXTRA_TAGS_INDEX] + (sorted(extra_tags.items()),) + row[_EXTRA_TAGS_INDEX + 1:]
+            # Fields are strings or None, whose repr is stable between runs and several times faster than json.dumps
+            rows_sum += int.from_bytes(sha256(repr(row).encode("utf-8")).digest(), "big")
+            self.row_count += 1
+        self._rows_sum = rows_sum % _DIGEST_MODULUS
+
+    def hexdigest(self) -> str:
+        return hashlib.sha256(f"{self._settings_digest}:{self.row_count}:{self._rows_sum:064x}".encode("utf-8")).hexdigest()
+
+def collect_with_digest(inventory: Iterable[Union[InventoryData, InventoryBatch]], settings: dict) -> Tuple[List[InventoryBatch], str]:
+    """
+    Reads the whole inventory, returning it as batches together with its digest. The rows have to be held until the
+    digest is known, since only then can the report be skipped, so this gives up streaming rows into the report.
+    Batches are kept as they are and rows are gathered into batches, which hold them in columnar form.
+    """
+    digest = InventoryDigest(settings)
+    batches: List[InventoryBatch] = []
+    rows = InventoryBatch()
+
+    for item in inventory:
+        if isinstance(item, InventoryBatch):
+            # Rows gathered so far go first so the report keeps the order rows arrived in
+            if len(rows):
+                batches.append(rows)
+                rows = InventoryBatch()
+            batches.append(item)
+            digest.update(item.iter_rows(INVENTORY_FIELDS))
+        else:
+            rows.append(item)
+            digest.update([tuple(getattr(item, field) for field in INVENTORY_FIELDS)])
+            if len(rows) >= DEFAULT_INVENTORY_BATCH_SIZE:
+                batches.append(rows)
+                rows = InventoryBatch()
+
+    if len(rows):
+        batches.append(rows)
+
+    return batches, digest.hexdigest()
+
+class ReportDigest():
+    """Digest of the inventory in the last delivered reports and where each format was delivered to."""
+    def __init__(self, digest: str, report_urls: Dict[str, str], row_count: int = 0, delivered_at: Optional[str] = None):
+        self.digest = digest
+        self.report_urls = report_urls
+        self.row_count = row_count
+        self.delivered_at = delivered_at or datetime.now(timezone.utc).isoformat()
+
+    def to_json(self) -> str:
+        return json.dumps({ "version": REPORT_DIGEST_VERSION,
+                            "digest": self.digest,
+                            "report_urls": self.report_urls,
+                            "row_count": self.row_count,
+                            "delivered_at": self.delivered_at })
+
+    @classmethod
+    def from_json(cls, document: str) -> "ReportDigest":
+        data = json.loads(document)
+        if data.get("version") != REPORT_DIGEST_VERSION:
+            raise ValueError(f"Unsupported report digest version: {data.get('version')}")
+
+        return cls(data["digest"], data["report_urls"], data.get("row_count", 0), data.get("delivered_at"))
+
+class LocalReportDigestStore(LocalDocumentStore):
+    def load(self) -> Optional[ReportDigest]:
+        document = self.load_document()
+        return ReportDigest.from_json(document) if document is not None else None
+
+    def save(self, report_digest: ReportDigest):
+        self.save_document(report_digest.to_json())
+
+class S3ReportDigestStore(S3DocumentStore):
+    def load(self) -> Optional[ReportDigest]:
+        document = self.load_document()
+        return ReportDigest.from_json(document) if document is not None else None
+
+    def save(self, report_digest: ReportDigest):
+        self.save_document(report_digest.to_json())
+
+def get_report_digest_store_from_environment(s3_client):
+    """
+    Returns the store named by REPORT_DIGEST_LOCATION, which is either an s3://bucket/key URL or a local file path.
+    Defaults to a file next to the delivered reports in REPORT_TARGET_BUCKET_NAME/REPORT_TARGET_BUCKET_PATH.
+    """
+    location = get_document_location_from_environment("REPORT_DIGEST_LOCATION", DEFAULT_REPORT_DIGEST_FILE_NAME)
+
+    return get_document_store(location, s3_client, "REPORT_DIGEST_LOCATION", LocalReportDigestStore, S3ReportDigestStore)
+
+def get_unchanged_report(report_digest_store, digest: str, report_exists=None) -> Optional[ReportDigest]:
+    """
+    Returns the last delivered reports if they were written from inventory with the same digest, and, when
+    report_exists is given, none of them has been deleted since, e.g. by a lifecycle rule. Returns None otherwise.
+    """
+    try:
+        previous = report_digest_store.load()
+    except (KeyError, ValueError) as ex:
+        _logger.warning("ignoring unreadable report digest: %s", ex)
+        return None
+
+    if previous is None or previous.digest != digest:
+        return None
+
+    if report_exists is not None and not all(report_exists(report_url) for report_url in previous.report_urls.values()):
+        _logger.info("inventory is unchanged but a previous report no longer exists: %s", previous.report_urls)
+        return None
+
+    return previous
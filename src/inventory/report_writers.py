@@ -0,0 +1,153 @@
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# License:
+# This sample code is made available under the MIT-0 license. See the LICENSE file.
+import csv
+import io
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+from itertools import islice
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Sequence, Union
+from inventory.mappers import DEFAULT_INVENTORY_BATCH_SIZE, InventoryBatch, InventoryData, get_extra_tag_columns, iter_inventory_rows
+from inventory.reports import FIELD_MAPPINGS, CreateReportCommandHandler
+from inventory.uploads import COMPRESSION_NONE, COMPRESSIONS
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover - pyarrow is optional
+    pyarrow = None
+
+_logger = logging.getLogger("inventory.report_writers")
+_logger.setLevel(getattr(logging, os.environ.get("LOG_LEVEL", "INFO"), logging.INFO))
+
+DEFAULT_REPORT_FORMATS = "xlsx"
+# Fields in the order of the workbook's columns, so every format reports the same columns in the same order
+REPORT_FIELDS = [attr for _, attr in FIELD_MAPPINGS]
+
+Inventory = Iterable[Union[InventoryData, InventoryBatch]]
+
+def get_column_names(extra_tag_columns: Sequence[str]) -> List[str]:
+    # Prefixed so a tag named like a field, e.g. owner, does not produce two columns with the same name
+    return REPORT_FIELDS + [f"tag:{tag_name}" for tag_name in extra_tag_columns]
+
+def iter_report_rows(inventory: Inventory, extra_tag_columns: Sequence[str]) -> Iterator[tuple]:
+    """Yields the values of get_column_names for every row."""
+    if not extra_tag_columns:
+        return iter_inventory_rows(inventory, REPORT_FIELDS)
+
+    return ((*values, *((extra_tags.get(tag_name) if extra_tags else None) for tag_name in extra_tag_columns))
+            for *values, extra_tags in iter_inventory_rows(inventory, REPORT_FIELDS + ["extra_tags"]))
+
+def _iter_chunks(rows: Iterator[tuple], chunk_size: int = DEFAULT_INVENTORY_BATCH_SIZE) -> Iterator[List[tuple]]:
+    while chunk := list(islice(rows, chunk_size)):
+        yield chunk
+
+class ReportWriter(ABC):
+    """Writes the inventory in one format into a binary file object, which does not need to be seekable."""
+    format_name: str
+    file_extension: str
+    # Whether REPORT_COMPRESSION applies, formats that are compressed already are delivered as they are
+    supports_compression: bool = False
+
+    @abstractmethod
+    def write(self, inventory: Inventory, output_file: BinaryIO):
+        pass
+
+class WorkbookReportWriter(ReportWriter):
+    """The FedRAMP A13 workbook, written by CreateReportCommandHandler in its REPORT_WRITE_MODE."""
+    format_name = "xlsx"
+    file_extension = ".xlsx"
+
+    def __init__(self, create_report_handler: Optional[CreateReportCommandHandler] = None):
+        self._create_report_handler = create_report_handler if create_report_handler is not None else CreateReportCommandHandler()
+
+    def write(self, inventory: Inventory, output_file: BinaryIO):
+        self._create_report_handler.execute(inventory, output_file)
+
+class CsvReportWriter(ReportWriter):
+    """One row per inventory row, with a heading row of get_column_names. Empty fields are written as empty strings."""
+    format_name = "csv"
+    file_extension = ".csv"
+    supports_compression = True
+
+    def write(self, inventory: Inventory, output_file: BinaryIO):
+        extra_tag_columns = get_extra_tag_columns()
+        text_file = io.TextIOWrapper(output_file, encoding="utf-8", newline="")
+        try:
+            writer = csv.writer(text_file)
+            writer.writerow(get_column_names(extra_tag_columns))
+            writer.writerows(iter_report_rows(inventory, extra_tag_columns))
+        finally:
+            # Detached rather than closed, closing the wrapper would close output_file too
+            text_file.flush()
+            text_file.detach()
+
+class JsonLinesReportWriter(ReportWriter):
+    """One JSON object per inventory row, keyed by get_column_names. Empty fields are null."""
+    format_name = "jsonl"
+    file_extension = ".jsonl"
+    supports_compression = True
+
+    def write(self, inventory: Inventory, output_file: BinaryIO):
+        extra_tag_columns = get_extra_tag_columns()
+        column_names = get_column_names(extra_tag_columns)
+        encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+        # Written a chunk of rows at a time, one write call per row would dominate for small rows
+        for chunk in _iter_chunks(iter_report_rows(inventory, extra_tag_columns)):
+            output_file.write("".join([encode(dict(zip(column_names, values))) + "\n" for values in chunk]).encode("utf-8"))
+
+class ParquetReportWriter(ReportWriter):
+    """
+    Columnar Parquet file with a string column per get_column_names, written a row group per chunk of rows so
+    memory does not grow with the inventory. Needs the optional pyarrow package.
+    """
+    format_name = "parquet"
+    file_extension = ".parquet"
+
+    def __init__(self):
+        if pyarrow is None:
+            raise ValueError("REPORT_FORMATS includes parquet but the pyarrow package is not installed")
+
+    def write(self, inventory: Inventory, output_file: BinaryIO):
+        extra_tag_columns = get_extra_tag_columns()
+        column_names = get_column_names(extra_tag_columns)
+        schema = pyarrow.schema([(column_name, pyarrow.string()) for column_name in column_names])
+
+        writer = pyarrow.parquet.ParquetWriter(output_file, schema)
+        try:
+            for chunk in _iter_chunks(iter_report_rows(inventory, extra_tag_columns)):
+                columns = [list(column) for column in zip(*chunk)]
+                writer.write_table(pyarrow.Table.from_arrays([pyarrow.array(column, type=pyarrow.string()) for column in columns], schema=schema))
+        finally:
+            writer.close()
+
+_REPORT_WRITERS = { writer_class.format_name: writer_class for writer_class in (WorkbookReportWriter, CsvReportWriter, JsonLinesReportWriter, ParquetReportWriter) }
+
+def get_report_writers(create_report_handler: Optional[CreateReportCommandHandler] = None, formats: Optional[str] = None) -> List[ReportWriter]:
+    """
+    Returns a writer for each of the comma separated formats or, if not provided, REPORT_FORMATS, in the order given.
+    Defaults to the workbook alone.
+    """
+    format_names: List[str] = []
+    for format_name in (formats or os.environ.get("REPORT_FORMATS", DEFAULT_REPORT_FORMATS)).split(","):
+        format_name = format_name.strip().lower()
+        if format_name and format_name not in format_names:
+            format_names.append(format_name)
+
+    if unknown_formats := [format_name for format_name in format_names if format_name not in _REPORT_WRITERS]:
+        raise ValueError(f"REPORT_FORMATS must be a comma separated list of {', '.join(_REPORT_WRITERS)}, not {', '.join(unknown_formats)}")
+    if not format_names:
+        raise ValueError("REPORT_FORMATS must name at least one format")
+
+    return [WorkbookReportWriter(create_report_handler) if format_name == WorkbookReportWriter.format_name else _REPORT_WRITERS[format_name]()
+            for format_name in format_names]
+
+def get_report_compression_from_environment() -> str:
+    compression = os.environ.get("REPORT_COMPRESSION", COMPRESSION_NONE).lower()
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"REPORT_COMPRESSION must be one of {', '.join(COMPRESSIONS)}, not {compression}")
+
+    return compression
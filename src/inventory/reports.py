@@ -2,14 +2,21 @@
 # License:
 # This sample code is made available under the MIT-0 license. See the LICENSE file.
 from datetime import datetime
+import hashlib
 import logging
 import tempfile
 import os, os.path
-from typing import List
+from itertools import chain
+from typing import BinaryIO, Callable, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 import boto3
+from botocore.exceptions import ClientError
 from openpyxl import load_workbook
 from openpyxl.worksheet.worksheet import Worksheet
-from inventory.mappers import InventoryData
+from inventory.concurrency import get_max_workers_from_environment
+from inventory.mappers import InventoryBatch, InventoryData, _sanitize_for_excel, get_extra_tag_columns, iter_inventory_rows
+from inventory.streaming_workbook import StreamingTemplateWorkbook
+from inventory.uploads import (BinaryOutput, COMPRESSION_EXTENSIONS, COMPRESSION_NONE, DEFAULT_UPLOAD_MAX_WORKERS, S3MultipartUploadStream,
+                               get_part_size_from_environment, open_compressed)
 
 _logger = logging.getLogger("inventory.reports")
 _logger.setLevel(getattr(logging, os.environ.get("LOG_LEVEL", "INFO"), logging.INFO))
@@ -18,6 +25,10 @@ _workbook_template_file_name = os.path.join(_current_dir_name, "SSP-A13-FedRAMP-
 _workbook_output_file_path = os.path.join(tempfile.gettempdir(), "SSP-A13-FedRAMP-Integrated-Inventory.xlsx")
 DEFAULT_REPORT_WORKSHEET_FIRST_WRITEABLE_ROW_NUMBER = 3
 
+def _get_output_file_path(file_extension: str) -> str:
+    # Every format is written next to the workbook, with the same name
+    return os.path.splitext(_workbook_output_file_path)[0] + file_extension
+
 # FedRAMP template column mappings (REV 4)
 COL_UNIQUE_ID = 2
 COL_IP_ADDRESS = 3
@@ -34,13 +45,79 @@ COL_SOFTWARE_PRODUCT = 17
 COL_FUNCTION = 19
 COL_NETWORK_ID = 22
 COL_OWNER = 23
+# EXTRA_TAG_COLUMNS are written from column Z onwards, after the last column of the template
+COL_FIRST_EXTRA_TAG = 26
+
+FIELD_MAPPINGS = [
+    (COL_UNIQUE_ID, 'unique_id'), (COL_IP_ADDRESS, 'ip_address'), (COL_IS_VIRTUAL, 'is_virtual'),
+    (COL_IS_PUBLIC, 'is_public'), (COL_DNS_NAME, 'dns_name'), (COL_MAC_ADDRESS, 'mac_address'),
+    (COL_AUTHENTICATED_SCAN, 'authenticated_scan_planned'), (COL_BASELINE_CONFIG, 'baseline_config'),
+    (COL_ASSET_TYPE, 'asset_type'), (COL_HARDWARE_MODEL, 'hardware_model'),
+    (COL_SOFTWARE_VENDOR, 'software_vendor'), (COL_SOFTWARE_PRODUCT, 'software_product_name'),
+    (COL_FUNCTION, 'function'), (COL_NETWORK_ID, 'network_id'), (COL_OWNER, 'owner')
+]
+
+_REPORT_COLUMNS = [col for col, _ in FIELD_MAPPINGS]
+_REPORT_FIELDS = [attr for _, attr in FIELD_MAPPINGS]
+
+def _iter_report_rows(inventory: Iterable[Union[InventoryData, InventoryBatch]], extra_tag_columns: Sequence[str]) -> Iterator[Iterable[Tuple[int, object]]]:
+    """Yields the (column, value) pairs of every row, including a column per extra tag."""
+    if not extra_tag_columns:
+        return (zip(_REPORT_COLUMNS, inventory_values) for inventory_values in iter_inventory_rows(inventory, _REPORT_FIELDS))
+
+    extra_tag_report_columns = list(enumerate(extra_tag_columns, start=COL_FIRST_EXTRA_TAG))
+
+    return (chain(zip(_REPORT_COLUMNS, inventory_values),
+                  ((column, extra_tags.get(tag_name) or None) for column, tag_name in extra_tag_report_columns if extra_tags))
+            for *inventory_values, extra_tags in iter_inventory_rows(inventory, _REPORT_FIELDS + ["extra_tags"]))
+
+REPORT_WRITE_MODE_STANDARD = "standard"
+REPORT_WRITE_MODE_STREAMING = "streaming"
 
 class CreateReportCommandHandler():
+    def __init__(self, write_mode=None):
+        self._write_mode = (write_mode or os.environ.get("REPORT_WRITE_MODE", REPORT_WRITE_MODE_STANDARD)).lower()
+        if self._write_mode not in (REPORT_WRITE_MODE_STANDARD, REPORT_WRITE_MODE_STREAMING):
+            raise ValueError(f"REPORT_WRITE_MODE must be '{REPORT_WRITE_MODE_STANDARD}' or '{REPORT_WRITE_MODE_STREAMING}'")
+
     def _write_cell_if_value_provided(self, worksheet: Worksheet, column:int, row: int, value: str):
         if value is not None:
             worksheet.cell(column=column, row=row, value=value)
 
-    def execute(self, inventory: List[InventoryData]) -> str:
+    def _get_first_writeable_row_number(self) -> int:
+        try:
+            return int(os.environ.get("REPORT_WORKSHEET_FIRST_WRITEABLE_ROW_NUMBER", DEFAULT_REPORT_WORKSHEET_FIRST_WRITEABLE_ROW_NUMBER))
+        except ValueError as e:
+            _logger.error(f"Invalid row number in environment variable: {e}")
+            raise ValueError("REPORT_WORKSHEET_FIRST_WRITEABLE_ROW_NUMBER must be a valid integer")
+
+    def _get_extra_tag_headings(self, extra_tag_columns: Sequence[str], first_row_number: int) -> List[Tuple[int, str]]:
+        if first_row_number < 2:
+            return []
+
+        return [(col, _sanitize_for_excel(tag_name)) for col, tag_name in enumerate(extra_tag_columns, start=COL_FIRST_EXTRA_TAG)]
+
+    def get_report_settings(self) -> dict:
+        """Everything besides the inventory that changes the report, so a cached report is not reused when these change."""
+        with open(_workbook_template_file_name, "rb") as template_file:
+            template_digest = hashlib.sha256(template_file.read()).hexdigest()
+
+        return { "template": template_digest,
+                 "worksheet": os.environ.get("REPORT_WORKSHEET_NAME", "Inventory"),
+                 "first_row_number": self._get_first_writeable_row_number(),
+                 "extra_tag_columns": list(get_extra_tag_columns()) }
+
+    def execute(self, inventory: Iterable[Union[InventoryData, InventoryBatch]], output_file: Optional[BinaryIO] = None) -> str:
+        """
+        Writes the inventory, given as InventoryData rows, InventoryBatch batches of rows or a mix of both, into the report.
+        The report is saved to output_file, which does not need to be seekable, if given or to a temporary file otherwise.
+        """
+        output = output_file if output_file is not None else _workbook_output_file_path
+        output_name = getattr(output_file, "location", "report stream") if output_file is not None else _workbook_output_file_path
+
+        if self._write_mode == REPORT_WRITE_MODE_STREAMING:
+            return self._execute_streaming(inventory, output, output_name)
+
         try:
             workbook = load_workbook(_workbook_template_file_name)
         except FileNotFoundError:
@@ -57,40 +134,75 @@ class CreateReportCommandHandler():
         
         report_worksheet = workbook[report_worksheet_name]
         
-        try:
-            rowNumber: int = int(os.environ.get("REPORT_WORKSHEET_FIRST_WRITEABLE_ROW_NUMBER", DEFAULT_REPORT_WORKSHEET_FIRST_WRITEABLE_ROW_NUMBER))
-        except ValueError as e:
-            _logger.error(f"Invalid row number in environment variable: {e}")
-            raise ValueError("REPORT_WORKSHEET_FIRST_WRITEABLE_ROW_NUMBER must be a valid integer")
+        rowNumber: int = self._get_first_writeable_row_number()
+        extra_tag_columns = get_extra_tag_columns()
 
-        _logger.info(f"writing {len(inventory)} rows into worksheet {report_worksheet_name} starting at row {rowNumber}")
+        _logger.info(f"writing rows into worksheet {report_worksheet_name} starting at row {rowNumber}")
 
-        field_mappings = [
-            (COL_UNIQUE_ID, 'unique_id'), (COL_IP_ADDRESS, 'ip_address'), (COL_IS_VIRTUAL, 'is_virtual'),
-            (COL_IS_PUBLIC, 'is_public'), (COL_DNS_NAME, 'dns_name'), (COL_MAC_ADDRESS, 'mac_address'),
-            (COL_AUTHENTICATED_SCAN, 'authenticated_scan_planned'), (COL_BASELINE_CONFIG, 'baseline_config'),
-            (COL_ASSET_TYPE, 'asset_type'), (COL_HARDWARE_MODEL, 'hardware_model'),
-            (COL_SOFTWARE_VENDOR, 'software_vendor'), (COL_SOFTWARE_PRODUCT, 'software_product_name'),
-            (COL_FUNCTION, 'function'), (COL_NETWORK_ID, 'network_id'), (COL_OWNER, 'owner')
-        ]
+        # The row above the first writeable row holds the column headings
+        for col, tag_name in self._get_extra_tag_headings(extra_tag_columns, rowNumber):
+            report_worksheet.cell(column=col, row=rowNumber - 1, value=tag_name)
 
-        for inventory_row in inventory:
-            for col, attr in field_mappings:
-                if (value := getattr(inventory_row, attr, None)) is not None:
+        # Cells of the template's guidance and example rows that a row leaves empty are cleared, so they do not show through
+        template_cells = { (cell.row, cell.column) for cells in report_worksheet.iter_rows(min_row=rowNumber, max_col=max(_REPORT_COLUMNS)) for cell in cells if cell.value is not None }
+
+        # Inventory can be a generator from the readers, so rows are counted as they are written
+        row_count = 0
+        for row in _iter_report_rows(inventory, extra_tag_columns):
+            for col, value in row:
+                if value is not None:
                     report_worksheet.cell(column=col, row=rowNumber, value=value)
+                elif (rowNumber, col) in template_cells:
+                    report_worksheet.cell(column=col, row=rowNumber).value = None
             rowNumber += 1
+            row_count += 1
+
+        workbook.save(output)
 
-        workbook.save(_workbook_output_file_path)
+        _logger.info(f"completed saving {row_count} rows of inventory into {output_name}")
 
-        _logger.info(f"completed saving inventory into {_workbook_output_file_path}")
+        return output_name
 
-        return _workbook_output_file_path
+    def _execute_streaming(self, inventory: Iterable[Union[InventoryData, InventoryBatch]], output: Union[str, BinaryIO], output_name: str) -> str:
+        # Rows are streamed straight into the worksheet XML so memory does not grow with the number of cells
+        report_worksheet_name = os.environ.get("REPORT_WORKSHEET_NAME", "Inventory")
+        first_row_number = self._get_first_writeable_row_number()
+
+        _logger.info(f"streaming rows into worksheet {report_worksheet_name} starting at row {first_row_number}")
+
+        workbook = StreamingTemplateWorkbook(_workbook_template_file_name, report_worksheet_name)
+        extra_tag_columns = get_extra_tag_columns()
+        rows = _iter_report_rows(inventory, extra_tag_columns)
+
+        if headings := self._get_extra_tag_headings(extra_tag_columns, first_row_number):
+            # Written into the template's heading row, which is not counted as an inventory row
+            row_count = workbook.save(output, first_row_number - 1, chain([headings], rows)) - 1
+        else:
+            row_count = workbook.save(output, first_row_number, rows)
+
+        _logger.info(f"completed saving {row_count} rows of inventory into {output_name}")
+
+        return output_name
+
+REPORT_DELIVERY_MODE_FILE = "file"
+REPORT_DELIVERY_MODE_STREAM = "stream"
 
 class DeliverReportCommandHandler():
-    def __init__(self, s3_client=boto3.client('s3')):
+    def __init__(self, s3_client=boto3.client('s3'), delivery_mode=None):
         self._s3_client = s3_client
+        self._delivery_mode = (delivery_mode or os.environ.get("REPORT_DELIVERY_MODE", REPORT_DELIVERY_MODE_FILE)).lower()
+        if self._delivery_mode not in (REPORT_DELIVERY_MODE_FILE, REPORT_DELIVERY_MODE_STREAM):
+            raise ValueError(f"REPORT_DELIVERY_MODE must be '{REPORT_DELIVERY_MODE_FILE}' or '{REPORT_DELIVERY_MODE_STREAM}'")
+
+    @property
+    def s3_client(self):
+        return self._s3_client
 
-    def execute(self, report_file_name: str) -> str:
+    @property
+    def delivery_mode(self) -> str:
+        return self._delivery_mode
+
+    def _get_report_target(self, file_extension: str) -> Tuple[str, str]:
         target_path = os.environ.get("REPORT_TARGET_BUCKET_PATH")
         target_bucket = os.environ.get("REPORT_TARGET_BUCKET_NAME")
         
@@ -101,12 +213,27 @@ class DeliverReportCommandHandler():
         if '..' in target_path or target_path.startswith('/'):
             raise ValueError(f"Invalid target path format: {target_path}")
         
-        # Use the expected report file path for all operations
-        validated_path = _workbook_output_file_path
+        report_stem = os.path.splitext(os.path.basename(_workbook_output_file_path))[0]
+
+        return target_bucket, f"{target_path}/{report_stem}-{datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}{file_extension}"
+
+    def report_exists(self, report_url: str) -> bool:
+        """Whether a report delivered to report_url, as returned by execute, is still in the bucket."""
+        bucket_host, _, report_s3_key = report_url[len("https://"):].partition("/")
+        try:
+            self._s3_client.head_object(Bucket=bucket_host[:-len(".s3.amazonaws.com")], Key=report_s3_key)
+        except ClientError as ex:
+            if ex.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return False
+            raise
+
+        return True
+
+    def execute(self, report_file_name: str, file_extension: str = ".xlsx") -> str:
+        target_bucket, report_s3_key = self._get_report_target(file_extension)
         
-        report_filename = os.path.basename(validated_path)
-        report_stem = os.path.splitext(report_filename)[0]
-        report_s3_key = f"{target_path}/{report_stem}-{datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}.xlsx"
+        # Use the expected report file path for all operations
+        validated_path = _get_output_file_path(file_extension)
         
         _logger.info(f"uploading file '{validated_path}' to bucket '{target_bucket}' with key '{report_s3_key}'")
 
@@ -115,4 +242,42 @@ class DeliverReportCommandHandler():
 
         _logger.info(f"completed file upload")
 
-        return f"https://{target_bucket}.s3.amazonaws.com/{report_s3_key}"
\ No newline at end of file
+        return f"https://{target_bucket}.s3.amazonaws.com/{report_s3_key}"
+
+    def execute_streaming(self, write_report: Callable[[BinaryOutput], object], file_extension: str = ".xlsx", compression: str = COMPRESSION_NONE) -> str:
+        """
+        Uploads the report write_report writes into the file object it is given while it is being written, without a
+        local copy, using a multipart upload for reports larger than a part. The report can be compressed with gzip
+        or into a zip archive, which suits text exports, workbooks are already compressed.
+        """
+        target_bucket, report_s3_key = self._get_report_target(file_extension + COMPRESSION_EXTENSIONS[compression])
+        report_file_name = os.path.basename(report_s3_key)[:-len(COMPRESSION_EXTENSIONS[compression]) or None]
+
+        _logger.info(f"streaming report to bucket '{target_bucket}' with key '{report_s3_key}'")
+
+        with S3MultipartUploadStream(self._s3_client, target_bucket, report_s3_key, get_part_size_from_environment(),
+                                     get_max_workers_from_environment("REPORT_UPLOAD_MAX_WORKERS", DEFAULT_UPLOAD_MAX_WORKERS)) as upload, \
+             open_compressed(upload, compression, report_file_name) as report_file:
+            write_report(report_file)
+
+        _logger.info("completed streaming upload")
+
+        return f"https://{target_bucket}.s3.amazonaws.com/{report_s3_key}"
+
+    def deliver(self, report_writer, inventory: Iterable[Union[InventoryData, InventoryBatch]], compression: str = COMPRESSION_NONE) -> str:
+        """
+        Writes the inventory with report_writer, one of the inventory.report_writers, and uploads it in the delivery
+        mode, compressing it if the writer's format supports compression. Returns the URL of the delivered report.
+        """
+        compression = compression if report_writer.supports_compression else COMPRESSION_NONE
+
+        if self._delivery_mode == REPORT_DELIVERY_MODE_STREAM:
+            return self.execute_streaming(lambda report_file: report_writer.write(inventory, report_file), report_writer.file_extension, compression)
+
+        file_extension = report_writer.file_extension + COMPRESSION_EXTENSIONS[compression]
+        report_path = _get_output_file_path(file_extension)
+        with open(report_path, "wb") as report_file, \
+             open_compressed(report_file, compression, os.path.basename(_get_output_file_path(report_writer.file_extension))) as target:
+            report_writer.write(inventory, target)
+
+        return self.execute(report_path, file_extension)
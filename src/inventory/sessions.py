@@ -0,0 +1,143 @@
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# License:
+# This sample code is made available under the MIT-0 license. See the LICENSE file.
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Hashable, NamedTuple, Optional, Tuple
+import boto3
+from inventory.throttling import NO_SDK_RETRIES_CONFIG
+
+_logger = logging.getLogger("inventory.sessions")
+_logger.setLevel(getattr(logging, os.environ.get("LOG_LEVEL", "INFO"), logging.INFO))
+
+# The longest session role chaining allows, since the function assumes the roles with its own role's credentials
+ASSUME_ROLE_DURATION_SECONDS = 3600
+# Credentials are refreshed this long before they expire so they cannot run out part way through collecting an account
+DEFAULT_REFRESH_MARGIN = timedelta(minutes=5)
+DEFAULT_MAX_CACHED_CLIENTS = 512
+
+class _CachedClient(NamedTuple):
+    client: object
+    expiration: Optional[datetime]
+
+def _utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+class ClientCache():
+    """
+    Least recently used cache of boto3 clients, evicting entries whose credentials are about to expire.
+
+    Clients are thread safe once created, so cached clients, and the connection pools they hold, can be shared by
+    concurrent collection workers. The lock only guards the cache itself, clients are created outside of it.
+    """
+    def __init__(self, max_size: int = DEFAULT_MAX_CACHED_CLIENTS, refresh_margin: timedelta = DEFAULT_REFRESH_MARGIN,
+                 clock: Callable[[], datetime] = _utc_now):
+        self._max_size = max_size
+        self._refresh_margin = refresh_margin
+        self._clock = clock
+        self._entries: "OrderedDict[Hashable, _CachedClient]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _is_fresh(self, entry: _CachedClient) -> bool:
+        return entry.expiration is None or entry.expiration - self._clock() > self._refresh_margin
+
+    def get(self, key: Hashable, create_client: Callable[[], Tuple[object, Optional[datetime]]]):
+        """
+        Returns the cached client for key, calling create_client for a new one when there is none or its credentials
+        are about to expire. create_client returns the client and when its credentials expire, or None if they do not.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._is_fresh(entry):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.client
+            self.misses += 1
+
+        if entry is not None:
+            _logger.debug("credentials for %s expire at %s, refreshing", key, entry.expiration)
+
+        client, expiration = create_client()
+
+        with self._lock:
+            self._entries[key] = _CachedClient(client, expiration)
+            self._entries.move_to_end(key)
+            self._evict()
+
+        return client
+
+    def _evict(self):
+        for key in [key for key, entry in self._entries.items() if not self._is_fresh(entry)]:
+            del self._entries[key]
+
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+# Held at module scope so warm Lambda invocations reuse the clients created by previous invocations
+_client_cache = ClientCache()
+
+def get_client_cache() -> ClientCache:
+    return _client_cache
+
+def get_credentials_expiration(sts_response, default: Optional[datetime] = None) -> Optional[datetime]:
+    """Returns the Expiration of the credentials in an AssumeRole response, or default if it has none."""
+    try:
+        expiration = sts_response["Credentials"]["Expiration"]
+    except (KeyError, TypeError):
+        return default
+
+    if not isinstance(expiration, datetime):
+        return default
+
+    return expiration if expiration.tzinfo is not None else expiration.replace(tzinfo=timezone.utc)
+
+def get_assumed_role_client(sts_client, role_arn: str, role_session_name: str, region_name: str, create_client: Callable[[dict], object],
+                            client_cache: Optional[ClientCache] = None):
+    """
+    Returns a client created by create_client from the credentials of role_arn for region_name. The credentials are
+    cached per role, so the role is only assumed once for all regions of an account, and again once they are about
+    to expire. Clients are cached per role and region and expire together with the credentials they were created from.
+    """
+    client_cache = client_cache if client_cache is not None else _client_cache
+
+    def assume_role() -> Tuple[object, Optional[datetime]]:
+        _logger.info("assuming role %s", role_arn)
+
+        requested_at = _utc_now()
+        sts_response = sts_client.assume_role(RoleArn=role_arn, RoleSessionName=role_session_name, DurationSeconds=ASSUME_ROLE_DURATION_SECONDS)
+
+        return sts_response, get_credentials_expiration(sts_response, requested_at + timedelta(seconds=ASSUME_ROLE_DURATION_SECONDS))
+
+    def create_region_client() -> Tuple[object, Optional[datetime]]:
+        requested_at = _utc_now()
+        sts_response = client_cache.get(("assumed-role", role_arn), assume_role)
+
+        return create_client(sts_response), get_credentials_expiration(sts_response, requested_at + timedelta(seconds=ASSUME_ROLE_DURATION_SECONDS))
+
+    return client_cache.get(("assumed-role-client", role_arn, region_name), create_region_client)
+
+def get_client(service_name: str, region_name: Optional[str] = None, client_cache: Optional[ClientCache] = None, sdk_retries: bool = True):
+    """
+    Returns a cached client for the credentials of the Lambda function itself, which botocore refreshes on its own.
+    Without sdk_retries botocore makes a single attempt per call, for clients wrapped in a RetryingClient.
+    """
+    client_cache = client_cache if client_cache is not None else _client_cache
+    config = None if sdk_retries else NO_SDK_RETRIES_CONFIG
+
+    # A new session is used per client since the default boto3 session is not thread safe
+    return client_cache.get(("default", service_name, region_name, sdk_retries),
+                            lambda: (boto3.session.Session().client(service_name, region_name=region_name, config=config), None))
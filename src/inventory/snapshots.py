@@ -0,0 +1,354 @@
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# License:
+# This sample code is made available under the MIT-0 license. See the LICENSE file.
+"""
+SQLite store of the rows of past runs, with a command line to query it, e.g.
+
+    python -m inventory.snapshots inventory.db runs
+    python -m inventory.snapshots inventory.db query --network-id vpc-0123456789abcdef0 --public
+    python -m inventory.snapshots inventory.db diff 3 4
+"""
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Union, cast
+from botocore.exceptions import ClientError
+from inventory.mappers import INVENTORY_FIELDS, InventoryBatch, InventoryData, iter_inventory_rows
+
+_logger = logging.getLogger("inventory.snapshots")
+_logger.setLevel(getattr(logging, os.environ.get("LOG_LEVEL", "INFO"), logging.INFO))
+
+SNAPSHOT_SCHEMA_VERSION = 1
+DEFAULT_SNAPSHOT_MAX_RUNS = 30
+# Attempts at saving a run to a database in S3 that other runs keep changing
+DEFAULT_SNAPSHOT_SAVE_ATTEMPTS = 3
+# Fields rows can be filtered on, each of which has an index together with run_id
+SNAPSHOT_QUERY_FIELDS = ("asset_type", "unique_id", "ip_address", "network_id", "is_public")
+
+CHANGE_ADDED = "added"
+CHANGE_REMOVED = "removed"
+CHANGE_CHANGED = "changed"
+
+_EXTRA_TAGS_INDEX = INVENTORY_FIELDS.index("extra_tags")
+_COLUMNS = ", ".join(INVENTORY_FIELDS)
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    label TEXT,
+    row_count INTEGER NOT NULL,
+    report_urls TEXT
+);
+CREATE TABLE IF NOT EXISTS inventory (
+    run_id INTEGER NOT NULL,
+    {", ".join(f"{field} TEXT" for field in INVENTORY_FIELDS)},
+    row_digest BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS inventory_key ON inventory (run_id, unique_id, ip_address);
+CREATE INDEX IF NOT EXISTS inventory_ip_address ON inventory (run_id, ip_address);
+CREATE INDEX IF NOT EXISTS inventory_network_id ON inventory (run_id, network_id, is_public);
+CREATE INDEX IF NOT EXISTS inventory_asset_type ON inventory (run_id, asset_type);
+"""
+
+class SnapshotConflictError(Exception):
+    """Raised when the database in S3 was changed by another run after it was downloaded."""
+
+class SnapshotRun(NamedTuple):
+    run_id: int
+    created_at: str
+    label: Optional[str]
+    row_count: int
+    report_urls: Dict[str, str]
+
+class RowChange(NamedTuple):
+    """A row only in the new run (added), only in the old run (removed), or in both runs with different values (changed)."""
+    change: str
+    old: Optional[InventoryData]
+    new: Optional[InventoryData]
+
+    @property
+    def changed_fields(self) -> List[str]:
+        if self.old is None or self.new is None:
+            return []
+
+        return [field for field in INVENTORY_FIELDS if getattr(self.old, field) != getattr(self.new, field)]
+
+def _encode_row(values: tuple) -> tuple:
+    extra_tags = values[_EXTRA_TAGS_INDEX]
+    if extra_tags:
+        # Sorted so the same tags give the same text, and digest, whatever order they were returned in
+        values = values[:_EXTRA_TAGS_INDEX] + (json.dumps(extra_tags, sort_keys=True),) + values[_EXTRA_TAGS_INDEX + 1:]
+    # Rows of two runs are compared by digest, so changed rows are found without comparing every field in SQL
+    return values + (hashlib.sha256(repr(values).encode("utf-8")).digest()[:16],)
+
+def _decode_row(values: tuple) -> InventoryData:
+    extra_tags = values[_EXTRA_TAGS_INDEX]
+    if extra_tags:
+        values = values[:_EXTRA_TAGS_INDEX] + (json.loads(extra_tags),) + values[_EXTRA_TAGS_INDEX + 1:]
+    # Stored rows were sanitized before they were saved
+    return InventoryData._from_sanitized_values(values)
+
+class SnapshotStore():
+    """
+    Keeps the rows of every saved run in a SQLite database, indexed by run together with the key of each row
+    (unique_id and ip_address), ip_address, network_id and asset_type, so a run can be queried without reading it all.
+
+    A run is saved in a single transaction, so a failed run is never partly saved.
+    """
+    def __init__(self, database_file_name: str):
+        self._database_file_name = database_file_name
+        self._connection = sqlite3.connect(database_file_name)
+        self._connection.executescript(_SCHEMA)
+        self._connection.execute(f"PRAGMA user_version = {SNAPSHOT_SCHEMA_VERSION}")
+
+    @property
+    def location(self) -> str:
+        return self._database_file_name
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self) -> "SnapshotStore":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def save_run(self, inventory: Iterable[Union[InventoryData, InventoryBatch]], label: Optional[str] = None,
+                 report_urls: Optional[Dict[str, str]] = None) -> int:
+        """Saves the inventory, given as InventoryData rows, InventoryBatch batches of rows or a mix of both, as a new run and returns its id."""
+        with self._connection:
+            run_id = cast(int, self._connection.execute("INSERT INTO runs (created_at, label, row_count, report_urls) VALUES (?, ?, 0, ?)",
+                                                        (datetime.now(timezone.utc).isoformat(), label, json.dumps(report_urls or {}))).lastrowid)
+            cursor = self._connection.executemany(f"INSERT INTO inventory (run_id, {_COLUMNS}, row_digest) VALUES ({', '.join(['?'] * (len(INVENTORY_FIELDS) + 2))})",
+                                                  ((run_id, *_encode_row(values)) for values in iter_inventory_rows(inventory, INVENTORY_FIELDS)))
+            self._connection.execute("UPDATE runs SET row_count = ? WHERE run_id = ?", (cursor.rowcount, run_id))
+
+        _logger.info("saved %s rows as run %s to %s", cursor.rowcount, run_id, self._database_file_name)
+
+        return run_id
+
+    def prune_runs(self, max_runs: int) -> int:
+        """Deletes all but the latest max_runs runs and their rows, returning how many runs were deleted."""
+        with self._connection:
+            oldest_kept_run_id = self._connection.execute("SELECT run_id FROM runs ORDER BY run_id DESC LIMIT 1 OFFSET ?",
+                                                          (max_runs - 1,)).fetchone()
+            if oldest_kept_run_id is None:
+                return 0
+
+            self._connection.execute("DELETE FROM inventory WHERE run_id < ?", oldest_kept_run_id)
+            deleted_run_count = self._connection.execute("DELETE FROM runs WHERE run_id < ?", oldest_kept_run_id).rowcount
+
+        if deleted_run_count:
+            # Gives the space of the deleted rows back so the database file shrinks rather than staying at its largest
+            self._connection.execute("VACUUM")
+
+            _logger.info("deleted %s runs older than run %s from %s", deleted_run_count, oldest_kept_run_id[0], self._database_file_name)
+
+        return deleted_run_count
+
+    def list_runs(self) -> List[SnapshotRun]:
+        return [SnapshotRun(run_id, created_at, label, row_count, json.loads(report_urls or "{}"))
+                for run_id, created_at, label, row_count, report_urls
+                in self._connection.execute("SELECT run_id, created_at, label, row_count, report_urls FROM runs ORDER BY run_id")]
+
+    def get_latest_run_id(self) -> Optional[int]:
+        return self._connection.execute("SELECT MAX(run_id) FROM runs").fetchone()[0]
+
+    def _get_run_id(self, run_id: Optional[int]) -> int:
+        if run_id is None:
+            run_id = self.get_latest_run_id()
+            if run_id is None:
+                raise ValueError(f"{self._database_file_name} has no runs")
+        elif self._connection.execute("SELECT 1 FROM runs WHERE run_id = ?", (run_id,)).fetchone() is None:
+            raise ValueError(f"{self._database_file_name} has no run {run_id}")
+
+        return run_id
+
+    def query(self, run_id: Optional[int] = None, **filters) -> Iterator[InventoryData]:
+        """
+        Yields the rows of a run, the latest if not given, whose SNAPSHOT_QUERY_FIELDS equal the values given for them,
+        e.g. query(network_id="vpc-0123456789abcdef0", is_public="Yes"). A value of None matches empty fields.
+        """
+        if unknown_fields := [field for field in filters if field not in SNAPSHOT_QUERY_FIELDS]:
+            raise ValueError(f"Snapshots can only be queried by {', '.join(SNAPSHOT_QUERY_FIELDS)}, not {', '.join(unknown_fields)}")
+
+        # IS rather than = so None matches NULL, SQLite still uses the indexes for it
+        conditions = "".join(f" AND {field} IS ?" for field in filters)
+        cursor = self._connection.execute(f"SELECT {_COLUMNS} FROM inventory WHERE run_id = ?{conditions} ORDER BY rowid",
+                                          (self._get_run_id(run_id), *filters.values()))
+
+        return (_decode_row(values) for values in cursor)
+
+    def iter_changes(self, old_run_id: int, new_run_id: int) -> Iterator[RowChange]:
+        """
+        Yields the rows added, removed and changed between two runs, matching rows by unique_id and ip_address.
+        Rows are expected to be unique by that key, as they are unless DEDUP_POLICY is off.
+        """
+        old_run_id, new_run_id = self._get_run_id(old_run_id), self._get_run_id(new_run_id)
+        columns = ", ".join(f"{alias}.{field}" for alias in ("old", "new") for field in INVENTORY_FIELDS)
+        field_count = len(INVENTORY_FIELDS)
+
+        # Each query is a join on the run_id, unique_id and ip_address index
+        for change, sql in ((CHANGE_ADDED, f"SELECT {columns} FROM inventory new LEFT JOIN inventory old "
+                                           "ON old.run_id = ? AND old.unique_id IS new.unique_id AND old.ip_address IS new.ip_address "
+                                           "WHERE new.run_id = ? AND old.rowid IS NULL ORDER BY new.rowid"),
+                            (CHANGE_REMOVED, f"SELECT {columns} FROM inventory old LEFT JOIN inventory new "
+                                             "ON new.run_id = ? AND new.unique_id IS old.unique_id AND new.ip_address IS old.ip_address "
+                                             "WHERE old.run_id = ? AND new.rowid IS NULL ORDER BY old.rowid"),
+                            (CHANGE_CHANGED, f"SELECT {columns} FROM inventory new JOIN inventory old "
+                                             "ON old.run_id = ? AND old.unique_id IS new.unique_id AND old.ip_address IS new.ip_address "
+                                             "WHERE new.run_id = ? AND old.row_digest != new.row_digest ORDER BY new.rowid")):
+            parameters = (new_run_id, old_run_id) if change == CHANGE_REMOVED else (old_run_id, new_run_id)
+            for values in self._connection.execute(sql, parameters):
+                yield RowChange(change,
+                                _decode_row(values[:field_count]) if change != CHANGE_ADDED else None,
+                                _decode_row(values[field_count:]) if change != CHANGE_REMOVED else None)
+
+@contextmanager
+def open_snapshot_store(location: str, s3_client=None) -> Iterator[SnapshotStore]:
+    """
+    Opens the store at location, either a local file path or an s3://bucket/key URL. An S3 database is downloaded to a
+    temporary file and, unless the block raises, uploaded again afterwards. The upload only replaces the database that
+    was downloaded, if another run has saved to it meanwhile SnapshotConflictError is raised instead.
+    """
+    if not location.startswith("s3://"):
+        with SnapshotStore(location) as snapshot_store:
+            yield snapshot_store
+        return
+
+    bucket, _, key = location[len("s3://"):].partition("/")
+    if not bucket or not key:
+        raise ValueError(f"Invalid SNAPSHOT_LOCATION: {location}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_file_name = os.path.join(directory, os.path.basename(key))
+        etag = None
+        try:
+            response = s3_client.get_object(Bucket=bucket, Key=key)
+            etag = response["ETag"]
+            with open(database_file_name, "wb") as database_file:
+                shutil.copyfileobj(response["Body"], database_file)
+        except ClientError as ex:
+            if ex.response.get("Error", {}).get("Code") not in ("NoSuchKey", "404"):
+                raise
+            _logger.info("no snapshots at %s yet, creating them", location)
+
+        with SnapshotStore(database_file_name) as snapshot_store:
+            yield snapshot_store
+
+        # Written only if the object is still the one downloaded, or still missing, so no other run's snapshot is lost
+        condition = { "IfMatch": etag } if etag is not None else { "IfNoneMatch": "*" }
+        try:
+            with open(database_file_name, "rb") as database_file:
+                s3_client.put_object(Bucket=bucket, Key=key, Body=database_file, **condition)
+        except ClientError as ex:
+            if ex.response.get("Error", {}).get("Code") in ("PreconditionFailed", "ConditionalRequestConflict", "412"):
+                raise SnapshotConflictError(f"{location} was changed by another run while this run was saving to it")
+            raise
+
+def save_snapshot(location: str, inventory: Iterable[Union[InventoryData, InventoryBatch]], s3_client=None, report_urls: Optional[Dict[str, str]] = None,
+                  max_runs: Optional[int] = None, max_attempts: int = DEFAULT_SNAPSHOT_SAVE_ATTEMPTS) -> int:
+    """
+    Saves the inventory as a new run in the store at location, keeping only the latest max_runs runs, and returns its id.
+    The inventory is saved again, into a fresh copy of the database, when another run saved to it at the same time, so
+    rows given as an iterator are read into a list first.
+    """
+    if max_attempts < 1:
+        raise ValueError("max_attempts must be at least 1")
+
+    max_runs = max_runs if max_runs is not None else get_snapshot_max_runs_from_environment()
+    inventory = inventory if isinstance(inventory, Sequence) else list(inventory)
+
+    for attempt in range(1, max_attempts + 1):
+        try:
+            with open_snapshot_store(location, s3_client) as snapshot_store:
+                run_id = snapshot_store.save_run(inventory, report_urls=report_urls)
+                if max_runs:
+                    snapshot_store.prune_runs(max_runs)
+
+            return run_id
+        except SnapshotConflictError as ex:
+            if attempt == max_attempts:
+                raise
+
+            _logger.warning("%s, saving the run again (attempt %s of %s)", ex, attempt + 1, max_attempts)
+
+    raise AssertionError("unreachable, the last attempt either returns or raises")
+
+def get_snapshot_location_from_environment() -> Optional[str]:
+    """Returns SNAPSHOT_LOCATION, or None when runs are not saved as snapshots."""
+    return os.environ.get("SNAPSHOT_LOCATION") or None
+
+def get_snapshot_max_runs_from_environment() -> int:
+    """Returns SNAPSHOT_MAX_RUNS, the number of runs kept in the store, where 0 keeps every run."""
+    try:
+        max_runs = int(os.environ.get("SNAPSHOT_MAX_RUNS", DEFAULT_SNAPSHOT_MAX_RUNS))
+    except ValueError:
+        raise ValueError("SNAPSHOT_MAX_RUNS must be a valid integer")
+
+    if max_runs < 0:
+        raise ValueError("SNAPSHOT_MAX_RUNS must not be negative")
+
+    return max_runs
+
+def _parse_run_id(value: str) -> Optional[int]:
+    return None if value == "latest" else int(value)
+
+def _write_rows(rows: Iterable[Sequence], column_names: List[str], output_file):
+    writer = csv.writer(output_file)
+    writer.writerow(column_names)
+    writer.writerows(rows)
+
+def _format_row(inventory_data: Optional[InventoryData]) -> list:
+    if inventory_data is None:
+        return [""] * len(INVENTORY_FIELDS)
+
+    return [json.dumps(inventory_data.extra_tags, sort_keys=True) if field == "extra_tags" and inventory_data.extra_tags else getattr(inventory_data, field)
+            for field in INVENTORY_FIELDS]
+
+def main(arguments: List[str], output_file=sys.stdout):
+    parser = argparse.ArgumentParser(prog="python -m inventory.snapshots", description="Queries the runs saved in a snapshot database.")
+    parser.add_argument("database", help="the SQLite database SNAPSHOT_LOCATION saves runs to, or a local copy of it if it is in S3")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("runs", help="lists the saved runs")
+
+    query_parser = commands.add_parser("query", help="writes the rows of a run as CSV")
+    query_parser.add_argument("--run", type=_parse_run_id, default=None, help="run id or latest (default: latest)")
+    for field in SNAPSHOT_QUERY_FIELDS:
+        query_parser.add_argument(f"--{field.replace('_', '-')}", dest=field, help=f"only rows with this {field}")
+    query_parser.add_argument("--public", dest="is_public", action="store_const", const="Yes", help="only public rows, the same as --is-public Yes")
+
+    diff_parser = commands.add_parser("diff", help="writes the rows added, removed and changed between two runs as CSV")
+    diff_parser.add_argument("old_run", type=_parse_run_id)
+    diff_parser.add_argument("new_run", type=_parse_run_id)
+
+    options = parser.parse_args(arguments)
+    if not os.path.exists(options.database):
+        parser.error(f"{options.database} does not exist")
+
+    with SnapshotStore(options.database) as snapshot_store:
+        if options.command == "runs":
+            _write_rows(((run.run_id, run.created_at, run.label or "", run.row_count, json.dumps(run.report_urls)) for run in snapshot_store.list_runs()),
+                        ["run_id", "created_at", "label", "row_count", "report_urls"], output_file)
+        elif options.command == "query":
+            filters = { field: getattr(options, field) for field in SNAPSHOT_QUERY_FIELDS if getattr(options, field) is not None }
+            _write_rows((_format_row(inventory_data) for inventory_data in snapshot_store.query(options.run, **filters)), list(INVENTORY_FIELDS), output_file)
+        else:
+            _write_rows(([row_change.change, " ".join(row_change.changed_fields), *_format_row(row_change.old if row_change.change == CHANGE_REMOVED else row_change.new)]
+                         for row_change in snapshot_store.iter_changes(options.old_run, options.new_run)),
+                        ["change", "changed_fields", *INVENTORY_FIELDS], output_file)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,114 @@
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# License:
+# This sample code is made available under the MIT-0 license. See the LICENSE file.
+import logging
+import os
+import tempfile
+from typing import Optional
+from botocore.exceptions import ClientError
+
+_logger = logging.getLogger("inventory.storage")
+_logger.setLevel(getattr(logging, os.environ.get("LOG_LEVEL", "INFO"), logging.INFO))
+
+class LocalDocumentStore():
+    """Stores a single text document in a local file."""
+    def __init__(self, file_name: str):
+        self._file_name = file_name
+
+    @property
+    def location(self) -> str:
+        return self._file_name
+
+    def load_document(self) -> Optional[str]:
+        if not os.path.exists(self._file_name):
+            return None
+
+        with open(self._file_name, "r") as document_file:
+            return document_file.read()
+
+    def save_document(self, document: str):
+        # Written to a temporary file first so a failed run never leaves a truncated document behind
+        directory = os.path.dirname(os.path.abspath(self._file_name))
+        with tempfile.NamedTemporaryFile("w", dir=directory, delete=False) as document_file:
+            document_file.write(document)
+        os.replace(document_file.name, self._file_name)
+
+    def create_document(self, document: str) -> bool:
+        """Writes the document only if it does not exist yet, returning whether it was written."""
+        try:
+            with open(self._file_name, "x") as document_file:
+                document_file.write(document)
+        except FileExistsError:
+            return False
+
+        return True
+
+    def delete_document(self):
+        if os.path.exists(self._file_name):
+            os.remove(self._file_name)
+
+class S3DocumentStore():
+    """Stores a single text document in an S3 object."""
+    def __init__(self, s3_client, bucket: str, key: str):
+        self._s3_client = s3_client
+        self._bucket = bucket
+        self._key = key
+
+    @property
+    def location(self) -> str:
+        return f"s3://{self._bucket}/{self._key}"
+
+    def load_document(self) -> Optional[str]:
+        try:
+            response = self._s3_client.get_object(Bucket=self._bucket, Key=self._key)
+        except ClientError as ex:
+            if ex.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return None
+            raise
+
+        return response["Body"].read().decode("utf-8")
+
+    def save_document(self, document: str):
+        self._s3_client.put_object(Bucket=self._bucket, Key=self._key, Body=document.encode("utf-8"))
+
+    def create_document(self, document: str) -> bool:
+        """Writes the document only if the object does not exist yet, returning whether it was written."""
+        # S3 conditional writes need botocore 1.35 or later, as locked in Pipfile.lock and bundled by package.sh
+        try:
+            self._s3_client.put_object(Bucket=self._bucket, Key=self._key, Body=document.encode("utf-8"), IfNoneMatch="*")
+        except ClientError as ex:
+            if ex.response.get("Error", {}).get("Code") in ("PreconditionFailed", "ConditionalRequestConflict", "412"):
+                return False
+            raise
+
+        return True
+
+    def delete_document(self):
+        self._s3_client.delete_object(Bucket=self._bucket, Key=self._key)
+
+def get_document_location_from_environment(variable_name: str, default_file_name: str) -> str:
+    """
+    Returns the location in variable_name, which is either an s3://bucket/key URL or a local file path.
+    Defaults to default_file_name next to the delivered reports in REPORT_TARGET_BUCKET_NAME/REPORT_TARGET_BUCKET_PATH.
+    """
+    location = os.environ.get(variable_name)
+    if location:
+        return location
+
+    target_bucket = os.environ.get("REPORT_TARGET_BUCKET_NAME")
+    target_path = os.environ.get("REPORT_TARGET_BUCKET_PATH")
+    if not target_bucket or not target_path:
+        raise ValueError(f"{variable_name} or REPORT_TARGET_BUCKET_NAME and REPORT_TARGET_BUCKET_PATH environment variables are required")
+
+    return f"s3://{target_bucket}/{target_path}/{default_file_name}"
+
+def get_document_store(location: str, s3_client, variable_name: str, local_store_class=LocalDocumentStore, s3_store_class=S3DocumentStore):
+    """Returns the store for an s3://bucket/key URL or a local file path, naming variable_name if the URL is invalid."""
+    if not location.startswith("s3://"):
+        return local_store_class(location)
+
+    bucket, _, key = location[len("s3://"):].partition("/")
+    if not bucket or not key:
+        raise ValueError(f"Invalid {variable_name}: {location}")
+
+    return s3_store_class(s3_client, bucket, key)
@@ -0,0 +1,183 @@
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# License:
+# This sample code is made available under the MIT-0 license. See the LICENSE file.
+import logging
+import os
+import posixpath
+import re
+import shutil
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Match, Optional, Tuple, Union
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+import zipfile
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.utils.cell import column_index_from_string, get_column_letter
+from openpyxl.utils.exceptions import IllegalCharacterError
+
+_logger = logging.getLogger("inventory.streaming_workbook")
+_logger.setLevel(getattr(logging, os.environ.get("LOG_LEVEL", "INFO"), logging.INFO))
+
+_SPREADSHEET_NAMESPACE = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_RELATIONSHIP_NAMESPACE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_PACKAGE_RELATIONSHIP_NAMESPACE = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+_SHEET_DATA_RE = re.compile(r"<sheetData\s*/>|<sheetData\b[^>]*>(.*?)</sheetData>", re.DOTALL)
+_DIMENSION_RE = re.compile(r'<dimension\s+ref="([^"]*)"\s*/>')
+_ROW_RE = re.compile(r"<row\b[^>]*?(?:/>|>.*?</row>)", re.DOTALL)
+_ROW_OPEN_TAG_RE = re.compile(r"<row\b[^>]*?(/?)>")
+_CELL_RE = re.compile(r"<c\b[^>]*?(?:/>|>.*?</c>)", re.DOTALL)
+_ROW_NUMBER_RE = re.compile(r'\br="(\d+)"')
+_CELL_REFERENCE_RE = re.compile(r'\br="([A-Z]+)\d+"')
+_CELL_STYLE_RE = re.compile(r'\bs="(\d+)"')
+
+# Row values are supplied as (column number, value) pairs
+RowValues = Iterable[Tuple[int, object]]
+
+def _expect_match(match: Optional[Match[str]], description: str) -> Match[str]:
+    # The template is parsed with regular expressions, so anything they do not recognise is reported rather than guessed at
+    if match is None:
+        raise ValueError(f"unexpected workbook template structure: {description}")
+
+    return match
+
+class StreamingTemplateWorkbook():
+    """
+    Writes rows into a worksheet of an xlsx template without loading the workbook into openpyxl.
+
+    Every part of the template other than the target worksheet is copied as-is. The worksheet XML is rewritten
+    as it is streamed into the output archive: rows above the first writeable row are kept verbatim, data rows
+    keep the style of the template cell they replace, and any template rows after the data are kept. Memory use
+    therefore depends on the size of the template rather than the number of rows written.
+    """
+    def __init__(self, template_file_name: str, worksheet_name: str):
+        self._template_file_name = template_file_name
+        self._worksheet_name = worksheet_name
+
+    def _get_worksheet_part_name(self, template: zipfile.ZipFile) -> str:
+        workbook = ElementTree.fromstring(template.read("xl/workbook.xml"))
+        relationships = ElementTree.fromstring(template.read("xl/_rels/workbook.xml.rels"))
+
+        sheet = next((sheet for sheet in workbook.iter(f"{{{_SPREADSHEET_NAMESPACE}}}sheet") if sheet.get("name") == self._worksheet_name), None)
+        if sheet is None:
+            raise ValueError(f"Worksheet '{self._worksheet_name}' not found in template")
+
+        relationship_id = sheet.get(f"{{{_RELATIONSHIP_NAMESPACE}}}id")
+        target = next((relationship.get("Target") for relationship in relationships.iter(f"{{{_PACKAGE_RELATIONSHIP_NAMESPACE}}}Relationship")
+                       if relationship.get("Id") == relationship_id), None)
+        if target is None:
+            raise ValueError(f"unexpected workbook template structure: no relationship target for worksheet '{self._worksheet_name}'")
+
+        return target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join("xl", target))
+
+    def _write_value_cell(self, column: int, row_number: int, value: object, style: Optional[str]) -> str:
+        style_attribute = f' s="{style}"' if style is not None else ""
+        reference = f"{get_column_letter(column)}{row_number}"
+
+        if value is None:
+            return f'<c r="{reference}"{style_attribute}/>'
+        if isinstance(value, bool):
+            return f'<c r="{reference}"{style_attribute} t="b"><v>{int(value)}</v></c>'
+        if isinstance(value, (int, float)):
+            return f'<c r="{reference}"{style_attribute}><v>{value}</v></c>'
+
+        value = str(value)
+        if ILLEGAL_CHARACTERS_RE.search(value):
+            raise IllegalCharacterError(f"{value} cannot be used in worksheets.")
+
+        space_attribute = ' xml:space="preserve"' if value != value.strip() else ""
+        return f'<c r="{reference}"{style_attribute} t="inlineStr"><is><t{space_attribute}>{escape(value)}</t></is></c>'
+
+    def _merge_row(self, row_number: int, template_row: Optional[str], values: Dict[int, object]) -> str:
+        if template_row is None:
+            cells = "".join(self._write_value_cell(column, row_number, values[column], None) for column in sorted(values) if values[column] is not None)
+            return f'<row r="{row_number}">{cells}</row>'
+
+        open_tag_match = _expect_match(_ROW_OPEN_TAG_RE.match(template_row), f"row {row_number} has no row element")
+        open_tag = open_tag_match.group(0)
+        if open_tag_match.group(1):
+            open_tag = open_tag[:-2].rstrip() + ">"
+
+        merged_cells: List[Tuple[int, str]] = []
+        for cell in _CELL_RE.findall(template_row):
+            column = column_index_from_string(_expect_match(_CELL_REFERENCE_RE.search(cell), f"cell without a reference in row {row_number}").group(1))
+            if column in values:
+                style_match = _CELL_STYLE_RE.search(cell.split(">", 1)[0])
+                merged_cells.append((column, self._write_value_cell(column, row_number, values.pop(column), style_match.group(1) if style_match else None)))
+            else:
+                merged_cells.append((column, cell))
+
+        merged_cells.extend((column, self._write_value_cell(column, row_number, value, None)) for column, value in values.items() if value is not None)
+        merged_cells.sort(key=lambda merged_cell: merged_cell[0])
+
+        return f'{open_tag}{"".join(cell for _, cell in merged_cells)}</row>'
+
+    def _iter_sheet_data(self, template_rows: List[Tuple[int, str]], first_row_number: int, rows: Iterable[RowValues]) -> Iterator[str]:
+        template_row_index = 0
+        row_number = first_row_number
+
+        for row in rows:
+            while template_row_index < len(template_rows) and template_rows[template_row_index][0] < row_number:
+                yield template_rows[template_row_index][1]
+                template_row_index += 1
+
+            template_row = None
+            if template_row_index < len(template_rows) and template_rows[template_row_index][0] == row_number:
+                template_row = template_rows[template_row_index][1]
+                template_row_index += 1
+
+            # Empty values are kept, they clear the template's guidance and example values from the cells of the row
+            values = dict(row)
+            if template_row is not None or any(value is not None for value in values.values()):
+                yield self._merge_row(row_number, template_row, values)
+
+            row_number += 1
+
+        for _, template_row in template_rows[template_row_index:]:
+            yield template_row
+
+    def save(self, output_file_name: Union[str, BinaryIO], first_row_number: int, rows: Iterable[RowValues]) -> int:
+        """
+        Writes the rows to the worksheet starting at first_row_number and returns the number of rows written.
+        output_file_name can also be a writable file object, which does not need to be seekable.
+        """
+        row_count = 0
+
+        def count_rows() -> Iterator[RowValues]:
+            nonlocal row_count
+            for row in rows:
+                row_count += 1
+                yield row
+
+        with zipfile.ZipFile(self._template_file_name) as template, \
+             zipfile.ZipFile(output_file_name, "w", compression=zipfile.ZIP_DEFLATED) as output:
+            worksheet_part_name = self._get_worksheet_part_name(template)
+
+            for item in template.infolist():
+                if item.filename == worksheet_part_name:
+                    continue
+                with template.open(item) as source, output.open(item, "w") as target:
+                    shutil.copyfileobj(source, target)
+
+            worksheet_xml = template.read(worksheet_part_name).decode("utf-8")
+            sheet_data_match = _SHEET_DATA_RE.search(worksheet_xml)
+            if sheet_data_match is None:
+                raise ValueError(f"Worksheet '{self._worksheet_name}' in template has no sheetData")
+
+            template_rows = [(int(_expect_match(_ROW_NUMBER_RE.search(row), f"row without a number in worksheet '{self._worksheet_name}'").group(1)), row)
+                             for row in _ROW_RE.findall(sheet_data_match.group(1) or "")]
+            # The used range is not known until every row has been streamed, so the optional dimension element is
+            # dropped rather than written with a stale value. Excel and openpyxl recalculate it on load.
+            prefix = _DIMENSION_RE.sub("", worksheet_xml[:sheet_data_match.start()], count=1)
+            suffix = worksheet_xml[sheet_data_match.end():]
+
+            with output.open(worksheet_part_name, "w", force_zip64=True) as target:
+                target.write(prefix.encode("utf-8"))
+                target.write(b"<sheetData>")
+                for row_xml in self._iter_sheet_data(template_rows, first_row_number, count_rows()):
+                    target.write(row_xml.encode("utf-8"))
+                target.write(b"</sheetData>")
+                target.write(suffix.encode("utf-8"))
+
+        _logger.info("completed streaming %s rows into worksheet %s", row_count, self._worksheet_name)
+
+        return row_count
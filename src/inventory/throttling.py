@@ -0,0 +1,322 @@
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# License:
+# This sample code is made available under the MIT-0 license. See the LICENSE file.
+import logging
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, Hashable, Optional, Tuple, TypeVar
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectionError as BotocoreConnectionError, HTTPClientError
+
+_logger = logging.getLogger("inventory.throttling")
+_logger.setLevel(getattr(logging, os.environ.get("LOG_LEVEL", "INFO"), logging.INFO))
+
+DEFAULT_API_REQUESTS_PER_SECOND = 50.0
+DEFAULT_ACCOUNT_REQUESTS_PER_SECOND = 10.0
+DEFAULT_RETRY_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_BASE_DELAY_SECONDS = 0.5
+DEFAULT_RETRY_MAX_DELAY_SECONDS = 20.0
+# A throttled bucket never drops below this share of its configured rate
+MIN_RATE_FACTOR = 0.1
+# Share of the configured rate a bucket recovers with every successful request after being throttled
+RATE_RECOVERY_FACTOR = 0.05
+# For clients wrapped in RetryingClient, so that only RetryPolicy retries and backs off
+NO_SDK_RETRIES_CONFIG = Config(retries={ "total_max_attempts": 1 })
+
+THROTTLING_ERROR_CODES = frozenset(["Throttling", "ThrottlingException", "ThrottledException", "RequestThrottled", "RequestThrottledException",
+                                    "TooManyRequestsException", "RequestLimitExceeded", "ProvisionedThroughputExceededException", "SlowDown",
+                                    "BandwidthLimitExceeded", "PriorRequestNotComplete", "EC2ThrottledException"])
+TRANSIENT_ERROR_CODES = frozenset(["InternalError", "InternalFailure", "InternalServerError", "ServiceUnavailable", "ServiceUnavailableException",
+                                   "RequestTimeout", "RequestTimeoutException", "IDPCommunicationError"])
+
+T = TypeVar("T")
+
+def _get_float_from_environment(variable_name: str, default: float) -> float:
+    try:
+        value = float(os.environ.get(variable_name, default))
+    except ValueError:
+        raise ValueError(f"{variable_name} must be a number")
+
+    if value < 0:
+        raise ValueError(f"{variable_name} must not be negative")
+
+    return value
+
+def get_error_code(ex: ClientError) -> str:
+    return ex.response.get("Error", {}).get("Code", "")
+
+def is_throttling_error(ex: Exception) -> bool:
+    return isinstance(ex, ClientError) and get_error_code(ex) in THROTTLING_ERROR_CODES
+
+def is_retryable_error(ex: Exception) -> bool:
+    """Throttling, server side and connection errors are retried, anything else, e.g. AccessDenied, is not."""
+    if isinstance(ex, (BotocoreConnectionError, HTTPClientError)):
+        return True
+    if not isinstance(ex, ClientError):
+        return False
+
+    return (get_error_code(ex) in THROTTLING_ERROR_CODES or get_error_code(ex) in TRANSIENT_ERROR_CODES
+            or ex.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0) >= 500)
+
+class TokenBucket():
+    """
+    Allows requests_per_second on average with bursts of up to capacity requests. The rate is halved whenever a
+    request is throttled and recovers gradually as requests succeed, so callers back off from a limit they share
+    with other clients of the same account.
+    """
+    def __init__(self, requests_per_second: float, capacity: Optional[float] = None, clock: Callable[[], float] = time.monotonic):
+        self._max_rate = requests_per_second
+        self._rate = requests_per_second
+        self._capacity = capacity if capacity is not None else max(requests_per_second, 1.0)
+        self._tokens = self._capacity
+        self._clock = clock
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated_at) * self._rate)
+        self._updated_at = now
+
+    def reserve(self) -> float:
+        """Takes a token, returning how many seconds the caller has to wait before using it."""
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+
+            return -self._tokens / self._rate if self._tokens < 0 else 0.0
+
+    def on_throttled(self):
+        with self._lock:
+            self._refill()
+            self._rate = max(self._max_rate * MIN_RATE_FACTOR, self._rate / 2)
+
+    def on_success(self):
+        if self._rate >= self._max_rate:
+            return
+
+        with self._lock:
+            self._refill()
+            self._rate = min(self._max_rate, self._rate + self._max_rate * RATE_RECOVERY_FACTOR)
+
+class RateLimiter():
+    """
+    Token buckets per API, shared by all accounts, and per API, account and region. API limits such as the STS
+    AssumeRole quota apply to the account the function runs in, while Config quotas apply to each account and region
+    being read, so throttling in one region does not slow down the others. A rate of 0 disables the corresponding buckets.
+    """
+    def __init__(self, api_requests_per_second: float = DEFAULT_API_REQUESTS_PER_SECOND,
+                 account_requests_per_second: float = DEFAULT_ACCOUNT_REQUESTS_PER_SECOND,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        self._api_requests_per_second = api_requests_per_second
+        self._account_requests_per_second = account_requests_per_second
+        self._clock = clock
+        self._sleep = sleep
+        self._buckets: Dict[Hashable, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def _get_bucket(self, key: Hashable, requests_per_second: float) -> Optional[TokenBucket]:
+        if requests_per_second <= 0:
+            return None
+
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(requests_per_second, clock=self._clock)
+
+            return bucket
+
+    def _get_buckets(self, api: str, account_id: Optional[str], region_name: Optional[str]) -> Tuple[TokenBucket, ...]:
+        buckets = [self._get_bucket(("api", api), self._api_requests_per_second)]
+        if account_id is not None:
+            buckets.append(self._get_bucket(("account", api, account_id, region_name), self._account_requests_per_second))
+
+        return tuple(bucket for bucket in buckets if bucket is not None)
+
+    def acquire(self, api: str, account_id: Optional[str] = None, region_name: Optional[str] = None) -> float:
+        """Waits until a request to api for account_id in region_name is allowed, returning the seconds waited."""
+        wait_seconds = max([bucket.reserve() for bucket in self._get_buckets(api, account_id, region_name)], default=0.0)
+        if wait_seconds > 0:
+            self._sleep(wait_seconds)
+
+        return wait_seconds
+
+    def on_throttled(self, api: str, account_id: Optional[str] = None, region_name: Optional[str] = None):
+        for bucket in self._get_buckets(api, account_id, region_name):
+            bucket.on_throttled()
+
+    def on_success(self, api: str, account_id: Optional[str] = None, region_name: Optional[str] = None):
+        for bucket in self._get_buckets(api, account_id, region_name):
+            bucket.on_success()
+
+def get_rate_limiter_from_environment() -> RateLimiter:
+    return RateLimiter(_get_float_from_environment("API_REQUESTS_PER_SECOND", DEFAULT_API_REQUESTS_PER_SECOND),
+                       _get_float_from_environment("ACCOUNT_REQUESTS_PER_SECOND", DEFAULT_ACCOUNT_REQUESTS_PER_SECOND))
+
+class RetryStats():
+    """Counts requests, retries and the time spent waiting on the rate limiter and backing off, across threads."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.sdk_retries = 0
+        self.failures = 0
+        self.backoff_seconds = 0.0
+        self.rate_limited_seconds = 0.0
+        self.retries_by_api: Dict[str, int] = {}
+
+    def record_request(self, rate_limited_seconds: float):
+        with self._lock:
+            self.requests += 1
+            self.rate_limited_seconds += rate_limited_seconds
+
+    def record_sdk_retries(self, response_metadata: Optional[dict]):
+        # Clients created with NO_SDK_RETRIES_CONFIG leave retries to RetryPolicy, others report botocore's own retries here
+        retry_attempts = (response_metadata or {}).get("RetryAttempts", 0) if isinstance(response_metadata, dict) else 0
+        if isinstance(retry_attempts, int) and retry_attempts > 0:
+            with self._lock:
+                self.sdk_retries += retry_attempts
+
+    def record_retry(self, api: str, throttled: bool, backoff_seconds: float):
+        with self._lock:
+            self.retries += 1
+            self.throttled += int(throttled)
+            self.backoff_seconds += backoff_seconds
+            self.retries_by_api[api] = self.retries_by_api.get(api, 0) + 1
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return { "requests": self.requests,
+                     "retries": self.retries,
+                     "throttled": self.throttled,
+                     "sdk_retries": self.sdk_retries,
+                     "failures": self.failures,
+                     "backoff_seconds": round(self.backoff_seconds, 3),
+                     "rate_limited_seconds": round(self.rate_limited_seconds, 3),
+                     "retries_by_api": dict(self.retries_by_api) }
+
+class RetryPolicy():
+    """
+    Rate limits requests and retries throttling and transient errors with exponential backoff and full jitter, i.e.
+    a random delay of up to base_delay_seconds * 2 ** retry, capped at max_delay_seconds.
+    """
+    def __init__(self, rate_limiter: Optional[RateLimiter] = None, max_attempts: int = DEFAULT_RETRY_MAX_ATTEMPTS,
+                 base_delay_seconds: float = DEFAULT_RETRY_BASE_DELAY_SECONDS, max_delay_seconds: float = DEFAULT_RETRY_MAX_DELAY_SECONDS,
+                 sleep: Callable[[float], None] = time.sleep, random_fraction: Callable[[], float] = random.random):
+        if max_attempts < 1:
+            raise ValueError("RETRY_MAX_ATTEMPTS must be at least 1")
+
+        self._rate_limiter = rate_limiter
+        self._max_attempts = max_attempts
+        self._base_delay_seconds = base_delay_seconds
+        self._max_delay_seconds = max_delay_seconds
+        self._sleep = sleep
+        self._random_fraction = random_fraction
+
+    def get_backoff_seconds(self, retry: int) -> float:
+        return self._random_fraction() * min(self._max_delay_seconds, self._base_delay_seconds * 2 ** retry)
+
+    def call(self, api: str, request: Callable[[], T], account_id: Optional[str] = None, stats: Optional[RetryStats] = None,
+             region_name: Optional[str] = None) -> T:
+        """
+        Makes request, an API call to api for account_id in region_name, retrying it until it succeeds or max_attempts
+        is reached.
+        """
+        attempt = 0
+        while True:
+            rate_limited_seconds = self._rate_limiter.acquire(api, account_id, region_name) if self._rate_limiter is not None else 0.0
+            if stats is not None:
+                stats.record_request(rate_limited_seconds)
+
+            try:
+                response = request()
+            except Exception as ex:
+                if stats is not None and isinstance(ex, ClientError):
+                    stats.record_sdk_retries(ex.response.get("ResponseMetadata"))
+
+                throttled = is_throttling_error(ex)
+                if throttled and self._rate_limiter is not None:
+                    self._rate_limiter.on_throttled(api, account_id, region_name)
+
+                if not is_retryable_error(ex) or attempt + 1 == self._max_attempts:
+                    if stats is not None:
+                        stats.record_failure()
+                    raise
+
+                backoff_seconds = self.get_backoff_seconds(attempt)
+                _logger.warning("%s for %s failed with %s, retrying in %.2f seconds (attempt %s of %s)", api, account_id or "the function's account",
+                                ex, backoff_seconds, attempt + 2, self._max_attempts)
+                if stats is not None:
+                    stats.record_retry(api, throttled, backoff_seconds)
+
+                self._sleep(backoff_seconds)
+                attempt += 1
+                continue
+
+            if self._rate_limiter is not None:
+                self._rate_limiter.on_success(api, account_id, region_name)
+            if stats is not None and isinstance(response, dict):
+                stats.record_sdk_retries(response.get("ResponseMetadata"))
+
+            return response
+
+def get_retry_policy_from_environment() -> RetryPolicy:
+    try:
+        max_attempts = int(os.environ.get("RETRY_MAX_ATTEMPTS", DEFAULT_RETRY_MAX_ATTEMPTS))
+    except ValueError:
+        raise ValueError("RETRY_MAX_ATTEMPTS must be a valid integer")
+
+    return RetryPolicy(get_rate_limiter_from_environment(), max_attempts,
+                       _get_float_from_environment("RETRY_BASE_DELAY_SECONDS", DEFAULT_RETRY_BASE_DELAY_SECONDS),
+                       _get_float_from_environment("RETRY_MAX_DELAY_SECONDS", DEFAULT_RETRY_MAX_DELAY_SECONDS))
+
+# Held at module scope so concurrent collection workers, and both readers, draw on the same buckets
+_retry_policy: Optional[RetryPolicy] = None
+_retry_policy_lock = threading.Lock()
+
+def get_retry_policy() -> RetryPolicy:
+    global _retry_policy
+
+    with _retry_policy_lock:
+        if _retry_policy is None:
+            _retry_policy = get_retry_policy_from_environment()
+
+        return _retry_policy
+
+class RetryingClient():
+    """
+    Wraps a boto3 client so every API call made through it goes through the retry policy. The client should be created
+    with NO_SDK_RETRIES_CONFIG so botocore's retries do not compound with the policy's.
+    """
+    def __init__(self, client, retry_policy: RetryPolicy, stats: Optional[RetryStats] = None, account_id: Optional[str] = None,
+                 region_name: Optional[str] = None):
+        self._client = client
+        self._retry_policy = retry_policy
+        self._stats = stats
+        self._account_id = account_id
+        self._region_name = region_name
+
+    @property
+    def client(self):
+        return self._client
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._client, name)
+        if not callable(attribute):
+            return attribute
+
+        def call_with_retry(*args, **kwargs):
+            return self._retry_policy.call(name, lambda: attribute(*args, **kwargs), self._account_id, self._stats, self._region_name)
+
+        return call_with_retry
@@ -0,0 +1,192 @@
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# License:
+# This sample code is made available under the MIT-0 license. See the LICENSE file.
+import gzip
+import io
+import logging
+import os
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import IO, Deque, Iterator, List, Optional, Union
+
+_logger = logging.getLogger("inventory.uploads")
+_logger.setLevel(getattr(logging, os.environ.get("LOG_LEVEL", "INFO"), logging.INFO))
+
+# S3 rejects multipart uploads with parts, other than the last, smaller than 5 MiB
+MIN_PART_SIZE_BYTES = 5 * 1024 * 1024
+DEFAULT_PART_SIZE_BYTES = 8 * 1024 * 1024
+DEFAULT_UPLOAD_MAX_WORKERS = 4
+# S3 allows at most 10,000 parts per upload
+MAX_PART_COUNT = 10000
+
+COMPRESSION_NONE = "none"
+COMPRESSION_GZIP = "gzip"
+COMPRESSION_ZIP = "zip"
+COMPRESSIONS = (COMPRESSION_NONE, COMPRESSION_GZIP, COMPRESSION_ZIP)
+COMPRESSION_EXTENSIONS = { COMPRESSION_NONE: "", COMPRESSION_GZIP: ".gz", COMPRESSION_ZIP: ".zip" }
+
+# Reports are written to open files, the upload stream and the gzip and zip writers alike
+BinaryOutput = Union[IO[bytes], io.RawIOBase, io.BufferedIOBase]
+
+def get_part_size_from_environment() -> int:
+    try:
+        part_size_mb = int(os.environ.get("REPORT_UPLOAD_PART_SIZE_MB", DEFAULT_PART_SIZE_BYTES // (1024 * 1024)))
+    except ValueError:
+        raise ValueError("REPORT_UPLOAD_PART_SIZE_MB must be a valid integer")
+
+    if part_size_mb * 1024 * 1024 < MIN_PART_SIZE_BYTES:
+        raise ValueError(f"REPORT_UPLOAD_PART_SIZE_MB must be at least {MIN_PART_SIZE_BYTES // (1024 * 1024)}")
+
+    return part_size_mb * 1024 * 1024
+
+class S3MultipartUploadStream(io.RawIOBase):
+    """
+    Write-only, unseekable file object that uploads what is written to it to an S3 object as it is written.
+
+    Writes are buffered into parts of part_size bytes, which are uploaded on a pool of max_workers threads while
+    writing carries on. Writing blocks once max_workers parts are in flight, so at most max_workers + 1 parts are
+    held in memory however large the object is. An object that fits in a single part is sent with one put_object
+    instead. Closing the stream completes the upload. If writing fails, abort discards the parts uploaded so far.
+
+    zipfile can write to unseekable streams, so workbooks can be saved straight into the stream.
+    """
+    def __init__(self, s3_client, bucket: str, key: str, part_size: int = DEFAULT_PART_SIZE_BYTES, max_workers: int = DEFAULT_UPLOAD_MAX_WORKERS,
+                 extra_args: Optional[dict] = None):
+        super().__init__()
+        self._s3_client = s3_client
+        self._bucket = bucket
+        self._key = key
+        self._part_size = part_size
+        self._max_workers = max_workers
+        self._extra_args = extra_args or {}
+        self._buffer = bytearray()
+        self._position = 0
+        self._upload_id: Optional[str] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending: Deque[Future] = deque()
+        self._parts: List[dict] = []
+        self._part_count = 0
+
+        # Checked once every attribute is set, since __del__ runs even when __init__ raises
+        if part_size < MIN_PART_SIZE_BYTES:
+            raise ValueError(f"part_size must be at least {MIN_PART_SIZE_BYTES} bytes")
+
+    @property
+    def location(self) -> str:
+        return f"s3://{self._bucket}/{self._key}"
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError("write to closed upload stream")
+
+        self._buffer += data
+        self._position += len(data)
+
+        while len(self._buffer) >= self._part_size:
+            part = bytes(self._buffer[:self._part_size])
+            del self._buffer[:self._part_size]
+            self._submit_part(part)
+
+        return len(data)
+
+    def _upload_part(self, part_number: int, part: bytes) -> dict:
+        response = self._s3_client.upload_part(Bucket=self._bucket, Key=self._key, UploadId=self._upload_id, PartNumber=part_number, Body=part)
+        return { "ETag": response["ETag"], "PartNumber": part_number }
+
+    def _submit_part(self, part: bytes):
+        if self._executor is None:
+            self._upload_id = self._s3_client.create_multipart_upload(Bucket=self._bucket, Key=self._key, **self._extra_args)["UploadId"]
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="inventory-upload")
+            _logger.info("started multipart upload of %s", self.location)
+
+        if self._part_count == MAX_PART_COUNT:
+            raise ValueError(f"{self.location} needs more than {MAX_PART_COUNT} parts, increase REPORT_UPLOAD_PART_SIZE_MB")
+
+        # Waiting for the oldest part bounds the number of parts held in memory, and surfaces failed parts early
+        if len(self._pending) >= self._max_workers:
+            self._parts.append(self._pending.popleft().result())
+
+        self._part_count += 1
+        self._pending.append(self._executor.submit(self._upload_part, self._part_count, part))
+
+    def close(self):
+        if self.closed:
+            return
+
+        try:
+            if self._upload_id is None:
+                self._s3_client.put_object(Bucket=self._bucket, Key=self._key, Body=bytes(self._buffer), **self._extra_args)
+            else:
+                if self._buffer:
+                    self._submit_part(bytes(self._buffer))
+                while self._pending:
+                    self._parts.append(self._pending.popleft().result())
+
+                self._s3_client.complete_multipart_upload(Bucket=self._bucket, Key=self._key, UploadId=self._upload_id,
+                                                          MultipartUpload={ "Parts": self._parts })
+                _logger.info("completed multipart upload of %s bytes in %s parts to %s", self._position, len(self._parts), self.location)
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self._buffer = bytearray()
+            self._shutdown()
+            super().close()
+
+    def abort(self):
+        """Discards everything written, including parts already uploaded, and closes the stream."""
+        self._buffer = bytearray()
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._shutdown()
+
+        if self._upload_id is not None:
+            _logger.warning("aborting multipart upload of %s", self.location)
+            self._s3_client.abort_multipart_upload(Bucket=self._bucket, Key=self._key, UploadId=self._upload_id)
+            self._upload_id = None
+
+        super().close()
+
+    def _shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def __del__(self):
+        # IOBase closes unclosed streams when they are collected, which would complete an upload that was abandoned
+        if not self.closed:
+            self.abort()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+@contextmanager
+def open_compressed(target: BinaryOutput, compression: str, member_name: str) -> Iterator[BinaryOutput]:
+    """
+    Yields a file object that compresses what is written to it into target, with gzip or as member_name of a zip
+    archive. Neither needs target to be seekable. With COMPRESSION_NONE target itself is yielded.
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Compression must be one of {', '.join(COMPRESSIONS)}, not {compression}")
+
+    if compression == COMPRESSION_GZIP:
+        with gzip.GzipFile(filename=member_name, mode="wb", fileobj=target, mtime=0) as compressed:
+            yield compressed
+    elif compression == COMPRESSION_ZIP:
+        with zipfile.ZipFile(target, "w", compression=zipfile.ZIP_DEFLATED) as archive, \
+             archive.open(member_name, "w", force_zip64=True) as compressed:
+            yield compressed
+    else:
+        yield target
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# AWS DISCLAMER
+# ---
+
+# The following files are provided by AWS Professional Services describe the process to create a IAM Policy with description.
+
+# These are non-production ready and are to be used for testing purposes.
+
+# These files is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations under the License.
+
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and Amazon Web Services, Inc.​
+import json
+import os
+import random
+import threading
+import time
+from unittest.mock import MagicMock, patch
+import pytest
+from botocore.exceptions import ClientError
+from inventory.aggregator_reader import MAX_BUFFERED_PAGES_PER_SHARD, AwsConfigAggregatorInventoryReader
+from inventory.throttling import RetryPolicy
+
+_RESOURCE_TYPES = ["AWS::DynamoDB::Table", "AWS::EFS::FileSystem"]
+
+class FakeAggregatorConfigClient():
+    """Answers GROUP BY queries from a fixed list of resources and filters resource queries on accountId/awsRegion."""
+    def __init__(self, resources, delay=False):
+        self.resources = resources
+        self.delay = delay
+        self.queries = []
+        self._lock = threading.Lock()
+
+    def select_aggregate_resource_config(self, Expression, ConfigurationAggregatorName, NextToken=None):
+        with self._lock:
+            self.queries.append(Expression)
+
+        if self.delay:
+            time.sleep(random.uniform(0, 0.02))
+
+        resource_types = [resource_type for resource_type in _RESOURCE_TYPES if f"'{resource_type}'" in Expression]
+        matching = [resource for resource in self.resources if resource["resourceType"] in resource_types
+                    and all(f"{field} = '{resource[field]}'" in Expression for field in ("accountId", "awsRegion") if f"{field} = " in Expression)]
+
+        if "GROUP BY" in Expression:
+            group_by = [field.strip() for field in Expression.split("GROUP BY")[1].split(",")]
+            groups = sorted({tuple(resource[field] for field in group_by) for resource in matching}, reverse=True)
+            return { "Results": [json.dumps(dict(zip(group_by, group))) for group in groups] }
+
+        # Two results per page to exercise pagination within a shard
+        start = int(NextToken or 0)
+        page = matching[start:start + 2]
+        result = { "Results": [json.dumps(dict(resource, tags=[], configuration={})) for resource in page] }
+        if start + 2 < len(matching):
+            result["NextToken"] = str(start + 2)
+
+        return result
+
+def _resources():
+    return [{ "arn": f"arn:{account_id}:{region}:{resource_type}:{index}", "resourceType": resource_type, "accountId": account_id, "awsRegion": region }
+            for resource_type in _RESOURCE_TYPES
+            for account_id in ["222222222222", "111111111111"]
+            for region in ["us-west-2", "us-east-1"]
+            for index in range(3)]
+
+def _get_reader(config_client, shard_by, max_workers=4):
+    return AwsConfigAggregatorInventoryReader(lambda_context=MagicMock(), config_client=config_client, include_resource_types=_RESOURCE_TYPES,
+                                              shard_by=shard_by, max_workers=max_workers, retry_policy=RetryPolicy(sleep=lambda seconds: None))
+
+@patch.dict(os.environ, {"CONFIG_AGGREGATOR_NAME": "aggregator"})
+def test_given_no_sharding_then_single_query_is_run():
+    config_client = FakeAggregatorConfigClient(_resources())
+
+    arns = list(_get_reader(config_client, shard_by=[]).iter_resource_arns())
+
+    assert len(arns) == len(_resources())
+    assert all("GROUP BY" not in query and " = '" not in query for query in config_client.queries)
+
+@patch.dict(os.environ, {"CONFIG_AGGREGATOR_NAME": "aggregator"})
+def test_given_deleted_resources_then_their_arns_are_not_listed():
+    resources = _resources()
+    resources[0] = dict(resources[0], configurationItemStatus="ResourceDeleted")
+    resources[1] = dict(resources[1], configurationItemStatus="ResourceDeletedNotRecorded")
+    config_client = FakeAggregatorConfigClient(resources)
+
+    arns = list(_get_reader(config_client, shard_by=[]).iter_resource_arns())
+
+    assert arns == [resource["arn"] for resource in resources[2:]]
+    assert all(query.startswith("SELECT arn, accountId, awsRegion, configurationItemStatus ") for query in config_client.queries)
+
+@patch.dict(os.environ, {"CONFIG_AGGREGATOR_NAME": "aggregator"})
+def test_given_shard_by_resource_type_then_one_query_per_resource_type_without_group_by():
+    config_client = FakeAggregatorConfigClient(_resources())
+
+    arns = list(_get_reader(config_client, shard_by=["resourceType"]).iter_resource_arns())
+
+    assert len(arns) == len(_resources())
+    assert not any("GROUP BY" in query for query in config_client.queries)
+    resource_types = [arn.split(":", 3)[3].rsplit(":", 1)[0] for arn in arns]
+    assert resource_types == sorted(resource_types, key=_RESOURCE_TYPES.index)
+
+@patch.dict(os.environ, {"CONFIG_AGGREGATOR_NAME": "aggregator"})
+def test_given_shard_by_account_and_region_then_each_shard_query_is_filtered():
+    config_client = FakeAggregatorConfigClient(_resources())
+
+    arns = list(_get_reader(config_client, shard_by=["accountId", "awsRegion"]).iter_resource_arns())
+
+    assert sorted(arns) == sorted(resource["arn"] for resource in _resources())
+    assert "SELECT accountId, awsRegion, COUNT(*)" in config_client.queries[0]
+    shard_queries = [query for query in config_client.queries if "GROUP BY" not in query]
+    assert "AND accountId = '111111111111' AND awsRegion = 'us-east-1'" in shard_queries[0]
+    assert {query.split("AND accountId")[1] for query in shard_queries} == \
+        {f" = '{account_id}' AND awsRegion = '{region}'" for account_id in ["111111111111", "222222222222"] for region in ["us-east-1", "us-west-2"]}
+
+@patch.dict(os.environ, {"CONFIG_AGGREGATOR_NAME": "aggregator"})
+def test_given_concurrent_shards_then_results_are_merged_in_stable_order():
+    expected = list(_get_reader(FakeAggregatorConfigClient(_resources()), shard_by=["resourceType", "accountId", "awsRegion"], max_workers=1).iter_resource_arns())
+
+    for _ in range(3):
+        config_client = FakeAggregatorConfigClient(_resources(), delay=True)
+
+        assert list(_get_reader(config_client, shard_by=["resourceType", "accountId", "awsRegion"]).iter_resource_arns()) == expected
+
+    # Shards are ordered by resource type, then account, then region
+    assert expected[0].startswith("arn:111111111111:us-east-1:AWS::DynamoDB::Table")
+    assert expected[-1].startswith("arn:222222222222:us-west-2:AWS::EFS::FileSystem")
+
+@patch.dict(os.environ, {"CONFIG_AGGREGATOR_NAME": "aggregator"})
+def test_given_concurrent_shards_then_only_a_few_pages_per_shard_are_fetched_ahead_of_the_rows_consumed():
+    # 20 pages of two resources in each of the eight shards
+    resources = [dict(resource, arn=f"{resource['arn']}:{index}") for resource in _resources() for index in range(10)]
+    config_client = FakeAggregatorConfigClient(resources)
+    max_workers = 4
+    max_pages_ahead = 0
+
+    reader = _get_reader(config_client, shard_by=["accountId", "awsRegion"], max_workers=max_workers)
+    for row_count, _ in enumerate(reader.iter_resources_from_all_accounts(), start=1):
+        # Gives the shard threads time to fetch as far ahead as they are allowed to
+        time.sleep(0.002)
+        pages_fetched = len([query for query in config_client.queries if "GROUP BY" not in query])
+        max_pages_ahead = max(max_pages_ahead, pages_fetched - row_count // 2)
+
+    assert row_count == len(resources)
+    # Every worker can hold a full queue, a page it is waiting to add to it and the page being consumed
+    assert max_pages_ahead <= max_workers * (MAX_BUFFERED_PAGES_PER_SHARD + 2)
+
+@patch.dict(os.environ, {"CONFIG_AGGREGATOR_NAME": "aggregator"})
+def test_given_shard_query_fails_then_error_is_raised_and_other_shards_are_stopped():
+    config_client = FakeAggregatorConfigClient([dict(resource, arn=f"{resource['arn']}:{index}") for resource in _resources() for index in range(10)])
+    select_aggregate_resource_config = config_client.select_aggregate_resource_config
+
+    def fail_for_one_shard(Expression, **kwargs):
+        if "accountId = '111111111111' AND awsRegion = 'us-west-2'" in Expression:
+            raise ClientError(error_response={'Error': {'Code': 'AccessDeniedException'}}, operation_name="select_aggregate_resource_config")
+        return select_aggregate_resource_config(Expression, **kwargs)
+
+    config_client.select_aggregate_resource_config = fail_for_one_shard
+
+    with pytest.raises(ClientError):
+        list(_get_reader(config_client, shard_by=["accountId", "awsRegion"]).iter_resources_from_all_accounts())
+
+@patch.dict(os.environ, {"CONFIG_AGGREGATOR_NAME": "aggregator"})
+def test_given_sharded_mapped_resources_then_captured_after_is_kept_in_every_shard_query():
+    config_client = FakeAggregatorConfigClient(_resources())
+
+    list(_get_reader(config_client, shard_by=["accountId"]).iter_mapped_resources(captured_after="2024-01-01T00:00:00Z"))
+
+    shard_queries = [query for query in config_client.queries if "GROUP BY" not in query]
+    assert shard_queries
+    assert all("configurationItemCaptureTime >= '2024-01-01T00:00:00Z'" in query and "accountId = '" in query for query in shard_queries)
+
+@patch.dict(os.environ, {"CONFIG_AGGREGATOR_NAME": "aggregator"})
+def test_given_error_in_shard_then_error_is_raised():
+    config_client = FakeAggregatorConfigClient(_resources())
+    select = config_client.select_aggregate_resource_config
+
+    def failing_select(Expression, ConfigurationAggregatorName, NextToken=None):
+        if "accountId = '222222222222'" in Expression:
+            raise ClientError({ "Error": { "Code": "ThrottlingException" } }, "SelectAggregateResourceConfig")
+        return select(Expression, ConfigurationAggregatorName, NextToken)
+
+    config_client.select_aggregate_resource_config = failing_select
+
+    with pytest.raises(ClientError):
+        list(_get_reader(config_client, shard_by=["accountId"]).iter_resource_arns())
+
+@patch.dict(os.environ, {"CONFIG_AGGREGATOR_NAME": "aggregator"})
+def test_given_transient_error_in_shard_then_query_is_retried():
+    config_client = FakeAggregatorConfigClient(_resources())
+    select = config_client.select_aggregate_resource_config
+    errors = [ ClientError({ "Error": { "Code": "ServiceUnavailable" } }, "SelectAggregateResourceConfig") ]
+
+    def flaky_select(Expression, ConfigurationAggregatorName, NextToken=None):
+        if "accountId = '222222222222'" in Expression and errors:
+            raise errors.pop()
+        return select(Expression, ConfigurationAggregatorName, NextToken)
+
+    config_client.select_aggregate_resource_config = flaky_select
+    reader = _get_reader(config_client, shard_by=["accountId"])
+
+    assert sorted(reader.iter_resource_arns()) == sorted(resource["arn"] for resource in _resources())
+    assert reader.retry_stats.retries == 1
+    assert reader.retry_stats.throttled == 0
+
+@patch.dict(os.environ, {"CONFIG_AGGREGATOR_NAME": "aggregator"})
+def test_given_resource_locations_then_account_and_region_are_listed_with_each_arn():
+    locations = list(_get_reader(FakeAggregatorConfigClient(_resources()), shard_by=[]).iter_resource_locations())
+
+    assert sorted(locations) == sorted((resource["arn"], resource["accountId"], resource["awsRegion"]) for resource in _resources())
+
+@patch.dict(os.environ, {"CONFIG_AGGREGATOR_NAME": "aggregator"})
+def test_given_arns_then_they_are_only_queried_in_their_account_and_region_without_sharding():
+    config_client = FakeAggregatorConfigClient(_resources())
+    reader = _get_reader(config_client, shard_by=["resourceType", "accountId", "awsRegion"])
+
+    list(reader.iter_mapped_resources(arns={ ("111111111111", "us-east-1"): [ "arn:1" ], ("222222222222", "us-west-2"): [ "arn:2", "arn:3" ] }))
+
+    assert not any("GROUP BY" in query for query in config_client.queries)
+    assert sorted({ (query.split("accountId = ")[1][1:13], query.split("arn IN ")[1]) for query in config_client.queries }) == \
+        [ ("111111111111", "('arn:1')"), ("222222222222", "('arn:2', 'arn:3')") ]
+    assert all("awsRegion = 'us-east-1'" in query for query in config_client.queries if "111111111111" in query)
+
+@patch.dict(os.environ, {"AGGREGATOR_SHARD_BY": "resourceType,availabilityZone"})
+def test_given_unsupported_shard_dimension_then_error_is_raised():
+    with pytest.raises(ValueError):
+        AwsConfigAggregatorInventoryReader(lambda_context=MagicMock(), config_client=MagicMock(), include_resource_types=_RESOURCE_TYPES)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# AWS DISCLAMER
+# ---
+
+# The following files are provided by AWS Professional Services describe the process to create a IAM Policy with description.
+
+# These are non-production ready and are to be used for testing purposes.
+
+# These files is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations under the License.
+
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and Amazon Web Services, Inc.​
+import json
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import benchmark_inventory
+
+def test_given_same_seed_then_same_resources_are_synthesized():
+    samples = benchmark_inventory.load_sample_resources(warn=False)
+    weights = benchmark_inventory.parse_resource_mix("AWS::EC2::Instance=3,AWS::DynamoDB::Table", samples)
+
+    results = benchmark_inventory.synthesize_results(50, weights, samples, seed=7)
+
+    assert results == benchmark_inventory.synthesize_results(50, weights, samples, seed=7)
+    assert { resource_type for resource_type, _ in results } == { "AWS::EC2::Instance", "AWS::DynamoDB::Table" }
+    assert len({ json.loads(raw_result)["arn"] for _, raw_result in results }) == 50
+
+def test_given_unknown_resource_type_in_mix_then_error_is_raised():
+    with pytest.raises(ValueError):
+        benchmark_inventory.parse_resource_mix("AWS::Foo::Bar=1", benchmark_inventory.load_sample_resources(warn=False))
+
+def test_given_small_run_then_every_stage_reports_results(tmp_path):
+    output_file_name = str(tmp_path / "results.json")
+
+    benchmark_inventory.main([ "--resources", "40", "--page-size", "7", "--accounts", "2", "--no-isolate", "--output", output_file_name ])
+
+    with open(output_file_name) as output_file:
+        results = json.load(output_file)
+
+    stages = { stage["stage"]: stage for stage in results["stages"] }
+    assert list(stages) == list(benchmark_inventory.STAGES)
+    assert stages["decode"]["rows"] == 40
+    # The reader must produce exactly the rows the mappers produce, regardless of pages and accounts
+    assert stages["reader"]["rows"] == stages["map"]["rows"] == stages["report"]["rows"]
+    assert all(stage["rows_per_second"] > 0 and stage["peak_rss_mb"] > 0 for stage in stages.values())
+
+def test_given_csv_report_format_then_report_stage_writes_every_row(tmp_path):
+    output_file_name = str(tmp_path / "results.json")
+
+    benchmark_inventory.main([ "--resources", "20", "--stages", "map,report", "--report-format", "csv", "--no-isolate", "--output", output_file_name ])
+
+    with open(output_file_name) as output_file:
+        results = json.load(output_file)
+
+    stages = { stage["stage"]: stage for stage in results["stages"] }
+    assert results["parameters"]["report_format"] == "csv"
+    assert stages["report"]["rows"] == stages["map"]["rows"]
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# AWS DISCLAMER
+# ---
+
+# The following files are provided by AWS Professional Services describe the process to create a IAM Policy with description.
+
+# These are non-production ready and are to be used for testing purposes.
+
+# These files is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations under the License.
+
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and Amazon Web Services, Inc.​
+import json
+import os
+from unittest.mock import Mock, patch
+import pytest
+from inventory.aggregator_reader import AwsConfigAggregatorInventoryReader
+from inventory.checkpoints import CheckpointInventory, CollectionPosition, DeadlineAwareCollector, LocalCheckpointStore, reinvoke_function
+from inventory.handler import lambda_handler
+from inventory.mappers import DataMapper, InventoryData
+from inventory.readers import AwsConfigInventoryReader
+from inventory.sessions import ClientCache
+
+_ACCOUNT_LIST = '[ { "name": "foo", "id": "111111111111" }, { "name": "bar", "id": "222222222222" } ]'
+
+class FakeConfigClient():
+    """Returns the ARNs of a fixed number of resources, two per page."""
+    def __init__(self, name, resource_count=5):
+        self._arns = [ f"arn:{name}:{index}" for index in range(resource_count) ]
+
+    def _get_page(self, next_token):
+        start = int(next_token or 0)
+        response = { "Results": [ json.dumps({ "resourceType": "foobar", "arn": arn }) for arn in self._arns[start:start + 2] ] }
+        if start + 2 < len(self._arns):
+            response["NextToken"] = str(start + 2)
+        return response
+
+    def select_resource_config(self, Expression, NextToken):
+        return self._get_page(NextToken)
+
+    def select_aggregate_resource_config(self, Expression, ConfigurationAggregatorName, NextToken=None):
+        return self._get_page(NextToken)
+
+class FakeLambdaContext():
+    """Has remaining_seconds left until the first page has been collected, then a second less for every page."""
+    invoked_function_arn = "arn:aws:lambda:us-east-1:123456789012:function:testing"
+
+    def __init__(self, remaining_seconds_per_call):
+        self._remaining_seconds_per_call = list(remaining_seconds_per_call)
+
+    def get_remaining_time_in_millis(self):
+        return (self._remaining_seconds_per_call.pop(0) if len(self._remaining_seconds_per_call) > 1 else self._remaining_seconds_per_call[0]) * 1000
+
+def _mapper():
+    mapper = Mock(spec=DataMapper)
+    mapper._get_supported_resource_type.return_value = [ "foobar" ]
+    mapper._get_configuration_paths.return_value = None
+    mapper._map_resource.side_effect = lambda resource: [ InventoryData(unique_id=resource["arn"]) ]
+    return mapper
+
+def _reader():
+    sts_client = Mock()
+    sts_client.assume_role.side_effect = lambda RoleArn, **kwargs: RoleArn.split(":")[4]
+    reader = AwsConfigInventoryReader(lambda_context=FakeLambdaContext([ 900 ]), sts_client=sts_client, mappers=[ _mapper() ], client_cache=ClientCache())
+    reader._get_config_client = lambda sts_response, region_name=None: FakeConfigClient(sts_response)
+    return reader
+
+@pytest.fixture(autouse=True)
+def environment():
+    with patch.dict(os.environ, { "ACCOUNT_LIST": _ACCOUNT_LIST, "CROSS_ACCOUNT_ROLE_NAME": "foobar", "AWS_REGION": "us-east-1" }):
+        os.environ.pop("REGIONS", None)
+        yield
+
+def _unique_ids(inventory):
+    return [ row.unique_id for batch in inventory for row in batch ]
+
+_ALL_ARNS = [ f"arn:{account_id}:{index}" for account_id in ("111111111111", "222222222222") for index in range(5) ]
+
+def test_given_resumable_pages_then_positions_point_at_the_following_page():
+    pages = list(_reader().iter_resumable_pages())
+
+    assert [ position for position, _ in pages ] == [ CollectionPosition(0, "111111111111/us-east-1", 0, "2"),
+                                                      CollectionPosition(0, "111111111111/us-east-1", 0, "4"),
+                                                      CollectionPosition(1, "222222222222/us-east-1", 0, ""),
+                                                      CollectionPosition(1, "222222222222/us-east-1", 0, "2"),
+                                                      CollectionPosition(1, "222222222222/us-east-1", 0, "4"),
+                                                      CollectionPosition(2, None, 0, "") ]
+    assert [ row.unique_id for _, rows in pages for row in rows ] == _ALL_ARNS
+
+def test_given_position_then_resumed_pages_continue_from_it():
+    pages = list(_reader().iter_resumable_pages())
+
+    for page_index, (position, _) in enumerate(pages):
+        resumed_rows = [ row.unique_id for _, rows in _reader().iter_resumable_pages(position) for row in rows ]
+        assert resumed_rows == [ row.unique_id for _, rows in pages[page_index + 1:] for row in rows ]
+
+def test_given_time_runs_out_then_checkpoint_is_saved_and_collection_resumes_from_it(tmp_path):
+    checkpoint_store = LocalCheckpointStore(str(tmp_path / "checkpoint.json"))
+
+    # Out of time after the second page, part way through the first account
+    first_result = DeadlineAwareCollector(_reader(), FakeLambdaContext([ 900, 100 ]), checkpoint_store, safety_margin_seconds=120).collect()
+
+    assert not first_result.complete
+    checkpoint = checkpoint_store.load(first_result.continuation_token)
+    assert checkpoint.checkpoint_id == first_result.continuation_token
+    assert (tmp_path / f"checkpoint-{first_result.continuation_token}.json").exists()
+    assert _unique_ids(CheckpointInventory(checkpoint_store, checkpoint)) == _ALL_ARNS[:4]
+    assert checkpoint.position == CollectionPosition(0, "111111111111/us-east-1", 0, "4")
+
+    collector = DeadlineAwareCollector(_reader(), FakeLambdaContext([ 900 ]), checkpoint_store, safety_margin_seconds=120)
+    second_result = collector.collect(first_result.continuation_token)
+
+    assert second_result.complete
+    assert _unique_ids(second_result.inventory) == _ALL_ARNS
+    # Kept in case writing or delivering the report fails
+    assert checkpoint_store.load(first_result.continuation_token) is not None
+
+    collector.delete_checkpoint(second_result)
+
+    assert checkpoint_store.load(first_result.continuation_token) is None
+
+def test_given_no_time_left_for_report_then_checkpoint_is_saved_at_the_end(tmp_path):
+    checkpoint_store = LocalCheckpointStore(str(tmp_path / "checkpoint.json"))
+
+    first_result = DeadlineAwareCollector(_reader(), FakeLambdaContext([ 900 ] * 6 + [ 100 ]), checkpoint_store, safety_margin_seconds=120).collect()
+
+    assert not first_result.complete
+    assert checkpoint_store.load(first_result.continuation_token).position == CollectionPosition(2, None, 0, "")
+
+    second_result = DeadlineAwareCollector(_reader(), FakeLambdaContext([ 900 ]), checkpoint_store, safety_margin_seconds=120) \
+                        .collect(first_result.continuation_token)
+
+    assert _unique_ids(second_result.inventory) == _ALL_ARNS
+
+def test_given_context_without_deadline_then_collection_completes(tmp_path):
+    checkpoint_store = LocalCheckpointStore(str(tmp_path / "checkpoint.json"))
+
+    result = DeadlineAwareCollector(_reader(), object(), checkpoint_store, safety_margin_seconds=120).collect()
+
+    assert _unique_ids(result.inventory) == _ALL_ARNS
+    assert result.checkpoint_id is None
+    assert list(tmp_path.iterdir()) == []
+
+def test_given_unknown_continuation_token_then_error_is_raised(tmp_path):
+    checkpoint_store = LocalCheckpointStore(str(tmp_path / "checkpoint.json"))
+    DeadlineAwareCollector(_reader(), FakeLambdaContext([ 100 ]), checkpoint_store, safety_margin_seconds=120).collect()
+
+    with pytest.raises(ValueError):
+        DeadlineAwareCollector(_reader(), FakeLambdaContext([ 900 ]), checkpoint_store, safety_margin_seconds=120).collect("foobar")
+    with pytest.raises(ValueError):
+        DeadlineAwareCollector(_reader(), FakeLambdaContext([ 900 ]), checkpoint_store, safety_margin_seconds=120).collect("../checkpoint")
+
+def test_given_two_runs_out_of_time_then_each_resumes_from_its_own_checkpoint(tmp_path):
+    checkpoint_store = LocalCheckpointStore(str(tmp_path / "checkpoint.json"))
+    first_result = DeadlineAwareCollector(_reader(), FakeLambdaContext([ 900, 100 ]), checkpoint_store, safety_margin_seconds=120).collect()
+    # The next scheduled run also times out before the first one has been continued
+    second_result = DeadlineAwareCollector(_reader(), FakeLambdaContext([ 900, 900, 900, 100 ]), checkpoint_store, safety_margin_seconds=120).collect()
+
+    for result in (first_result, second_result):
+        resumed_result = DeadlineAwareCollector(_reader(), FakeLambdaContext([ 900 ]), checkpoint_store, safety_margin_seconds=120) \
+                            .collect(result.continuation_token)
+
+        assert _unique_ids(resumed_result.inventory) == _ALL_ARNS
+
+def test_given_each_invocation_runs_out_of_time_then_only_its_new_rows_are_appended_as_a_part(tmp_path):
+    checkpoint_store = LocalCheckpointStore(str(tmp_path / "checkpoint.json"))
+    result = DeadlineAwareCollector(_reader(), FakeLambdaContext([ 900, 100 ]), checkpoint_store, safety_margin_seconds=120).collect()
+    continuation_token = result.continuation_token
+    result = DeadlineAwareCollector(_reader(), FakeLambdaContext([ 900, 900, 100 ]), checkpoint_store, safety_margin_seconds=120).collect(continuation_token)
+
+    part_rows = [ _unique_ids([ checkpoint_store.load_part(continuation_token, part_index) ]) for part_index in range(2) ]
+    index = json.loads((tmp_path / f"checkpoint-{continuation_token}.json").read_text())
+
+    assert part_rows == [ _ALL_ARNS[:4], _ALL_ARNS[4:9] ]
+    assert (index["part_count"], index["row_count"]) == (2, 9)
+    assert "columns" not in index
+
+    collector = DeadlineAwareCollector(_reader(), FakeLambdaContext([ 900 ]), checkpoint_store, safety_margin_seconds=120)
+    result = collector.collect(continuation_token)
+
+    assert len(result.inventory) == 10
+    assert _unique_ids(result.inventory) == _ALL_ARNS
+
+    collector.delete_checkpoint(result)
+
+    assert list(tmp_path.iterdir()) == []
+
+def test_given_account_list_changed_since_checkpoint_then_collection_starts_over(tmp_path, caplog):
+    checkpoint_store = LocalCheckpointStore(str(tmp_path / "checkpoint.json"))
+    first_result = DeadlineAwareCollector(_reader(), FakeLambdaContext([ 900, 900, 100 ]), checkpoint_store, safety_margin_seconds=120).collect()
+
+    os.environ["ACCOUNT_LIST"] = '[ { "name": "foo", "id": "111111111111" }, { "name": "baz", "id": "333333333333" } ]'
+    result = DeadlineAwareCollector(_reader(), FakeLambdaContext([ 900 ]), checkpoint_store, safety_margin_seconds=120).collect(first_result.continuation_token)
+
+    assert _unique_ids(result.inventory) == _ALL_ARNS[:5] + [ f"arn:333333333333:{index}" for index in range(5) ]
+    assert f"discarding the 5 rows of checkpoint {first_result.continuation_token}" in caplog.text
+    assert list(tmp_path.iterdir()) == []
+
+@patch("inventory.handler.DeliverReportCommandHandler")
+@patch("inventory.handler.AwsConfigInventoryReader", side_effect=lambda lambda_context: _reader())
+def test_given_report_delivery_fails_then_checkpoint_is_kept_until_report_is_delivered(_, deliver_report_handler, tmp_path):
+    deliver_report_handler.return_value.deliver.side_effect = [ Exception("upload failed"), "https://reports/report.xlsx" ]
+
+    with patch.dict(os.environ, { "CHECKPOINT_MODE": "true", "CHECKPOINT_RESUME_MODE": "return", "CHECKPOINT_LOCATION": str(tmp_path / "checkpoint.json"),
+                                  "CHECKPOINT_SAFETY_MARGIN_SECONDS": "120" }):
+        first_response = lambda_handler(None, FakeLambdaContext([ 900, 100 ]))
+        continuation_token = json.loads(first_response["body"])["continuation_token"]
+        failed_response = lambda_handler({ "continuation_token": continuation_token }, FakeLambdaContext([ 900 ]))
+
+        assert failed_response["statusCode"] == 500
+        assert (tmp_path / f"checkpoint-{continuation_token}.json").exists()
+
+        response = lambda_handler({ "continuation_token": continuation_token }, FakeLambdaContext([ 900 ]))
+
+    assert response["statusCode"] == 200
+    assert list(tmp_path.iterdir()) == []
+
+@patch.dict(os.environ, { "CONFIG_AGGREGATOR_NAME": "aggregator" })
+def test_given_aggregator_position_then_resumed_pages_continue_from_it():
+    reader = AwsConfigAggregatorInventoryReader(lambda_context=Mock(), config_client=FakeConfigClient("aggregated"), mappers=[ _mapper() ], shard_by=[])
+
+    pages = list(reader.iter_resumable_pages())
+    resumed_rows = [ row.unique_id for _, rows in reader.iter_resumable_pages(pages[0][0]) for row in rows ]
+
+    assert pages[0][0].next_token == "2"
+    assert resumed_rows == [ f"arn:aggregated:{index}" for index in range(2, 5) ]
+
+def test_given_continuation_token_then_function_is_invoked_asynchronously():
+    lambda_client = Mock()
+
+    reinvoke_function(lambda_client, "arn:aws:lambda:us-east-1:123456789012:function:testing", "token")
+
+    lambda_client.invoke.assert_called_once_with(FunctionName="arn:aws:lambda:us-east-1:123456789012:function:testing", InvocationType="Event",
+                                                 Payload=b'{"continuation_token": "token"}')
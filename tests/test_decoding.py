@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# AWS DISCLAMER
+# ---
+
+# The following files are provided by AWS Professional Services describe the process to create a IAM Policy with description.
+
+# These are non-production ready and are to be used for testing purposes.
+
+# These files is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations under the License.
+
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and Amazon Web Services, Inc.​
+import glob
+import json
+import math
+import os
+from unittest.mock import patch
+import pytest
+import inventory.decoding
+from inventory.decoding import OrjsonDecoder, StdlibJsonDecoder, get_json_decoder
+
+_SAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sample_config_query_results")
+
+def _sample_results():
+    raw_results = []
+    for file_name in sorted(glob.glob(os.path.join(_SAMPLES_DIR, "*.json"))):
+        with open(file_name) as sample_file:
+            try:
+                document = json.load(sample_file)
+            except json.JSONDecodeError:
+                continue
+        raw_results.extend(json.dumps(sample) for sample in (document if isinstance(document, list) else [document]))
+    return raw_results
+
+_DECODERS = [ StdlibJsonDecoder, OrjsonDecoder ]
+
+@pytest.mark.parametrize("decoder_class", _DECODERS)
+def test_given_sample_results_then_page_decodes_to_same_resources_as_json_loads(decoder_class):
+    raw_results = _sample_results()
+
+    assert raw_results
+    assert decoder_class().decode_page(raw_results) == [ json.loads(raw_result) for raw_result in raw_results ]
+
+@pytest.mark.parametrize("decoder_class", _DECODERS)
+def test_given_empty_page_then_no_resources_are_returned(decoder_class):
+    assert decoder_class().decode_page([]) == []
+
+@pytest.mark.parametrize("decoder_class", _DECODERS)
+def test_given_json_only_stdlib_accepts_then_it_is_still_decoded(decoder_class):
+    resources = decoder_class().decode_page([ '{ "arn": "a", "size": NaN }', '{ "arn": "b", "size": 1 }' ])
+
+    assert [ resource["arn"] for resource in resources ] == [ "a", "b" ]
+    assert math.isnan(resources[0]["size"])
+
+@pytest.mark.parametrize("decoder_class", _DECODERS)
+def test_given_result_with_more_than_one_value_then_error_is_raised(decoder_class):
+    with pytest.raises(ValueError):
+        decoder_class().decode_page([ '{ "arn": "a" }, { "arn": "b" }', '{ "arn": "c" }' ])
+
+@pytest.mark.parametrize("decoder_class", _DECODERS)
+def test_given_invalid_result_then_error_is_raised(decoder_class):
+    with pytest.raises(ValueError):
+        decoder_class().decode_page([ '{ "arn": "a" }', '{ "arn": ' ])
+
+def test_given_auto_then_orjson_is_used_when_installed():
+    assert get_json_decoder("auto").name == "orjson"
+
+@patch.object(inventory.decoding, "orjson", None)
+def test_given_orjson_not_installed_then_auto_falls_back_to_stdlib():
+    assert get_json_decoder("auto").name == "json"
+
+    with pytest.raises(ValueError):
+        get_json_decoder("orjson")
+
+@patch.dict(os.environ, { "JSON_DECODER": "json" })
+def test_given_decoder_in_environment_then_it_is_used():
+    assert get_json_decoder().name == "json"
+
+@patch.dict(os.environ, { "JSON_DECODER": "simdjson" })
+def test_given_unknown_decoder_then_error_is_raised():
+    with pytest.raises(ValueError):
+        get_json_decoder()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# AWS DISCLAMER
+# ---
+
+# The following files are provided by AWS Professional Services describe the process to create a IAM Policy with description.
+
+# These are non-production ready and are to be used for testing purposes.
+
+# These files is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations under the License.
+
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and Amazon Web Services, Inc.​
+from unittest.mock import patch
+import pytest
+from inventory.dedup import DEDUP_POLICY_FIRST, DEDUP_POLICY_MERGE, DEDUP_POLICY_OFF, InventoryDeduplicator, get_dedup_policy_from_environment
+from inventory.mappers import InventoryBatch, InventoryData, iter_inventory_rows
+
+def _rows(items):
+    return list(iter_inventory_rows(items, ["unique_id", "ip_address", "owner"]))
+
+def test_given_duplicate_rows_across_batches_then_first_row_of_each_key_is_kept():
+    deduplicator = InventoryDeduplicator(DEDUP_POLICY_FIRST)
+    inventory = [ InventoryBatch.from_inventory([ InventoryData(unique_id="eni-1", ip_address="10.0.0.1", owner="a"),
+                                                  InventoryData(unique_id="eni-1", ip_address="10.0.0.2", owner="a") ]),
+                  InventoryBatch.from_inventory([ InventoryData(unique_id="eni-1", ip_address="10.0.0.1", owner="b") ]),
+                  InventoryData(unique_id="eni-1", ip_address="10.0.0.2", owner="c"),
+                  InventoryData(unique_id="db-1", owner="d"),
+                  InventoryData(unique_id="db-1", owner="e") ]
+
+    result = list(deduplicator.deduplicate(inventory))
+
+    assert _rows(result) == [ ("eni-1", "10.0.0.1", "a"), ("eni-1", "10.0.0.2", "a"), ("db-1", None, "d") ]
+    assert deduplicator.duplicates_removed == 3
+    assert result[0] is inventory[0], "Batches without duplicates are passed on as they are"
+
+def test_given_first_policy_then_rows_are_passed_on_as_they_arrive():
+    deduplicator = InventoryDeduplicator(DEDUP_POLICY_FIRST)
+
+    def inventory():
+        yield InventoryData(unique_id="i-1", ip_address="10.0.0.1")
+        raise AssertionError("Only the first row should have been read")
+
+    assert next(deduplicator.deduplicate(inventory())).unique_id == "i-1"
+
+def test_given_rows_without_unique_id_then_they_are_never_removed():
+    deduplicator = InventoryDeduplicator(DEDUP_POLICY_FIRST)
+
+    result = list(deduplicator.deduplicate([ InventoryData(ip_address="10.0.0.1"), InventoryData(ip_address="10.0.0.1") ]))
+
+    assert len(result) == 2
+    assert deduplicator.duplicates_removed == 0
+
+def test_given_merge_policy_then_empty_fields_of_first_row_are_filled_from_duplicates():
+    first = InventoryData(unique_id="eni-1", ip_address="10.0.0.1", owner="a", extra_tags={ "CostCenter": "1" })
+    deduplicator = InventoryDeduplicator(DEDUP_POLICY_MERGE)
+
+    result = list(deduplicator.deduplicate([ first,
+                                             InventoryData(unique_id="eni-2", ip_address="10.0.0.2"),
+                                             InventoryData(unique_id="eni-1", ip_address="10.0.0.1", owner="b", function="web",
+                                                           extra_tags={ "CostCenter": "2", "Environment": "prod" }) ]))
+
+    rows = [ row for batch in result for row in batch ]
+    assert [ (row.unique_id, row.owner, row.function, row.extra_tags) for row in rows ] == [ ("eni-1", "a", "web", { "CostCenter": "1", "Environment": "prod" }),
+                                                                                             ("eni-2", None, None, None) ]
+    assert deduplicator.duplicates_removed == 1
+    assert first.function is None and first.extra_tags == { "CostCenter": "1" }, "Rows handed to the deduplicator must not be changed"
+
+def test_given_off_policy_then_every_row_is_kept():
+    deduplicator = InventoryDeduplicator(DEDUP_POLICY_OFF)
+    inventory = [ InventoryData(unique_id="i-1", ip_address="10.0.0.1"), InventoryData(unique_id="i-1", ip_address="10.0.0.1") ]
+
+    assert list(deduplicator.deduplicate(inventory)) == inventory
+    assert deduplicator.duplicates_removed == 0
+
+def test_given_policy_from_environment_then_it_is_validated():
+    with patch.dict("os.environ", { "DEDUP_POLICY": "Merge" }):
+        assert get_dedup_policy_from_environment() == DEDUP_POLICY_MERGE
+
+    with patch.dict("os.environ", { "DEDUP_POLICY": "last" }):
+        with pytest.raises(ValueError):
+            get_dedup_policy_from_environment()
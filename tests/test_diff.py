@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# AWS DISCLAMER
+# ---
+
+# The following files are provided by AWS Professional Services describe the process to create a IAM Policy with description.
+
+# These are non-production ready and are to be used for testing purposes.
+
+# These files is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations under the License.
+
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and Amazon Web Services, Inc.​
+import csv
+import gzip
+import io
+import os
+from unittest.mock import patch
+import pytest
+from openpyxl import load_workbook
+from inventory.diff import (CHANGE_COLUMN_NAMES, InventoryDiffer, iter_inventory_diff_rows, iter_report_file_diff_rows, iter_workbook_diff_rows, main,
+                            write_changes_csv, write_changes_workbook)
+from inventory.mappers import InventoryBatch, InventoryData
+from inventory.report_writers import CsvReportWriter
+from inventory.reports import CreateReportCommandHandler
+from inventory.snapshots import CHANGE_ADDED, CHANGE_CHANGED, CHANGE_REMOVED, SnapshotStore
+
+def _row(unique_id, ip_address="10.0.0.1", **fields):
+    return InventoryData(**{ "asset_type": "EC2", "unique_id": unique_id, "ip_address": ip_address, "is_virtual": "Yes", "is_public": "No",
+                             "authenticated_scan_planned": "Yes", **fields })
+
+def _old_inventory():
+    return [ _row("i-1", owner="team", extra_tags={ "Env": "prod", "CostCenter": "42" }), _row("i-1", "10.0.0.2"), _row("i-2"), _row("bucket", None, asset_type="S3") ]
+
+def _new_inventory():
+    return [ InventoryBatch.from_inventory([ _row("i-1", owner="team", network_id="", extra_tags={ "CostCenter": "42", "Env": "prod" }),
+                                             _row("i-1", "10.0.0.2", owner="other") ]),
+             _row("i-3"), _row("bucket", None, asset_type="S3") ]
+
+def _changes(changes):
+    return sorted((row_change.change, (row_change.old or row_change.new).unique_id, (row_change.old or row_change.new).ip_address) for row_change in changes)
+
+EXPECTED_CHANGES = [ (CHANGE_ADDED, "i-3", "10.0.0.1"), (CHANGE_CHANGED, "i-1", "10.0.0.2"), (CHANGE_REMOVED, "i-2", "10.0.0.1") ]
+
+def test_given_two_inventories_then_added_removed_and_changed_rows_are_found():
+    changes = list(InventoryDiffer().diff(iter_inventory_diff_rows(_old_inventory()), iter_inventory_diff_rows(_new_inventory())))
+
+    # An empty network_id and tags in another order are not changes
+    assert _changes(changes) == EXPECTED_CHANGES
+    changed = next(row_change for row_change in changes if row_change.change == CHANGE_CHANGED)
+    assert changed.changed_fields == [ "owner" ]
+    assert (changed.old.owner, changed.new.owner) == (None, "other")
+
+def test_given_partitions_then_same_changes_are_found_and_partition_files_are_removed(tmp_path):
+    old_inventory = [ _row(f"i-{index}", owner="team") for index in range(3000) ]
+    new_inventory = [ _row(f"i-{index}", owner="other" if index % 7 == 0 else "team") for index in range(100, 3100) ]
+
+    in_memory = _changes(InventoryDiffer().diff(iter_inventory_diff_rows(old_inventory), iter_inventory_diff_rows(new_inventory)))
+    partitioned = list(InventoryDiffer(8, str(tmp_path)).diff(iter_inventory_diff_rows(old_inventory), iter_inventory_diff_rows(new_inventory)))
+
+    assert _changes(partitioned) == in_memory
+    assert len(in_memory) == 100 + 100 + len([ index for index in range(100, 3000) if index % 7 == 0 ])
+    assert os.listdir(tmp_path) == []
+
+def test_given_invalid_partition_count_then_error_is_raised():
+    with pytest.raises(ValueError):
+        InventoryDiffer(0)
+
+def test_given_workbook_then_its_rows_match_the_inventory_it_was_written_from(tmp_path):
+    workbook_file_name = str(tmp_path / "report.xlsx")
+    # Enough rows to write over all of the template's guidance and example rows
+    inventory = _old_inventory() + [ _row(f"i-{index}") for index in range(10, 30) ]
+
+    with patch.dict("os.environ", { "EXTRA_TAG_COLUMNS": "Env,CostCenter" }):
+        with open(workbook_file_name, "wb") as workbook_file:
+            CreateReportCommandHandler().execute(inventory, workbook_file)
+        workbook_rows = list(iter_workbook_diff_rows(workbook_file_name))
+
+    assert workbook_rows == list(iter_inventory_diff_rows(inventory))
+
+@pytest.mark.parametrize("write_mode", [ "standard", "streaming" ])
+def test_given_workbook_values_equal_to_template_examples_then_they_are_read_back(write_mode, tmp_path):
+    workbook_file_name = str(tmp_path / "report.xlsx")
+    # The fifth row is written over the template's first example row, whose values it shares, and the template's
+    # other example rows are left below the inventory
+    inventory = [ _row(f"i-{index}") for index in range(4) ] + \
+                [ _row("123.45.78.90", "123.45.78.90", is_virtual="No", is_public="Yes", baseline_config="Base Config1", hardware_model="Acme Server") ]
+
+    with patch.dict("os.environ", { "REPORT_WRITE_MODE": write_mode }):
+        with open(workbook_file_name, "wb") as workbook_file:
+            CreateReportCommandHandler().execute(inventory, workbook_file)
+        workbook_rows = list(iter_workbook_diff_rows(workbook_file_name))
+
+    assert workbook_rows == list(iter_inventory_diff_rows(inventory))
+
+def test_given_gzipped_csv_report_then_its_rows_match_the_inventory_it_was_written_from(tmp_path):
+    report_file_name = str(tmp_path / "report.csv.gz")
+
+    with patch.dict("os.environ", { "EXTRA_TAG_COLUMNS": "Env,CostCenter" }), gzip.open(report_file_name, "wb") as report_file:
+        CsvReportWriter().write(_old_inventory(), report_file)
+
+    assert list(iter_report_file_diff_rows(report_file_name)) == list(iter_inventory_diff_rows(_old_inventory()))
+
+def test_given_changes_then_csv_and_workbook_have_a_row_per_change():
+    changes = list(InventoryDiffer().diff(iter_inventory_diff_rows(_old_inventory()), iter_inventory_diff_rows(_new_inventory())))
+    csv_file = io.StringIO()
+    workbook_file = io.BytesIO()
+
+    assert write_changes_csv(changes, csv_file) == write_changes_workbook(changes, workbook_file) == { CHANGE_ADDED: 1, CHANGE_REMOVED: 1, CHANGE_CHANGED: 1 }
+
+    rows = [ dict(zip(CHANGE_COLUMN_NAMES, row)) for row in list(csv.reader(io.StringIO(csv_file.getvalue())))[1:] ]
+    changed = next(row for row in rows if row["change"] == CHANGE_CHANGED)
+    assert (changed["changed_fields"], changed["owner"], changed["old:owner"], changed["old:asset_type"]) == ("owner", "other", "", "")
+
+    workbook = load_workbook(workbook_file)
+    assert workbook.sheetnames == [ "Summary", "Changes" ]
+    assert list(workbook["Summary"].values) == [ ("change", "rows"), (CHANGE_ADDED, 1), (CHANGE_REMOVED, 1), (CHANGE_CHANGED, 1) ]
+    assert workbook["Changes"].max_row == 4
+
+def test_given_snapshot_runs_then_command_line_writes_their_changes(tmp_path):
+    database_file_name = str(tmp_path / "inventory.db")
+    with SnapshotStore(database_file_name) as snapshot_store:
+        old_run_id = snapshot_store.save_run(_old_inventory())
+        snapshot_store.save_run(_new_inventory())
+
+    output_file = io.StringIO()
+    change_counts = main([ "--snapshots", database_file_name, str(old_run_id), "latest" ], output_file)
+
+    assert change_counts == { CHANGE_ADDED: 1, CHANGE_REMOVED: 1, CHANGE_CHANGED: 1 }
+    assert len(output_file.getvalue().splitlines()) == 4
+
+def test_given_run_id_without_snapshots_then_error_is_raised():
+    with pytest.raises(ValueError):
+        main([ "1", "2" ], io.StringIO())
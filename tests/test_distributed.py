@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# AWS DISCLAMER
+# ---
+
+# The following files are provided by AWS Professional Services describe the process to create a IAM Policy with description.
+
+# These are non-production ready and are to be used for testing purposes.
+
+# These files is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations under the License.
+
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and Amazon Web Services, Inc.​
+import json
+import os
+from unittest.mock import Mock, patch
+import boto3
+import pytest
+from botocore.stub import ANY, Stubber
+from inventory.distributed import InProcessDispatcher, LambdaDispatcher, WorkStore, iter_run_inventory, run_work_unit, start_run
+from inventory.handler import lambda_handler
+from inventory.mappers import DataMapper, InventoryData
+from inventory.readers import AwsConfigInventoryReader
+from inventory.sessions import ClientCache
+
+_ACCOUNT_LIST = '[ { "name": "foo", "id": "111111111111" }, { "name": "bar", "id": "222222222222", "regions": [ "us-east-1", "us-west-2" ] } ]'
+
+class FakeConfigClient():
+    def __init__(self, account_id, region_name):
+        self._arns = [ f"arn:{account_id}:{region_name}:{index}" for index in range(3) ]
+
+    def select_resource_config(self, Expression, NextToken):
+        start = int(NextToken or 0)
+        response = { "Results": [ json.dumps({ "resourceType": "foobar", "arn": arn }) for arn in self._arns[start:start + 2] ] }
+        if start + 2 < len(self._arns):
+            response["NextToken"] = str(start + 2)
+        return response
+
+class FakeLambdaContext():
+    invoked_function_arn = "arn:aws:lambda:us-east-1:123456789012:function:testing"
+
+def _mapper():
+    mapper = Mock(spec=DataMapper)
+    mapper._get_supported_resource_type.return_value = [ "foobar" ]
+    mapper._get_configuration_paths.return_value = None
+    mapper._map_resource.side_effect = lambda resource: [ InventoryData(unique_id=resource["arn"]) ]
+    return mapper
+
+def _reader(lambda_context=None):
+    sts_client = Mock()
+    sts_client.assume_role.side_effect = lambda RoleArn, **kwargs: RoleArn.split(":")[4]
+    reader = AwsConfigInventoryReader(lambda_context=lambda_context or FakeLambdaContext(), sts_client=sts_client, mappers=[ _mapper() ],
+                                      client_cache=ClientCache())
+    reader._get_config_client = lambda sts_response, region_name=None: FakeConfigClient(sts_response, region_name)
+    return reader
+
+@pytest.fixture(autouse=True)
+def environment():
+    with patch.dict(os.environ, { "ACCOUNT_LIST": _ACCOUNT_LIST, "CROSS_ACCOUNT_ROLE_NAME": "foobar", "AWS_REGION": "us-east-1" }):
+        os.environ.pop("REGIONS", None)
+        yield
+
+_ALL_ARNS = [ f"arn:{account_id}:{region_name}:{index}"
+              for account_id, region_name in (("111111111111", "us-east-1"), ("222222222222", "us-east-1"), ("222222222222", "us-west-2"))
+              for index in range(3) ]
+
+def _run_all(reader, work_store):
+    reduced_run_ids = []
+
+    def handle_event(event, dispatcher):
+        if event["distributed"]["role"] == "worker":
+            return run_work_unit(reader, work_store, dispatcher, event["distributed"]["run_id"], event["distributed"]["unit_index"])
+        reduced_run_ids.append(event["distributed"]["run_id"])
+
+    dispatcher = InProcessDispatcher(handle_event)
+    run_id = start_run(reader, work_store, dispatcher, run_id="run")
+    responses = dispatcher.run()
+
+    return run_id, responses, reduced_run_ids
+
+def test_given_account_list_then_a_worker_runs_for_each_account_and_region_and_reduce_runs_once(tmp_path):
+    work_store = WorkStore(str(tmp_path))
+
+    run_id, responses, reduced_run_ids = _run_all(_reader(), work_store)
+
+    assert responses[:3] == [ 3, 3, 3 ]
+    assert reduced_run_ids == [ run_id ]
+    assert [ row.unique_id for batch in iter_run_inventory(work_store, run_id) for row in batch ] == _ALL_ARNS
+
+def test_given_unit_rerun_then_its_rows_are_replaced_and_reduce_is_not_dispatched_again(tmp_path):
+    work_store = WorkStore(str(tmp_path))
+    reader = _reader()
+    run_id, _, _ = _run_all(reader, work_store)
+    dispatcher = Mock()
+
+    run_work_unit(reader, work_store, dispatcher, run_id, 1)
+
+    dispatcher.dispatch.assert_not_called()
+    assert [ row.unique_id for batch in iter_run_inventory(work_store, run_id) for row in batch ] == _ALL_ARNS
+
+def test_given_units_still_running_then_reduce_is_not_dispatched(tmp_path):
+    work_store = WorkStore(str(tmp_path))
+    reader = _reader()
+    dispatcher = Mock()
+    run_id = start_run(reader, work_store, dispatcher)
+
+    run_work_unit(reader, work_store, dispatcher, run_id, 0)
+
+    assert [ call.args[0]["distributed"]["role"] for call in dispatcher.dispatch.call_args_list ] == [ "worker", "worker", "worker" ]
+
+def test_given_unknown_run_then_error_is_raised(tmp_path):
+    with pytest.raises(ValueError):
+        run_work_unit(_reader(), WorkStore(str(tmp_path)), Mock(), "missing", 0)
+
+def test_given_event_then_lambda_dispatcher_invokes_function_asynchronously():
+    lambda_client = Mock()
+
+    LambdaDispatcher(lambda_client, FakeLambdaContext.invoked_function_arn).dispatch({ "distributed": { "role": "reduce", "run_id": "run" } })
+
+    lambda_client.invoke.assert_called_once_with(FunctionName=FakeLambdaContext.invoked_function_arn, InvocationType="Event",
+                                                 Payload=b'{"distributed": {"role": "reduce", "run_id": "run"}}')
+
+def test_given_s3_work_location_then_unit_results_are_counted_from_listing():
+    s3_client = Mock()
+    s3_client.get_paginator.return_value.paginate.return_value = [ { "KeyCount": 2 }, { "KeyCount": 1 } ]
+
+    assert WorkStore("s3://bucket/inventory/runs", s3_client).count_unit_results("run") == 3
+    s3_client.get_paginator.return_value.paginate.assert_called_once_with(Bucket="bucket", Prefix="inventory/runs/run/unit-")
+
+def test_given_s3_work_location_then_reduce_is_claimed_with_conditional_write_the_sdk_accepts():
+    # A real client, stubbed, validates the request against the S3 API model of the botocore in use
+    s3_client = boto3.client("s3", region_name="us-east-1", aws_access_key_id="test", aws_secret_access_key="test")
+    work_store = WorkStore("s3://bucket/inventory/runs", s3_client)
+
+    with Stubber(s3_client) as stubber:
+        stubber.add_response("put_object", {}, { "Bucket": "bucket", "Key": "inventory/runs/run/reduce.json", "Body": ANY, "IfNoneMatch": "*" })
+        stubber.add_client_error("put_object", service_error_code="PreconditionFailed", http_status_code=412,
+                                 expected_params={ "Bucket": "bucket", "Key": "inventory/runs/run/reduce.json", "Body": ANY, "IfNoneMatch": "*" })
+
+        assert work_store.claim_reduce("run")
+        assert not work_store.claim_reduce("run")
+
+@patch("inventory.handler.DeliverReportCommandHandler")
+@patch("inventory.handler.CreateReportCommandHandler")
+@patch("inventory.handler.AwsConfigInventoryReader", side_effect=_reader)
+def test_given_distributed_mode_then_handler_runs_coordinator_workers_and_reduce_in_process(_, create_report_handler, deliver_report_handler, tmp_path):
+    reported_rows = []
+    create_report_handler.return_value.execute.side_effect = lambda inventory, output_file: reported_rows.extend(row.unique_id for batch in inventory for row in batch)
+    deliver_report_handler.return_value.deliver.side_effect = lambda report_writer, inventory, compression: report_writer.write(inventory, None) or "https://reports/report.xlsx"
+    context = FakeLambdaContext()
+    dispatcher = InProcessDispatcher(lambda event, dispatcher: lambda_handler(event, context, dispatcher))
+
+    with patch.dict(os.environ, { "DISTRIBUTED_MODE": "true", "WORK_LOCATION": str(tmp_path) }):
+        coordinator_response = lambda_handler({}, context, dispatcher)
+        responses = dispatcher.run()
+
+    assert coordinator_response["statusCode"] == 202
+    assert [ response["statusCode"] for response in responses ] == [ 200, 200, 200, 200 ]
+    assert json.loads(responses[-1]["body"]) == { "report": { "url": "https://reports/report.xlsx", "urls": { "xlsx": "https://reports/report.xlsx" } } }
+    assert reported_rows == _ALL_ARNS
+
+@patch("inventory.handler.DeliverReportCommandHandler")
+@patch("inventory.handler.CreateReportCommandHandler")
+@patch("inventory.handler.AwsConfigInventoryReader")
+def test_given_failing_worker_then_reduce_still_runs_reports_the_failure_and_deletes_the_run(reader_class, create_report_handler, deliver_report_handler, tmp_path):
+    def create_reader(lambda_context):
+        reader = _reader(lambda_context)
+        reader._get_config_client = lambda sts_response, region_name=None: (Mock(**{ "select_resource_config.side_effect": RuntimeError("out of luck") })
+                                                                             if region_name == "us-west-2" else FakeConfigClient(sts_response, region_name))
+        return reader
+
+    reader_class.side_effect = create_reader
+    reported_rows = []
+    create_report_handler.return_value.execute.side_effect = lambda inventory, output_file: reported_rows.extend(row.unique_id for batch in inventory for row in batch)
+    deliver_report_handler.return_value.deliver.side_effect = lambda report_writer, inventory, compression: report_writer.write(inventory, None) or "https://reports/report.xlsx"
+    context = FakeLambdaContext()
+    dispatcher = InProcessDispatcher(lambda event, dispatcher: lambda_handler(event, context, dispatcher))
+
+    with patch.dict(os.environ, { "DISTRIBUTED_MODE": "true", "WORK_LOCATION": str(tmp_path) }):
+        lambda_handler({}, context, dispatcher)
+        responses = dispatcher.run()
+
+    assert [ response["statusCode"] for response in responses ] == [ 200, 200, 500, 200 ]
+    assert json.loads(responses[-1]["body"])["failed_units"] == { "2": "RuntimeError: out of luck" }
+    assert reported_rows == _ALL_ARNS[:6]
+    # Built for the coordinator and the three workers, but not for the reduce step
+    assert reader_class.call_count == 4
+    assert list(tmp_path.iterdir()) == []
+
+@pytest.mark.parametrize("other_mode", [ "INCREMENTAL_MODE", "CHECKPOINT_MODE" ])
+@patch("inventory.handler.DeliverReportCommandHandler")
+def test_given_distributed_mode_with_other_mode_then_handler_fails(_, other_mode, tmp_path):
+    with patch.dict(os.environ, { "DISTRIBUTED_MODE": "true", other_mode: "true", "WORK_LOCATION": str(tmp_path) }):
+        response = lambda_handler({}, FakeLambdaContext(), Mock())
+
+    assert response["statusCode"] == 500
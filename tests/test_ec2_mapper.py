@@ -16,7 +16,7 @@
 import json
 import os
 import pytest
-from inventory.mappers import EC2DataMapper
+from inventory.mappers import EC2DataMapper, MapperRegistry, get_default_mappers
 
 @pytest.fixture()
 def full_ec2_config():
@@ -90,3 +90,35 @@ def test_given_ec2_instance_with_public_dns_name_then_asset_is_marked_as_public(
     assert len(mapped_result) == 2, "Two rows were expected. One for the public IP and one for the private IP"
     assert mapped_result[0].is_public == "Yes", "Instance should have been marked public since it has a public DNS name"
     assert mapped_result[1].is_public == "Yes", "Instance should have been marked public since it has a public DNS name"
+
+def test_given_ec2_instance_with_many_ips_then_each_ip_has_its_own_row_with_the_instance_fields(full_ec2_config):
+    nic = full_ec2_config["configuration"]["networkInterfaces"][0]
+    full_ec2_config["configuration"]["networkInterfaces"] = [ dict(nic, macAddress="02:00:00:00:00:01"),
+                                                              dict(nic, macAddress="02:00:00:00:00:02",
+                                                                   privateIpAddresses=[ { "privateIpAddress": "10.0.1.1" }, { "privateIpAddress": "10.0.1.2" } ]) ]
+
+    mapper = EC2DataMapper()
+
+    mapped_result = mapper.map(full_ec2_config)
+
+    assert [(row.ip_address, row.mac_address) for row in mapped_result] == [(nic["privateIpAddresses"][0]["privateIpAddress"], "02:00:00:00:00:01"),
+                                                                            (nic["privateIpAddresses"][0]["association"]["publicIp"], "02:00:00:00:00:01"),
+                                                                            ("10.0.1.1", "02:00:00:00:00:02"),
+                                                                            ("10.0.1.2", "02:00:00:00:00:02")]
+    assert { (row.unique_id, row.baseline_config, row.hardware_model, row.network_id, row.dns_name, row.is_public) for row in mapped_result } == \
+           { (full_ec2_config["configuration"]["instanceId"], full_ec2_config["configuration"]["imageId"], full_ec2_config["configuration"]["instanceType"],
+              full_ec2_config["configuration"]["vpcId"], full_ec2_config["configuration"]["publicDnsName"], "Yes") }
+
+def test_given_ec2_instance_without_network_interfaces_then_empty_array_is_returned(full_ec2_config):
+    full_ec2_config["configuration"]["networkInterfaces"] = []
+
+    mapper = EC2DataMapper()
+
+    assert mapper.map(full_ec2_config) == []
+
+def test_given_registry_with_default_mappers_then_ec2_resource_is_dispatched_to_ec2_mapper(full_ec2_config):
+    registry = MapperRegistry(get_default_mappers())
+
+    assert isinstance(registry.get_mapper("AWS::EC2::Instance"), EC2DataMapper)
+    assert len(registry.map(full_ec2_config)) == len(EC2DataMapper().map(full_ec2_config))
+    assert registry.map({ "resourceType": "NOT EC2" }) is None, "None is returned when no mapper supports the resource type"
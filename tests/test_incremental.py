@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# AWS DISCLAMER
+# ---
+
+# The following files are provided by AWS Professional Services describe the process to create a IAM Policy with description.
+
+# These are non-production ready and are to be used for testing purposes.
+
+# These files is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations under the License.
+
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and Amazon Web Services, Inc.​
+import os
+from unittest.mock import Mock, patch
+from botocore.exceptions import ClientError
+import pytest
+from inventory.incremental import (IncrementalInventoryCollector, IncrementalState, LocalIncrementalStateStore, S3IncrementalStateStore,
+                                   get_captured_after, get_incremental_state_store_from_environment)
+from inventory.mappers import InventoryData
+from inventory.queries import ResourceLocation
+
+def _mapped_resource(arn, capture_time, status="OK"):
+    return ({ "arn": arn, "resourceType": "AWS::EC2::Instance", "configurationItemCaptureTime": capture_time, "configurationItemStatus": status },
+            [ InventoryData(unique_id=arn, ip_address="10.0.0.1") ])
+
+def _mock_reader(mapped_resources, resource_arns=(), failed_account_ids=()):
+    reader = Mock()
+    reader.iter_mapped_resources.return_value = iter(mapped_resources)
+    reader.iter_resource_locations.return_value = iter(arn if isinstance(arn, ResourceLocation) else ResourceLocation(arn, "111111111111", "us-east-1")
+                                                       for arn in resource_arns)
+    reader.failed_account_ids = list(failed_account_ids)
+    return reader
+
+def test_given_no_stored_state_then_all_resources_are_collected_and_state_is_saved(tmp_path):
+    state_store = LocalIncrementalStateStore(str(tmp_path / "state.json"))
+    reader = _mock_reader([ _mapped_resource("arn:a", "2024-01-01T00:00:00.000Z"), _mapped_resource("arn:b", "2024-01-02T00:00:00.000Z") ])
+
+    inventory = list(IncrementalInventoryCollector(reader, state_store).collect())
+
+    assert [ row.unique_id for row in inventory ] == [ "arn:a", "arn:b" ]
+    reader.iter_mapped_resources.assert_called_with(captured_after=None)
+    reader.iter_resource_locations.assert_not_called()
+    assert state_store.load().high_water_mark == "2024-01-02T00:00:00.000Z"
+
+def test_given_stored_state_then_changes_and_deletions_are_merged(tmp_path):
+    state_store = LocalIncrementalStateStore(str(tmp_path / "state.json"))
+    state_store.save(IncrementalState("2024-01-02T00:00:00.000Z", { "arn:a": [ { "unique_id": "arn:a", "ip_address": "10.0.0.9" } ],
+                                                                    "arn:b": [ { "unique_id": "arn:b" } ],
+                                                                    "arn:c": [ { "unique_id": "arn:c" } ],
+                                                                    "arn:d": [ { "unique_id": "arn:d" } ] }))
+    reader = _mock_reader([ _mapped_resource("arn:a", "2024-01-03T00:00:00.000Z"),
+                            _mapped_resource("arn:d", "2024-01-04T00:00:00.000Z", status="ResourceDeleted"),
+                            _mapped_resource("arn:e", "2024-01-05T00:00:00.000Z") ],
+                          resource_arns=[ "arn:a", "arn:c", "arn:e" ])
+
+    inventory = list(IncrementalInventoryCollector(reader, state_store).collect())
+
+    # One hour before the high water mark, INCREMENTAL_LOOKBACK_SECONDS' default, for items AWS Config records late
+    reader.iter_mapped_resources.assert_called_once_with(captured_after="2024-01-01T23:00:00.000Z")
+    assert [ (row.unique_id, row.ip_address) for row in inventory ] == [ ("arn:a", "10.0.0.1"), ("arn:c", None), ("arn:e", "10.0.0.1") ]
+    assert state_store.load().high_water_mark == "2024-01-05T00:00:00.000Z"
+
+def test_given_resource_recorded_with_capture_time_before_high_water_mark_then_it_is_collected(tmp_path):
+    state_store = LocalIncrementalStateStore(str(tmp_path / "state.json"))
+    state_store.save(IncrementalState("2024-01-05T00:00:00.000Z", { "arn:a": [ { "unique_id": "arn:a" } ] }))
+    reader = _mock_reader([], resource_arns=[ "arn:a", "arn:late" ])
+    # Recorded by AWS Config after the previous run, but captured days before its high water mark
+    reader.iter_mapped_resources.side_effect = [ iter([]), iter([ _mapped_resource("arn:late", "2024-01-01T00:00:00.000Z") ]) ]
+
+    inventory = list(IncrementalInventoryCollector(reader, state_store, lookback_seconds=600).collect())
+
+    assert reader.iter_mapped_resources.call_args_list[0].kwargs == { "captured_after": "2024-01-04T23:50:00.000Z" }
+    assert reader.iter_mapped_resources.call_args_list[1].kwargs == { "arns": { ("111111111111", "us-east-1"): [ "arn:late" ] } }
+    assert [ row.unique_id for row in inventory ] == [ "arn:a", "arn:late" ]
+    assert state_store.load().high_water_mark == "2024-01-05T00:00:00.000Z"
+
+def test_given_missing_resources_then_each_is_only_queried_in_the_account_and_region_it_was_listed_in(tmp_path):
+    state_store = LocalIncrementalStateStore(str(tmp_path / "state.json"))
+    state_store.save(IncrementalState("2024-01-05T00:00:00.000Z", { "arn:a": [ { "unique_id": "arn:a" } ] }))
+    reader = _mock_reader([], resource_arns=[ "arn:a", ResourceLocation("arn:c", "222222222222", "us-west-2"), ResourceLocation("arn:b", "222222222222", "us-west-2"),
+                                              ResourceLocation("arn:d", "111111111111", "eu-west-1") ])
+    reader.iter_mapped_resources.side_effect = [ iter([]), iter([]) ]
+
+    list(IncrementalInventoryCollector(reader, state_store).collect())
+
+    assert reader.iter_mapped_resources.call_args_list[1].kwargs == { "arns": { ("111111111111", "eu-west-1"): [ "arn:d" ],
+                                                                                ("222222222222", "us-west-2"): [ "arn:b", "arn:c" ] } }
+
+def test_given_arn_scan_interval_not_passed_then_arns_are_not_listed(tmp_path):
+    state_store = LocalIncrementalStateStore(str(tmp_path / "state.json"))
+    state_store.save(IncrementalState("2024-01-02T00:00:00.000Z", { "arn:a": [ { "unique_id": "arn:a" } ] }, arn_scanned_at="2999-01-01T00:00:00+00:00"))
+    reader = _mock_reader([ _mapped_resource("arn:b", "2024-01-03T00:00:00.000Z") ], resource_arns=[ "arn:b" ])
+
+    inventory = list(IncrementalInventoryCollector(reader, state_store, arn_scan_interval_seconds=86400).collect())
+
+    reader.iter_resource_locations.assert_not_called()
+    assert [ row.unique_id for row in inventory ] == [ "arn:a", "arn:b" ]
+    assert state_store.load().arn_scanned_at == "2999-01-01T00:00:00+00:00"
+
+@pytest.mark.parametrize("high_water_mark, lookback_seconds, expected", [
+    (None, 3600, None),
+    ("2024-01-02T00:00:00.000Z", 0, "2024-01-02T00:00:00.000Z"),
+    ("2024-01-02T00:00:00.000Z", 90, "2024-01-01T23:58:30.000Z"),
+    ("2024-01-02T01:00:00+01:00", 60, "2024-01-01T23:59:00.000Z"),
+])
+def test_given_lookback_then_query_starts_that_long_before_high_water_mark(high_water_mark, lookback_seconds, expected):
+    assert get_captured_after(high_water_mark, lookback_seconds) == expected
+
+def test_given_account_could_not_be_read_then_high_water_mark_is_kept_and_nothing_is_deleted(tmp_path):
+    state_store = LocalIncrementalStateStore(str(tmp_path / "state.json"))
+    state_store.save(IncrementalState("2024-01-02T00:00:00.000Z", { "arn:b": [ { "unique_id": "arn:b" } ] }))
+    reader = _mock_reader([ _mapped_resource("arn:a", "2024-01-03T00:00:00.000Z") ], failed_account_ids=[ "123456789012" ])
+
+    inventory = list(IncrementalInventoryCollector(reader, state_store).collect())
+
+    assert [ row.unique_id for row in inventory ] == [ "arn:b", "arn:a" ]
+    reader.iter_resource_locations.assert_not_called()
+    assert state_store.load().high_water_mark == "2024-01-02T00:00:00.000Z"
+
+def test_given_invalid_high_water_mark_in_state_then_error_is_raised():
+    with pytest.raises(ValueError):
+        IncrementalState.from_json('{ "version": 1, "high_water_mark": "2024\' OR 1=1", "resources": {} }')
+
+def test_given_no_state_object_in_s3_then_no_state_is_loaded():
+    mock_s3_client = Mock()
+    mock_s3_client.get_object.side_effect = ClientError(error_response={'Error': {'Code': 'NoSuchKey'}}, operation_name="get_object")
+
+    assert S3IncrementalStateStore(mock_s3_client, "bucket", "key").load() is None
+
+@patch.dict(os.environ, { "REPORT_TARGET_BUCKET_NAME": "bucket", "REPORT_TARGET_BUCKET_PATH": "inventory-reports" }, clear=True)
+def test_given_no_state_location_then_state_is_stored_next_to_reports():
+    mock_s3_client = Mock()
+    state = IncrementalState("2024-01-02T00:00:00.000Z")
+
+    get_incremental_state_store_from_environment(mock_s3_client).save(state)
+
+    mock_s3_client.put_object.assert_called_with(Bucket="bucket", Key="inventory-reports/incremental-state.json", Body=state.to_json().encode("utf-8"))
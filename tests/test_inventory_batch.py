@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# AWS DISCLAMER
+# ---
+
+# The following files are provided by AWS Professional Services describe the process to create a IAM Policy with description.
+
+# These are non-production ready and are to be used for testing purposes.
+
+# These files is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations under the License.
+
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and Amazon Web Services, Inc.​
+import pytest
+from inventory.mappers import INVENTORY_FIELDS, InventoryBatch, InventoryData, get_sanitize_cache_stats, iter_inventory_batches
+
+def _inventory(count):
+    return [ InventoryData(asset_type="EC2", unique_id=f"i-{index}", ip_address=f"10.0.0.{index}", owner="=team") for index in range(count) ]
+
+def test_given_inventory_data_then_attributes_are_slotted():
+    inventory_data = InventoryData(unique_id="i-1")
+
+    assert not hasattr(inventory_data, "__dict__")
+    with pytest.raises(AttributeError):
+        inventory_data.unknown_field = "foobar"
+
+def test_given_inventory_data_then_dict_round_trip_keeps_every_field():
+    inventory_data = InventoryData(**{ field: f"value-{field}" for field in INVENTORY_FIELDS if field != "extra_tags" }, extra_tags={ "CostCenter": "42" })
+
+    assert list(inventory_data.to_dict()) == list(INVENTORY_FIELDS)
+    assert InventoryData.from_dict(inventory_data.to_dict()).to_dict() == inventory_data.to_dict()
+
+def test_given_inventory_data_then_copy_keeps_every_field_and_shares_values():
+    inventory_data = InventoryData(**{ field: f"value-{field}" for field in INVENTORY_FIELDS if field != "extra_tags" }, extra_tags={ "CostCenter": "42" })
+
+    copied = inventory_data._copy()
+    copied.ip_address = "10.0.0.2"
+
+    assert copied.to_dict() == { **inventory_data.to_dict(), "ip_address": "10.0.0.2" }
+    assert inventory_data.ip_address == "value-ip_address", "Setting a field of the copy must not change the original"
+    assert copied.extra_tags is inventory_data.extra_tags
+
+def test_given_rows_with_repeated_values_then_sanitized_values_are_shared_and_counted():
+    stats_before = get_sanitize_cache_stats()
+
+    # Built at runtime so each row gets its own, equal, string objects, as rows mapped from separate results do
+    first, second = [ InventoryData(hardware_model="".join(["t3.", "micro"]), owner="".join(["=", "team"]), unique_id=f"i-{index}") for index in range(2) ]
+
+    stats = get_sanitize_cache_stats()
+    assert first.hardware_model is second.hardware_model
+    assert first.owner is second.owner and first.owner == "'=team"
+    assert stats["hits"] - stats_before["hits"] >= 2
+    assert stats["size"] <= stats["max_size"]
+
+def test_given_non_string_value_then_it_is_sanitized_to_empty_without_caching():
+    assert InventoryData(owner=["not", "hashable"]).owner == ""
+
+def test_given_batch_then_columns_hold_row_values_and_iteration_returns_rows():
+    inventory = _inventory(3)
+
+    batch = InventoryBatch.from_inventory(inventory)
+
+    assert len(batch) == 3
+    assert batch.column("unique_id") == [ "i-0", "i-1", "i-2" ]
+    assert batch.column("dns_name") == [ None, None, None ]
+    assert list(batch.iter_rows([ "ip_address", "owner" ])) == [ (f"10.0.0.{index}", "'=team") for index in range(3) ]
+    assert [ row.to_dict() for row in batch ] == [ row.to_dict() for row in inventory ]
+
+def test_given_partial_columns_then_missing_fields_are_empty():
+    batch = InventoryBatch({ "unique_id": [ "a", "b" ] })
+
+    assert len(batch) == 2
+    assert batch.column("owner") == [ None, None ]
+
+@pytest.mark.parametrize("columns", [ { "unique_id": [ "a" ], "owner": [] }, { "foobar": [ "a" ] } ])
+def test_given_invalid_columns_then_error_is_raised(columns):
+    with pytest.raises(ValueError):
+        InventoryBatch(columns)
+
+def test_given_inventory_then_batches_are_split_by_batch_size():
+    batches = list(iter_inventory_batches(_inventory(5), batch_size=2))
+
+    assert [ len(batch) for batch in batches ] == [ 2, 2, 1 ]
+    assert [ row.unique_id for batch in batches for row in batch ] == [ f"i-{index}" for index in range(5) ]
@@ -17,15 +17,20 @@ from botocore.exceptions import ClientError
 from callee import String, Contains
 import json
 import os
+import time
 from unittest.mock import MagicMock, Mock, patch, ANY
 import pytest
 from inventory.mappers import DataMapper
 import inventory.readers
 from inventory.readers import AwsConfigInventoryReader
+from inventory.sessions import get_client_cache
+from inventory.throttling import RetryPolicy
 
 def setup_function():
     os.environ["ACCOUNT_LIST"] = '[ { "name": "foo", "id": "210987654321"} ]'
     os.environ["CROSS_ACCOUNT_ROLE_NAME"] = "foobar"
+    # Clients are cached at module scope, so each test starts without the clients of the previous one
+    get_client_cache().clear()
 
 def test_given_valid_arn_then_aws_partition_determined():
     mock_lambda_context = Mock()
@@ -40,7 +45,8 @@ def test_given_valid_arn_then_aws_partition_determined():
 @patch("inventory.readers._logger", autospec=True)
 def test_given_unsupported_resource_type_then_warning_is_logged(mock_logger):
     mock_mapper = Mock(spec=DataMapper)
-    mock_mapper.can_map.return_value = False
+    mock_mapper._get_supported_resource_type.return_value = [ "barfoo" ]
+    mock_mapper._get_configuration_paths.return_value = None
     mock_config_client_factory = Mock()
     mock_config_client_factory.return_value \
                               .select_resource_config \
@@ -59,8 +65,9 @@ def test_given_unsupported_resource_type_then_warning_is_logged(mock_logger):
 def test_given_error_from_boto_then_account_is_skipped_but_others_still_processed(mock_logger):
     os.environ["ACCOUNT_LIST"] = '[ { "name": "foo", "id": "210987654321" }, { "name": "bar", "id": "123456789012" } ]'
     mock_mapper = Mock(spec=DataMapper)
-    mock_mapper.can_map.return_value = True
-    mock_mapper.map.return_value = [ { "test": True }]
+    mock_mapper._get_supported_resource_type.return_value = [ "foobar" ]
+    mock_mapper._get_configuration_paths.return_value = None
+    mock_mapper._map_resource.return_value = [ { "test": True }]
     mock_select_resource_config = Mock(side_effect=[ ClientError(error_response={'Error': {'Code': 'ResourceInUseException'}}, operation_name="select_resource_config"),
                                                     { "NextToken": None,
                                                       "Results": [ json.dumps({ "resourceType": "foobar" }) ] }])
@@ -79,7 +86,8 @@ def test_given_error_from_boto_then_account_is_skipped_but_others_still_processe
 
 def test_given_multiple_resource_pages_from_boto_then_reader_loops_through_all_pages():
     mock_mapper = Mock(spec=DataMapper)
-    mock_mapper.can_map.return_value = False
+    mock_mapper._get_supported_resource_type.return_value = [ "barfoo" ]
+    mock_mapper._get_configuration_paths.return_value = None
     mock_select_resource_config = Mock(side_effect=[{ "NextToken": "nextpage",
                                                       "Results": [ json.dumps({ "resourceType": "foobar" }) ] },
                                                     { "NextToken": None,
@@ -96,3 +104,226 @@ def test_given_multiple_resource_pages_from_boto_then_reader_loops_through_all_p
     assert len(all_inventory) == 0, "no inventory should be returned since there was nothing to map"
     assert len(mock_select_resource_config.mock_calls) == 2, "boto should have been called twice to page through results"
     assert mock_select_resource_config.call_args.kwargs["NextToken"] == "nextpage", "NextToken must use value from previous select_resource_config call"
+
+def test_given_multiple_workers_then_inventory_is_returned_in_account_list_order():
+    os.environ["ACCOUNT_LIST"] = '[ { "name": "foo", "id": "111111111111" }, { "name": "bar", "id": "222222222222" }, { "name": "baz", "id": "333333333333" } ]'
+    mock_lambda_context = Mock()
+    mock_lambda_context.invoked_function_arn = "arn:aws:lambda:us-east-1:123456789012:function:testing"
+    mock_mapper = Mock(spec=DataMapper)
+    mock_mapper._get_supported_resource_type.return_value = [ "foobar" ]
+    mock_mapper._get_configuration_paths.return_value = None
+    mock_mapper._map_resource.side_effect = lambda resource: [ resource["accountId"] ]
+    # Earlier accounts take longer so they finish last
+    delays = { "111111111111": 0.2, "222222222222": 0.1, "333333333333": 0 }
+
+    def get_resources_from_account(account_id, queries=None, region_name=None):
+        time.sleep(delays[account_id])
+        yield [ json.dumps({ "resourceType": "foobar", "accountId": account_id }) ]
+
+    reader = AwsConfigInventoryReader(lambda_context=mock_lambda_context, sts_client=Mock(), mappers=[mock_mapper], max_workers=3)
+    reader._get_resources_from_account = get_resources_from_account
+
+    all_inventory = reader.get_resources_from_all_accounts()
+
+    assert all_inventory == [ "111111111111", "222222222222", "333333333333" ], "inventory should follow ACCOUNT_LIST order"
+
+def test_given_multiple_workers_and_error_from_boto_then_account_is_skipped_but_others_still_processed():
+    os.environ["ACCOUNT_LIST"] = '[ { "name": "foo", "id": "210987654321" }, { "name": "bar", "id": "123456789012" } ]'
+    mock_lambda_context = Mock()
+    mock_lambda_context.invoked_function_arn = "arn:aws:lambda:us-east-1:123456789012:function:testing"
+    mock_mapper = Mock(spec=DataMapper)
+    mock_mapper._get_supported_resource_type.return_value = [ "foobar" ]
+    mock_mapper._get_configuration_paths.return_value = None
+    mock_mapper._map_resource.return_value = [ { "test": True } ]
+
+    def get_config_client(sts_response, region_name=None):
+        client = Mock()
+        if sts_response == "210987654321":
+            client.select_resource_config.side_effect = ClientError(error_response={'Error': {'Code': 'ResourceInUseException'}}, operation_name="select_resource_config")
+        else:
+            client.select_resource_config.return_value = { "NextToken": None,
+                                                           "Results": [ json.dumps({ "resourceType": "foobar" }) ] }
+        return client
+
+    mock_sts_client = Mock()
+    mock_sts_client.assume_role.side_effect = lambda RoleArn, **kwargs: RoleArn.split(":")[4]
+
+    reader = AwsConfigInventoryReader(lambda_context=mock_lambda_context, sts_client=mock_sts_client, mappers=[mock_mapper], max_workers=2)
+    reader._get_config_client = get_config_client
+
+    all_inventory = reader.get_resources_from_all_accounts()
+
+    assert len(all_inventory) == 1, "inventory from the successful account should be returned"
+    assert reader.failed_account_ids == [ "210987654321" ], "failed account should be reported"
+
+def test_given_invalid_worker_count_in_environment_then_error_is_raised():
+    os.environ["ACCOUNT_COLLECTION_MAX_WORKERS"] = "0"
+
+    try:
+        with pytest.raises(ValueError):
+            AwsConfigInventoryReader(lambda_context=Mock(), sts_client=Mock())
+    finally:
+        del os.environ["ACCOUNT_COLLECTION_MAX_WORKERS"]
+
+def test_given_multiple_resource_pages_then_rows_are_yielded_before_next_page_is_requested():
+    mock_lambda_context = Mock()
+    mock_lambda_context.invoked_function_arn = "arn:aws:lambda:us-east-1:123456789012:function:testing"
+    mock_mapper = Mock(spec=DataMapper)
+    mock_mapper._get_supported_resource_type.return_value = [ "foobar" ]
+    mock_mapper._get_configuration_paths.return_value = None
+    mock_mapper._map_resource.side_effect = lambda resource: [ resource["page"] ]
+    mock_select_resource_config = Mock(side_effect=[{ "NextToken": "nextpage",
+                                                      "Results": [ json.dumps({ "resourceType": "foobar", "page": 1 }) ] },
+                                                    { "NextToken": None,
+                                                      "Results": [ json.dumps({ "resourceType": "foobar", "page": 2 }) ] }])
+    mock_config_client_factory = Mock()
+    mock_config_client_factory.return_value \
+                              .select_resource_config = mock_select_resource_config
+
+    reader = AwsConfigInventoryReader(lambda_context=mock_lambda_context, sts_client=Mock(), mappers=[mock_mapper])
+    reader._get_config_client = mock_config_client_factory
+
+    inventory = reader.iter_resources_from_all_accounts()
+
+    assert next(inventory) == 1
+    assert len(mock_select_resource_config.mock_calls) == 1, "second page should not be requested until the first has been consumed"
+    assert list(inventory) == [ 2 ]
+
+def test_given_two_mappers_support_same_resource_type_then_error_is_raised():
+    first_mapper = Mock(spec=DataMapper)
+    first_mapper._get_supported_resource_type.return_value = [ "foobar" ]
+    second_mapper = Mock(spec=DataMapper)
+    second_mapper._get_supported_resource_type.return_value = [ "foobar" ]
+
+    with pytest.raises(ValueError):
+        AwsConfigInventoryReader(lambda_context=Mock(), sts_client=Mock(), mappers=[first_mapper, second_mapper])
+
+def test_given_repeated_collections_then_role_is_assumed_once_per_account():
+    os.environ["ACCOUNT_LIST"] = '[ { "name": "foo", "id": "111111111111"}, { "name": "bar", "id": "222222222222"} ]'
+    mock_lambda_context = Mock()
+    mock_lambda_context.invoked_function_arn = "arn:aws:lambda:us-east-1:123456789012:function:testing"
+    mock_mapper = Mock(spec=DataMapper)
+    mock_mapper._get_supported_resource_type.return_value = [ "barfoo" ]
+    mock_mapper._get_configuration_paths.return_value = None
+    mock_sts_client = Mock()
+    mock_config_client_factory = Mock()
+    mock_config_client_factory.return_value.select_resource_config.return_value = { "Results": [] }
+
+    for _ in range(2):
+        reader = AwsConfigInventoryReader(lambda_context=mock_lambda_context, sts_client=mock_sts_client, mappers=[mock_mapper])
+        reader._get_config_client = mock_config_client_factory
+        reader.get_resources_from_all_accounts()
+
+    assert [ call.kwargs["RoleArn"] for call in mock_sts_client.assume_role.call_args_list ] == \
+        [ "arn:aws:iam::111111111111:role/foobar", "arn:aws:iam::222222222222:role/foobar" ]
+    assert mock_config_client_factory.call_count == 2
+
+@patch.dict(os.environ, { "REGIONS": "us-east-1, us-west-2" })
+def test_given_regions_then_every_account_and_region_pair_is_collected_in_order():
+    os.environ["ACCOUNT_LIST"] = '[ { "name": "foo", "id": "111111111111"}, { "name": "bar", "id": "222222222222", "regions": [ "eu-west-1" ] } ]'
+    mock_lambda_context = Mock()
+    mock_lambda_context.invoked_function_arn = "arn:aws:lambda:us-east-1:123456789012:function:testing"
+    mock_mapper = Mock(spec=DataMapper)
+    mock_mapper._get_supported_resource_type.return_value = [ "foobar" ]
+    mock_mapper._get_configuration_paths.return_value = None
+    mock_mapper._map_resource.side_effect = lambda resource: [ resource["account_region"] ]
+    mock_sts_client = Mock()
+    mock_sts_client.assume_role.side_effect = lambda RoleArn, **kwargs: RoleArn.split(":")[4]
+
+    def get_config_client(sts_response, region_name=None):
+        client = Mock()
+        client.select_resource_config.return_value = { "Results": [ json.dumps({ "resourceType": "foobar", "account_region": f"{sts_response}/{region_name}" }) ] }
+        return client
+
+    reader = AwsConfigInventoryReader(lambda_context=mock_lambda_context, sts_client=mock_sts_client, mappers=[mock_mapper], max_workers=3)
+    reader._get_config_client = get_config_client
+
+    with patch("inventory.readers._logger") as mock_logger:
+        all_inventory = reader.get_resources_from_all_accounts()
+
+    assert all_inventory == [ "111111111111/us-east-1", "111111111111/us-west-2", "222222222222/eu-west-1" ]
+    timing_logs = [ call.args[1:4] for call in mock_logger.info.call_args_list if call.args[0].startswith("collected %s items") ]
+    assert sorted(timing_logs) == [ (1, "111111111111", "us-east-1"), (1, "111111111111", "us-west-2"), (1, "222222222222", "eu-west-1") ]
+
+def test_given_arns_by_account_region_then_only_those_pairs_are_queried_for_their_own_arns():
+    os.environ["ACCOUNT_LIST"] = '[ { "name": "foo", "id": "111111111111", "regions": [ "us-east-1", "us-west-2" ] }, { "name": "bar", "id": "222222222222", "regions": [ "eu-west-1" ] } ]'
+    mock_lambda_context = Mock()
+    mock_lambda_context.invoked_function_arn = "arn:aws:lambda:us-east-1:123456789012:function:testing"
+    mock_mapper = Mock(spec=DataMapper)
+    mock_mapper._get_supported_resource_type.return_value = [ "foobar" ]
+    mock_mapper._get_configuration_paths.return_value = None
+    mock_mapper._map_resource.side_effect = lambda resource: []
+    mock_sts_client = Mock()
+    mock_sts_client.assume_role.side_effect = lambda RoleArn, **kwargs: RoleArn.split(":")[4]
+    queries = []
+
+    def get_config_client(sts_response, region_name=None):
+        client = Mock()
+        client.select_resource_config.side_effect = lambda Expression, NextToken: queries.append((sts_response, region_name, Expression)) or { "Results": [] }
+        return client
+
+    reader = AwsConfigInventoryReader(lambda_context=mock_lambda_context, sts_client=mock_sts_client, mappers=[mock_mapper], max_workers=1)
+    reader._get_config_client = get_config_client
+
+    list(reader.iter_mapped_resources(arns={ ("222222222222", "eu-west-1"): [ "arn:a", "arn:b" ], ("111111111111", "us-west-2"): [ "arn:c" ] }))
+
+    assert [ (account_id, region_name, query.split("arn IN ")[1]) for account_id, region_name, query in queries ] == \
+        [ ("111111111111", "us-west-2", "('arn:c')"), ("222222222222", "eu-west-1", "('arn:a', 'arn:b')") ]
+
+def test_given_error_in_one_region_then_other_regions_are_still_collected():
+    os.environ["ACCOUNT_LIST"] = '[ { "name": "foo", "id": "111111111111", "regions": [ "us-east-1", "us-west-2" ] } ]'
+    mock_lambda_context = Mock()
+    mock_lambda_context.invoked_function_arn = "arn:aws:lambda:us-east-1:123456789012:function:testing"
+    mock_mapper = Mock(spec=DataMapper)
+    mock_mapper._get_supported_resource_type.return_value = [ "foobar" ]
+    mock_mapper._get_configuration_paths.return_value = None
+    mock_mapper._map_resource.side_effect = lambda resource: [ resource["region"] ]
+
+    def get_config_client(sts_response, region_name=None):
+        client = Mock()
+        if region_name == "us-east-1":
+            client.select_resource_config.side_effect = ClientError(error_response={'Error': {'Code': 'AccessDenied'}}, operation_name="select_resource_config")
+        else:
+            client.select_resource_config.return_value = { "Results": [ json.dumps({ "resourceType": "foobar", "region": region_name }) ] }
+        return client
+
+    reader = AwsConfigInventoryReader(lambda_context=mock_lambda_context, sts_client=Mock(), mappers=[mock_mapper])
+    reader._get_config_client = get_config_client
+
+    assert reader.get_resources_from_all_accounts() == [ "us-west-2" ]
+    assert reader.failed_account_ids == [ "111111111111" ]
+
+def test_given_throttling_error_then_page_is_retried_and_account_is_not_skipped():
+    mock_lambda_context = Mock()
+    mock_lambda_context.invoked_function_arn = "arn:aws:lambda:us-east-1:123456789012:function:testing"
+    mock_mapper = Mock(spec=DataMapper)
+    mock_mapper._get_supported_resource_type.return_value = [ "foobar" ]
+    mock_mapper._get_configuration_paths.return_value = None
+    mock_mapper._map_resource.side_effect = lambda resource: [ resource["page"] ]
+    mock_config_client = Mock()
+    mock_config_client.select_resource_config.side_effect = [ { "NextToken": "2", "Results": [ json.dumps({ "resourceType": "foobar", "page": 1 }) ] },
+                                                              ClientError(error_response={'Error': {'Code': 'ThrottlingException'}}, operation_name="select_resource_config"),
+                                                              { "Results": [ json.dumps({ "resourceType": "foobar", "page": 2 }) ] } ]
+    backoffs = []
+
+    reader = AwsConfigInventoryReader(lambda_context=mock_lambda_context, sts_client=Mock(), mappers=[mock_mapper],
+                                      retry_policy=RetryPolicy(sleep=backoffs.append))
+    reader._get_config_client = Mock(return_value=mock_config_client)
+
+    assert reader.get_resources_from_all_accounts() == [ 1, 2 ]
+    assert reader.failed_account_ids == []
+    assert mock_config_client.select_resource_config.call_args_list[2].kwargs["NextToken"] == "2"
+    assert len(backoffs) == 1
+    assert reader.retry_stats.to_dict()["retries_by_api"] == { "select_resource_config": 1 }
+
+@pytest.mark.parametrize("account_list", [ '[ { "name": "foo", "id": "111111111111", "regions": [] } ]',
+                                           '[ { "name": "foo", "id": "111111111111", "regions": [ 1 ] } ]' ])
+def test_given_invalid_account_regions_then_error_is_raised(account_list):
+    os.environ["ACCOUNT_LIST"] = account_list
+    mock_mapper = Mock(spec=DataMapper)
+    mock_mapper._get_supported_resource_type.return_value = [ "foobar" ]
+    mock_mapper._get_configuration_paths.return_value = None
+    reader = AwsConfigInventoryReader(lambda_context=Mock(), sts_client=Mock(), mappers=[mock_mapper])
+
+    with pytest.raises(ValueError):
+        reader.get_resources_from_all_accounts()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# AWS DISCLAMER
+# ---
+
+# The following files are provided by AWS Professional Services describe the process to create a IAM Policy with description.
+
+# These are non-production ready and are to be used for testing purposes.
+
+# These files is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations under the License.
+
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and Amazon Web Services, Inc.​
+import json
+import os
+from unittest.mock import patch
+import pytest
+from inventory.mappers import MapperRegistry, get_default_mappers
+from inventory.queries import MAX_ARNS_PER_QUERY, build_resource_queries, build_resource_query, select_resource_types
+
+@pytest.fixture()
+def registry():
+    return MapperRegistry(get_default_mappers())
+
+@patch.dict(os.environ, {}, clear=True)
+def test_given_no_filters_then_all_supported_resource_types_are_queried(registry):
+    resource_types = select_resource_types(registry)
+
+    assert resource_types == registry.get_supported_resource_types()
+    assert "AWS::EC2::NetworkInterface" in resource_types
+
+@patch.dict(os.environ, { "RESOURCE_TYPES_INCLUDE": "AWS::EC2::Instance, AWS::EC2::NetworkInterface" }, clear=True)
+def test_given_include_filter_in_environment_then_only_included_types_are_queried(registry):
+    assert select_resource_types(registry) == [ "AWS::EC2::Instance", "AWS::EC2::NetworkInterface" ]
+
+@patch.dict(os.environ, { "RESOURCE_TYPES_EXCLUDE": "AWS::S3::Bucket" }, clear=True)
+def test_given_exclude_filter_in_environment_then_excluded_types_are_not_queried(registry):
+    resource_types = select_resource_types(registry)
+
+    assert "AWS::S3::Bucket" not in resource_types
+    assert len(resource_types) == len(registry.get_supported_resource_types()) - 1
+
+@patch.dict(os.environ, {}, clear=True)
+def test_given_filter_for_type_without_mapper_then_error_is_raised(registry):
+    with pytest.raises(ValueError):
+        select_resource_types(registry, include_resource_types=[ "AWS::EC2::Foobar" ])
+
+@patch.dict(os.environ, {}, clear=True)
+def test_given_filters_exclude_every_type_then_error_is_raised(registry):
+    with pytest.raises(ValueError):
+        select_resource_types(registry, include_resource_types=[ "AWS::S3::Bucket" ], exclude_resource_types=[ "AWS::S3::Bucket" ])
+
+def test_given_resource_types_then_query_filters_on_each_type():
+    query = build_resource_query([ "arn", "resourceType" ], [ "AWS::EC2::Instance", "AWS::S3::Bucket" ])
+
+    assert query == "SELECT arn, resourceType WHERE resourceType IN ('AWS::EC2::Instance', 'AWS::S3::Bucket')"
+
+def test_given_projection_then_declared_configuration_paths_are_selected_and_other_types_select_full_configuration(registry):
+    queries = build_resource_queries([ "arn" ], registry, [ "AWS::EC2::Instance", "AWS::DynamoDB::Table", "AWS::RDS::DBInstance" ])
+
+    assert len(queries) == 2, "types with declared paths and types needing the full configuration are queried separately"
+    assert queries[0].startswith("SELECT arn, configuration.instanceId, ")
+    assert "configuration.networkInterfaces" in queries[0]
+    assert "'AWS::EC2::Instance', 'AWS::DynamoDB::Table'" in queries[0]
+    assert queries[1] == "SELECT arn, configuration WHERE resourceType IN ('AWS::RDS::DBInstance')"
+
+def test_given_projection_is_disabled_then_single_query_selects_full_configuration(registry):
+    queries = build_resource_queries([ "arn" ], registry, [ "AWS::EC2::Instance", "AWS::RDS::DBInstance" ], projection=False)
+
+    assert queries == [ "SELECT arn, configuration WHERE resourceType IN ('AWS::EC2::Instance', 'AWS::RDS::DBInstance')" ]
+
+@pytest.mark.parametrize("sample_file_name", [ "sample_ec2.json", "sample_dynamo_table.json" ])
+def test_given_configuration_limited_to_declared_paths_then_mapping_is_unchanged(registry, sample_file_name):
+    with open(os.path.join(os.path.dirname(__file__), "sample_config_query_results", sample_file_name)) as file_data:
+        full_resource = json.load(file_data)
+    configuration_paths = registry.get_configuration_paths(full_resource["resourceType"])
+    projected_resource = dict(full_resource)
+    projected_resource["configuration"] = { key: value for key, value in full_resource["configuration"].items() if key in configuration_paths }
+
+    assert [ row.to_dict() for row in registry.map(projected_resource) ] == [ row.to_dict() for row in registry.map(full_resource) ]
+
+def test_given_captured_after_then_queries_only_select_resources_captured_since():
+    query = build_resource_query([ "arn" ], [ "AWS::EC2::Instance" ], captured_after="2024-01-02T00:00:00.000Z")
+
+    assert query == "SELECT arn WHERE resourceType IN ('AWS::EC2::Instance') AND configurationItemCaptureTime >= '2024-01-02T00:00:00.000Z'"
+
+def test_given_arns_then_queries_select_those_resources_in_chunks(registry):
+    arns = [ f"arn:aws:ec2:us-east-1:123456789012:instance/i-{index}" for index in range(MAX_ARNS_PER_QUERY + 1) ]
+
+    queries = build_resource_queries([ "arn" ], registry, [ "AWS::EC2::Instance" ], projection=False, arns=arns)
+
+    assert len(queries) == 2
+    assert queries[0].endswith(f" AND arn IN ({', '.join(repr(arn) for arn in arns[:MAX_ARNS_PER_QUERY])})")
+    assert queries[1].endswith(f" AND arn IN ('{arns[-1]}')")
+    assert build_resource_queries([ "arn" ], registry, [ "AWS::EC2::Instance" ], arns=[]) == []
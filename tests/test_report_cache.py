@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# AWS DISCLAMER
+# ---
+
+# The following files are provided by AWS Professional Services describe the process to create a IAM Policy with description.
+
+# These are non-production ready and are to be used for testing purposes.
+
+# These files is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations under the License.
+
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and Amazon Web Services, Inc.​
+from unittest.mock import Mock
+from botocore.exceptions import ClientError
+from inventory.mappers import InventoryBatch, InventoryData, iter_inventory_rows
+from inventory.report_cache import (InventoryDigest, LocalReportDigestStore, ReportDigest, collect_with_digest, get_report_digest_store_from_environment,
+                                    get_unchanged_report)
+from inventory.reports import DeliverReportCommandHandler
+
+SETTINGS = { "worksheet": "Inventory", "extra_tag_columns": [] }
+
+def _inventory():
+    return [ InventoryData(unique_id="i-1", ip_address="10.0.0.1", extra_tags={ "A": "1", "B": "2" }),
+             InventoryData(unique_id="i-2", ip_address="10.0.0.2"),
+             InventoryData(unique_id="db-1") ]
+
+def _digest(inventory, settings=SETTINGS):
+    return collect_with_digest(inventory, settings)[1]
+
+def test_given_same_rows_in_a_different_order_or_batching_then_digest_is_the_same():
+    rows = _inventory()
+    reordered = [ InventoryData(unique_id="db-1"),
+                  InventoryData(unique_id="i-1", ip_address="10.0.0.1", extra_tags={ "B": "2", "A": "1" }),
+                  InventoryData(unique_id="i-2", ip_address="10.0.0.2") ]
+
+    assert _digest(rows) == _digest(reordered) == _digest([ InventoryBatch.from_inventory(rows[:2]), rows[2] ])
+
+def test_given_changed_rows_or_settings_then_digest_changes():
+    digest = _digest(_inventory())
+    changed = _inventory()
+    changed[1].owner = "team"
+
+    assert _digest(changed) != digest
+    assert _digest(_inventory() + [ InventoryData(unique_id="db-1") ]) != digest, "A duplicated row must change the digest"
+    assert _digest(_inventory(), { **SETTINGS, "extra_tag_columns": [ "CostCenter" ] }) != digest
+    assert InventoryDigest(SETTINGS).hexdigest() != digest
+
+def test_given_mixed_rows_and_batches_then_collected_batches_keep_row_order():
+    rows = _inventory()
+
+    batches, _ = collect_with_digest([ rows[0], InventoryBatch.from_inventory([ rows[1] ]), rows[2] ], SETTINGS)
+
+    assert all(isinstance(batch, InventoryBatch) for batch in batches)
+    assert list(iter_inventory_rows(batches, [ "unique_id" ])) == [ ("i-1",), ("i-2",), ("db-1",) ]
+
+def test_given_matching_digest_then_previous_reports_are_returned(tmp_path):
+    store = LocalReportDigestStore(str(tmp_path / "report-digest.json"))
+    report_urls = { "xlsx": "https://bucket.s3.amazonaws.com/reports/report.xlsx", "csv": "https://bucket.s3.amazonaws.com/reports/report.csv" }
+
+    assert get_unchanged_report(store, "abc") is None, "No report has been delivered yet"
+
+    store.save(ReportDigest("abc", report_urls, 3))
+
+    assert get_unchanged_report(store, "abc").report_urls == report_urls
+    assert get_unchanged_report(store, "def") is None
+    assert get_unchanged_report(store, "abc", lambda report_url: not report_url.endswith(".csv")) is None, "Deleted reports must be written again"
+    assert store.load().row_count == 3
+
+def test_given_unreadable_digest_then_report_is_not_skipped(tmp_path):
+    (tmp_path / "report-digest.json").write_text('{ "version": 0 }')
+
+    assert get_unchanged_report(LocalReportDigestStore(str(tmp_path / "report-digest.json")), "abc") is None
+
+def test_given_no_digest_location_then_it_defaults_next_to_the_reports(monkeypatch):
+    monkeypatch.delenv("REPORT_DIGEST_LOCATION", raising=False)
+    monkeypatch.setenv("REPORT_TARGET_BUCKET_NAME", "bucket")
+    monkeypatch.setenv("REPORT_TARGET_BUCKET_PATH", "reports")
+
+    assert get_report_digest_store_from_environment(Mock()).location == "s3://bucket/reports/report-digest.json"
+
+def test_given_report_url_then_its_existence_is_checked_in_the_bucket():
+    s3_client = Mock()
+    report_handler = DeliverReportCommandHandler(s3_client)
+
+    assert report_handler.report_exists("https://bucket.s3.amazonaws.com/reports/report.xlsx")
+    s3_client.head_object.assert_called_with(Bucket="bucket", Key="reports/report.xlsx")
+
+    s3_client.head_object.side_effect = ClientError({ "Error": { "Code": "404" } }, "HeadObject")
+    assert not report_handler.report_exists("https://bucket.s3.amazonaws.com/reports/report.xlsx")
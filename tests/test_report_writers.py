@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# AWS DISCLAMER
+# ---
+
+# The following files are provided by AWS Professional Services describe the process to create a IAM Policy with description.
+
+# These are non-production ready and are to be used for testing purposes.
+
+# These files is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations under the License.
+
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and Amazon Web Services, Inc.​
+import csv
+import gzip
+import io
+import json
+from unittest.mock import Mock, patch
+import pytest
+from openpyxl import load_workbook
+from inventory.mappers import InventoryBatch, InventoryData
+from inventory.report_writers import (REPORT_FIELDS, CsvReportWriter, JsonLinesReportWriter, ParquetReportWriter, WorkbookReportWriter,
+                                      get_report_compression_from_environment, get_report_writers)
+from inventory.reports import FIELD_MAPPINGS, DeliverReportCommandHandler
+from inventory.uploads import COMPRESSION_GZIP
+
+def _inventory():
+    return [ InventoryBatch.from_inventory([ InventoryData(asset_type="EC2", unique_id="i-1", ip_address="10.0.0.1", owner="=team",
+                                                          extra_tags={ "CostCenter": "42" }) ]),
+             InventoryData(asset_type="RDS", unique_id="db-1, primary", dns_name='db "main"') ]
+
+def test_given_report_fields_then_they_follow_the_workbook_columns():
+    assert REPORT_FIELDS == [ attr for _, attr in FIELD_MAPPINGS ]
+
+def test_given_inventory_then_csv_has_heading_and_a_row_per_inventory_row():
+    output_file = io.BytesIO()
+
+    CsvReportWriter().write(_inventory(), output_file)
+
+    rows = list(csv.reader(io.StringIO(output_file.getvalue().decode("utf-8"))))
+    assert rows[0] == REPORT_FIELDS
+    assert [ dict(zip(rows[0], row)) for row in rows[1:] ] == [ { **{ field: "" for field in REPORT_FIELDS }, "asset_type": "EC2", "unique_id": "i-1",
+                                                                  "ip_address": "10.0.0.1", "owner": "'=team" },
+                                                                { **{ field: "" for field in REPORT_FIELDS }, "asset_type": "RDS", "unique_id": "db-1, primary",
+                                                                  "dns_name": 'db "main"' } ]
+    assert not output_file.closed, "The writer must leave the output file open for delivery to finish it"
+
+def test_given_extra_tag_columns_then_csv_has_a_prefixed_column_per_tag():
+    output_file = io.BytesIO()
+
+    with patch.dict("os.environ", { "EXTRA_TAG_COLUMNS": "CostCenter" }):
+        CsvReportWriter().write(_inventory(), output_file)
+
+    rows = list(csv.reader(io.StringIO(output_file.getvalue().decode("utf-8"))))
+    assert rows[0][-1] == "tag:CostCenter"
+    assert [ row[-1] for row in rows[1:] ] == [ "42", "" ]
+
+def test_given_inventory_then_json_lines_has_an_object_per_row():
+    output_file = io.BytesIO()
+
+    with patch.dict("os.environ", { "EXTRA_TAG_COLUMNS": "CostCenter" }):
+        JsonLinesReportWriter().write(_inventory(), output_file)
+
+    rows = [ json.loads(line) for line in output_file.getvalue().decode("utf-8").splitlines() ]
+    assert [ (row["unique_id"], row["owner"], row["tag:CostCenter"]) for row in rows ] == [ ("i-1", "'=team", "42"), ("db-1, primary", None, None) ]
+    assert list(rows[0]) == REPORT_FIELDS + [ "tag:CostCenter" ]
+
+def test_given_inventory_then_parquet_has_a_string_column_per_field():
+    pyarrow_parquet = pytest.importorskip("pyarrow.parquet")
+    output_file = io.BytesIO()
+
+    ParquetReportWriter().write(_inventory(), output_file)
+
+    table = pyarrow_parquet.read_table(io.BytesIO(output_file.getvalue()))
+    assert table.column_names == REPORT_FIELDS
+    assert table.column("unique_id").to_pylist() == [ "i-1", "db-1, primary" ]
+
+def test_given_formats_then_writers_are_returned_in_order_without_repeats():
+    writers = get_report_writers(formats="CSV, xlsx,csv,jsonl")
+
+    assert [ type(writer) for writer in writers ] == [ CsvReportWriter, WorkbookReportWriter, JsonLinesReportWriter ]
+    assert [ type(writer) for writer in get_report_writers() ] == [ WorkbookReportWriter ], "Only the workbook is written by default"
+
+def test_given_unknown_format_or_compression_then_error_is_raised():
+    with pytest.raises(ValueError):
+        get_report_writers(formats="xlsx,pdf")
+
+    with patch.dict("os.environ", { "REPORT_COMPRESSION": "bzip2" }):
+        with pytest.raises(ValueError):
+            get_report_compression_from_environment()
+
+def test_given_compression_then_only_text_formats_are_compressed_on_delivery(tmp_path):
+    uploaded = {}
+    s3_client = Mock()
+    s3_client.put_object.side_effect = lambda Bucket, Key, Body: uploaded.update({ Key.rsplit("-", 1)[-1]: Body.read() })
+    environment = { "REPORT_TARGET_BUCKET_NAME": "bucket", "REPORT_TARGET_BUCKET_PATH": "reports", "REPORT_WORKSHEET_NAME": "Inventory" }
+
+    with patch.dict("os.environ", environment), patch("inventory.reports._workbook_output_file_path", str(tmp_path / "report.xlsx")):
+        report_handler = DeliverReportCommandHandler(s3_client, "file")
+        csv_url = report_handler.deliver(CsvReportWriter(), _inventory(), COMPRESSION_GZIP)
+        workbook_url = report_handler.deliver(WorkbookReportWriter(), _inventory(), COMPRESSION_GZIP)
+
+    assert csv_url.endswith(".csv.gz") and workbook_url.endswith(".xlsx")
+    csv_report, = [ data for name, data in uploaded.items() if name.endswith(".csv.gz") ]
+    assert gzip.decompress(csv_report).decode("utf-8").splitlines()[0] == ",".join(REPORT_FIELDS)
+    workbook_report, = [ data for name, data in uploaded.items() if name.endswith(".xlsx") ]
+    assert load_workbook(io.BytesIO(workbook_report))["Inventory"].cell(row=3, column=2).value == "i-1"
+
+def test_given_parquet_without_pyarrow_then_error_is_raised():
+    with patch("inventory.report_writers.pyarrow", None):
+        with pytest.raises(ValueError):
+            get_report_writers(formats="parquet")
@@ -14,11 +14,16 @@
 # This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
 # http://aws.amazon.com/agreement or other written agreement between Customer and Amazon Web Services, Inc.​
 import os
+import re
+import zipfile
 from unittest.mock import Mock, mock_open, patch, ANY
 from callee import String, Contains
 import pytest
+from openpyxl import load_workbook
 import inventory.reports
+from inventory.mappers import InventoryBatch, InventoryData, iter_inventory_batches
 from inventory.reports import CreateReportCommandHandler, DeliverReportCommandHandler
+from inventory.streaming_workbook import StreamingTemplateWorkbook
 
 @patch('inventory.reports.load_workbook')
 def test_given_empty_inventory_list_then_report_is_still_written(mock_load_workbook):
@@ -42,4 +47,98 @@ def test_given_report_file_exists_then_delivery_to_s3_uses_correct_file_naming_c
     # Only verifying that we try to format the datetime correctly as that's the most import part of the report file name
     mock_datetime.now.return_value.strftime.assert_called_with("%Y-%m-%d-%H-%M-%S")
     mock_s3_client.put_object.assert_called_with(Key=ANY, Bucket=test_bucket_name, Body=ANY)
-    assert report_url is not None and len(report_url) > 0, "report URL should be returned"
\ No newline at end of file
+    assert report_url is not None and len(report_url) > 0, "report URL should be returned"
+@patch('inventory.reports.load_workbook')
+def test_given_inventory_generator_then_each_row_is_written(mock_load_workbook):
+    mock_worksheet = mock_load_workbook.return_value.__getitem__.return_value
+    mock_load_workbook.return_value.sheetnames = [ "Inventory" ]
+    os.environ["REPORT_WORKSHEET_NAME"] = "Inventory"
+    report_handler = CreateReportCommandHandler()
+
+    report_handler.execute(InventoryData(unique_id=f"id-{index}") for index in range(3))
+
+    written_values = [ call.kwargs["value"] for call in mock_worksheet.cell.mock_calls ]
+    assert written_values == [ "id-0", "id-1", "id-2" ]
+    mock_load_workbook.return_value.save.assert_called()
+
+@patch('inventory.reports.load_workbook')
+def test_given_inventory_batches_and_rows_then_rows_are_written_in_order(mock_load_workbook):
+    mock_worksheet = mock_load_workbook.return_value.__getitem__.return_value
+    mock_load_workbook.return_value.sheetnames = [ "Inventory" ]
+    os.environ["REPORT_WORKSHEET_NAME"] = "Inventory"
+    report_handler = CreateReportCommandHandler()
+
+    report_handler.execute([ InventoryBatch.from_inventory(InventoryData(unique_id=f"id-{index}") for index in range(2)),
+                             InventoryData(unique_id="id-2"),
+                             InventoryBatch({ "unique_id": [ "id-3" ] }) ])
+
+    written_values = [ call.kwargs["value"] for call in mock_worksheet.cell.mock_calls ]
+    assert written_values == [ "id-0", "id-1", "id-2", "id-3" ]
+
+def _load_worksheet_cells(file_name):
+    workbook = load_workbook(file_name)
+    cells = {}
+    for worksheet in workbook.worksheets:
+        for row in worksheet.iter_rows():
+            for cell in row:
+                cells[(worksheet.title, cell.coordinate)] = (cell.value, repr(cell.font), repr(cell.fill), repr(cell.border),
+                                                             repr(cell.alignment), cell.number_format, repr(cell.protection))
+    return cells, { worksheet.title: sorted(str(merged) for merged in worksheet.merged_cells.ranges) for worksheet in workbook.worksheets }
+
+def test_given_streaming_write_mode_then_report_matches_standard_write_mode(tmp_path):
+    os.environ["REPORT_WORKSHEET_NAME"] = "Inventory"
+    # Enough rows to run past the end of the rows defined in the template
+    inventory = [ InventoryData(asset_type="EC2", unique_id=f"i-{index:017}", ip_address=f"10.0.{index // 256}.{index % 256}",
+                                is_virtual="Yes", dns_name="=cmd|' /C calc'!A0", owner="  <team & co>  ")
+                  for index in range(1800) ]
+    inventory.insert(1, InventoryData())
+    standard_output = str(tmp_path / "standard.xlsx")
+    streaming_output = str(tmp_path / "streaming.xlsx")
+
+    with patch("inventory.reports._workbook_output_file_path", standard_output):
+        CreateReportCommandHandler(write_mode="standard").execute(inventory)
+    with patch("inventory.reports._workbook_output_file_path", streaming_output):
+        CreateReportCommandHandler(write_mode="streaming").execute(iter(inventory))
+
+    assert _load_worksheet_cells(streaming_output) == _load_worksheet_cells(standard_output)
+
+    batched_output = str(tmp_path / "batched.xlsx")
+    with patch("inventory.reports._workbook_output_file_path", batched_output):
+        CreateReportCommandHandler(write_mode="streaming").execute(iter_inventory_batches(inventory, batch_size=500))
+
+    assert _load_worksheet_cells(batched_output) == _load_worksheet_cells(standard_output)
+
+def test_given_template_row_without_number_then_streaming_write_raises_clear_error(tmp_path):
+    template_file_name = str(tmp_path / "template.xlsx")
+    with zipfile.ZipFile(inventory.reports._workbook_template_file_name) as template, zipfile.ZipFile(template_file_name, "w") as changed_template:
+        worksheet_part_name = StreamingTemplateWorkbook(template_file_name, "Inventory")._get_worksheet_part_name(template)
+        for item in template.infolist():
+            document = template.read(item)
+            if item.filename == worksheet_part_name:
+                document = re.sub(rb'<row r="\d+"', b"<row", document, count=1)
+            changed_template.writestr(item, document)
+
+    with pytest.raises(ValueError, match="unexpected workbook template structure"):
+        StreamingTemplateWorkbook(template_file_name, "Inventory").save(str(tmp_path / "report.xlsx"), 3, [])
+
+@pytest.mark.parametrize("write_mode", [ "standard", "streaming" ])
+def test_given_extra_tag_columns_then_they_are_written_after_template_columns_with_headings(write_mode, tmp_path):
+    os.environ["REPORT_WORKSHEET_NAME"] = "Inventory"
+    output = str(tmp_path / f"{write_mode}.xlsx")
+    inventory = [ InventoryData(unique_id="i-1", extra_tags={ "CostCenter": "42", "Environment": "=prod" }),
+                  InventoryData(unique_id="i-2", extra_tags={ "CostCenter": "", "Environment": "dev" }),
+                  InventoryData(unique_id="i-3") ]
+
+    with patch.dict(os.environ, { "EXTRA_TAG_COLUMNS": "CostCenter, Environment" }), \
+         patch("inventory.reports._workbook_output_file_path", output):
+        CreateReportCommandHandler(write_mode=write_mode).execute(inventory)
+
+    worksheet = load_workbook(output)["Inventory"]
+    assert [ worksheet.cell(column=26, row=row).value for row in range(2, 6) ] == [ "CostCenter", "42", None, None ]
+    assert [ worksheet.cell(column=27, row=row).value for row in range(2, 6) ] == [ "Environment", "'=prod", "dev", None ]
+    assert worksheet.cell(column=2, row=2).value == "UNIQUE ASSET IDENTIFIER"
+    assert [ worksheet.cell(column=2, row=row).value for row in range(3, 6) ] == [ "i-1", "i-2", "i-3" ]
+
+def test_given_unknown_write_mode_then_error_is_raised():
+    with pytest.raises(ValueError):
+        CreateReportCommandHandler(write_mode="foobar")
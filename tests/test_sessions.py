@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# AWS DISCLAMER
+# ---
+
+# The following files are provided by AWS Professional Services describe the process to create a IAM Policy with description.
+
+# These are non-production ready and are to be used for testing purposes.
+
+# These files is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations under the License.
+
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and Amazon Web Services, Inc.​
+from datetime import datetime, timedelta, timezone
+from unittest.mock import Mock
+from inventory.sessions import ClientCache, get_assumed_role_client, get_client, get_credentials_expiration
+
+_NOW = datetime(2024, 1, 1, 12, 0, tzinfo=timezone.utc)
+
+class FakeClock():
+    def __init__(self):
+        self.now = _NOW
+
+    def __call__(self):
+        return self.now
+
+def _sts_client():
+    sts_client = Mock()
+    sts_client.assume_role.side_effect = lambda RoleArn, **kwargs: { "Credentials": { "AccessKeyId": RoleArn, "Expiration": _NOW + timedelta(minutes=15) } }
+    return sts_client
+
+def test_given_cached_client_then_role_is_not_assumed_again():
+    sts_client = _sts_client()
+    client_cache = ClientCache(clock=FakeClock())
+
+    first_client = get_assumed_role_client(sts_client, "arn:aws:iam::111111111111:role/foobar", "session", "us-east-1", lambda sts_response: object(), client_cache)
+    second_client = get_assumed_role_client(sts_client, "arn:aws:iam::111111111111:role/foobar", "session", "us-east-1", lambda sts_response: object(), client_cache)
+
+    assert first_client is second_client
+    assert sts_client.assume_role.call_count == 1
+    assert (client_cache.hits, client_cache.misses) == (1, 2)
+
+def test_given_different_role_or_region_then_separate_clients_share_the_credentials_of_the_role():
+    sts_client = _sts_client()
+    client_cache = ClientCache(clock=FakeClock())
+
+    for role_arn, region_name in [ ("arn:aws:iam::111111111111:role/foobar", "us-east-1"), ("arn:aws:iam::222222222222:role/foobar", "us-east-1"),
+                                   ("arn:aws:iam::111111111111:role/foobar", "us-west-2") ]:
+        get_assumed_role_client(sts_client, role_arn, "session", region_name, lambda sts_response: object(), client_cache)
+
+    assert [ call.kwargs["RoleArn"] for call in sts_client.assume_role.call_args_list ] == [ "arn:aws:iam::111111111111:role/foobar",
+                                                                                         "arn:aws:iam::222222222222:role/foobar" ]
+    assert len(client_cache) == 5
+
+def test_given_credentials_about_to_expire_then_role_is_assumed_again():
+    sts_client = _sts_client()
+    clock = FakeClock()
+    client_cache = ClientCache(refresh_margin=timedelta(minutes=5), clock=clock)
+    get_client = lambda: get_assumed_role_client(sts_client, "arn:aws:iam::111111111111:role/foobar", "session", "us-east-1",
+                                                 lambda sts_response: object(), client_cache)
+
+    first_client = get_client()
+    clock.now = _NOW + timedelta(minutes=9)
+    assert get_client() is first_client
+
+    clock.now = _NOW + timedelta(minutes=10)
+    assert get_client() is not first_client
+    assert sts_client.assume_role.call_count == 2
+
+def test_given_cache_is_full_then_least_recently_used_client_is_evicted():
+    client_cache = ClientCache(max_size=2, clock=FakeClock())
+
+    client_cache.get("first", lambda: ("first client", None))
+    client_cache.get("second", lambda: ("second client", None))
+    client_cache.get("first", lambda: ("unused", None))
+    client_cache.get("third", lambda: ("third client", None))
+
+    assert client_cache.get("first", lambda: ("new first client", None)) == "first client"
+    assert client_cache.get("second", lambda: ("new second client", None)) == "new second client"
+
+def test_given_response_without_expiration_then_default_is_used():
+    default = _NOW + timedelta(minutes=15)
+
+    assert get_credentials_expiration({ "Credentials": {} }, default) == default
+    assert get_credentials_expiration("not a response", default) == default
+    assert get_credentials_expiration({ "Credentials": { "Expiration": datetime(2024, 1, 1) } }) == datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+def test_given_sdk_retries_disabled_then_client_makes_a_single_attempt_and_is_cached_separately():
+    client_cache = ClientCache()
+
+    client = get_client("sts", region_name="us-east-1", client_cache=client_cache, sdk_retries=False)
+
+    assert client.meta.config.retries["total_max_attempts"] == 1
+    assert get_client("sts", region_name="us-east-1", client_cache=client_cache, sdk_retries=False) is client
+    assert get_client("sts", region_name="us-east-1", client_cache=client_cache) is not client
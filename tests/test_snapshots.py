@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# AWS DISCLAMER
+# ---
+
+# The following files are provided by AWS Professional Services describe the process to create a IAM Policy with description.
+
+# These are non-production ready and are to be used for testing purposes.
+
+# These files is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations under the License.
+
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and Amazon Web Services, Inc.​
+import io
+import json
+import os
+import uuid
+from unittest.mock import Mock, patch
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+from botocore.stub import ANY, Stubber
+from inventory.handler import lambda_handler
+from inventory.mappers import InventoryBatch, InventoryData
+from inventory.snapshots import (CHANGE_ADDED, CHANGE_CHANGED, CHANGE_REMOVED, SnapshotConflictError, SnapshotStore,
+                                 get_snapshot_max_runs_from_environment, main, open_snapshot_store, save_snapshot)
+
+class FakeS3Client():
+    """Keeps objects in memory and honours the IfMatch and IfNoneMatch conditions of put_object like S3 does."""
+    def __init__(self):
+        self.objects = {}
+        self.before_put = []
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({ "Error": { "Code": "NoSuchKey" } }, "GetObject")
+        etag, body = self.objects[(Bucket, Key)]
+        return { "ETag": etag, "Body": io.BytesIO(body) }
+
+    def put_object(self, Bucket, Key, Body, IfMatch=None, IfNoneMatch=None):
+        if self.before_put:
+            self.before_put.pop(0)()
+
+        current = self.objects.get((Bucket, Key))
+        if (IfNoneMatch == "*" and current is not None) or (IfMatch is not None and (current is None or current[0] != IfMatch)):
+            raise ClientError({ "Error": { "Code": "PreconditionFailed" } }, "PutObject")
+        self.objects[(Bucket, Key)] = (f'"{uuid.uuid4().hex}"', Body.read())
+
+def _inventory():
+    return [ InventoryData(asset_type="EC2", unique_id="i-1", ip_address="10.0.0.1", network_id="vpc-1", is_public="No"),
+             InventoryData(asset_type="EC2", unique_id="i-1", ip_address="3.3.3.3", network_id="vpc-1", is_public="Yes", extra_tags={ "Env": "prod" }),
+             InventoryData(asset_type="EC2", unique_id="i-2", ip_address="3.3.3.4", network_id="vpc-2", is_public="Yes"),
+             InventoryData(asset_type="S3", unique_id="bucket") ]
+
+def _key(inventory_data):
+    return (inventory_data.unique_id, inventory_data.ip_address)
+
+def test_given_saved_run_then_rows_are_read_back_unchanged(tmp_path):
+    with SnapshotStore(str(tmp_path / "inventory.db")) as snapshot_store:
+        run_id = snapshot_store.save_run([ InventoryBatch.from_inventory(_inventory()[:3]), _inventory()[3] ], "january", { "xlsx": "https://reports/report.xlsx" })
+
+        runs = snapshot_store.list_runs()
+        assert [ (run.run_id, run.label, run.row_count, run.report_urls) for run in runs ] == [ (run_id, "january", 4, { "xlsx": "https://reports/report.xlsx" }) ]
+        assert [ row.to_dict() for row in snapshot_store.query(run_id) ] == [ row.to_dict() for row in _inventory() ]
+
+def test_given_filters_then_only_matching_rows_of_the_run_are_returned(tmp_path):
+    with SnapshotStore(str(tmp_path / "inventory.db")) as snapshot_store:
+        snapshot_store.save_run(_inventory())
+        latest_run_id = snapshot_store.save_run(_inventory()[:2])
+
+        assert [ _key(row) for row in snapshot_store.query(network_id="vpc-1", is_public="Yes") ] == [ ("i-1", "3.3.3.3") ]
+        assert [ _key(row) for row in snapshot_store.query(latest_run_id - 1, is_public="Yes") ] == [ ("i-1", "3.3.3.3"), ("i-2", "3.3.3.4") ]
+        assert [ _key(row) for row in snapshot_store.query(latest_run_id - 1, ip_address=None) ] == [ ("bucket", None) ]
+
+def test_given_unknown_filter_or_run_then_error_is_raised(tmp_path):
+    with SnapshotStore(str(tmp_path / "inventory.db")) as snapshot_store:
+        with pytest.raises(ValueError):
+            snapshot_store.query()
+        with pytest.raises(ValueError):
+            snapshot_store.query(owner="team")
+
+        snapshot_store.save_run(_inventory())
+
+        with pytest.raises(ValueError):
+            snapshot_store.query(2)
+
+def test_given_two_runs_then_added_removed_and_changed_rows_are_returned(tmp_path):
+    changed = _inventory()
+    changed[1].extra_tags = { "Env": "dev" }
+    del changed[2]
+    changed.append(InventoryData(asset_type="RDS", unique_id="db-1"))
+
+    with SnapshotStore(str(tmp_path / "inventory.db")) as snapshot_store:
+        old_run_id = snapshot_store.save_run(_inventory())
+        new_run_id = snapshot_store.save_run(changed)
+
+        changes = { (row_change.change, _key(row_change.old or row_change.new)): row_change for row_change in snapshot_store.iter_changes(old_run_id, new_run_id) }
+
+    assert list(changes) == [ (CHANGE_ADDED, ("db-1", None)), (CHANGE_REMOVED, ("i-2", "3.3.3.4")), (CHANGE_CHANGED, ("i-1", "3.3.3.3")) ]
+    assert changes[(CHANGE_CHANGED, ("i-1", "3.3.3.3"))].changed_fields == [ "extra_tags" ]
+    assert changes[(CHANGE_CHANGED, ("i-1", "3.3.3.3"))].old.extra_tags == { "Env": "prod" }
+
+def test_given_s3_location_then_database_is_downloaded_and_uploaded_again(tmp_path):
+    s3_client = FakeS3Client()
+
+    for _ in range(2):
+        with open_snapshot_store("s3://bucket/inventory/inventory.db", s3_client) as snapshot_store:
+            snapshot_store.save_run(_inventory())
+
+    with open_snapshot_store("s3://bucket/inventory/inventory.db", s3_client) as snapshot_store:
+        assert [ run.row_count for run in snapshot_store.list_runs() ] == [ 4, 4 ]
+
+def test_given_run_saved_to_s3_meanwhile_then_upload_fails_instead_of_dropping_it(tmp_path):
+    s3_client = FakeS3Client()
+
+    with pytest.raises(SnapshotConflictError):
+        with open_snapshot_store("s3://bucket/inventory.db", s3_client) as snapshot_store:
+            snapshot_store.save_run(_inventory())
+            save_snapshot("s3://bucket/inventory.db", _inventory()[:1], s3_client)
+
+    with open_snapshot_store("s3://bucket/inventory.db", s3_client) as snapshot_store:
+        assert [ run.row_count for run in snapshot_store.list_runs() ] == [ 1 ]
+
+def test_given_concurrent_run_then_snapshot_is_saved_again_on_top_of_it(tmp_path):
+    s3_client = FakeS3Client()
+    s3_client.before_put.append(lambda: save_snapshot("s3://bucket/inventory.db", _inventory()[:1], s3_client))
+
+    save_snapshot("s3://bucket/inventory.db", _inventory(), s3_client)
+
+    with open_snapshot_store("s3://bucket/inventory.db", s3_client) as snapshot_store:
+        assert [ run.row_count for run in snapshot_store.list_runs() ] == [ 1, 4 ]
+
+def test_given_concurrent_run_and_inventory_iterator_then_every_row_is_saved_again(tmp_path):
+    s3_client = FakeS3Client()
+    s3_client.before_put.append(lambda: save_snapshot("s3://bucket/inventory.db", _inventory()[:1], s3_client))
+
+    save_snapshot("s3://bucket/inventory.db", iter(_inventory()), s3_client)
+
+    with open_snapshot_store("s3://bucket/inventory.db", s3_client) as snapshot_store:
+        assert [ run.row_count for run in snapshot_store.list_runs() ] == [ 1, 4 ]
+
+def test_given_no_attempts_then_error_is_raised(tmp_path):
+    with pytest.raises(ValueError):
+        save_snapshot(str(tmp_path / "inventory.db"), _inventory(), max_attempts=0)
+
+def test_given_s3_location_then_upload_is_conditional_on_downloaded_etag_the_sdk_accepts(tmp_path):
+    database_file_name = str(tmp_path / "inventory.db")
+    save_snapshot(database_file_name, _inventory())
+    with open(database_file_name, "rb") as database_file:
+        body = database_file.read()
+    s3_client = boto3.client("s3", region_name="us-east-1", aws_access_key_id="testing", aws_secret_access_key="testing")
+
+    with Stubber(s3_client) as stubber:
+        stubber.add_response("get_object", { "ETag": '"etag"', "Body": StreamingBody(io.BytesIO(body), len(body)) },
+                             expected_params={ "Bucket": "bucket", "Key": "inventory.db" })
+        stubber.add_client_error("put_object", "PreconditionFailed", http_status_code=412,
+                                 expected_params={ "Bucket": "bucket", "Key": "inventory.db", "Body": ANY, "IfMatch": '"etag"' })
+
+        with pytest.raises(SnapshotConflictError):
+            save_snapshot("s3://bucket/inventory.db", _inventory(), s3_client, max_attempts=1)
+
+def test_given_max_runs_then_only_latest_runs_and_their_rows_are_kept(tmp_path):
+    database_file_name = str(tmp_path / "inventory.db")
+    for row_count in range(1, 5):
+        save_snapshot(database_file_name, _inventory()[:row_count], max_runs=2)
+
+    with SnapshotStore(database_file_name) as snapshot_store:
+        assert [ (run.run_id, run.row_count) for run in snapshot_store.list_runs() ] == [ (3, 3), (4, 4) ]
+        assert snapshot_store._connection.execute("SELECT COUNT(*) FROM inventory").fetchone() == (7,)
+
+        with pytest.raises(ValueError):
+            snapshot_store.query(2)
+
+@pytest.mark.parametrize("value, expected", [ (None, 30), ("0", 0), ("5", 5), ("-1", ValueError), ("all", ValueError) ])
+def test_given_snapshot_max_runs_then_it_is_read_from_environment(value, expected, tmp_path):
+    with patch.dict(os.environ, {} if value is None else { "SNAPSHOT_MAX_RUNS": value }):
+        if value is None:
+            os.environ.pop("SNAPSHOT_MAX_RUNS", None)
+
+        if expected is ValueError:
+            with pytest.raises(ValueError):
+                get_snapshot_max_runs_from_environment()
+        else:
+            assert get_snapshot_max_runs_from_environment() == expected
+
+@patch("inventory.handler.save_snapshot", side_effect=[ SnapshotConflictError("changed"), 1 ])
+@patch("inventory.handler.DeliverReportCommandHandler")
+@patch("inventory.handler.CreateReportCommandHandler")
+@patch("inventory.handler.AwsConfigInventoryReader")
+def test_given_snapshot_fails_then_report_is_returned_and_next_run_does_not_skip_it(reader, create_report_handler, deliver_report_handler, save_snapshot_mock, tmp_path):
+    reader.return_value.iter_inventory_batches.side_effect = lambda: iter([ InventoryBatch.from_inventory(_inventory()) ])
+    reader.return_value.retry_stats.to_dict.return_value = {}
+    create_report_handler.return_value.get_report_settings.return_value = {}
+    deliver_report_handler.return_value.deliver.return_value = "https://reports/report.xlsx"
+    deliver_report_handler.return_value.report_exists.return_value = True
+
+    with patch.dict(os.environ, { "SKIP_UNCHANGED_REPORT": "true", "REPORT_DIGEST_LOCATION": str(tmp_path / "report-digest.json"),
+                                  "SNAPSHOT_LOCATION": "s3://bucket/inventory.db" }):
+        responses = [ lambda_handler(None, Mock()) for _ in range(3) ]
+
+    assert [ response["statusCode"] for response in responses ] == [ 200, 200, 200 ]
+    assert [ json.loads(response["body"])["report"].get("unchanged", False) for response in responses ] == [ False, False, True ]
+    assert deliver_report_handler.return_value.deliver.call_count == 2
+    assert save_snapshot_mock.call_count == 2
+
+def test_given_query_command_then_matching_rows_are_written_as_csv(tmp_path):
+    database_file_name = str(tmp_path / "inventory.db")
+    with SnapshotStore(database_file_name) as snapshot_store:
+        snapshot_store.save_run(_inventory())
+
+    output_file = io.StringIO()
+    main([ database_file_name, "query", "--network-id", "vpc-1", "--public" ], output_file)
+
+    lines = output_file.getvalue().splitlines()
+    assert lines[0].startswith("asset_type,unique_id,ip_address,")
+    assert len(lines) == 2 and lines[1].startswith("EC2,i-1,3.3.3.3,")
+    assert lines[1].endswith('"{""Env"": ""prod""}"')
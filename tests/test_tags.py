@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# AWS DISCLAMER
+# ---
+
+# The following files are provided by AWS Professional Services describe the process to create a IAM Policy with description.
+
+# These are non-production ready and are to be used for testing purposes.
+
+# These files is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations under the License.
+
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and Amazon Web Services, Inc.​
+import json
+import os
+from unittest.mock import patch
+import pytest
+from inventory.mappers import EC2DataMapper, NetworkInterfaceDataMapper, TagIndex, get_extra_tag_columns, get_tag_fields
+
+@pytest.fixture()
+def full_ec2_config():
+    with open(os.path.join(os.path.dirname(__file__), "sample_config_query_results/sample_ec2.json")) as file_data:
+        return json.loads(file_data.read())
+
+def test_given_tags_then_lookup_ignores_case_of_keys_and_names():
+    tags = TagIndex([ { "key": "FUNCTION", "value": "web" }, { "key": "Owner", "value": "team" } ])
+
+    assert tags.get("function") == "web"
+    assert tags.get("OWNER") == "team"
+    assert tags.get("missing") == ""
+
+def test_given_keys_differing_only_in_case_then_first_tag_wins():
+    assert TagIndex([ { "key": "Owner", "value": "first" }, { "key": "owner", "value": "second" } ]).get("owner") == "first"
+
+def test_given_tag_value_starting_with_formula_character_then_it_is_sanitized():
+    assert TagIndex([ { "key": "owner", "value": "=HYPERLINK(\"x\")" } ]).get("owner") == "'=HYPERLINK(\"x\")"
+
+def test_given_no_tags_then_tag_fields_are_empty():
+    assert get_tag_fields({ "tags": None }) == { "function": "", "owner": "" }
+    assert get_tag_fields({}) == { "function": "", "owner": "" }
+
+@patch.dict(os.environ, { "EXTRA_TAG_COLUMNS": " CostCenter,environment , costcenter,," })
+def test_given_extra_tag_columns_then_they_are_parsed_in_order_without_duplicates():
+    assert get_extra_tag_columns() == ("CostCenter", "environment")
+
+@patch.dict(os.environ, { "EXTRA_TAG_COLUMNS": "CostCenter,Environment" })
+def test_given_extra_tag_columns_then_every_row_of_a_resource_has_their_values(full_ec2_config):
+    full_ec2_config["tags"] = [ { "key": "costcenter", "value": "42" }, { "key": "Owner", "value": "team" } ]
+
+    inventory = EC2DataMapper().map(full_ec2_config)
+
+    assert len(inventory) > 1
+    assert all(row.extra_tags == { "CostCenter": "42", "Environment": "" } and row.owner == "team" for row in inventory)
+
+def test_given_no_extra_tag_columns_then_rows_have_no_extra_tags(full_ec2_config):
+    with patch.dict(os.environ, { "EXTRA_TAG_COLUMNS": "" }):
+        assert all(row.extra_tags is None for row in EC2DataMapper().map(full_ec2_config))
+
+def test_given_network_interface_with_many_ips_then_tags_are_indexed_once():
+    config_resource = { "resourceType": "AWS::EC2::NetworkInterface", "arn": "arn:eni",
+                        "tags": [ { "key": f"tag-{index}", "value": str(index) } for index in range(50) ] + [ { "key": "Function", "value": "nat" } ],
+                        "configuration": { "privateIpAddresses": [ { "privateIpAddress": f"10.0.0.{index}" } for index in range(10) ] } }
+
+    with patch("inventory.mappers.TagIndex", wraps=TagIndex) as tag_index:
+        inventory = NetworkInterfaceDataMapper().map(config_resource)
+
+    assert tag_index.call_count == 1
+    assert [ row.function for row in inventory ] == [ "nat" ] * 10
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# AWS DISCLAMER
+# ---
+
+# The following files are provided by AWS Professional Services describe the process to create a IAM Policy with description.
+
+# These are non-production ready and are to be used for testing purposes.
+
+# These files is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations under the License.
+
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and Amazon Web Services, Inc.​
+import os
+from unittest.mock import Mock, patch
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError
+from inventory.throttling import (RateLimiter, RetryingClient, RetryPolicy, RetryStats, TokenBucket, get_retry_policy_from_environment,
+                                  is_retryable_error)
+
+class FakeClock():
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+def _error(code, status_code=400):
+    return ClientError({ "Error": { "Code": code }, "ResponseMetadata": { "HTTPStatusCode": status_code } }, "SelectResourceConfig")
+
+@pytest.mark.parametrize("error, retryable", [ (_error("ThrottlingException"), True),
+                                               (_error("ServiceUnavailable", 503), True),
+                                               (_error("SomethingNew", 500), True),
+                                               (EndpointConnectionError(endpoint_url="https://config.us-east-1.amazonaws.com"), True),
+                                               (_error("AccessDenied", 403), False),
+                                               (ValueError("not an AWS error"), False) ])
+def test_given_error_then_only_throttling_and_transient_errors_are_retryable(error, retryable):
+    assert is_retryable_error(error) == retryable
+
+def test_given_burst_above_rate_then_token_bucket_spaces_requests():
+    clock = FakeClock()
+    bucket = TokenBucket(2, capacity=2, clock=clock)
+
+    waits = [ bucket.reserve() for _ in range(4) ]
+
+    assert waits == [ 0.0, 0.0, 0.5, 1.0 ]
+
+def test_given_throttling_then_bucket_rate_is_halved_and_recovers_on_success():
+    bucket = TokenBucket(10, clock=FakeClock())
+
+    bucket.on_throttled()
+    bucket.on_throttled()
+    assert bucket.rate == 2.5
+
+    for _ in range(20):
+        bucket.on_success()
+    assert bucket.rate == 10
+
+def test_given_many_throttles_then_bucket_rate_has_a_floor():
+    bucket = TokenBucket(10, clock=FakeClock())
+
+    for _ in range(10):
+        bucket.on_throttled()
+
+    assert bucket.rate == 1
+
+def test_given_separate_accounts_then_each_has_its_own_bucket_but_api_bucket_is_shared():
+    clock = FakeClock()
+    limiter = RateLimiter(api_requests_per_second=3, account_requests_per_second=1, clock=clock, sleep=clock.sleep)
+
+    waits = [ limiter.acquire("select_resource_config", account_id) for account_id in ("111111111111", "222222222222", "111111111111") ]
+
+    assert waits == [ 0.0, 0.0, 1.0 ]
+    assert limiter.acquire("assume_role") == 0.0
+
+def test_given_one_region_is_throttled_then_other_regions_of_the_account_are_not_slowed_down():
+    clock = FakeClock()
+    limiter = RateLimiter(api_requests_per_second=0, account_requests_per_second=1, clock=clock, sleep=clock.sleep)
+
+    for _ in range(3):
+        limiter.on_throttled("select_resource_config", "111111111111", "us-east-1")
+    waits = [ limiter.acquire("select_resource_config", "111111111111", region_name) for region_name in ("us-east-1", "us-east-1", "us-west-2") ]
+
+    assert waits == [ 0.0, 8.0, 0.0 ]
+
+def test_given_zero_rates_then_requests_are_not_limited():
+    limiter = RateLimiter(0, 0, sleep=Mock(side_effect=AssertionError("should not wait")))
+
+    assert sum(limiter.acquire("select_resource_config", "111111111111") for _ in range(100)) == 0
+
+def test_given_throttling_then_call_is_retried_with_jittered_exponential_backoff():
+    backoffs = []
+    request = Mock(side_effect=[ _error("ThrottlingException"), _error("ThrottlingException"), { "Results": [] } ])
+    stats = RetryStats()
+    policy = RetryPolicy(base_delay_seconds=1, max_delay_seconds=3, sleep=backoffs.append, random_fraction=lambda: 0.5)
+
+    assert policy.call("select_resource_config", request, "111111111111", stats) == { "Results": [] }
+    assert backoffs == [ 0.5, 1.0 ]
+    assert stats.to_dict() == { "requests": 3, "retries": 2, "throttled": 2, "sdk_retries": 0, "failures": 0, "backoff_seconds": 1.5,
+                                "rate_limited_seconds": 0.0, "retries_by_api": { "select_resource_config": 2 } }
+
+def test_given_backoff_then_it_is_capped_at_max_delay():
+    policy = RetryPolicy(base_delay_seconds=1, max_delay_seconds=3, random_fraction=lambda: 1.0)
+
+    assert [ policy.get_backoff_seconds(retry) for retry in range(4) ] == [ 1, 2, 3, 3 ]
+
+def test_given_error_persists_then_it_is_raised_after_max_attempts():
+    request = Mock(side_effect=_error("ThrottlingException"))
+    stats = RetryStats()
+
+    with pytest.raises(ClientError):
+        RetryPolicy(max_attempts=3, sleep=lambda seconds: None).call("select_resource_config", request, stats=stats)
+
+    assert request.call_count == 3
+    assert stats.failures == 1
+
+def test_given_non_retryable_error_then_it_is_raised_immediately():
+    request = Mock(side_effect=_error("AccessDenied", 403))
+
+    with pytest.raises(ClientError):
+        RetryPolicy(sleep=Mock(side_effect=AssertionError("should not back off"))).call("select_resource_config", request)
+
+    assert request.call_count == 1
+
+def test_given_sdk_retries_in_response_metadata_then_they_are_counted():
+    stats = RetryStats()
+
+    RetryPolicy().call("assume_role", lambda: { "ResponseMetadata": { "RetryAttempts": 2 } }, stats=stats)
+
+    assert stats.sdk_retries == 2
+
+def test_given_wrapped_client_then_calls_go_through_policy_with_operation_name_and_account():
+    client = Mock()
+    client.select_resource_config.return_value = { "Results": [] }
+    policy = Mock(spec=RetryPolicy)
+    policy.call.side_effect = lambda api, request, account_id, stats, region_name: request()
+
+    response = RetryingClient(client, policy, account_id="111111111111", region_name="us-west-2").select_resource_config(Expression="SELECT arn",
+                                                                                                                          NextToken="")
+
+    assert response == { "Results": [] }
+    assert policy.call.call_args.args[0] == "select_resource_config"
+    assert policy.call.call_args.args[2] == "111111111111"
+    assert policy.call.call_args.args[4] == "us-west-2"
+    client.select_resource_config.assert_called_once_with(Expression="SELECT arn", NextToken="")
+
+@pytest.mark.parametrize("variable_name, value", [ ("RETRY_MAX_ATTEMPTS", "0"), ("RETRY_MAX_ATTEMPTS", "many"),
+                                                   ("API_REQUESTS_PER_SECOND", "-1"), ("RETRY_BASE_DELAY_SECONDS", "fast") ])
+def test_given_invalid_environment_then_error_is_raised(variable_name, value):
+    with patch.dict(os.environ, { variable_name: value }):
+        with pytest.raises(ValueError):
+            get_retry_policy_from_environment()
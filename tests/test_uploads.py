@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# AWS DISCLAMER
+# ---
+
+# The following files are provided by AWS Professional Services describe the process to create a IAM Policy with description.
+
+# These are non-production ready and are to be used for testing purposes.
+
+# These files is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations under the License.
+
+# (c) 2019 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+# This AWS Content is provided subject to the terms of the AWS Customer Agreement available at
+# http://aws.amazon.com/agreement or other written agreement between Customer and Amazon Web Services, Inc.​
+import gzip
+import io
+import threading
+import zipfile
+from unittest.mock import patch
+import pytest
+from botocore.exceptions import ClientError
+from openpyxl import load_workbook
+from inventory.mappers import InventoryData
+from inventory.reports import REPORT_WRITE_MODE_STREAMING, CreateReportCommandHandler, DeliverReportCommandHandler
+from inventory.uploads import (COMPRESSION_GZIP, COMPRESSION_NONE, COMPRESSION_ZIP, MIN_PART_SIZE_BYTES, S3MultipartUploadStream,
+                               get_part_size_from_environment, open_compressed)
+
+class FakeS3Client():
+    """In-memory stand-in for the S3 API calls uploads make, keeping objects and in-progress multipart uploads."""
+    def __init__(self, failing_part_number=None):
+        self.objects = {}
+        self.uploads = {}
+        self.aborted_upload_ids = []
+        self.calls = []
+        self._failing_part_number = failing_part_number
+        self._lock = threading.Lock()
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.calls.append("put_object")
+        self.objects[(Bucket, Key)] = Body if isinstance(Body, bytes) else Body.read()
+        return {}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self.calls.append("create_multipart_upload")
+        upload_id = f"upload-{len(self.uploads) + 1}"
+        self.uploads[upload_id] = {}
+        return { "UploadId": upload_id }
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        if PartNumber == self._failing_part_number:
+            raise ClientError({ "Error": { "Code": "InternalError" } }, "UploadPart")
+
+        with self._lock:
+            self.uploads[UploadId][PartNumber] = Body
+        return { "ETag": f"etag-{PartNumber}" }
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.calls.append("complete_multipart_upload")
+        parts = self.uploads.pop(UploadId)
+        assert [part["PartNumber"] for part in MultipartUpload["Parts"]] == sorted(parts), "Parts must be listed in order"
+        assert [part["ETag"] for part in MultipartUpload["Parts"]] == [f"etag-{part_number}" for part_number in sorted(parts)]
+        self.objects[(Bucket, Key)] = b"".join(parts[part_number] for part_number in sorted(parts))
+        return {}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.calls.append("abort_multipart_upload")
+        self.uploads.pop(UploadId)
+        self.aborted_upload_ids.append(UploadId)
+        return {}
+
+def _data(size):
+    return bytes(index % 251 for index in range(size))
+
+def test_given_object_smaller_than_a_part_then_it_is_uploaded_with_one_put():
+    s3_client = FakeS3Client()
+
+    with S3MultipartUploadStream(s3_client, "bucket", "key") as upload:
+        upload.write(b"small")
+
+    assert s3_client.objects[("bucket", "key")] == b"small"
+    assert s3_client.calls == [ "put_object" ]
+
+def test_given_object_larger_than_a_part_then_parts_are_uploaded_in_order():
+    s3_client = FakeS3Client()
+    data = _data(MIN_PART_SIZE_BYTES * 3 + 123)
+
+    with S3MultipartUploadStream(s3_client, "bucket", "key", part_size=MIN_PART_SIZE_BYTES, max_workers=2) as upload:
+        for offset in range(0, len(data), 1000000):
+            upload.write(data[offset:offset + 1000000])
+        assert upload.tell() == len(data)
+
+    assert s3_client.objects[("bucket", "key")] == data
+    assert s3_client.calls == [ "create_multipart_upload", "complete_multipart_upload" ]
+
+def test_given_error_while_writing_then_multipart_upload_is_aborted():
+    s3_client = FakeS3Client()
+
+    with pytest.raises(RuntimeError):
+        with S3MultipartUploadStream(s3_client, "bucket", "key", part_size=MIN_PART_SIZE_BYTES) as upload:
+            upload.write(_data(MIN_PART_SIZE_BYTES + 1))
+            raise RuntimeError("report failed")
+
+    assert s3_client.objects == {}
+    assert s3_client.aborted_upload_ids == [ "upload-1" ]
+
+def test_given_error_while_writing_small_object_then_nothing_is_uploaded():
+    s3_client = FakeS3Client()
+
+    with pytest.raises(RuntimeError):
+        with S3MultipartUploadStream(s3_client, "bucket", "key") as upload:
+            upload.write(b"partial")
+            raise RuntimeError("report failed")
+
+    assert s3_client.calls == []
+
+def test_given_part_upload_fails_then_error_is_raised_and_upload_is_aborted():
+    s3_client = FakeS3Client(failing_part_number=2)
+
+    with pytest.raises(ClientError):
+        with S3MultipartUploadStream(s3_client, "bucket", "key", part_size=MIN_PART_SIZE_BYTES, max_workers=1) as upload:
+            upload.write(_data(MIN_PART_SIZE_BYTES * 3))
+
+    assert s3_client.objects == {}
+    assert s3_client.aborted_upload_ids == [ "upload-1" ]
+
+def test_given_part_size_below_s3_minimum_then_error_is_raised():
+    with pytest.raises(ValueError):
+        S3MultipartUploadStream(FakeS3Client(), "bucket", "key", part_size=1024)
+
+    with patch.dict("os.environ", { "REPORT_UPLOAD_PART_SIZE_MB": "4" }):
+        with pytest.raises(ValueError):
+            get_part_size_from_environment()
+
+@pytest.mark.parametrize("compression", [ COMPRESSION_NONE, COMPRESSION_GZIP, COMPRESSION_ZIP ])
+def test_given_compression_then_written_data_can_be_read_back(compression):
+    s3_client = FakeS3Client()
+
+    with S3MultipartUploadStream(s3_client, "bucket", "key") as upload, open_compressed(upload, compression, "inventory.csv") as target:
+        target.write(b"unique_id,ip_address\n" * 1000)
+
+    data = s3_client.objects[("bucket", "key")]
+    if compression == COMPRESSION_GZIP:
+        data = gzip.decompress(data)
+    elif compression == COMPRESSION_ZIP:
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            assert archive.namelist() == [ "inventory.csv" ]
+            data = archive.read("inventory.csv")
+
+    assert data == b"unique_id,ip_address\n" * 1000
+
+@pytest.mark.parametrize("write_mode", [ None, REPORT_WRITE_MODE_STREAMING ])
+def test_given_stream_delivery_then_workbook_is_uploaded_without_local_file(write_mode):
+    s3_client = FakeS3Client()
+    environment = { "REPORT_TARGET_BUCKET_NAME": "bucket", "REPORT_TARGET_BUCKET_PATH": "reports", "REPORT_WORKSHEET_NAME": "Inventory" }
+
+    with patch.dict("os.environ", environment), patch("inventory.reports._workbook_output_file_path", "/nonexistent/report.xlsx"):
+        report_url = DeliverReportCommandHandler(s3_client, "stream").execute_streaming(
+            lambda report_file: CreateReportCommandHandler(write_mode).execute([ InventoryData(unique_id="i-1", ip_address="10.0.0.1") ], report_file))
+
+    (bucket, key), = s3_client.objects
+    assert bucket == "bucket" and key.startswith("reports/report-") and key.endswith(".xlsx")
+    assert report_url == f"https://bucket.s3.amazonaws.com/{key}"
+    worksheet = load_workbook(io.BytesIO(s3_client.objects[(bucket, key)]))["Inventory"]
+    assert (worksheet.cell(row=3, column=2).value, worksheet.cell(row=3, column=3).value) == ("i-1", "10.0.0.1")
+
+def test_given_compressed_stream_delivery_then_key_has_compression_extension():
+    s3_client = FakeS3Client()
+
+    with patch.dict("os.environ", { "REPORT_TARGET_BUCKET_NAME": "bucket", "REPORT_TARGET_BUCKET_PATH": "reports" }):
+        DeliverReportCommandHandler(s3_client).execute_streaming(lambda report_file: report_file.write(b"a,b\n"), ".csv", COMPRESSION_ZIP)
+
+    (_, key), = s3_client.objects
+    assert key.endswith(".csv.zip")
+    with zipfile.ZipFile(io.BytesIO(s3_client.objects[("bucket", key)])) as archive:
+        assert archive.namelist() == [ key.split("/")[-1][:-len(".zip")] ]
+
+def test_given_unknown_delivery_mode_then_error_is_raised():
+    with pytest.raises(ValueError):
+        DeliverReportCommandHandler(FakeS3Client(), "email")